@@ -6,8 +6,13 @@ from app_properties import AppPropertyDefinition
 from constants import PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER, PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER, \
     PROPERTY_SERVER_MEDIA_TEMP_FOLDER, PROPERTY_SERVER_SECRET_KEY, PROPERTY_SERVER_HOST_KEY, \
     PROPERTY_SERVER_AUTH_TIMEOUT_KEY, PROPERTY_SERVER_PORT_KEY, PROPERTY_SERVER_VOLUME_FOLDER, \
-    PROPERTY_SERVER_VOLUME_FORMAT, PROPERTY_SERVER_MEDIA_ENCODER_HOST
+    PROPERTY_SERVER_VOLUME_FORMAT, PROPERTY_SERVER_MEDIA_ENCODER_HOST, PROPERTY_SERVER_VOLUME_IMAGE_CACHE_SIZE, \
+    PROPERTY_SERVER_DATABASE_JOURNAL_MODE, PROPERTY_SERVER_DATABASE_SYNCHRONOUS, PROPERTY_SERVER_DATABASE_MMAP_SIZE, \
+    PROPERTY_SERVER_DATABASE_CACHE_SIZE, PROPERTY_SERVER_DATABASE_BUSY_TIMEOUT, PROPERTY_SERVER_VOLUME_SCAN_WORKERS, \
+    PROPERTY_SERVER_MEDIA_HLS_CACHE_SIZE, PROPERTY_SERVER_MEDIA_HLS_WINDOW, PROPERTY_SERVER_MEDIA_ENCODER_POOL, \
+    PROPERTY_SERVER_MEDIA_ENCODER_LOCAL_SLOTS
 from db import AppProperties, User, UserLimit, db, UserHardSession
+from sqlite_utils import SQLITE_JOURNAL_MODES, SQLITE_SYNCHRONOUS_MODES
 from text_utils import is_not_blank
 
 
@@ -166,6 +171,116 @@ def get_volume_format() -> str:
     return "PNG"
 
 
+def get_volume_image_cache_size() -> int:
+    """
+    Get the max size of the derived image cache in MB, 0 disables the cache
+    """
+    try:
+        value = _get_attr_value(PROPERTY_SERVER_VOLUME_IMAGE_CACHE_SIZE)
+        if is_not_blank(value):
+            v = int(value)
+            if v >= 0:
+                return v
+    except ValueError:
+        pass
+    # Fallback to default
+    return 512
+
+
+def get_volume_scan_workers() -> int:
+    """
+    Get the number of threads scanning book folders when every book definition is updated, by default two
+    """
+    return _get_int_attr_value(PROPERTY_SERVER_VOLUME_SCAN_WORKERS, 2, 1)
+
+
+def get_media_encoder_pool() -> str:
+    """
+    Get the other remote encoders, see parse_encoder_list
+    """
+    value = _get_attr_value(PROPERTY_SERVER_MEDIA_ENCODER_POOL)
+    if is_not_blank(value):
+        return value
+    return ""
+
+
+def get_media_encoder_local_slots() -> int:
+    """
+    Get the number of videos this machine encodes at once, 0 when only the external encoders are used
+    """
+    return _get_int_attr_value(PROPERTY_SERVER_MEDIA_ENCODER_LOCAL_SLOTS, 1, 0)
+
+
+def get_media_hls_cache_size() -> int:
+    """
+    Get the max size of the HLS segment cache in MB, 0 disables HLS streaming
+    """
+    return _get_int_attr_value(PROPERTY_SERVER_MEDIA_HLS_CACHE_SIZE, 2048, 0)
+
+
+def get_media_hls_window() -> int:
+    """
+    Get the number of HLS segments prepared ahead of the one being played
+    """
+    return _get_int_attr_value(PROPERTY_SERVER_MEDIA_HLS_WINDOW, 3, 0)
+
+
+def _get_int_attr_value(attr_id: str, default_value: int, min_value: int) -> int:
+    """
+    Get the value of the attribute with the given ID as an integer, or the default when missing or invalid.
+    """
+    try:
+        value = _get_attr_value(attr_id)
+        if is_not_blank(value):
+            v = int(value)
+            if v >= min_value:
+                return v
+    except ValueError:
+        pass
+    return default_value
+
+
+def get_database_journal_mode() -> str:
+    """
+    Get the SQLite journal mode
+    """
+    value = _get_attr_value(PROPERTY_SERVER_DATABASE_JOURNAL_MODE).upper()
+    if value in SQLITE_JOURNAL_MODES:
+        return value
+    return 'WAL'
+
+
+def get_database_synchronous() -> str:
+    """
+    Get the SQLite synchronous mode
+    """
+    value = _get_attr_value(PROPERTY_SERVER_DATABASE_SYNCHRONOUS).upper()
+    if value in SQLITE_SYNCHRONOUS_MODES:
+        return value
+    return 'NORMAL'
+
+
+def get_database_mmap_size() -> int:
+    """
+    Get the MB of the database memory mapped per connection, 0 disables it
+    """
+    return _get_int_attr_value(PROPERTY_SERVER_DATABASE_MMAP_SIZE, 256, 0)
+
+
+def get_database_cache_size() -> int:
+    """
+    Get the MB of SQLite page cache per connection
+    """
+    return _get_int_attr_value(PROPERTY_SERVER_DATABASE_CACHE_SIZE, 64, 1)
+
+
+def get_database_busy_timeout() -> int:
+    """
+    Get the milliseconds a connection waits on a locked database before failing
+    """
+    return _get_int_attr_value(PROPERTY_SERVER_DATABASE_BUSY_TIMEOUT, 10000, 0)
+
+
 def get_plugin_value(property_id: str) -> str:
     """
     Get the path for the temp show folder
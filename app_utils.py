@@ -131,6 +131,45 @@ def value_is_ipaddress(value: str) -> str | None:
         return "Value must be a valid IP address."
 
 
+def parse_encoder_list(value: str) -> list[tuple[str, int, int]]:
+    """
+    Parse a comma separated list of encoders, each host:port with an optional /slots, the jobs it takes at once.
+    For example: 10.0.0.5:8080/2, encoder.lan:8080
+
+    :param value: The list, blank for none
+    :return: (host, port, slots) of each encoder
+    :raises ValueError: When an entry is not valid
+    """
+    encoders = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if len(entry) == 0:
+            continue
+        match = re.fullmatch(r'(.+):(\d+)(?:/(\d+))?', entry)
+        if match is None or value_is_hostname(match.group(1)) is not None:
+            raise ValueError(f'{entry} is not host:port or host:port/slots')
+        port = int(match.group(2))
+        slots = int(match.group(3)) if match.group(3) is not None else 1
+        if not 0 < port < 65535 or not 0 < slots <= 64:
+            raise ValueError(f'{entry} has an invalid port or slot count')
+        encoders.append((match.group(1), port, slots))
+    return encoders
+
+
+def value_is_encoder_list(value: str) -> str | None:
+    """
+    Validate if the given value is a list of encoders, see parse_encoder_list.
+
+    :param value: The value to validate.
+    :return: None if valid, otherwise an error message.
+    """
+    try:
+        parse_encoder_list(value)
+        return None
+    except ValueError as e:
+        return str(e)
+
+
 def get_random_hash():
     """
     Generate a random SHA-256 hash.
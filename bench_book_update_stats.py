@@ -0,0 +1,113 @@
+"""
+Times generate_book_definitions on a synthetic library: the first scan, which makes every thumbnail, then rescans of
+the unchanged library, for each number of scan threads.
+
+    python bench_book_update_stats.py --books 100 --chapters 30 --pages 20 --workers 1 2 4
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from PIL import Image
+from flask import Flask
+
+from db import db, init_db, Book
+from plugins.book_update_stats import generate_book_definitions
+from thread_utils import TaskWrapper
+
+
+class BenchTask(TaskWrapper):
+
+    def run(self, db_session):
+        pass
+
+
+def make_library(folder: str, books: int, chapters: int, pages: int, width: int, height: int):
+    """
+    Write a library of books, each with chapter folders of numbered PNG pages
+    :param folder: The volume folder
+    :param books: Books in the library
+    :param chapters: Chapters in each book
+    :param pages: Pages in each chapter
+    :param width: Page width
+    :param height: Page height
+    """
+    for book in range(books):
+        for chapter in range(chapters):
+            chapter_path = os.path.join(folder, f'book-{book}', str(chapter + 1))
+            os.makedirs(chapter_path)
+            for page in range(pages):
+                # A different colour per page, so each file is its own image
+                colour = ((book * 37) % 256, (chapter * 53) % 256, (page * 71) % 256)
+                Image.new('RGB', (width, height), colour).save(os.path.join(chapter_path, f'{page + 1:03d}.png'))
+
+
+def time_scans(library: str, workers: int, rescans: int) -> list[float]:
+    """
+    Scan the library into a new database, once from clean previews and then again unchanged
+    :param library: The volume folder
+    :param workers: Scan threads
+    :param rescans: Scans of the unchanged library
+    :return: Seconds of each scan, the first scan first
+    """
+    for book in os.listdir(library):
+        shutil.rmtree(os.path.join(library, book, '.previews'), ignore_errors=True)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(temp_dir, 'bench.db')
+        init_db(app)
+        with app.app_context():
+            db.create_all()
+            for book in os.listdir(library):
+                db.session.add(Book(id=book, name=book, info_url='', active=True, processor='bench'))
+            db.session.commit()
+
+            timings = []
+            for _ in range(rescans + 1):
+                task = BenchTask('Bench', 'Scan the library')
+                started = time.perf_counter()
+                generate_book_definitions(task, None, library, session=db.session, scan_workers=workers)
+                timings.append(time.perf_counter() - started)
+                failures = [entry['text'] for entry in task.log_entries if entry['s'] == task.CRITICAL]
+                if failures:
+                    raise RuntimeError(failures[0])
+
+            db.session.remove()
+            db.engine.dispose()
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark book definition generation on a synthetic library')
+    parser.add_argument('--books', type=int, default=100)
+    parser.add_argument('--chapters', type=int, default=30)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--size', type=int, nargs=2, default=[400, 600], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--rescans', type=int, default=2)
+    parser.add_argument('--library', help='Keep the generated library in this folder and reuse it')
+    args = parser.parse_args()
+
+    library = args.library or tempfile.mkdtemp()
+    try:
+        if not os.path.isdir(library) or len(os.listdir(library)) == 0:
+            started = time.perf_counter()
+            make_library(library, args.books, args.chapters, args.pages, *args.size)
+            print(f'Made {args.books} books x {args.chapters} chapters x {args.pages} pages in '
+                  f'{time.perf_counter() - started:.1f}s, {os.cpu_count()} cores')
+
+        for workers in args.workers:
+            first, *rescans = time_scans(library, workers, args.rescans)
+            print(f'{workers} threads: first scan {first:.2f}s, unchanged rescan ' +
+                  ' / '.join(f'{rescan:.2f}s' for rescan in rescans))
+    finally:
+        if args.library is None:
+            shutil.rmtree(library, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Times a one pass encode against keyframe split chunked encodes of a synthetic testsrc2 video with a sine tone, and
+checks the chunked output has the same frames and duration.
+
+    python bench_chunked_encode.py --seconds 120 --size 1280 720 --preset veryfast --workers 2 4
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import ffmpeg_utils
+from chunked_encode import encode_in_chunks
+from ffmpeg_utils import encode_video_locally, _x264_args, _aac_args
+
+VIDEO_FILTER = "scale='min(3840,iw)':-2"
+
+
+def make_video(path: str, seconds: int, width: int, height: int, rate: int):
+    """
+    Write a testsrc2 video with a sine tone, a keyframe every 2 seconds
+    :param path: Where the video goes
+    :param seconds: Duration
+    :param width: Frame width
+    :param height: Frame height
+    :param rate: Frames per second
+    """
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i',
+                    f'testsrc2=duration={seconds}:size={width}x{height}:rate={rate}', '-f', 'lavfi', '-i',
+                    f'sine=frequency=440:duration={seconds}', '-c:v', 'libx264', '-preset', 'ultrafast', '-g',
+                    str(rate * 2), '-c:a', 'aac', path, '-y'], check=True)
+
+
+def video_frames_and_duration(path: str) -> tuple[int, float]:
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets', '-show_entries',
+                             'stream=nb_read_packets,duration', '-of', 'csv=p=0', path],
+                            stdout=subprocess.PIPE, text=True, check=True)
+    duration, frames = result.stdout.strip().split(',')[:2]
+    return int(frames), float(duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chunked encodes on a synthetic testsrc2 video')
+    parser.add_argument('--seconds', type=int, default=120)
+    parser.add_argument('--size', type=int, nargs=2, default=[1280, 720], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--rate', type=int, default=30)
+    parser.add_argument('--preset', default='veryfast')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4])
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        source_path = os.path.join(temp_dir, 'source.mp4')
+        make_video(source_path, args.seconds, *args.size, args.rate)
+        print(f'{args.seconds}s {args.size[0]}x{args.size[1]} at {args.rate} fps, {args.preset}, '
+              f'{os.cpu_count()} cores')
+
+        # Chunking is only turned on for long videos on multi-core hosts, the one pass is forced here
+        ffmpeg_utils.CHUNKED_ENCODE_MIN_SECONDS = float('inf')
+        single_path = os.path.join(temp_dir, 'single.mp4')
+        started = time.perf_counter()
+        if not encode_video_locally(source_path, single_path, ffmpeg_preset=args.preset):
+            raise RuntimeError('One pass encode failed')
+        single_seconds = time.perf_counter() - started
+        single_frames, single_duration = video_frames_and_duration(single_path)
+        print(f'one pass: {single_seconds:.1f}s, {single_frames} frames, {single_duration:.3f}s')
+
+        for workers in args.workers:
+            chunked_path = os.path.join(temp_dir, f'chunked{workers}.mp4')
+            started = time.perf_counter()
+            if not encode_in_chunks(source_path, chunked_path, None, VIDEO_FILTER, _x264_args(args.preset, 23),
+                                    _aac_args(128, True), workers):
+                raise RuntimeError(f'Chunked encode with {workers} workers failed')
+            seconds = time.perf_counter() - started
+            frames, duration = video_frames_and_duration(chunked_path)
+            print(f'{workers} chunks: {seconds:.1f}s, {single_seconds / seconds:.2f}x, {frames} frames, '
+                  f'{duration:.3f}s' + ('' if frames == single_frames else ', FRAME COUNT DIFFERS'))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
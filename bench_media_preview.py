@@ -0,0 +1,119 @@
+"""
+Times video previews on a folder of synthetic testsrc videos, as previews per minute and ffmpeg/ffprobe processes per
+preview. The second pass makes every preview again, with the probes already cached.
+
+    python bench_media_preview.py --videos 500
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from PIL import Image
+
+from plugins.media_preview_folder import generate_thumbnail
+from thread_utils import TaskWrapper
+
+
+class BenchTask(TaskWrapper):
+
+    def run(self, db_session):
+        pass
+
+
+class ProcessCounter:
+    """
+    Count the processes started while it is active
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._popen_init = subprocess.Popen.__init__
+
+    def __enter__(self):
+        counter = self
+
+        def counting_init(popen, *args, **kwargs):
+            counter.count += 1
+            counter._popen_init(popen, *args, **kwargs)
+
+        subprocess.Popen.__init__ = counting_init
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        subprocess.Popen.__init__ = self._popen_init
+
+
+def make_videos(folder: str, videos: int, width: int, height: int) -> list[str]:
+    """
+    Write testsrc videos of 20 to 59 seconds
+    :param folder: Where the videos go
+    :param videos: How many
+    :param width: Frame width
+    :param height: Frame height
+    :return: The video paths
+    """
+    paths = []
+    for index in range(videos):
+        path = os.path.join(folder, f'{index}.mp4')
+        subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i',
+                        f'testsrc=duration={20 + index % 40}:size={width}x{height}:rate=25', '-c:v', 'libx264',
+                        '-preset', 'ultrafast', '-g', '250', '-pix_fmt', 'yuv420p', path, '-y'], check=True)
+        paths.append(path)
+    return paths
+
+
+def time_previews(videos: list[str], output_folder: str) -> tuple[float, int]:
+    """
+    Make a preview of every video
+    :param videos: The video paths
+    :param output_folder: Where the previews go
+    :return: Seconds taken and processes started
+    """
+    task = BenchTask('Bench', 'Preview the videos')
+    with ProcessCounter() as counter:
+        started = time.perf_counter()
+        for path in videos:
+            if not generate_thumbnail('video/mp4', path, os.path.join(output_folder, os.path.basename(path) + '.webp'),
+                                      task, 45):
+                raise RuntimeError(f'No preview for {path}')
+        return time.perf_counter() - started, counter.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark video previews on synthetic testsrc videos')
+    parser.add_argument('--videos', type=int, default=500)
+    parser.add_argument('--size', type=int, nargs=2, default=[320, 240], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--folder', help='Keep the generated videos in this folder and reuse them')
+    args = parser.parse_args()
+
+    folder = args.folder or tempfile.mkdtemp()
+    output_folder = tempfile.mkdtemp()
+    try:
+        existing = sorted((name for name in os.listdir(folder) if name.endswith('.mp4')) if os.path.isdir(folder)
+                          else [], key=lambda name: int(name.split('.')[0]))
+        if len(existing) >= args.videos:
+            videos = [os.path.join(folder, name) for name in existing[:args.videos]]
+        else:
+            os.makedirs(folder, exist_ok=True)
+            started = time.perf_counter()
+            videos = make_videos(folder, args.videos, *args.size)
+            print(f'Made {args.videos} videos in {time.perf_counter() - started:.1f}s, {os.cpu_count()} cores')
+
+        for label in ['first pass', 'probes cached']:
+            seconds, processes = time_previews(videos, output_folder)
+            print(f'{label}: {len(videos)} previews in {seconds:.1f}s, {len(videos) / seconds * 60:.0f} per minute, '
+                  f'{processes / len(videos):.1f} processes per preview')
+
+        with Image.open(os.path.join(output_folder, os.path.basename(videos[0]) + '.webp')) as image:
+            print(f'Previews are {image.format} {image.size[0]}x{image.size[1]}')
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+        if args.folder is None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
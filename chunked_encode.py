@@ -0,0 +1,156 @@
+import bisect
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from constants import CHUNKED_ENCODE_DURATION_TOLERANCE
+from media_probe import probe_media, media_stream, read_keyframes
+from thread_utils import TaskWrapper, NoOpTaskWrapper
+
+# Cuts are made this many seconds before a keyframe, less than a frame, so the frame on the keyframe goes to the
+# chunk it starts and not the one before
+SEAM_SECONDS = 0.001
+
+
+def plan_chunks(keyframes: list[float], end: float, count: int) -> list[tuple[float, float]]:
+    """
+    Split a video into about count parts of similar length, each starting on a keyframe.
+    :param keyframes: Keyframe times, in order
+    :param end: When the video ends
+    :param count: Parts wanted, fewer are made when there aren't enough keyframes
+    :return: (start, end) of each part
+    """
+    if len(keyframes) == 0:
+        return []
+
+    first = keyframes[0]
+    starts = [first]
+    for index in range(1, count):
+        target = first + (end - first) * index / count
+        position = bisect.bisect_left(keyframes, target)
+        nearest = min(keyframes[max(position - 1, 0):position + 1], key=lambda keyframe: abs(keyframe - target))
+        if nearest > starts[-1]:
+            starts.append(nearest)
+
+    return list(zip(starts, starts[1:] + [end]))
+
+
+def _start_time(section: Optional[dict]) -> float:
+    try:
+        return float((section or {}).get('start_time', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _run_ffmpeg(command: list[str], log: TaskWrapper) -> bool:
+    if log.is_cancelled:
+        return False
+    result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            text=True)
+    if result.returncode != 0:
+        log.error("FFMPEG failed with error:")
+        log.error(result.stderr)
+        return False
+    return True
+
+
+def encode_in_chunks(input_file, output_file, input_format: Optional[str], video_filter: str, video_args: list[str],
+                     audio_args: list[str], workers: int, log: TaskWrapper = NoOpTaskWrapper()) -> bool:
+    """
+    Encode a video as keyframe aligned chunks, workers of them at a time, and join them with the concat demuxer without
+    encoding again.
+
+    Each chunk's frames get their place in the whole video back before the filter runs, so burned in subtitles keep
+    their timing. The audio isn't chunked, it is encoded once, alongside the chunks, and resampled to its timestamps,
+    so there are no gaps or drift at the seams. The joined video has to last as long as the source's.
+    :param input_file: The video
+    :param output_file: Where the MP4 goes
+    :param input_format: ffmpeg's -f for the input, None to let ffmpeg work it out
+    :param video_filter: ffmpeg's -vf
+    :param video_args: Video codec arguments
+    :param audio_args: Audio codec arguments
+    :param workers: Chunks, and the video encodes run at once
+    :param log: The task
+    :return: True when the encoded file is in place, False when it should be encoded in one pass instead
+    """
+    input_path = os.fspath(input_file)
+    output_path = os.fspath(output_file)
+    chunk_folder = f'{output_path}.chunks'
+    try:
+        probe = probe_media(input_path, log)
+        video = media_stream(probe, 'video')
+        if video is None:
+            return False
+        keyframes, end = read_keyframes(input_path)
+        chunks = plan_chunks(keyframes, end, workers)
+        if len(chunks) < 2:
+            return False
+
+        file_start = _start_time(probe.get('format'))
+        audio = media_stream(probe, 'audio')
+        input_args = ['-f', input_format] if input_format else []
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        os.makedirs(chunk_folder, exist_ok=True)
+
+        jobs = []
+        # The audio encode has its own slot, it is light and no chunk should wait behind it
+        with ThreadPoolExecutor(workers + 1 if audio is not None else workers) as executor:
+            audio_path = os.path.join(chunk_folder, 'audio.m4a')
+            if audio is not None:
+                jobs.append(executor.submit(_run_ffmpeg, [
+                    'ffmpeg', '-v', 'error', *input_args, '-i', input_path, '-map', '0:a:0', '-vn', '-sn', '-dn',
+                    '-af', 'aresample=async=1,asetpts=PTS-STARTPTS', *audio_args, audio_path, '-y'], log))
+
+            chunk_names = []
+            for index, (start, chunk_end) in enumerate(chunks):
+                chunk_names.append(f'chunk{index:04d}.mp4')
+                command = ['ffmpeg', '-v', 'error']
+                chunk_filter = f'{video_filter},setpts=PTS-STARTPTS'
+                if index > 0:
+                    # The seek is from the start of the file, the frames come out of it timed from the seek
+                    seek = start - file_start - SEAM_SECONDS
+                    command.extend(['-ss', f'{seek:.6f}'])
+                    chunk_filter = f'setpts=PTS+{seek:.6f}/TB,{chunk_filter}'
+                command.extend([*input_args, '-i', input_path, '-map', '0:v:0', '-an', '-sn', '-dn'])
+                if index < len(chunks) - 1:
+                    command.extend(['-t', f'{chunk_end - start - SEAM_SECONDS:.6f}'])
+                command.extend(['-vf', chunk_filter, *video_args, '-threads', str(threads),
+                                os.path.join(chunk_folder, chunk_names[-1]), '-y'])
+                jobs.append(executor.submit(_run_ffmpeg, command, log))
+
+            if not all([job.result() for job in jobs]):
+                return False
+
+        list_path = os.path.join(chunk_folder, 'chunks.txt')
+        with open(list_path, 'w') as list_file:
+            list_file.writelines(f"file '{name}'\n" for name in chunk_names)
+
+        command = ['ffmpeg', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio is not None:
+            # Both tracks start at 0, the audio is moved back to where it was against the video
+            offset = _start_time(audio) - _start_time(video)
+            if offset >= 0:
+                command.extend(['-itsoffset', f'{offset:.6f}', '-i', audio_path])
+            else:
+                command.extend(['-ss', f'{-offset:.6f}', '-i', audio_path])
+            command.extend(['-map', '0:v:0', '-map', '1:a:0'])
+        command.extend(['-c', 'copy', '-movflags', '+faststart', output_path, '-y'])
+        if not _run_ffmpeg(command, log):
+            return False
+
+        output_keyframes, output_end = read_keyframes(output_path)
+        source_duration = end - keyframes[0]
+        output_duration = output_end - (output_keyframes[0] if len(output_keyframes) > 0 else 0)
+        if abs(output_duration - source_duration) > CHUNKED_ENCODE_DURATION_TOLERANCE:
+            log.warn(f'Chunked encode lasts {output_duration:.3f}s, the source {source_duration:.3f}s')
+            os.remove(output_path)
+            return False
+
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.warn(f'Chunked encode failed: {e}')
+        return False
+    finally:
+        shutil.rmtree(chunk_folder, ignore_errors=True)
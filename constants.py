@@ -6,6 +6,11 @@ APP_KEY_SLC = 'SHORT_LIVED_CACHE'
 APP_KEY_AUTHENTICATE = 'AUTHENTICATE'
 APP_KEY_PLUGINS = 'PLUGINS'
 APP_KEY_PROCESSORS = 'PROCESSORS'
+APP_KEY_IMAGE_CACHE = 'IMAGE_CACHE'
+APP_KEY_COUNT_CACHE = 'COUNT_CACHE'
+APP_KEY_PROGRESS_BUFFER = 'PROGRESS_BUFFER'
+APP_KEY_HLS_CACHE = 'HLS_CACHE'
+APP_KEY_ENCODER_POOL = 'ENCODER_POOL'
 
 PROPERTY_DEFINITIONS = 'PROPERTY_DEFINITIONS'
 
@@ -21,11 +26,80 @@ PROPERTY_SERVER_MEDIA_READY = 'SERVER.MEDIA.READY'
 
 PROPERTY_SERVER_MEDIA_ENCODER_HOST = 'SERVER.MEDIA.ENCODER.HOST'
 PROPERTY_SERVER_MEDIA_ENCODER_PORT = 'SERVER.MEDIA.ENCODER.PORT'
+PROPERTY_SERVER_MEDIA_ENCODER_POOL = 'SERVER.MEDIA.ENCODER.POOL'
+PROPERTY_SERVER_MEDIA_ENCODER_LOCAL_SLOTS = 'SERVER.MEDIA.ENCODER.LOCAL.SLOTS'
+PROPERTY_SERVER_MEDIA_HLS_CACHE_SIZE = 'SERVER.MEDIA.HLS.CACHE.SIZE'
+PROPERTY_SERVER_MEDIA_HLS_WINDOW = 'SERVER.MEDIA.HLS.WINDOW'
 
 PROPERTY_SERVER_VOLUME_FOLDER = 'SERVER.VOLUME.FOLDER'
 PROPERTY_SERVER_VOLUME_FORMAT = 'SERVER.VOLUME.FORMAT'
 PROPERTY_SERVER_VOLUME_READY = 'SERVER.VOLUME.READY'
+PROPERTY_SERVER_VOLUME_IMAGE_CACHE_SIZE = 'SERVER.VOLUME.IMAGE.CACHE.SIZE'
+PROPERTY_SERVER_VOLUME_SCAN_WORKERS = 'SERVER.VOLUME.SCAN.WORKERS'
+
+PROPERTY_SERVER_DATABASE_JOURNAL_MODE = 'SERVER.DATABASE.JOURNAL.MODE'
+PROPERTY_SERVER_DATABASE_SYNCHRONOUS = 'SERVER.DATABASE.SYNCHRONOUS'
+PROPERTY_SERVER_DATABASE_MMAP_SIZE = 'SERVER.DATABASE.MMAP.SIZE'
+PROPERTY_SERVER_DATABASE_CACHE_SIZE = 'SERVER.DATABASE.CACHE.SIZE'
+PROPERTY_SERVER_DATABASE_BUSY_TIMEOUT = 'SERVER.DATABASE.BUSY.TIMEOUT'
+
+# Seconds a listing total is reused while paging, before it is counted again
+PAGING_COUNT_CACHE_SECONDS = 60
+
+# Seconds reading and playback progress is held in memory before it is written, and the pending entries that force an
+# early write
+PROGRESS_FLUSH_SECONDS = 5
+PROGRESS_BUFFER_MAX_ENTRIES = 1000
+
+# Width of the quick (thumbnail strip) version of a volume image
+QUICK_IMAGE_WIDTH = 256
 
 COMMON_MEDIA_RATINGS = [0, 40, 60, 80, 90, 100, 200]
 
-MAX_WORKERS = 5
\ No newline at end of file
+MAX_WORKERS = 5
+
+# Seconds a worker blocks waiting for a task before it re-checks in
+WORKER_IDLE_TIMEOUT = 30
+
+# Production (--production) serving defaults, request threads and seconds an idle keep-alive connection is held open
+PRODUCTION_SERVER_THREADS = 16
+PRODUCTION_SERVER_KEEP_ALIVE = 120
+
+# Read window used when streaming media files, and the most ranges accepted in one Range header
+STREAM_CHUNK_SIZE = 1024 * 1024
+MAX_BYTE_RANGES = 16
+# Outgoing HTTP, hosts that keep a pool of idle connections, connections kept per host, seconds to connect and to wait
+# between bytes, and the write size when a response is saved to disk
+HTTP_POOL_HOSTS = 32
+HTTP_POOL_CONNECTIONS_PER_HOST = 8
+HTTP_CONNECT_TIMEOUT = 15
+HTTP_READ_TIMEOUT = 60
+HTTP_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Chapter images handed to one curl process, the host's rate limit is charged for the whole batch when it starts
+CURL_BATCH_SIZE = 25
+
+# Media files whose ffprobe result is kept in memory
+PROBE_CACHE_SIZE = 2048
+
+# Width of media file previews
+MEDIA_PREVIEW_WIDTH = 256
+
+# HLS segments are cut at the first keyframe past this many seconds, the first one is kept short to start playback
+HLS_SEGMENT_SECONDS = 6
+HLS_FIRST_SEGMENT_SECONDS = 2
+
+# Remote encoder, seconds a status request is held open waiting for a change, the longest pause between status
+# requests to an encoder that answers right away, and the attempts made at an upload or download before giving up
+REMOTE_ENCODE_WAIT_SECONDS = 25
+REMOTE_ENCODE_MAX_POLL_SECONDS = 30
+REMOTE_ENCODE_ATTEMPTS = 3
+# Seconds a remote encoder's health and queue depth are trusted before it is asked again, a down encoder is asked
+# again after the same time, and seconds it has to answer
+ENCODER_HEALTH_SECONDS = 15
+ENCODER_HEALTH_TIMEOUT = 3
+
+# Videos at least this many seconds long are encoded in keyframe aligned chunks, one ffmpeg per core, when the machine
+# has more than one core. The joined video's duration has to be within the tolerance of the source's, in seconds
+CHUNKED_ENCODE_MIN_SECONDS = 300
+CHUNKED_ENCODE_DURATION_TOLERANCE = 0.1
@@ -31,63 +31,98 @@ This includes utility methods which will call a special version of CURL, that em
 """
 
 
-def custom_curl_get(url, headers=None, download_file=None, task_wrapper: TaskWrapper = NoOpTaskWrapper(),
-                    insecure: bool = False, header_file=None):
+CURL_COMMAND = 'curl_chrome116'
+
+# One line per finished transfer, the URL's position in the batch, curl's exit code and the HTTP status
+_BATCH_WRITE_OUT = '%{urlnum} %{exitcode} %{http_code}\\n'
+
+
+def _curl_config_value(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def custom_curl_get_batch(downloads: list[tuple[str, Optional[str]]], headers=None,
+                          task_wrapper: TaskWrapper = NoOpTaskWrapper(), insecure: bool = False, header_file=None,
+                          parallel: int = 1, rate: Optional[float] = None) -> list[int]:
     """
-    This is to call the custom CHROM based CURL as a GET command
-    :param header_file:
-    :param url:
-    :param headers:
-    :param download_file:
+    Fetch many URLs with one call to the custom CHROME based CURL, so a chapter doesn't start a process and a TLS
+    session per image. The URLs and headers go in a config file, the transfers share connections.
+    :param downloads: (url, download_file) pairs, a None file throws the body away
+    :param headers: Headers sent with every URL
     :param task_wrapper:
-    :return:
+    :param insecure: Skip certificate checks
+    :param header_file: Where the response headers of every transfer are written
+    :param parallel: Transfers at once, 1 fetches one after another
+    :param rate: Most requests per second, curl only paces serial transfers
+    :return: curl's exit code for each download, in order, 0 is success and -1 means curl never reported it
     """
     if platform.system() != 'Linux':
         print("This function can only run on a Linux-based device.")
-        return False
+        return [-1] * len(downloads)
 
-    command = ['curl_chrome116', url, '-L', '--max-redirs', '5', '--connect-timeout', '10']
+    config_lines = ['location', 'max-redirs = 5', 'connect-timeout = 10']
     if headers:
         for key, value in headers.items():
-            command.extend(['-H', f'{key}: {value}'])
-
-    if download_file:
-        command.extend(['-o', download_file])
-
+            config_lines.append(f'header = {_curl_config_value(f"{key}: {value}")}')
+    if insecure:
+        config_lines.append('insecure')
     if header_file is not None:
-        command.extend(['-D', header_file])
+        config_lines.append(f'dump-header = {_curl_config_value(header_file)}')
+    for url, download_file in downloads:
+        config_lines.append(f'url = {_curl_config_value(url)}')
+        config_lines.append(f'output = {_curl_config_value(download_file if download_file else os.devnull)}')
 
-    if insecure:
-        command.extend(['-k'])
+    command = [CURL_COMMAND, '--config', '-', '--write-out', _BATCH_WRITE_OUT]
+    if parallel > 1 and len(downloads) > 1:
+        command.extend(['--parallel', '--parallel-max', str(parallel)])
+    elif rate is not None and len(downloads) > 1:
+        command.extend(['--rate', f'{max(1, round(rate * 3600))}/h'])
+
+    config = '\n'.join(config_lines) + '\n'
 
     if task_wrapper.can_trace():
-        command_str = shlex.join(command)
-        task_wrapper.trace(command_str)
+        task_wrapper.trace(shlex.join(command))
+        task_wrapper.trace(config)
 
+    codes = [-1] * len(downloads)
     try:
+        result = subprocess.run(command, input=config.encode('utf-8'), check=False, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+    except OSError as e:
+        task_wrapper.error(f"Error: {e}")
+        return codes
 
-        result = subprocess.run(command, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    for line in result.stdout.decode('utf-8', 'replace').splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].isdigit() and int(parts[0]) < len(codes):
+            codes[int(parts[0])] = int(parts[1]) if parts[1].lstrip('-').isdigit() else -1
 
-        if task_wrapper.can_trace():
-            output_normal = result.stdout.decode('utf-8')
-            output_error = result.stderr.decode('utf-8')
+    if task_wrapper.can_trace():
+        task_wrapper.trace(f'Error: {result.stderr.decode("utf-8", "replace")}')
+        task_wrapper.trace(f'Return Code: {result.returncode}, Exit Codes: {codes}')
 
-            task_wrapper.trace(f'Output: {output_normal}')
-            task_wrapper.trace(f'Error: {output_error}')
-            task_wrapper.trace(f'Return Code: {result.returncode}')
+    # A broken content encoding is fetched again raw, one by one
+    for index, (url, download_file) in enumerate(downloads):
+        if codes[index] == 61:
+            random_sleep(6, 3)
+            if custom_curl_get_raw(url, headers, download_file, task_wrapper, insecure, header_file):
+                codes[index] = 0
 
-        ret_code = result.returncode
+    return codes
 
-        if ret_code == 61:
-            # Delay a bit...
-            random_sleep(6, 3)
-            return custom_curl_get_raw(url, headers, download_file, task_wrapper, insecure, header_file)
 
-        return ret_code == 0
-    except subprocess.CalledProcessError as e:
-        task_wrapper.set_failure()
-        task_wrapper.error(f"Error: {e}")
-        return False
+def custom_curl_get(url, headers=None, download_file=None, task_wrapper: TaskWrapper = NoOpTaskWrapper(),
+                    insecure: bool = False, header_file=None):
+    """
+    This is to call the custom CHROM based CURL as a GET command, a batch of one
+    :param header_file:
+    :param url:
+    :param headers:
+    :param download_file:
+    :param task_wrapper:
+    :return:
+    """
+    return custom_curl_get_batch([(url, download_file)], headers, task_wrapper, insecure, header_file)[0] == 0
 
 
 def custom_curl_get_raw(url, headers=None, download_file=None, task_wrapper: TaskWrapper = NoOpTaskWrapper(),
@@ -4,10 +4,11 @@ import uuid
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import event, ForeignKey
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import object_session, relationship
+from sqlalchemy.orm import object_session, relationship, sessionmaker, Session, deferred
 from werkzeug.security import generate_password_hash
 
 from feature_flags import MANAGE_APP, MANAGE_PROCESSES, UTILITY_PLUGINS, GENERAL_PLUGINS, VIEW_PROCESSES
+from sqlite_utils import configure_sqlite_engine
 
 # Initialize SQLAlchemy
 db = SQLAlchemy()
@@ -136,6 +137,10 @@ class Chapter(db.Model):
 
     page_count = db.Column(db.Integer, nullable=False)  # Page count, required
     image_names = db.Column(db.Text, nullable=False)  # Image names, required
+    # Per page name, w, h, size, format and mtime in reading order, see build_chapter_manifest. None until scanned
+    manifest = db.Column(db.JSON, nullable=True)
+    # Chapter folder mtime (ns) at the last scan, an unchanged folder with the same entry count is not listed again
+    folder_mtime = db.Column(db.BigInteger, nullable=True)
 
     sequence = db.Column(db.Integer, nullable=False)  # Sequence number, required
     date = db.Column(db.Date, nullable=False, default=datetime.date(2005, 1, 1))  # Date, required, default 1/1/2005
@@ -143,6 +148,7 @@ class Chapter(db.Model):
     # Composite primary key (book_id + chapter_id)
     __table_args__ = (
         db.PrimaryKeyConstraint('book_id', 'chapter_id'),
+        db.Index('ix_chapters_book_id_sequence', 'book_id', 'sequence'),
     )
 
     # Establish the back-population from Chapter to Book
@@ -165,8 +171,19 @@ class Chapter(db.Model):
         # Update the page_count based on the remaining images
         self.page_count = len(image_list)
 
+        if self.manifest is not None:
+            self.manifest = [page for page in self.manifest if page['name'] != image_name]
+
         return True
 
+    def replace_page(self, page: dict):
+        """
+        Swap in the manifest entry of a page that was edited in place
+        :param page: The new read_page_info entry
+        """
+        if self.manifest is not None:
+            self.manifest = [page if existing['name'] == page['name'] else existing for existing in self.manifest]
+
 
 class VolumeBookmark(db.Model):
     __tablename__ = 'volume_bookmarks'
@@ -184,6 +201,10 @@ class VolumeBookmark(db.Model):
     user = db.relationship('User', backref=db.backref('volume_bookmarks', cascade='all, delete-orphan'))
     book = db.relationship('Book', backref=db.backref('volume_bookmarks', cascade='all, delete-orphan'))
 
+    __table_args__ = (
+        db.Index('ix_volume_bookmarks_user_id_book_id', 'user_id', 'book_id'),
+    )
+
 
 class VolumeProgress(db.Model):
     __tablename__ = 'volume_progress'
@@ -206,6 +227,32 @@ class VolumeProgress(db.Model):
     # Composite unique constraint to prevent duplicate progress records
     __table_args__ = (
         db.UniqueConstraint('user_id', 'book_id', 'chapter_id', name='_user_book_chapter_uc'),
+        # Latest progress per book, for a user
+        db.Index('ix_volume_progress_user_id_book_id_timestamp', 'user_id', 'book_id', 'timestamp'),
+    )
+
+
+class VolumeLastRead(db.Model):
+    """
+    The newest VolumeProgress row of each user and book, kept up to date by upsert_recent_entries so book lists and
+    history don't have to aggregate every page turn ever recorded.
+    """
+    __tablename__ = 'volume_last_read'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    book_id = db.Column(db.String(128), db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    chapter_id = db.Column(db.String(32), nullable=False)  # Chapter last read
+    page_number = db.Column(db.Integer, nullable=True)  # Page number, optional
+    page_percent = db.Column(db.Float, nullable=True)  # Page percent, optional
+    timestamp = db.Column(db.DateTime, nullable=False)  # When the chapter was last read
+
+    # Relationships
+    user = db.relationship('User', backref=db.backref('volume_last_read', cascade='all, delete-orphan'))
+    book = db.relationship('Book', backref=db.backref('volume_last_read', cascade='all, delete-orphan'))
+
+    # A user's reading history, newest first
+    __table_args__ = (
+        db.Index('ix_volume_last_read_user_id_timestamp', 'user_id', 'timestamp'),
     )
 
 
@@ -250,6 +297,12 @@ class MediaFolder(db.Model):
     owning_group_id = db.Column(db.Integer, db.ForeignKey('user_groups.id'), nullable=True)
     owning_group = db.relationship("UserGroup", backref="mediafolders")
 
+    # Listing a folder's children, by name or by date
+    __table_args__ = (
+        db.Index('ix_mediafolders_parent_id_name', 'parent_id', 'name'),
+        db.Index('ix_mediafolders_parent_id_created', 'parent_id', 'created'),
+    )
+
 
 @event.listens_for(MediaFolder, 'before_delete')
 def prevent_deletion_if_children(mapper, connection, target):
@@ -277,6 +330,13 @@ class MediaFile(db.Model):
     created = db.Column(db.DateTime(timezone=True), nullable=False,
                         server_default=db.func.now())  # Auto store current UTC time
 
+    # ffprobe's format and streams, see media_probe.probe_media_file. Only loaded when used, listings skip it
+    probe = deferred(db.Column(db.JSON, nullable=True))
+    # mtime_ns of the data file when it was probed, None until probed
+    probe_mtime = db.Column(db.BigInteger, nullable=True)
+    # Seconds, from the probe
+    duration = db.Column(db.Float, nullable=True)
+
     # Establish the back-population from Chapter to Book
     mediafolder = db.relationship("MediaFolder", back_populates="mediafiles")
 
@@ -287,6 +347,13 @@ class MediaFile(db.Model):
         cascade='all, delete-orphan'
     )
 
+    # Listing a folder's files, in every sort order the listing offers
+    __table_args__ = (
+        db.Index('ix_mediafiles_folder_id_filename', 'folder_id', 'filename'),
+        db.Index('ix_mediafiles_folder_id_created', 'folder_id', 'created'),
+        db.Index('ix_mediafiles_folder_id_filesize', 'folder_id', 'filesize'),
+    )
+
 
 class MediaFileProgress(db.Model):
     __tablename__ = 'media_file_progress'
@@ -303,11 +370,19 @@ class MediaFileProgress(db.Model):
     user = db.relationship('User', backref=db.backref('media_file_progress', cascade='all, delete-orphan'))
     file = db.relationship('MediaFile', back_populates='progress_records')
 
+    __table_args__ = (
+        # One entry per user and file, progress is written with INSERT ... ON CONFLICT
+        db.Index('ix_media_file_progress_user_id_file_id', 'user_id', 'file_id', unique=True),
+        # A user's most recent progress
+        db.Index('ix_media_file_progress_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
 
 # Initialize the database
 def init_db(app):
     db.init_app(app)
     with app.app_context():
+        configure_sqlite_engine(db.engine)
         db.create_all()
 
         # Check if any users exist
@@ -320,3 +395,14 @@ def init_db(app):
             )
             db.session.add(admin_user)
             db.session.commit()
+
+
+_task_session_factory = sessionmaker()
+
+
+def create_task_session() -> Session:
+    """
+    Open a session for a background task, bound to the app's engine so tasks and requests share one connection pool.
+    Must be called inside an app context.
+    """
+    return _task_session_factory(bind=db.engine)
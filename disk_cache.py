@@ -0,0 +1,67 @@
+import logging
+import os
+import threading
+
+
+class SizeBoundedDiskCache:
+    """
+    A folder of cached files kept under max_bytes.
+
+    The file mtime of an entry doubles as its last access time, the least recently used entries are evicted once the
+    cache grows past max_bytes. Subclasses decide what goes in the folder, they touch an entry when it is used and call
+    _track_added once a new one is in place.
+    """
+
+    def __init__(self, cache_folder: str, max_bytes: int):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.current_bytes = -1  # Unknown until the folder has been scanned
+
+    def is_enabled(self) -> bool:
+        return bool(self.cache_folder) and self.max_bytes > 0
+
+    def _track_added(self, size: int):
+        with self.lock:
+            if self.current_bytes < 0:
+                self.current_bytes = self._scan_size()
+            else:
+                self.current_bytes += size
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+
+    def _list_entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for root, dirs, files in os.walk(self.cache_folder):
+            for file in files:
+                # Still being written
+                if file.endswith('.tmp'):
+                    continue
+                file_path = os.path.join(root, file)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._list_entries())
+
+    def _evict(self):
+        # Shrink to 90% of the limit, so every new entry doesn't trigger another full scan
+        target_bytes = int(self.max_bytes * 0.9)
+
+        entries = sorted(self._list_entries())
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, file_path in entries:
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(file_path)
+                total -= size
+            except OSError as e:
+                logging.warning(f'Unable to evict cached file {file_path}: {e}')
+
+        self.current_bytes = total
@@ -0,0 +1,195 @@
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+from app_utils import parse_encoder_list
+from constants import ENCODER_HEALTH_SECONDS, ENCODER_HEALTH_TIMEOUT
+from ffmpeg_utils import encode_video_locally, remote_encode_options
+from http_client import http_get
+from remote_encoder import remote_encode
+from text_utils import is_not_blank
+from thread_utils import TaskWrapper, NoOpTaskWrapper
+
+
+class EncoderNode:
+    """
+    An encoder in the pool, this machine when url is None.
+    """
+
+    def __init__(self, name: str, url: Optional[str], slots: int):
+        """
+        :param name: Shown in task logs
+        :param url: Base URL of a remote encoder, None for this machine
+        :param slots: Jobs it is given at once
+        """
+        self.name = name
+        self.url = url
+        self.slots = slots
+        self.active = 0  # Jobs this server has on it
+        self.reported = 0  # Jobs the encoder said it had at its last health check, from any server
+        self.healthy = True
+        self.checked_at = 0.0
+
+    def load(self) -> float:
+        return max(self.active, self.reported) / self.slots
+
+    def is_stale(self) -> bool:
+        return self.url is not None and time.monotonic() - self.checked_at >= ENCODER_HEALTH_SECONDS
+
+
+class EncoderPool:
+    """
+    The encoders a video can go to: remote encoders on the LAN and this machine. Every encode job in the server shares
+    the pool, so each encoder is kept to its slots however many tasks are running.
+
+    A job goes to the least loaded encoder with a free slot, remote encoders first on a tie. Load counts the jobs the
+    encoder reports from its health check (GET /encode/health, queued + running), so an encoder other servers keep busy
+    gets less. When a remote encoder stops answering part way through, the job moves on to the next encoder and the
+    failed one is left out until its health check passes again.
+    """
+
+    def __init__(self, remote_encoders: list[tuple[str, int, int]], local_slots: int = 1):
+        """
+        :param remote_encoders: (host, port, slots) of each remote encoder
+        :param local_slots: Jobs this machine encodes at once, 0 to never encode locally
+        """
+        self.nodes = [EncoderNode(f'{host}:{port}', f'http://{host}:{port}', slots)
+                      for host, port, slots in remote_encoders]
+        if local_slots > 0:
+            self.nodes.append(EncoderNode('local', None, local_slots))
+        self.changed = threading.Condition()
+
+    def has_remote(self) -> bool:
+        return any(node.url is not None for node in self.nodes)
+
+    def _check(self, node: EncoderNode):
+        try:
+            response = http_get(f'{node.url}/encode/health', timeout=ENCODER_HEALTH_TIMEOUT)
+            # Encoders without the health endpoint answer 404, they are up but their queue isn't known
+            reported = 0
+            if response.status_code == 200:
+                health = response.json()
+                reported = int(health.get('queued', 0)) + int(health.get('running', 0))
+            healthy = True
+        except (requests.RequestException, ValueError):
+            healthy = False
+            reported = 0
+
+        with self.changed:
+            node.healthy = healthy
+            node.reported = reported
+            node.checked_at = time.monotonic()
+            self.changed.notify_all()
+
+    def acquire(self, excluded: set[EncoderNode], log: TaskWrapper = NoOpTaskWrapper()) -> Optional[EncoderNode]:
+        """
+        Take a slot, waiting for one to free up when every encoder is busy.
+        :param excluded: Encoders that already failed this job
+        :param log: The task, waiting stops when it is cancelled
+        :return: The encoder, None when no encoder is left to try or the task was cancelled
+        """
+        while True:
+            if log.is_cancelled:
+                return None
+
+            for node in self.nodes:
+                if node not in excluded and node.is_stale():
+                    self._check(node)
+
+            with self.changed:
+                usable = [node for node in self.nodes if node not in excluded and node.healthy]
+                if len(usable) == 0:
+                    return None
+
+                free = [node for node in usable if max(node.active, node.reported) < node.slots]
+                if len(free) > 0:
+                    node = min(free, key=lambda n: (n.load(), n.url is None))
+                    node.active += 1
+                    node.reported += 1
+                    return node
+
+                # Cancelling a task doesn't notify the pool, it is looked at every second
+                self.changed.wait(min(1.0, ENCODER_HEALTH_SECONDS))
+
+    def release(self, node: EncoderNode, failed: bool = False):
+        """
+        Give a slot back.
+        :param node: The encoder
+        :param failed: It stopped answering, leave it out until it passes a health check
+        """
+        with self.changed:
+            node.active -= 1
+            node.reported = max(0, node.reported - 1)
+            if failed:
+                node.healthy = False
+                node.checked_at = time.monotonic()
+            self.changed.notify_all()
+
+    def encode(self, input_file, output_file, input_format=None, ffmpeg_preset: str = 'medium',
+               constant_rate_factor=23, stereo=True, audio_bitrate=128, srt_file: str | None = None,
+               log: TaskWrapper = NoOpTaskWrapper()) -> bool:
+        """
+        Encode a video on the pool, see encode_video.
+        :return: True when the encoded file is in place
+        """
+        input_path = Path(input_file)
+        output_path = Path(output_file)
+        options = remote_encode_options(input_format, ffmpeg_preset, constant_rate_factor, stereo, audio_bitrate)
+
+        tried = set()
+        while True:
+            if log.is_cancelled:
+                return False
+
+            node = self.acquire(tried, log)
+            if node is None:
+                if not log.is_cancelled:
+                    log.error('No encoder left to try')
+                return False
+            tried.add(node)
+
+            if node.url is None:
+                try:
+                    return encode_video_locally(input_path, output_path, input_format, ffmpeg_preset,
+                                                constant_rate_factor, stereo, audio_bitrate, srt_file, log)
+                finally:
+                    self.release(node)
+
+            log.info(f'Encoding on {node.name}')
+            failed = False
+            try:
+                if remote_encode(node.url, input_path, output_path, options, srt_file, log):
+                    return True
+            except Exception as e:
+                failed = True
+                log.warn(f'Lost {node.name}: {e}')
+            finally:
+                self.release(node, failed)
+
+            log.warn(f'{node.name} did not finish the encode, moving it to another encoder')
+
+
+def create_encoder_pool(encoder_host: str, encoder_port: int, encoder_list: str, local_slots: int) -> EncoderPool:
+    """
+    Build the pool from the app properties, the encoder host and port are the pool's first encoder.
+    :param encoder_host: SERVER.MEDIA.ENCODER.HOST
+    :param encoder_port: SERVER.MEDIA.ENCODER.PORT
+    :param encoder_list: SERVER.MEDIA.ENCODER.POOL
+    :param local_slots: SERVER.MEDIA.ENCODER.LOCAL.SLOTS
+    :return: The pool
+    """
+    remote_encoders = []
+    if is_not_blank(encoder_host):
+        remote_encoders.append((encoder_host, encoder_port, 1))
+    try:
+        remote_encoders.extend(parse_encoder_list(encoder_list))
+    except ValueError as e:
+        logging.warning(f'Ignoring the encoder pool: {e}')
+    if len(remote_encoders) == 0 and local_slots < 1:
+        logging.warning('No external media encoder, encoding one video at a time on this server')
+        local_slots = 1
+    return EncoderPool(remote_encoders, local_slots)
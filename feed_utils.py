@@ -1,11 +1,12 @@
-import requests
 import xml.etree.ElementTree as ElTree
 import re
 
+from http_client import http_get
+
 
 def get_guid_values_from_url(xml_url):
     # Fetch the XML content from the URL
-    response = requests.get(xml_url)
+    response = http_get(xml_url)
     if response.status_code != 200:
         print("Failed to fetch XML from URL:", xml_url)
         return []
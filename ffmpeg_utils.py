@@ -1,12 +1,16 @@
 import logging
+import os
 import subprocess
 import json
 
-import requests
-import time
 from pathlib import Path
+from typing import Optional
 
+from chunked_encode import encode_in_chunks
+from constants import MEDIA_PREVIEW_WIDTH, CHUNKED_ENCODE_MIN_SECONDS
+from media_probe import get_media_duration, probe_media
 from plugin_methods import plugin_select_arg, plugin_select_values
+from remote_encoder import remote_encode
 from thread_utils import TaskWrapper, NoOpTaskWrapper
 
 FFMPEG_PRESET = plugin_select_arg('Preset', 'ffmpeg_preset', 'medium', plugin_select_values(
@@ -58,6 +62,110 @@ def get_ffmpeg_f_argument_from_mimetype(mime: str) -> str:
     return 'mp4'
 
 
+def _x264_args(ffmpeg_preset: str, constant_rate_factor) -> list[str]:
+    return ["-c:v", "libx264", "-preset", ffmpeg_preset, "-profile:v", "high", "-level", "4.2", "-pix_fmt", "yuv420p",
+            "-crf", str(constant_rate_factor)]
+
+
+def _aac_args(audio_bitrate, stereo) -> list[str]:
+    return ["-c:a", "aac", "-b:a", f"{audio_bitrate}k", "-ac", str(2 if stereo else 1)]
+
+
+def _encode_long_video_in_chunks(input_file, output_file, input_format, video_filter: str, ffmpeg_preset: str,
+                                 constant_rate_factor, stereo, audio_bitrate, log: TaskWrapper) -> bool:
+    """
+    Encode a long video in keyframe aligned chunks, one ffmpeg per core, see encode_in_chunks
+    :return: True when the encoded file is in place, False to encode it in one pass
+    """
+    workers = os.cpu_count() or 1
+    duration = get_media_duration(os.fspath(input_file), log)
+    if workers < 2 or duration is None or duration < CHUNKED_ENCODE_MIN_SECONDS:
+        return False
+
+    log.info(f"Encoding in {workers} chunks...")
+    if encode_in_chunks(input_file, output_file, input_format, video_filter,
+                        _x264_args(ffmpeg_preset, constant_rate_factor), _aac_args(audio_bitrate, stereo), workers,
+                        log):
+        log.info("Chunked encode completed successfully.")
+        return True
+
+    if not log.is_cancelled:
+        log.warn("Chunked encode failed, encoding in one pass")
+    return False
+
+
+def encode_video_locally(input_file, output_file, input_format=None, ffmpeg_preset: str = 'medium',
+                         constant_rate_factor=23, stereo=True, audio_bitrate=128, srt_file: str | None = None,
+                         log: TaskWrapper = NoOpTaskWrapper()) -> bool:
+    """
+    Encode a video with this machine's ffmpeg, see encode_video
+    """
+    try:
+        log.info("Starting local ffmpeg encoding...")
+        if srt_file is None:
+            vf_arg = "scale='min(3840,iw)':-2"
+        else:
+            vf_arg = f"scale='min(3840,iw)':-2,subtitles={srt_file}"
+
+        if _encode_long_video_in_chunks(input_file, output_file, input_format, vf_arg, ffmpeg_preset,
+                                        constant_rate_factor, stereo, audio_bitrate, log):
+            return True
+        if log.is_cancelled:
+            return False
+
+        command = ["ffmpeg"]
+
+        if input_format:
+            command.extend(["-f", input_format])
+
+        command.extend([
+            "-y", "-i", str(input_file),
+            "-vf", vf_arg,
+            *_x264_args(ffmpeg_preset, constant_rate_factor),
+            "-movflags", "+faststart",
+            *_aac_args(audio_bitrate, stereo),
+            str(output_file)
+        ])
+
+        result = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+
+        if result.returncode != 0:
+            log.error("FFMPEG failed with error:")
+            log.error(result.stderr)
+            return False
+
+        log.info("FFMPEG completed successfully.")
+        return True
+
+    except Exception as e:
+        log.error(f"Local encode failed: {e}")
+        logging.exception(e)
+        return False
+
+
+def remote_encode_options(input_format=None, ffmpeg_preset: str = 'medium', constant_rate_factor=23, stereo=True,
+                          audio_bitrate=128) -> dict:
+    """
+    The options sent to a remote encoder, see remote_encoder
+    """
+    payload = {
+        "ffmpeg_preset": ffmpeg_preset,
+        "constant_rate_factor": constant_rate_factor,
+        "stereo": stereo,
+        "audio_bitrate": audio_bitrate,
+    }
+
+    if input_format is not None:
+        payload['input_format'] = input_format
+
+    return payload
+
+
 def encode_video(
     input_file,
     output_file,
@@ -76,114 +184,19 @@ def encode_video(
 
     # --- Nested helper for local fallback ---
     def _run_local_encode():
-        try:
-            log.info("Starting local ffmpeg encoding...")
-            command = ["ffmpeg"]
-
-            if input_format:
-                command.extend(["-f", input_format])
-
-            channels = 2 if stereo else 1
-
-            if srt_file is not None:
-                vf_arg = "scale='min(3840,iw)':-2"
-            else:
-                vf_arg = f"scale='min(3840,iw)':-2,subtitles={srt_file}"
-
-            command.extend([
-                "-y", "-i", str(input_path),
-                "-vf", vf_arg,
-                "-c:v", "libx264",
-                "-preset", ffmpeg_preset,
-                "-profile:v", "high",
-                "-level", "4.2",
-                "-pix_fmt", "yuv420p",
-                "-crf", str(constant_rate_factor),
-                "-movflags", "+faststart",
-                "-c:a", "aac",
-                "-b:a", f"{audio_bitrate}k",
-                "-ac", str(channels),
-                str(output_path)
-            ])
-
-            result = subprocess.run(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-
-            if result.returncode != 0:
-                log.error("FFMPEG failed with error:")
-                log.error(result.stderr)
-                return False
-
-            log.info("FFMPEG completed successfully.")
-            return True
-
-        except Exception as e:
-            log.error(f"Local encode failed: {e}")
-            logging.exception(e)
-            return False
+        return encode_video_locally(input_path, output_path, input_format, ffmpeg_preset, constant_rate_factor, stereo,
+                                    audio_bitrate, srt_file, log)
 
     # If a remote server is provided, try it first
     if server_url:
         try:
-            log.info(f"Submitting job to remote server: {server_url}")
-
-            files = {"input_file": open(input_path, "rb")}
-            if srt_file and Path(srt_file).exists():
-                files["srt_file"] = open(srt_file, "rb")
-
-            payload = {
-                "ffmpeg_preset": ffmpeg_preset,
-                "constant_rate_factor": constant_rate_factor,
-                "stereo": stereo,
-                "audio_bitrate": audio_bitrate,
-            }
-
-            if input_format is not None:
-                payload['input_format'] = input_format
-
-            response = requests.post(f"{server_url}/encode/start", files=files, data={"options": json.dumps(payload)}, timeout=15)
-            for f in files.values():
-                f.close()
-
-            if response.status_code != 200:
-                log.warn(f"Server returned {response.status_code}, falling back to local.")
-                return _run_local_encode()
-
-            ticket = response.json()
-            ticket_id = ticket.get("ticket_id")
-            if not ticket_id:
-                log.warn("No ticket_id in response; falling back to local encoding.")
-                return _run_local_encode()
-
-            # Poll every 30s
-            while True:
-                time.sleep(30)
-                status_resp = requests.get(f"{server_url}/encode/status/{ticket_id}", timeout=10)
-                if status_resp.status_code != 200:
-                    log.warn("Status check failed; falling back to local.")
-                    return _run_local_encode()
-
-                status = status_resp.json().get("status")
-                log.info(f"Ticket {ticket_id} status: {status}")
-                if status == "done":
-                    # Retrieve file
-                    result = requests.get(f"{server_url}/encode/result/{ticket_id}", timeout=60)
-                    if result.status_code == 200:
-                        with open(output_path, "wb") as f:
-                            f.write(result.content)
-                        log.info("Downloaded encoded file successfully.")
-                        return True
-                    else:
-                        log.error("Failed to download result file; falling back to local.")
-                        return _run_local_encode()
-                elif status == "failed":
-                    log.error("Remote encoding failed; falling back to local.")
-                    return _run_local_encode()
-                # otherwise, "queued" or "processing" — continue waiting
+            payload = remote_encode_options(input_format, ffmpeg_preset, constant_rate_factor, stereo, audio_bitrate)
+
+            if remote_encode(server_url, input_path, output_path, payload, srt_file, log):
+                return True
+            if log.is_cancelled:
+                return False
+            return _run_local_encode()
 
         except Exception as e:
             log.warn(f"Remote encoding attempt failed: {e}")
@@ -199,6 +212,13 @@ def burn_subtitles_to_video(input_file, srt_file, output_file, offset:int = 0, i
                             ffmpeg_preset: str = 'medium', constant_rate_factor: int = 23, stereo=True,
                             audio_bitrate=128, log: TaskWrapper = NoOpTaskWrapper()):
     try:
+        vf_arg = f"scale='min(3840,iw)':-2,subtitles={srt_file}"
+
+        if _encode_long_video_in_chunks(input_file, output_file, input_format, vf_arg, ffmpeg_preset,
+                                        constant_rate_factor, stereo, audio_bitrate, log):
+            return True
+        if log.is_cancelled:
+            return False
 
         # Construct the FFMPEG command
         command = ["ffmpeg"]
@@ -207,23 +227,12 @@ def burn_subtitles_to_video(input_file, srt_file, output_file, offset:int = 0, i
         if input_format:
             command.extend(["-f", input_format])
 
-        channels = 1
-        if stereo:
-            channels = 2
-
         command.extend([
             "-y", "-i", input_file,
-            "-vf", f"scale='min(3840,iw)':-2,subtitles={srt_file}",
-            "-c:v", "libx264",
-            "-preset", ffmpeg_preset,
-            "-profile:v", "high",
-            "-level", "4.2",
-            "-pix_fmt", "yuv420p",
-            "-crf", str(constant_rate_factor),
+            "-vf", vf_arg,
+            *_x264_args(ffmpeg_preset, constant_rate_factor),
             "-movflags", "+faststart",
-            "-c:a", "aac",
-            "-b:a", f"{audio_bitrate}k",
-            "-ac", str(channels),
+            *_aac_args(audio_bitrate, stereo),
             output_file
         ])
 
@@ -251,8 +260,9 @@ def burn_subtitles_to_video(input_file, srt_file, output_file, offset:int = 0, i
 
 # Utilities
 
-def get_video_duration(input_file, input_format: str):
-    result = subprocess.run(['ffmpeg', "-f", input_format, '-i', input_file], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+def get_video_duration(input_file, input_format: Optional[str]):
+    format_args = ["-f", input_format] if input_format is not None else []
+    result = subprocess.run(['ffmpeg', *format_args, '-i', input_file], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
     # Extract duration from ffmpeg output
     duration_line = [line for line in result.stderr.decode().split('\n') if 'Duration' in line]
     if not duration_line:
@@ -262,68 +272,80 @@ def get_video_duration(input_file, input_format: str):
     return int(h * 3600 + m * 60 + s)
 
 
-def generate_video_thumbnail(input_file, input_format: str, output_file, percentage):
-    # Get the video duration
-    duration = get_video_duration(input_file, input_format)
+def generate_video_thumbnail(input_file, input_format: Optional[str], output_file, percentage,
+                             width: int = MEDIA_PREVIEW_WIDTH, duration: Optional[float] = None):
+    """
+    Make a WEBP preview of a video in one ffmpeg run. The seek happens before the input is opened, so only the
+    nearest keyframe onwards is decoded, and the frame is scaled and encoded by ffmpeg, like resize_image would,
+    instead of going through a PNG. The duration comes from the cached probe, unless it is given.
+    :param input_file: The video
+    :param input_format: ffmpeg's -f for the input, None to let ffmpeg work it out
+    :param output_file: Where the WEBP goes
+    :param percentage: Position of the frame, in percent of the duration
+    :param width: Width of the preview
+    :param duration: Seconds, when already known, see probe_media_file
+    """
+    if duration is None:
+        duration = get_media_duration(input_file)
+    if duration is None:
+        duration = get_video_duration(input_file, input_format)
     # Calculate the time at the specified percentage
-    time = duration * percentage / 100
-    # Extract the frame at the calculated time and save as PNG
-    subprocess.run(['ffmpeg', '-ss', str(time), "-f", input_format, '-i', input_file, '-frames:v', '1', output_file, '-y'], check=True)
-
-
-def get_media_info(file_path: str, logger: TaskWrapper):
-    cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-print_format", "json",
-        "-show_streams",
-        "-show_format",
-        file_path
-    ]
-
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-    if result.returncode != 0:
+    position = duration * percentage / 100
+
+    command = ['ffmpeg', '-v', 'error', '-ss', f'{position:.3f}']
+    if input_format is not None:
+        command.extend(['-f', input_format])
+    # Scaled to the width, a frame over twice as tall as it is wide is cropped to a square from its middle
+    command.extend(['-i', input_file, '-map', '0:v:0', '-frames:v', '1',
+                    '-vf', f"scale={width}:-1:flags=lanczos,crop=iw:'if(gt(ih,2*iw),iw,ih)'",
+                    '-c:v', 'libwebp', '-quality', '80', '-f', 'webp', output_file, '-y'])
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def get_media_info(file_path: str, logger: TaskWrapper, metadata: Optional[dict] = None):
+    """
+    Log and return a summary of a media file's format and streams
+    :param file_path: The media file
+    :param logger: The task
+    :param metadata: The probe, when already known, see probe_media_file
+    :return: The summary, None if it could not be probed
+    """
+    if metadata is None:
+        metadata = probe_media(file_path, logger)
+
+    if metadata is None:
         logger.set_failure()
-        logger.error(f"Error: {result.stderr}")
         return None
 
-    try:
-        metadata = json.loads(result.stdout)
-
-        info = {
-            "format": metadata.get("format", {}).get("format_name", "Unknown"),
-            "duration": metadata.get("format", {}).get("duration", "Unknown"),
-            "bit_rate": metadata.get("format", {}).get("bit_rate", "Unknown"),
-            "streams": []
+    info = {
+        "format": metadata.get("format", {}).get("format_name", "Unknown"),
+        "duration": metadata.get("format", {}).get("duration", "Unknown"),
+        "bit_rate": metadata.get("format", {}).get("bit_rate", "Unknown"),
+        "streams": []
+    }
+
+    for stream in metadata.get("streams", []):
+        stream_info = {
+            "codec": stream.get("codec_name", "Unknown"),
+            "type": stream.get("codec_type", "Unknown"),
+            "bit_rate": stream.get("bit_rate", "Unknown")
         }
 
-        for stream in metadata.get("streams", []):
-            stream_info = {
-                "codec": stream.get("codec_name", "Unknown"),
-                "type": stream.get("codec_type", "Unknown"),
-                "bit_rate": stream.get("bit_rate", "Unknown")
-            }
-
-            if stream_info["type"] == "video":
-                stream_info.update({
-                    "width": stream.get("width", "Unknown"),
-                    "height": stream.get("height", "Unknown"),
-                    "fps": eval(stream.get("avg_frame_rate", "0/1")) if stream.get("avg_frame_rate") else "Unknown"
-                })
-
-            if stream_info["type"] == "audio":
-                stream_info.update({
-                    "channels": stream.get("channels", "Unknown"),
-                    "sample_rate": stream.get("sample_rate", "Unknown")
-                })
+        if stream_info["type"] == "video":
+            stream_info.update({
+                "width": stream.get("width", "Unknown"),
+                "height": stream.get("height", "Unknown"),
+                "fps": eval(stream.get("avg_frame_rate", "0/1")) if stream.get("avg_frame_rate") else "Unknown"
+            })
 
-            info["streams"].append(stream_info)
+        if stream_info["type"] == "audio":
+            stream_info.update({
+                "channels": stream.get("channels", "Unknown"),
+                "sample_rate": stream.get("sample_rate", "Unknown")
+            })
 
-        logger.info(json.dumps(info))
+        info["streams"].append(stream_info)
 
-        return info
+    logger.info(json.dumps(info))
 
-    except json.JSONDecodeError:
-        print("Error decoding JSON output")
-        return None
\ No newline at end of file
+    return info
@@ -25,4 +25,16 @@ def generate_unique_string(file_path):
     unique_string = f"{folder_hash}_{file_hash}"
 
     # Return the unique string
-    return str(unique_string)
\ No newline at end of file
+    return str(unique_string)
+
+def file_sha256(file_path) -> str:
+    """
+    SHA256 of a file's content, read in chunks so large files are never held in memory.
+    :param file_path: The file
+    :return: The hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,202 @@
+import json
+import logging
+import math
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from constants import HLS_SEGMENT_SECONDS, HLS_FIRST_SEGMENT_SECONDS
+from disk_cache import SizeBoundedDiskCache
+from media_probe import read_keyframes
+
+
+def split_at_keyframes(keyframes: list[float], end: float, first_seconds: float = HLS_FIRST_SEGMENT_SECONDS,
+                       seconds: float = HLS_SEGMENT_SECONDS) -> list[tuple[float, float]]:
+    """
+    Group a video's keyframes into segments. Every segment starts on a keyframe, so it can be cut without decoding.
+    :param keyframes: Keyframe times, in order
+    :param end: When the video ends
+    :param first_seconds: Shortest first segment
+    :param seconds: Shortest later segment
+    :return: (start, duration) of each segment
+    """
+    if len(keyframes) == 0:
+        return []
+
+    starts = [keyframes[0]]
+    shortest = first_seconds
+    for keyframe in keyframes[1:]:
+        if keyframe - starts[-1] >= shortest:
+            starts.append(keyframe)
+            shortest = seconds
+
+    ends = starts[1:] + [max(end, starts[-1] + 0.001)]
+    return [(start, segment_end - start) for start, segment_end in zip(starts, ends)]
+
+
+class HlsSegmentCache(SizeBoundedDiskCache):
+    """
+    Packages media files as HLS on demand. Segments are remuxed (ffmpeg -c copy) to MPEG-TS, one keyframe range at a
+    time, and kept in a size bounded folder on the primary drive, keyed by file id and the file's mtime.
+
+    Each request for a segment also queues the next window segments, so generation stays ahead of playback. They are
+    made one at a time by a single background thread, a remux is bound by the disk, not the CPU.
+    """
+
+    def __init__(self, cache_folder: str, max_bytes: int, window: int):
+        """
+        :param cache_folder: Where segments are kept
+        :param max_bytes: Most bytes kept, 0 disables HLS
+        :param window: Segments prepared ahead of the one being played
+        """
+        super().__init__(cache_folder, max_bytes)
+        self.window = window
+        self.pending_lock = threading.Lock()
+        self.pending: dict[str, threading.Event] = {}
+        self.queued: set[str] = set()
+        self.prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hls')
+
+    def _entry_folder(self, source_path: str, file_id: str) -> str:
+        return os.path.join(self.cache_folder, file_id, str(os.stat(source_path).st_mtime_ns))
+
+    @staticmethod
+    def _segment_path(entry_folder: str, index: int) -> str:
+        return os.path.join(entry_folder, f'{index:05}.ts')
+
+    def segments(self, source_path: str, file_id: str) -> list[tuple[float, float]]:
+        """
+        The segments of a file, from its keyframes. They are worked out once and kept with the segments.
+        :param source_path: The media file
+        :param file_id: Its id
+        :return: (start, duration) of each segment, empty when there is no video
+        """
+        index_path = os.path.join(self._entry_folder(source_path, file_id), 'index.json')
+        self._ensure(index_path, lambda temp_path: self._write_index(source_path, temp_path))
+        with open(index_path, 'r') as index_file:
+            return [(start, duration) for start, duration in json.load(index_file)['segments']]
+
+    def playlist(self, source_path: str, file_id: str, segment_uri: Callable[[int], str]) -> Optional[str]:
+        """
+        A VOD playlist for a file. The first segments start being made right away, before the player asks.
+        :param source_path: The media file
+        :param file_id: Its id
+        :param segment_uri: URI of a segment by its index, relative to the playlist
+        :return: The m3u8 text, None when the file has no video
+        """
+        segments = self.segments(source_path, file_id)
+        if len(segments) == 0:
+            return None
+
+        self._prefetch(source_path, self._entry_folder(source_path, file_id), segments, -1)
+
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3',
+                 f'#EXT-X-TARGETDURATION:{math.ceil(max(duration for _, duration in segments))}',
+                 '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-INDEPENDENT-SEGMENTS']
+        for index, (_, duration) in enumerate(segments):
+            lines.append(f'#EXTINF:{duration:.6f},')
+            lines.append(segment_uri(index))
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def fetch_segment(self, source_path: str, file_id: str, index: int) -> Optional[str]:
+        """
+        Get the path to a segment, making it when missing, and queue the ones after it.
+        :param source_path: The media file
+        :param file_id: Its id
+        :param index: The segment
+        :return: Path to the cached segment, None if there is no such segment
+        """
+        segments = self.segments(source_path, file_id)
+        if index < 0 or index >= len(segments):
+            return None
+
+        entry_folder = self._entry_folder(source_path, file_id)
+        segment_path = self._ensure(self._segment_path(entry_folder, index),
+                                    lambda temp_path: self._write_segment(source_path, segments, index, temp_path))
+        self._prefetch(source_path, entry_folder, segments, index)
+        return segment_path
+
+    def _prefetch(self, source_path: str, entry_folder: str, segments: list[tuple[float, float]], index: int):
+        for next_index in range(index + 1, min(index + 1 + self.window, len(segments))):
+            segment_path = self._segment_path(entry_folder, next_index)
+            with self.pending_lock:
+                if segment_path in self.pending or segment_path in self.queued or os.path.exists(segment_path):
+                    continue
+                self.queued.add(segment_path)
+            self.prefetcher.submit(self._prefetch_segment, source_path, segments, next_index, segment_path)
+
+    def _prefetch_segment(self, source_path: str, segments: list[tuple[float, float]], index: int,
+                          segment_path: str):
+        with self.pending_lock:
+            self.queued.discard(segment_path)
+        try:
+            self._ensure(segment_path, lambda temp_path: self._write_segment(source_path, segments, index, temp_path))
+        except Exception as e:
+            logging.warning(f'Unable to prepare HLS segment {segment_path}: {e}')
+
+    def _ensure(self, entry_path: str, build: Callable[[str], None]) -> str:
+        """
+        Get a cache entry, building it when missing. A request for an entry that is being built waits for it,
+        instead of building it again.
+        :param entry_path: The entry
+        :param build: Writes the entry to the path it is given
+        :return: The entry path
+        """
+        while True:
+            try:
+                # Touch the entry, so it counts as recently used
+                os.utime(entry_path)
+                return entry_path
+            except FileNotFoundError:
+                pass
+
+            with self.pending_lock:
+                event = self.pending.get(entry_path)
+                building = event is None
+                if building:
+                    event = threading.Event()
+                    self.pending[entry_path] = event
+
+            if not building:
+                event.wait()
+                continue
+
+            try:
+                os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+                # Write to a temp file first, a concurrent request must never see a partial entry
+                temp_path = f'{entry_path}.{threading.get_ident()}.tmp'
+                try:
+                    build(temp_path)
+                    os.replace(temp_path, entry_path)
+                except Exception:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+
+                self._track_added(os.path.getsize(entry_path))
+                return entry_path
+            finally:
+                with self.pending_lock:
+                    del self.pending[entry_path]
+                event.set()
+
+    @staticmethod
+    def _write_index(source_path: str, index_path: str):
+        keyframes, end = read_keyframes(source_path)
+        with open(index_path, 'w') as index_file:
+            json.dump({'segments': split_at_keyframes(keyframes, end)}, index_file)
+
+    @staticmethod
+    def _write_segment(source_path: str, segments: list[tuple[float, float]], index: int, segment_path: str):
+        start, duration = segments[index]
+        # The seek lands on the segment's keyframe. The offset keeps the original timeline, so segments line up
+        command = ['ffmpeg', '-v', 'error', '-ss', f'{start:.6f}', '-i', source_path]
+        if index < len(segments) - 1:
+            command.extend(['-t', f'{duration:.6f}'])
+        command.extend(['-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-output_ts_offset', f'{start:.6f}',
+                        '-f', 'mpegts', segment_path, '-y'])
+        subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       check=True)
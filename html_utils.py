@@ -1,6 +1,7 @@
 import json
 import os
 import tempfile
+import threading
 from datetime import datetime, timedelta
 from typing import Optional
 from urllib.parse import urlparse
@@ -9,8 +10,9 @@ import mimetypes
 import requests
 from bs4 import BeautifulSoup
 
-from curl_utils import custom_curl_get, read_temp_file, custom_curl_post, custom_curl_headers
-from thread_utils import TaskWrapper
+from curl_utils import custom_curl_get, read_temp_file, custom_curl_post, custom_curl_headers, custom_curl_get_batch
+from http_client import http_get, http_download
+from thread_utils import TaskWrapper, NoOpTaskWrapper
 
 def download_unsecure_file(url, destination_folder, filename, headers=None, task_logger: TaskWrapper = None):
     """
@@ -30,8 +32,9 @@ def download_unsecure_file(url, destination_folder, filename, headers=None, task
         # Create destination folder if it doesn't exist
         os.makedirs(destination_folder, exist_ok=True)
 
-        # Get the file content from the URL
-        response = requests.get(url, headers=headers)
+        # Stream the file to the specified path, over a pooled connection
+        file_path = os.path.join(destination_folder, filename)
+        response = http_download(url, file_path, headers)
 
         if response.status_code == 403:
             print("Not authorized:", url)
@@ -48,11 +51,6 @@ def download_unsecure_file(url, destination_folder, filename, headers=None, task
 
         response.raise_for_status()  # Raise an exception for bad status codes
 
-        # Save the file to the specified path
-        file_path = os.path.join(destination_folder, filename)
-        with open(file_path, 'wb') as file:
-            file.write(response.content)
-
         print("File downloaded successfully:", file_path)
         return True
     except Exception as e:
@@ -86,6 +84,27 @@ def download_secure_file(url, destination_folder, filename, headers=None, task_l
         return False
 
 
+def download_secure_files(downloads: list[tuple[str, str]], destination_folder, headers=None,
+                          task_logger: TaskWrapper = None, parallel: int = 1, rate: Optional[float] = None) -> list[bool]:
+    """
+    Download many files from one site with a single curl call, see custom_curl_get_batch.
+    :param downloads: (url, filename) pairs
+    :param destination_folder: The folder the files are saved in
+    :param headers: Headers sent with every URL
+    :param task_logger: The task
+    :param parallel: Transfers at once
+    :param rate: Most requests per second, for serial transfers
+    :return: Whether each file was downloaded, in order
+    """
+    if headers is None:
+        headers = {}
+    os.makedirs(destination_folder, exist_ok=True)
+    codes = custom_curl_get_batch([(url, os.path.join(destination_folder, filename)) for url, filename in downloads],
+                                  headers, task_logger if task_logger is not None else NoOpTaskWrapper(),
+                                  parallel=parallel, rate=rate)
+    return [code == 0 for code in codes]
+
+
 def download_secure_text(url, headers=None, task_logger: TaskWrapper = None):
     """
     Download a text-based file from the given URL and return the text
@@ -187,7 +206,7 @@ def download_html(url):
     str: The HTML content of the webpage.
     """
     try:
-        response = requests.get(url)
+        response = http_get(url)
         response.raise_for_status()  # Raise an exception for bad status codes
         return response.text
     except requests.exceptions.RequestException as e:
@@ -264,6 +283,29 @@ def has_valid_headers():
 
     return modified_time >= time_limit
 
+_header_profiles = {}
+_header_profiles_lock = threading.Lock()
+
+
+def _load_header_profile(file_path: str) -> dict:
+    """
+    The headers saved in a headers.json file. The file is read again only when its mtime changes, not for every page
+    and image of a download.
+    :param file_path: The headers.json path
+    :return: A copy the caller can change
+    """
+    file_path = os.path.abspath(file_path)
+    mtime = os.stat(file_path).st_mtime_ns
+    with _header_profiles_lock:
+        cached = _header_profiles.get(file_path)
+    if cached is None or cached[0] != mtime:
+        with open(file_path, 'r') as file:
+            cached = (mtime, json.load(file))
+        with _header_profiles_lock:
+            _header_profiles[file_path] = cached
+    return dict(cached[1])
+
+
 def get_headers(url: str, is_page: bool, task_wrapper: TaskWrapper, test: bool = False, alt_url: str = None, ignore_errors: bool = False) -> \
         Optional[dict[str, str]]:
     """
@@ -288,32 +330,31 @@ def get_headers(url: str, is_page: bool, task_wrapper: TaskWrapper, test: bool =
         # Look up one folder
         file_path = '../headers.json'
 
-    with open(file_path, 'r') as file:
-        try:
-            headers = json.load(file)
+    try:
+        headers = _load_header_profile(file_path)
 
-            if is_page:
-                headers["accept"] = "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7"
-            else:
-                headers["accept"] = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
-            headers["Accept-Encoding"] = "gzip, deflate, br, zstd"
+        if is_page:
+            headers["accept"] = "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7"
+        else:
+            headers["accept"] = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+        headers["Accept-Encoding"] = "gzip, deflate, br, zstd"
 
-            # Use alt_url if provided, otherwise use url
-            referer_url = alt_url if alt_url and len(alt_url) > 0 else url
+        # Use alt_url if provided, otherwise use url
+        referer_url = alt_url if alt_url and len(alt_url) > 0 else url
 
-            if task_wrapper is not None and task_wrapper.can_trace():
-                task_wrapper.trace(f'referer_url: {referer_url}')
-                task_wrapper.trace(f'cleaned_referer_url: {get_base_url(referer_url)}')
+        if task_wrapper is not None and task_wrapper.can_trace():
+            task_wrapper.trace(f'referer_url: {referer_url}')
+            task_wrapper.trace(f'cleaned_referer_url: {get_base_url(referer_url)}')
 
-            headers["referer"] = get_base_url(referer_url)
-            headers["authority"] = get_authority_url(referer_url)
+        headers["referer"] = get_base_url(referer_url)
+        headers["authority"] = get_authority_url(referer_url)
 
-            return headers
-        except json.JSONDecodeError:
-            task_wrapper.error(f"Failed to load JSON from headers.json.")
-            if not ignore_errors:
-                task_wrapper.set_failure(True)
-            return None
+        return headers
+    except json.JSONDecodeError:
+        task_wrapper.error(f"Failed to load JSON from headers.json.")
+        if not ignore_errors:
+            task_wrapper.set_failure(True)
+        return None
 
 
 def guess_file_extension(url: str) -> str:
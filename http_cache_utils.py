@@ -0,0 +1,88 @@
+import hashlib
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from flask import Response, request
+
+
+class FileValidators:
+    """
+    Strong ETag and Last-Modified validators for a file that is served as-is or derived from a file on disk.
+
+    The ETag is built from a caller supplied key (file id, book/chapter/image...) plus the file's size and mtime, so
+    it is known from a single stat() and a route can answer a conditional request before opening the file.
+    """
+
+    def __init__(self, item_key: str, file_path: str):
+        """
+        :param item_key: What is being served, must differ between derived variants of the same file
+        :param file_path: The file the response is built from
+        """
+        stat = os.stat(file_path)
+        self.etag = hashlib.sha1(f'{item_key}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8')).hexdigest()[:32]
+        # HTTP dates only carry whole seconds
+        self.last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+
+    def is_not_modified(self) -> bool:
+        """
+        Check the request's If-None-Match, or when missing its If-Modified-Since, against this file.
+        :return: True if the client's copy is current and a 304 can be sent
+        """
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        if request.if_modified_since is not None:
+            return self.last_modified <= request.if_modified_since
+        return False
+
+    def is_range_current(self) -> bool:
+        """
+        Check the request's If-Range against this file, a stale If-Range means the whole file must be sent.
+        :return: True if a Range request may be answered with partial content
+        """
+        if_range_header = request.headers.get('If-Range')
+        if not if_range_header:
+            return True
+        if if_range_header.strip().startswith('W/'):
+            # If-Range only accepts strong validators
+            return False
+        if_range = request.if_range
+        if if_range.etag is not None:
+            return if_range.etag == self.etag
+        if if_range.date is not None:
+            return if_range.date == self.last_modified
+        return False
+
+    def apply(self, response: Response) -> Response:
+        """
+        Add the validators to a response.
+        :param response: The response for this file
+        :return: The same response
+        """
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        return response
+
+    def not_modified_response(self, max_age: Optional[int] = None) -> Response:
+        """
+        Build the 304 reply, with the same validators and cache headers the full response would carry.
+        :param max_age: Seconds the client may cache the response, None to leave out the cache headers
+        :return: The 304 response
+        """
+        response = self.apply(Response(status=304))
+        if max_age is not None:
+            set_cache_headers(response, max_age)
+        return response
+
+
+def set_cache_headers(response: Response, max_age: int) -> Response:
+    """
+    Allow the client to cache a response for max_age seconds.
+    :param response: The response
+    :param max_age: Seconds to cache
+    :return: The same response
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=max_age)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    response.headers['Expires'] = expires_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    return response
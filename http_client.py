@@ -0,0 +1,88 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from constants import HTTP_POOL_HOSTS, HTTP_POOL_CONNECTIONS_PER_HOST, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, \
+    HTTP_DOWNLOAD_CHUNK_SIZE
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+# One keep-alive pool per host, shared by every thread. The adapter's pool manager is thread safe, a Session is not
+_adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_CONNECTIONS_PER_HOST)
+_local = threading.local()
+
+
+def http_session() -> requests.Session:
+    """
+    The calling thread's session. Every session sends through the same connection pools, so a connection opened by
+    one task is reused by the next request to that host, from any thread.
+    Cookies are not kept between requests, the same as the plain requests calls this replaces.
+    :return: The session
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.mount('http://', _adapter)
+        session.mount('https://', _adapter)
+        _local.session = session
+    return session
+
+
+def http_get(url: str, headers=None, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """
+    GET over a pooled connection, see requests.get
+    """
+    return http_session().get(url, headers=headers, timeout=timeout, **kwargs)
+
+
+def http_post(url: str, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """
+    POST over a pooled connection, see requests.post
+    """
+    return http_session().post(url, timeout=timeout, **kwargs)
+
+
+def http_download(url: str, file_path, headers=None, timeout=DEFAULT_TIMEOUT, resume: bool = False) -> requests.Response:
+    """
+    Stream a response body to a file, without holding it in memory. The body goes to a .part file that is moved into
+    place once complete, so a failed download doesn't leave half a file behind.
+    Nothing is written when the status isn't 2xx, check the returned response.
+    :param url: The URL
+    :param file_path: Where the body is saved
+    :param headers: Request headers
+    :param timeout: Connect and read timeout
+    :param resume: Keep the .part file when the transfer breaks, and continue it with a Range request on the next call
+    :return: The (closed) response
+    """
+    file_path = os.fspath(file_path)
+    partial_path = file_path + '.part'
+
+    offset = 0
+    request_headers = dict(headers or {})
+    if resume and os.path.exists(partial_path):
+        offset = os.path.getsize(partial_path)
+        if offset > 0:
+            request_headers['Range'] = f'bytes={offset}-'
+
+    with http_get(url, headers=request_headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 416 and offset > 0:
+            # The partial file doesn't match the resource anymore, start over
+            os.remove(partial_path)
+            return http_download(url, file_path, headers, timeout, resume)
+        if not response.ok:
+            return response
+        try:
+            # A server that ignores the Range header sends the whole body
+            with open(partial_path, 'ab' if response.status_code == 206 else 'wb') as file:
+                for chunk in response.iter_content(chunk_size=HTTP_DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+            os.replace(partial_path, file_path)
+        except BaseException:
+            if not resume and os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+    return response
@@ -0,0 +1,63 @@
+import hashlib
+import os
+import threading
+from typing import Optional
+
+from disk_cache import SizeBoundedDiskCache
+from image_utils import shrink_image_to_width
+
+
+class DerivedImageCache(SizeBoundedDiskCache):
+    """
+    A size bounded on-disk cache for derived (resized) volume images.
+
+    Entries are keyed by book, chapter, image, target width and the source file's mtime, so a changed page never
+    serves a stale derivative. The least recently used entries are evicted, see SizeBoundedDiskCache.
+    """
+
+    def _entry_path(self, source_path: str, book_id: str, chapter_id: str, image_name: str, width: int,
+                    source_mtime_ns: int) -> str:
+        key = f'{book_id}/{chapter_id}/{image_name}@{width}:{source_mtime_ns}'
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        extension = os.path.splitext(source_path)[1].lower()
+        return os.path.join(self.cache_folder, digest[:2], digest + extension)
+
+    def fetch(self, source_path: str, book_id: str, chapter_id: str, image_name: str, width: int) -> Optional[str]:
+        """
+        Get the path to a cached derivative of the source image, creating it when missing.
+        :param source_path: Path to the full size image
+        :param book_id: The book the image belongs to
+        :param chapter_id: The chapter the image belongs to
+        :param image_name: The image's file name
+        :param width: The target width
+        :return: Path to the cached file, or None if the cache is disabled
+        """
+        if not self.is_enabled():
+            return None
+
+        entry_path = self._entry_path(source_path, book_id, chapter_id, image_name, width,
+                                      os.stat(source_path).st_mtime_ns)
+
+        try:
+            # Touch the entry, so it counts as recently used
+            os.utime(entry_path)
+            return entry_path
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+        # Write to a temp file first, a concurrent request must never see a partial image
+        temp_path = f'{entry_path}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'wb') as temp_file:
+                shrink_image_to_width(source_path, temp_file, width)
+            os.replace(temp_path, entry_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self._track_added(os.path.getsize(entry_path))
+
+        return entry_path
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Optional
 
 from PIL import Image
 
@@ -55,6 +56,31 @@ def resize_image(input_path, output_path, target_width, file_format='PNG'):
     resized_image.save(output_path, format=file_format)
 
 
+def shrink_image_to_width(input_path, output, target_width) -> str:
+    """
+    Shrink an image down to a target width while maintaining aspect ratio, keeping the source format.
+    Images that are already narrow enough are re-saved as is.
+
+    Args:
+        input_path (str): Path to the input image file.
+        output: A path or a writable binary file object.
+        target_width (int): The max width for the image.
+
+    Returns:
+        str: The image format that was written.
+    """
+    with Image.open(input_path) as img:
+        img_format = img.format if img.format else 'JPEG'
+        width, height = img.size
+        if width > target_width:
+            new_height = int((target_width / width) * height)
+            img = img.resize((target_width, new_height), Image.LANCZOS)
+
+        img.save(output, format=img_format)
+
+    return img_format
+
+
 def crop_and_resize(input_path, output_path, size, side=False):
     # Open the image
     original_image = Image.open(input_path)
@@ -187,6 +213,51 @@ def clean_images_folder(folder_path, logger: TaskWrapper):
                 logger.set_failure()
 
 
+def read_page_info(image_path: str, previous: Optional[dict] = None) -> dict:
+    """
+    Describe a chapter page for the reader manifest, only the image header is read.
+    :param image_path: The page file
+    :param previous: The page's entry from the last scan, reused as is when the file hasn't changed
+    :return: name, w, h, size (bytes), format and mtime (ns), w and h are 0 when the file isn't a readable image
+    """
+    stat = os.stat(image_path)
+    if previous is not None and previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime_ns:
+        return previous
+
+    width, height, image_format = 0, 0, ''
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            image_format = (img.format or '').lower()
+    except Exception:
+        pass
+
+    return {'name': os.path.basename(image_path), 'w': width, 'h': height, 'size': stat.st_size,
+            'format': image_format, 'mtime': stat.st_mtime_ns}
+
+
+def build_chapter_manifest(chapter_path: str, file_names: list[str],
+                           previous: Optional[list[dict]] = None) -> list[dict]:
+    """
+    Build the reader manifest of a chapter, one read_page_info entry per page in reading order.
+    :param chapter_path: The chapter folder
+    :param file_names: The page files, in reading order
+    :param previous: The manifest from the last scan, unchanged pages are not opened again
+    :return: The manifest
+    """
+    previous_pages = {page['name']: page for page in previous} if previous else {}
+    manifest = []
+
+    for file_name in file_names:
+        file_path = os.path.join(chapter_path, file_name)
+        if os.path.isfile(file_path):
+            manifest.append(read_page_info(file_path, previous_pages.get(file_name)))
+        else:
+            manifest.append({'name': file_name, 'w': 0, 'h': 0, 'size': 0, 'format': '', 'mtime': 0})
+
+    return manifest
+
+
 def split_and_save_image(image_path: str, position: int, is_horizontal: bool, keep_first: bool):
     """
     Split an image and only save a part of it
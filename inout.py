@@ -3,16 +3,35 @@ import os
 from datetime import date
 from datetime import datetime
 
+from alembic import command
+from alembic.config import Config
 from flask_sqlalchemy.session import Session
 from sqlalchemy import MetaData
 from sqlalchemy.engine.reflection import Inspector
 
-from app_queries import get_volume_folder
+from app_queries import get_volume_folder, get_volume_scan_workers
 from db import db, UserGroup, User, Book, MediaFolder, MediaFileProgress, VolumeProgress, AppProperties, UserLimit, \
     UserHardSession, MediaFile, VolumeBookmark
+from media_queries import upsert_progress_entries
 from plugins.book_update_stats import generate_book_definitions
+from search_index import rebuild_search_index, reset_search_index
 from text_utils import is_not_blank
 from thread_utils import TaskWrapper
+from volume_queries import rebuild_volume_last_read
+
+
+def upgrade_database_schema():
+    """
+    Apply any alembic migrations the database is missing, this is safe to call on every startup.
+    """
+    root_folder = os.path.dirname(os.path.abspath(__file__))
+    # No ini file, so alembic leaves the server's logging configuration alone
+    config = Config()
+    config.set_main_option('script_location', os.path.join(root_folder, 'migrations'))
+
+    with db.engine.begin() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, 'head')
 
 
 def validate_database_schema():
@@ -445,20 +464,22 @@ def backup_media_progress(output_folder, db_session: Session, user_lookup: dict[
 
 def restore_media_progress(restore_path: str, db_session: Session, users: dict[str, int], tw: TaskWrapper):
     file_path = os.path.join(restore_path, "progress_media.json")
-    count = 0
+    # Backups of older databases can hold several rows for a user and file, only the newest is kept
+    latest: dict[tuple[int, str], dict] = {}
     with open(file_path, "r") as file:
         for line in file:
             row = json.loads(line.strip())
             if '@user' in row and 'file_id' in row and 'progress' in row and 'timestamp' in row:
-                entry_item = MediaFileProgress(user_id=users[row['@user']],
-                                               file_id=row['file_id'],
-                                               progress=row['progress'],
-                                               timestamp=datetime.fromisoformat(row['timestamp']))
-                db_session.add(entry_item)
-                db_session.commit()
-                count += 1
+                entry = {'user_id': users[row['@user']], 'file_id': row['file_id'], 'progress': row['progress'],
+                         'timestamp': datetime.fromisoformat(row['timestamp'])}
+                key = (entry['user_id'], entry['file_id'])
+                if key not in latest or latest[key]['timestamp'] < entry['timestamp']:
+                    latest[key] = entry
 
-    tw.debug(f'Added {count} Media Progress Records')
+    upsert_progress_entries(list(latest.values()), db_session)
+    db_session.commit()
+
+    tw.debug(f'Added {len(latest)} Media Progress Records')
 
 
 def backup_volume_progress(output_folder, db_session: Session, user_lookup: dict[int, str], tw: TaskWrapper):
@@ -616,6 +637,8 @@ def perform_restore(restore_path: str, tw: TaskWrapper):
     # Re-create the database
     tw.trace('Starting to Create Database')
     db.create_all()
+    # The search tables aren't models, drop_all leaves them holding the old catalogue
+    reset_search_index()
     tw.info('Created Database')
 
     db_session = db.session
@@ -648,6 +671,10 @@ def perform_restore(restore_path: str, tw: TaskWrapper):
     restore_volume_progress(restore_path, db_session, users, tw)
     tw.info('Restored Volume Progress')
 
+    tw.trace('Starting to Rebuild Last Read Books')
+    rebuild_volume_last_read(db_session, tw)
+    tw.info('Rebuilt Last Read Books')
+
     tw.trace('Starting to Restore Volume Bookmarks')
     restore_volume_bookmarks(restore_path, db_session, users, tw)
     tw.info('Restored Volume Bookmarks')
@@ -655,8 +682,13 @@ def perform_restore(restore_path: str, tw: TaskWrapper):
     volume_folder = get_volume_folder()
     if is_not_blank(volume_folder) and os.path.isdir(volume_folder):
         tw.info('Updating Book Cache')
-        generate_book_definitions(tw, None, volume_folder, False, sync_tags=True, session=db_session)
+        generate_book_definitions(tw, None, volume_folder, False, sync_tags=True, session=db_session,
+                                  scan_workers=get_volume_scan_workers())
     else:
         tw.warn('Did not update Book Cache')
 
+    tw.trace('Starting to Rebuild Search Index')
+    rebuild_search_index(db_session, tw)
+    tw.info('Rebuilt Search Index')
+
     tw.info("Database restore complete!")
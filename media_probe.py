@@ -1,6 +1,12 @@
-import subprocess
 import json
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import Optional
 
+from constants import PROBE_CACHE_SIZE
+from db import MediaFile
 from thread_utils import TaskWrapper, NoOpTaskWrapper
 
 # Map container names to canonical extensions
@@ -15,8 +21,36 @@ FORMAT_EXTENSION_MAP = {
     # Add others if needed
 }
 
-def get_file_formats(filepath: str, tw: TaskWrapper = NoOpTaskWrapper()) -> str | None:
-    """Return list of format names for a media file using ffprobe."""
+# What is kept of ffprobe's output, enough for every reader of a probe, without tags and side data
+PROBE_FORMAT_FIELDS = ("format_name", "start_time", "duration", "bit_rate")
+PROBE_STREAM_FIELDS = ("index", "codec_type", "codec_name", "profile", "pix_fmt", "width", "height", "avg_frame_rate",
+                       "start_time", "bit_rate", "channels", "sample_rate")
+
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+
+def probe_media(filepath: str, tw: TaskWrapper = NoOpTaskWrapper()) -> Optional[dict]:
+    """
+    ffprobe's format and streams for a media file. Results are kept in memory by path, size and mtime, so a file is
+    probed once as long as it doesn't change.
+    :param filepath: The media file
+    :param tw: The task, for errors
+    :return: The parsed ffprobe JSON, None if it could not be probed
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError as e:
+        tw.error(f"ffprobe error: {e}")
+        return None
+    key = (filepath, stat.st_size, stat.st_mtime_ns)
+
+    with _probe_cache_lock:
+        data = _probe_cache.get(key)
+        if data is not None:
+            _probe_cache.move_to_end(key)
+            return data
+
     try:
         # Run ffprobe and get JSON output
         result = subprocess.run(
@@ -33,38 +67,162 @@ def get_file_formats(filepath: str, tw: TaskWrapper = NoOpTaskWrapper()) -> str
             text=True,
             check=True
         )
+        data = _compact_probe(json.loads(result.stdout))
+    except subprocess.CalledProcessError as e:
+        tw.error(f"ffprobe error: {e.stderr.strip()}")
+        return None
+    except FileNotFoundError:
+        tw.error("ffprobe not found. Make sure FFmpeg is installed and ffprobe is in PATH.")
+        return None
 
-        data = json.loads(result.stdout)
+    with _probe_cache_lock:
+        _probe_cache[key] = data
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
 
-        if tw.can_trace():
-            tw.trace(str(data))
+    return data
 
-        # ffprobe may report multiple format aliases separated by commas
-        format_name = data.get("format", {}).get("format_name", "")
 
-        if format_name:
-            primary_format = format_name.split(",")[0]
-            return FORMAT_EXTENSION_MAP.get(primary_format, primary_format)
+def _compact_probe(data: dict) -> dict:
+    """
+    Keep the fields of an ffprobe result that are used, this is what is cached and stored with a media file
+    :param data: ffprobe's JSON
+    :return: The format and streams, with only the PROBE_*_FIELDS
+    """
+    media_format = data.get("format", {})
+    return {
+        "format": {field: media_format[field] for field in PROBE_FORMAT_FIELDS if field in media_format},
+        "streams": [{field: stream[field] for field in PROBE_STREAM_FIELDS if field in stream}
+                    for stream in data.get("streams", [])]
+    }
 
-        # Secondary: fall back to stream codec info
-        stream_codecs = []
-        for stream in data.get("streams", []):
-            codec = stream.get("codec_name")
-            if codec:
-                stream_codecs.append(codec)
 
-        if stream_codecs:
-            return 'ts'
+def probe_media_file(file: MediaFile, filepath: str, tw: TaskWrapper = NoOpTaskWrapper()) -> Optional[dict]:
+    """
+    The probe of a media file, stored on its row. ffprobe only runs when the file was never probed or its data file
+    changed since, then the row's probe, probe_mtime and duration are updated and the caller commits them.
+    :param file: The media file
+    :param filepath: Its data file, see get_data_for_mediafile
+    :param tw: The task, for errors
+    :return: The probe, None if it could not be probed
+    """
+    try:
+        mtime = os.stat(filepath).st_mtime_ns
+    except OSError as e:
+        tw.error(f"ffprobe error: {e}")
+        return None
+
+    if file.probe_mtime == mtime and file.probe is not None:
+        return file.probe
+
+    data = probe_media(filepath, tw)
+    if data is not None:
+        file.probe = data
+        file.probe_mtime = mtime
+        file.duration = media_duration(data)
+    return data
 
+
+def media_duration(data: Optional[dict]) -> Optional[float]:
+    """
+    The duration in a probe
+    :param data: The probe, see probe_media
+    :return: Seconds, None if it isn't known
+    """
+    if data is None:
+        return None
+    try:
+        return float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
         return None
 
-    except subprocess.CalledProcessError as e:
-        tw.error(f"ffprobe error: {e.stderr.strip()}")
+
+def media_stream(data: Optional[dict], codec_type: str) -> Optional[dict]:
+    """
+    The first stream of a type in a probe
+    :param data: The probe, see probe_media
+    :param codec_type: video, audio or subtitle
+    :return: The stream, None if there is none
+    """
+    if data is None:
         return None
-    except FileNotFoundError:
-        tw.error("ffprobe not found. Make sure FFmpeg is installed and ffprobe is in PATH.")
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == codec_type:
+            return stream
+    return None
+
+
+def get_media_duration(filepath: str, tw: TaskWrapper = NoOpTaskWrapper()) -> Optional[float]:
+    """
+    The duration of a media file in seconds, from the cached probe
+    :param filepath: The media file
+    :param tw: The task, for errors
+    :return: Seconds, None if it isn't known
+    """
+    return media_duration(probe_media(filepath, tw))
+
+
+def get_file_formats(filepath: str, tw: TaskWrapper = NoOpTaskWrapper()) -> str | None:
+    """Return list of format names for a media file using ffprobe."""
+    return media_file_format(probe_media(filepath, tw), tw)
+
+
+def media_file_format(data: Optional[dict], tw: TaskWrapper = NoOpTaskWrapper()) -> str | None:
+    """
+    The container of a probe, as a file extension
+    :param data: The probe, see probe_media
+    :param tw: The task, for tracing
+    :return: The extension, None if it isn't known
+    """
+    if data is None:
         return None
 
+    if tw.can_trace():
+        tw.trace(str(data))
+
+    # ffprobe may report multiple format aliases separated by commas
+    format_name = data.get("format", {}).get("format_name", "")
+
+    if format_name:
+        primary_format = format_name.split(",")[0]
+        return FORMAT_EXTENSION_MAP.get(primary_format, primary_format)
+
+    # Secondary: fall back to stream codec info
+    stream_codecs = []
+    for stream in data.get("streams", []):
+        codec = stream.get("codec_name")
+        if codec:
+            stream_codecs.append(codec)
+
+    if stream_codecs:
+        return 'ts'
+
+    return None
+
+def read_keyframes(source_path: str) -> tuple[list[float], float]:
+    """
+    Find the keyframes of a file's first video stream. The packets are listed without being decoded.
+    :param source_path: The media file
+    :return: The keyframe times in order, and when the video ends
+    """
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                             '-show_entries', 'packet=pts_time,duration_time,flags', '-of', 'csv=p=0',
+                             source_path], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True, check=True)
+    keyframes = []
+    end = 0.0
+    for line in result.stdout.splitlines():
+        fields = line.split(',')
+        if len(fields) < 3 or fields[0] == 'N/A':
+            continue
+        pts = float(fields[0])
+        end = max(end, pts + (float(fields[1]) if fields[1] != 'N/A' else 0))
+        if 'K' in fields[2]:
+            keyframes.append(pts)
+    # Packets come in decode order
+    return sorted(keyframes), end
+
+
 # Example usage:
 if __name__ == "__main__":
     formats = get_file_formats("example.mp4")
@@ -2,11 +2,14 @@ from datetime import datetime
 from typing import Optional, List, Tuple
 
 from flask_sqlalchemy.session import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, func, or_
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import joinedload
 
 from db import MediaFolder, MediaFile, db, MediaFileProgress
+from paging_utils import after_key_filter
+from search_index import apply_text_search, SEARCH_KIND_FOLDER, SEARCH_KIND_FILE
 from text_utils import is_not_blank
 
 
@@ -86,14 +89,15 @@ def update_folder(folder_id: str, name: str, rating: int, info_url: str, tags: s
 
 
 def _build_folders_in_folders_query(folder_id: str, db_session: Session = None, filter_text: str = None,
-                                    max_rating: int = 0):
+                                    max_rating: int = 0, rank_search: bool = False):
     if db_session is not None:
         query_builder = db_session.query(MediaFolder)
     else:
         query_builder = MediaFolder.query
 
     if is_not_blank(filter_text):
-        query_builder = query_builder.filter(MediaFolder.name.like(f'%{filter_text}%'))
+        query_builder = apply_text_search(query_builder, SEARCH_KIND_FOLDER, MediaFolder.id, filter_text,
+                                          [MediaFolder.name], rank_search)
 
     if max_rating <= 200:
         query_builder = query_builder.filter(MediaFolder.rating <= max_rating)
@@ -106,7 +110,8 @@ def _build_folders_in_folders_query(folder_id: str, db_session: Session = None,
 # Find Folders in Folder
 def find_folders_in_folder(folder_id: str, filter_text: str = None, max_limit: int = 0, query_offset: int = 0,
                            query_limit: int = 0, sort_column=MediaFolder.name, sort_descending: bool = False,
-                           db_session: Session = None) -> Optional[List[type[MediaFolder]]]:
+                           db_session: Session = None, rank_search: bool = False,
+                           after_key: Optional[tuple] = None) -> Optional[List[type[MediaFolder]]]:
     """
     Find all subfolders in a specific folder.
 
@@ -119,12 +124,17 @@ def find_folders_in_folder(folder_id: str, filter_text: str = None, max_limit: i
         :param query_limit:
         :param sort_column:
         :param sort_descending:
+        :param rank_search: Order by search relevance first, when filtering
+        :param after_key: (sort value, id) of the last folder already sent, to seek past instead of using an offset
     Returns:
         Optional[List[MediaFolder]]: A list of subfolder MediaFolder objects or None if not found.
 
     """
 
-    query = _build_folders_in_folders_query(folder_id, db_session, filter_text, max_limit)
+    query = _build_folders_in_folders_query(folder_id, db_session, filter_text, max_limit, rank_search)
+
+    if after_key is not None:
+        query = query.filter(after_key_filter(sort_column, MediaFolder.id, sort_descending, after_key))
 
     if sort_descending:
         query = query.order_by(sort_column.desc(), MediaFolder.id.desc())
@@ -176,14 +186,16 @@ def find_folder_by_id(folder_id: str, db_session: Session = None) -> Optional[Me
         return MediaFolder.query.filter_by(id=folder_id).first()
 
 
-def _build_root_folders_query(filter_text: str = None, max_limit: int = 0, db_session: Session = None):
+def _build_root_folders_query(filter_text: str = None, max_limit: int = 0, db_session: Session = None,
+                              rank_search: bool = False):
     if db_session is not None:
         query_builder = db_session.query(MediaFolder)
     else:
         query_builder = MediaFolder.query
 
     if is_not_blank(filter_text):
-        query_builder = query_builder.filter(MediaFolder.name.like(f'%{filter_text}%'))
+        query_builder = apply_text_search(query_builder, SEARCH_KIND_FOLDER, MediaFolder.id, filter_text,
+                                          [MediaFolder.name], rank_search)
 
     query_builder = query_builder.filter(MediaFolder.rating <= max_limit)
 
@@ -198,7 +210,8 @@ def find_all_folders(db_session: Session = db.session):
 
 # Find Root Folders
 def find_root_folders(filter_text: str = None, max_limit: int = 0, query_offset: int = 0, query_limit: int = 0,
-                      sort_column=MediaFolder.name, sort_descending: bool = False, db_session: Session = None) -> \
+                      sort_column=MediaFolder.name, sort_descending: bool = False, db_session: Session = None,
+                      rank_search: bool = False, after_key: Optional[tuple] = None) -> \
         Optional[
             List[type[MediaFolder]]]:
     """
@@ -212,12 +225,17 @@ def find_root_folders(filter_text: str = None, max_limit: int = 0, query_offset:
         :param sort_column:
         :param sort_descending:
         :param db_session (Session, optional): The database session to use. Defaults to None.
+        :param rank_search: Order by search relevance first, when filtering
+        :param after_key: (sort value, id) of the last folder already sent, to seek past instead of using an offset
     Returns:
         Optional[List[MediaFolder]]: A list of root MediaFolder objects or None if not found.
 
     """
 
-    query = _build_root_folders_query(filter_text, max_limit, db_session)
+    query = _build_root_folders_query(filter_text, max_limit, db_session, rank_search)
+
+    if after_key is not None:
+        query = query.filter(after_key_filter(sort_column, MediaFolder.id, sort_descending, after_key))
 
     if sort_descending:
         query = query.order_by(sort_column.desc(), MediaFolder.id.desc())
@@ -334,6 +352,24 @@ def find_file_by_id(file_id: str, db_session: Session = None) -> Optional[MediaF
         return MediaFile.query.filter_by(id=file_id).first()
 
 
+# Find Files by ID
+def find_files_by_ids(file_ids: List[str], db_session: Session = db.session) -> List[MediaFile]:
+    """
+    Find several media files by their IDs in a single query, with their folders loaded.
+
+    Args:
+        file_ids (List[str]): The IDs of the files to find.
+        db_session (Session, optional): The database session to use.
+
+    Returns:
+        List[MediaFile]: The found MediaFile objects, in no particular order. Unknown IDs are skipped.
+    """
+    if not file_ids:
+        return []
+    return db_session.query(MediaFile).options(joinedload(MediaFile.mediafolder)).filter(
+        MediaFile.id.in_(file_ids)).all()
+
+
 # Find File by Name in folder
 def find_file_by_filename(file_name: str, folder_id: str, db_session: Session = None) -> Optional[MediaFile]:
     """
@@ -361,7 +397,8 @@ def _build_files_in_folders_query(folder_id: str, filter_text: str = None, db_se
         query_builder = MediaFile.query
 
     if is_not_blank(filter_text):
-        query_builder = query_builder.filter(MediaFile.filename.like(f'%{filter_text}%'))
+        query_builder = apply_text_search(query_builder, SEARCH_KIND_FILE, MediaFile.id, filter_text,
+                                          [MediaFile.filename])
 
     query_builder = query_builder.filter(MediaFile.folder_id == folder_id)
 
@@ -370,8 +407,8 @@ def _build_files_in_folders_query(folder_id: str, filter_text: str = None, db_se
 
 # Find Files in Folder
 def find_files_in_folder(folder_id: str, filter_text: str = None, query_offset: int = 0, query_limit: int = 0,
-                         sort_column=MediaFile.filename, sort_descending: bool = False, db_session: Session = None,
-                         uid: Optional[int] = None) -> Optional[List[type[MediaFile]]]:
+                         sort_column=MediaFile.filename, sort_descending: bool = False, db_session: Session = None) -> \
+        Optional[List[type[MediaFile]]]:
     """
     Find all files in a specific folder.
 
@@ -383,7 +420,6 @@ def find_files_in_folder(folder_id: str, filter_text: str = None, query_offset:
         :param sort_column:
         :param sort_descending:
         :param db_session (Session, optional): The database session to use. Defaults to None.
-        :param uid: User identify
 
     Returns:
         Optional[List[MediaFile]]: A list of MediaFile objects in the folder or None if not found.
@@ -391,11 +427,6 @@ def find_files_in_folder(folder_id: str, filter_text: str = None, query_offset:
 
     query = _build_files_in_folders_query(folder_id, filter_text, db_session)
 
-    if uid is not None:
-        query = query.outerjoin(MediaFileProgress, and_(MediaFile.id == MediaFileProgress.file_id,
-                                                        MediaFileProgress.user_id == uid)).options(
-            joinedload(MediaFile.progress_records))
-
     if sort_descending:
         query = query.order_by(sort_column.desc(), MediaFile.id.desc())
     else:
@@ -410,6 +441,74 @@ def find_files_in_folder(folder_id: str, filter_text: str = None, query_offset:
     return query.all()
 
 
+def find_files_with_progress_in_folder(folder_id: str, uid: int, filter_text: str = None, query_offset: int = 0,
+                                       query_limit: int = 0, sort_column=MediaFile.filename,
+                                       sort_descending: bool = False, db_session: Session = db.session,
+                                       rank_search: bool = False, after_key: Optional[tuple] = None,
+                                       with_total: bool = True) -> \
+        Tuple[List[Tuple[MediaFile, Optional[float]]], Optional[int]]:
+    """
+    Find a page of files in a specific folder, along with a single user's progress for each file and the total number
+    of matching files, all in one query.
+
+    Args:
+        :param folder_id: The ID of the folder to search in.
+        :param uid: The user whose progress should be loaded.
+        :param filter_text: Text that will be searched for. Defaults to None.
+        :param query_offset: The number of rows to skip. Defaults to 0.
+        :param query_limit: The maximum number of rows to return. Defaults to unlimited.
+        :param sort_column:
+        :param sort_descending:
+        :param db_session: The database session to use.
+        :param rank_search: Order by search relevance first, when filtering
+        :param after_key: (sort value, id) of the last file already sent, to seek past instead of using an offset
+        :param with_total: Count the matching files, this reads every match instead of stopping at the page end
+
+    Returns:
+        A list of (MediaFile, progress) tuples, progress is None if the user never played the file, and the total
+        number of matching files. The total is None when the page is empty, since no row carried it back, or when
+        with_total is False.
+    """
+    if with_total:
+        query = db_session.query(MediaFile, MediaFileProgress.progress, func.count().over().label('total_count'))
+    else:
+        query = db_session.query(MediaFile, MediaFileProgress.progress)
+
+    if is_not_blank(filter_text):
+        query = apply_text_search(query, SEARCH_KIND_FILE, MediaFile.id, filter_text, [MediaFile.filename],
+                                  rank_search)
+
+    query = query.filter(MediaFile.folder_id == folder_id)
+
+    if after_key is not None:
+        query = query.filter(after_key_filter(sort_column, MediaFile.id, sort_descending, after_key))
+
+    # Only the requesting user's progress, at most one row per file
+    query = query.outerjoin(MediaFileProgress, and_(MediaFile.id == MediaFileProgress.file_id,
+                                                    MediaFileProgress.user_id == uid))
+
+    if sort_descending:
+        query = query.order_by(sort_column.desc(), MediaFile.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), MediaFile.id.asc())
+
+    if query_offset > 0:
+        query = query.offset(query_offset)
+
+    if query_limit > 0:
+        query = query.limit(query_limit)
+
+    rows = query.all()
+
+    if not with_total:
+        return [(file, progress) for file, progress in rows], None
+
+    if len(rows) == 0:
+        return [], None
+
+    return [(file, progress) for file, progress, _ in rows], rows[0].total_count
+
+
 def count_files_in_folder(folder_id: str, filter_text: str = None, db_session: Session = None) -> int:
     """
     Find all files in a specific folder.
@@ -512,6 +611,28 @@ def find_missing_file_previews(db_session: Session = None) -> Optional[List[type
         return MediaFile.query.filter_by(preview=False).order_by(MediaFile.folder_id, MediaFile.filename).all()
 
 
+def find_files_to_probe(folder_id: Optional[str] = None, include_probed: bool = False,
+                        db_session: Session = db.session) -> List[MediaFile]:
+    """
+    Find the audio and video files that have no stored probe yet.
+
+    Args:
+        folder_id (str, optional): Only files in this folder, None for every folder.
+        include_probed (bool, optional): Also return probed files, to find the ones whose data file changed.
+        db_session (Session, optional): The database session to use.
+
+    Returns:
+        List[MediaFile]: The files, by folder and name.
+    """
+    query = db_session.query(MediaFile).filter(or_(MediaFile.mime_type.like('video/%'),
+                                                   MediaFile.mime_type.like('audio/%')))
+    if folder_id is not None:
+        query = query.filter(MediaFile.folder_id == folder_id)
+    if not include_probed:
+        query = query.filter(MediaFile.probe_mtime.is_(None))
+    return query.order_by(MediaFile.folder_id, MediaFile.filename).all()
+
+
 # Progress
 
 def find_progress_entry(user_id: int, file_id: str) -> Optional[MediaFileProgress]:
@@ -561,25 +682,21 @@ def upsert_progress(user_id: int, file_id: str, progress: float, timestamp: date
     :param db_session:
     :return:
     """
-    try:
-        # Try to get the book with the specified ID
-        existing_progress = db_session.query(MediaFileProgress).filter_by(user_id=user_id, file_id=file_id).one()
-
-        existing_progress.progress = progress
-        existing_progress.timestamp = timestamp
-
-        # Commit the updates
-        db_session.commit()
+    upsert_progress_entries([{'user_id': user_id, 'file_id': file_id, 'progress': progress, 'timestamp': timestamp}],
+                            db_session)
+    db_session.commit()
 
-    except NoResultFound:
-        # If no book is found, create a new record
-        new_progress = MediaFileProgress(
-            user_id=user_id,
-            file_id=file_id,
-            progress=progress,
-            timestamp=timestamp
-        )
 
-        # Add and commit the new book
-        db_session.add(new_progress)
-        db_session.commit()
+def upsert_progress_entries(entries: List[dict], db_session: Session):
+    """
+    Add/update many progress entries with one INSERT ... ON CONFLICT DO UPDATE, the caller commits.
+    :param entries: Dicts of user_id, file_id, progress and timestamp, at most one per user and file
+    :param db_session: The database session
+    """
+    if len(entries) == 0:
+        return
+    statement = sqlite_insert(MediaFileProgress)
+    statement = statement.on_conflict_do_update(index_elements=['user_id', 'file_id'],
+                                                set_={'progress': statement.excluded.progress,
+                                                      'timestamp': statement.excluded.timestamp})
+    db_session.execute(statement, entries)
@@ -2,37 +2,41 @@ import logging
 import mimetypes
 import os
 import shutil
-import tempfile
-import uuid
-import zipfile
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import Optional
 
 from PIL import Image
 from flask import Blueprint, request, current_app, make_response, send_from_directory, Response, send_file, \
-    stream_with_context, after_this_request
+    stream_with_context
 from werkzeug.utils import secure_filename
 
 from auth_utils import feature_required, feature_required_with_cookie, get_user_features, get_user_group_id, get_uid
 from common_utils import generate_success_response, generate_failure_response
 from constants import PROPERTY_SERVER_MEDIA_READY, COMMON_MEDIA_RATINGS, PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER, \
-    PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER, APP_KEY_SLC
+    PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER, APP_KEY_SLC, APP_KEY_COUNT_CACHE, APP_KEY_PROGRESS_BUFFER, APP_KEY_HLS_CACHE
 from date_utils import convert_date_to_yyyymmdd, convert_datetime_to_yyyymmdd
 from db import db, MediaFolder, MediaFile
 from feature_flags import VIEW_MEDIA, MANAGE_MEDIA, MEDIA_PLUGINS, MANAGE_APP
 from file_utils import is_valid_mime_type
+from hls_cache import HlsSegmentCache
 from media_queries import find_folder_by_id, find_root_folders, find_folders_in_folder, find_files_in_folder, \
     insert_folder, update_folder, find_file_by_id, update_file, count_folders_in_folder, count_root_folders, \
-    count_files_in_folder, insert_file, upsert_progress, find_progress_entries
-from media_utils import calculate_offset_limit, parse_range_header, get_data_for_mediafile, get_media_max_rating, \
-    get_folder_group_checker, get_folder_rating_checker, user_can_see_rating, read_file_chunk
+    count_files_in_folder, insert_file, find_progress_entries, find_files_with_progress_in_folder, \
+    find_files_by_ids
+from http_cache_utils import FileValidators, set_cache_headers
+from media_utils import create_range_response, get_data_for_mediafile, get_media_max_rating, \
+    get_folder_group_checker, get_folder_rating_checker, user_can_see_rating
 from messages import msg_file_migrated, msg_access_denied_content_rating, msg_action_cancelled_wrong, msg_action_failed, \
     msg_operation_complete, msg_file_moved, msg_file_deleted, msg_file_updated, msg_missing_parameter, \
     msg_folder_created, msg_invalid_parameter, msg_folder_updated, msg_action_cancelled_folder_not_empty, \
     msg_folder_deleted, msg_folder_moved
 from number_utils import is_integer, is_boolean, parse_boolean
+from paging_utils import PageCursor, CountCache, PAGE_PHASE_FOLDERS, PAGE_PHASE_FILES, PAGE_PHASE_OFFSET
+from progress_buffer import ProgressBuffer
 from short_lived_cache import ShortLivedCache
 from text_utils import clean_string, is_not_blank, is_blank, is_guid, safe_filename
+from zip_utils import StoredZipStream
 from user_queries import get_all_groups, get_group_by_id
 
 media_blueprint = Blueprint('media', __name__)
@@ -107,6 +111,11 @@ def list_media(user_details: dict) -> tuple:
             folder_sort = MediaFolder.name
             file_sort = MediaFile.filesize
             sort_descending = True
+        elif sort == 'RL':
+            # Best search matches first, name breaks ties
+            folder_sort = MediaFolder.name
+            file_sort = MediaFile.filename
+            sort_descending = False
         else:
             folder_sort = MediaFolder.name
             file_sort = MediaFile.filename
@@ -116,6 +125,23 @@ def list_media(user_details: dict) -> tuple:
         file_sort = MediaFile.filename
         sort_descending = False
 
+    rank_search = sort == 'RL' and is_not_blank(filter_text)
+
+    # Clients that send a cursor (blank for the first page) page by keyset, older clients keep using offset
+    keyset_paging = request.form.get('cursor') is not None
+    cursor = None
+    if keyset_paging and is_not_blank(request.form.get('cursor')):
+        try:
+            cursor = PageCursor.decode(clean_string(request.form.get('cursor')), sort)
+        except ValueError:
+            return generate_failure_response('Invalid cursor', messages=[msg_invalid_parameter('cursor')])
+        offset = cursor.offset
+
+    include_total = parse_boolean(request.form.get('total', 'true'))
+    count_cache: CountCache = current_app.config[APP_KEY_COUNT_CACHE]
+    next_cursor = None
+    total_items = None
+
     current_info = {}
     folder_data = []
     file_data = []
@@ -142,24 +168,48 @@ def list_media(user_details: dict) -> tuple:
                 'User is not allowed to see a folder that is owned by another group',
                 messages=[msg_access_denied_content_rating()])
 
-        total_folders = count_folders_in_folder(folder_id, filter_text, requested_rating_limit, None)
-        total_files = count_files_in_folder(folder_id, filter_text, None)
-        total_items = total_folders + total_files
+        total_folders = None
 
-        query_stats = calculate_offset_limit(offset, limit, total_folders, total_files)
-
-        if query_stats['folders_needed']:
-            folder_rows = find_folders_in_folder(folder_id, filter_text, requested_rating_limit,
-                                                 query_stats['folder_offset'], query_stats['folder_limit'], folder_sort,
-                                                 sort_descending, None)
+        if keyset_paging and not rank_search and limit > 0:
+            folder_rows, file_rows, next_cursor = _find_folder_page_after(folder_id, user_uid, filter_text,
+                                                                          requested_rating_limit, limit, sort,
+                                                                          folder_sort, file_sort, sort_descending,
+                                                                          cursor)
         else:
-            folder_rows = []
-
-        if query_stats['files_needed']:
-            file_rows = find_files_in_folder(folder_id, filter_text, query_stats['file_offset'],
-                                             query_stats['file_limit'], file_sort, sort_descending, None, user_uid)
-        else:
-            file_rows = []
+            total_folders = count_cache.fetch(
+                ('folders', folder_id, filter_text, requested_rating_limit),
+                lambda: count_folders_in_folder(folder_id, filter_text, requested_rating_limit, None))
+
+            # Folders come first, files fill the rest of the page
+            if 0 < limit and offset < total_folders:
+                folder_limit = min(limit, total_folders - offset)
+                folder_rows = find_folders_in_folder(folder_id, filter_text, requested_rating_limit, offset,
+                                                     folder_limit, folder_sort, sort_descending, None, rank_search)
+            else:
+                folder_limit = 0
+                folder_rows = []
+
+            file_offset = max(0, offset - total_folders)
+            file_limit = max(0, limit - folder_limit)
+
+            if file_limit > 0:
+                file_rows, _ = find_files_with_progress_in_folder(folder_id, user_uid, filter_text, file_offset,
+                                                                  file_limit, file_sort, sort_descending,
+                                                                  rank_search=rank_search, with_total=False)
+            else:
+                file_rows = []
+
+            if keyset_paging and limit > 0 and len(folder_rows) + len(file_rows) == limit:
+                next_cursor = PageCursor(sort, PAGE_PHASE_OFFSET, offset=offset + limit)
+
+        if include_total:
+            if total_folders is None:
+                total_folders = count_cache.fetch(
+                    ('folders', folder_id, filter_text, requested_rating_limit),
+                    lambda: count_folders_in_folder(folder_id, filter_text, requested_rating_limit, None))
+            total_items = total_folders + count_cache.fetch(('files', folder_id, filter_text),
+                                                            lambda: count_files_in_folder(folder_id, filter_text,
+                                                                                          None))
 
         # Setup the folder
         current_info['name'] = clean_string(current_folder.name)
@@ -170,9 +220,23 @@ def list_media(user_details: dict) -> tuple:
         current_info['active'] = current_folder.active
         current_info['parent'] = clean_string(current_folder.parent_id)
     else:
-        folder_rows = find_root_folders(filter_text, requested_rating_limit, offset, limit, folder_sort,
-                                        sort_descending, None)
-        total_items = count_root_folders(filter_text, requested_rating_limit, None)
+        if keyset_paging and not rank_search and limit > 0:
+            after_key = cursor.after_key() if cursor is not None else None
+            # One extra row tells if there is a next page
+            folder_rows = find_root_folders(filter_text, requested_rating_limit, 0, limit + 1, folder_sort,
+                                            sort_descending, None, after_key=after_key)
+            if len(folder_rows) > limit:
+                folder_rows = folder_rows[:limit]
+                next_cursor = PageCursor.after_row(sort, PAGE_PHASE_FOLDERS, folder_rows[-1], folder_sort)
+        else:
+            folder_rows = find_root_folders(filter_text, requested_rating_limit, offset, limit, folder_sort,
+                                            sort_descending, None, rank_search)
+            if keyset_paging and limit > 0 and len(folder_rows) == limit:
+                next_cursor = PageCursor(sort, PAGE_PHASE_OFFSET, offset=offset + limit)
+
+        if include_total:
+            total_items = count_cache.fetch(('root', filter_text, requested_rating_limit),
+                                            lambda: count_root_folders(filter_text, requested_rating_limit, None))
         file_rows = []
         current_info['name'] = 'ROOT'
         current_info['info_url'] = ''
@@ -196,26 +260,72 @@ def list_media(user_details: dict) -> tuple:
                  "updated": convert_date_to_yyyymmdd(row.last_date)
                  })
 
-    for row in file_rows:
+    progress_buffer: ProgressBuffer = current_app.config[APP_KEY_PROGRESS_BUFFER]
+
+    for row, user_progress in file_rows:
         the_time = convert_datetime_to_yyyymmdd(row.created)
 
-        user_progress = next(
-            (progress for progress in row.progress_records if progress.user_id == user_uid),
-            None
-        )
+        pending_progress = progress_buffer.media_progress(user_uid, row.id)
+        if pending_progress is not None:
+            user_progress = pending_progress
 
         if user_progress is None:
             progress = '0'
         else:
-            progress = f'{user_progress.progress:.5f}'
+            progress = f'{user_progress:.5f}'
 
         file_data.append(
             {"id": row.id, "name": row.filename, "mime_type": row.mime_type, "preview": row.preview,
-             "filesize": row.filesize, "archive": row.archive, "progress": progress,
+             "filesize": row.filesize, "archive": row.archive, "progress": progress, "duration": row.duration,
              "created": the_time, "updated": the_time})
 
-    return generate_success_response('', {"info": current_info, "paging": {"total": total_items, "offset": offset},
-                                          "folders": folder_data, "files": file_data})
+    paging = {"total": total_items, "offset": offset, "next": next_cursor.encode() if next_cursor is not None else None}
+
+    return generate_success_response('', {"info": current_info, "paging": paging, "folders": folder_data,
+                                          "files": file_data})
+
+
+def _find_folder_page_after(folder_id: str, user_uid: int, filter_text: str, rating_limit: int, limit: int, sort: str,
+                            folder_sort, file_sort, sort_descending: bool, cursor: Optional[PageCursor]) -> tuple:
+    """
+    Find a page of a folder's listing by keyset, sub folders first and then files.
+    :param folder_id: The folder being listed
+    :param user_uid: The user whose progress is loaded
+    :param filter_text: Text that will be searched for
+    :param rating_limit: 0 - 200 rating limit for sub folders
+    :param limit: Page size
+    :param sort: The requested sort code
+    :param folder_sort: Column the folders are ordered by
+    :param file_sort: Column the files are ordered by
+    :param sort_descending: Is this descending sort?
+    :param cursor: Where the previous page ended, None for the first page
+    :return: Folder rows, (file, progress) rows and the cursor of the next page, None on the last page
+    """
+    folder_rows = []
+    file_after_key = None
+
+    if cursor is None or cursor.phase == PAGE_PHASE_FOLDERS:
+        after_key = cursor.after_key() if cursor is not None else None
+        # One extra row tells if the folders continue on the next page
+        folder_rows = find_folders_in_folder(folder_id, filter_text, rating_limit, 0, limit + 1, folder_sort,
+                                             sort_descending, None, after_key=after_key)
+        if len(folder_rows) > limit:
+            folder_rows = folder_rows[:limit]
+            return folder_rows, [], PageCursor.after_row(sort, PAGE_PHASE_FOLDERS, folder_rows[-1], folder_sort)
+    else:
+        file_after_key = cursor.after_key()
+
+    file_limit = limit - len(folder_rows)
+    file_rows, _ = find_files_with_progress_in_folder(folder_id, user_uid, filter_text, 0, file_limit + 1, file_sort,
+                                                      sort_descending, after_key=file_after_key, with_total=False)
+    if len(file_rows) <= file_limit:
+        return folder_rows, file_rows, None
+
+    file_rows = file_rows[:file_limit]
+    if len(file_rows) == 0:
+        # The page was filled by folders, the files start on the next one
+        return folder_rows, file_rows, PageCursor(sort, PAGE_PHASE_FILES)
+    return folder_rows, file_rows, PageCursor.after_row(sort, PAGE_PHASE_FILES, file_rows[-1][0], file_sort)
 
 
 # Folder Management
@@ -662,6 +772,7 @@ def get_media_file(user_details: dict) -> tuple:
                                                "mime_type": file_row.mime_type,
                                                "archive": file_row.archive, "preview": file_row.preview,
                                                "filesize": file_row.filesize, "active": folder_row.active,
+                                               "duration": file_row.duration,
                                                "created": convert_datetime_to_yyyymmdd(file_row.created)}})
 
 
@@ -747,7 +858,8 @@ def put_media_progress(user_details: dict) -> tuple:
         logging.exception(e)
         return generate_failure_response('Failed to parse progress value', messages=[msg_action_failed()])
 
-    upsert_progress(get_uid(user_details), file_id, progress, datetime.now(timezone.utc))
+    progress_buffer: ProgressBuffer = current_app.config[APP_KEY_PROGRESS_BUFFER]
+    progress_buffer.record_media(get_uid(user_details), file_id, progress, datetime.now(timezone.utc))
 
     return generate_success_response('')
 
@@ -1036,15 +1148,18 @@ def serve_media_thumbnail(user_details, folder_id):
 
     # Check if the file exists
     if os.path.exists(target_file) and os.path.isfile(target_file):
+        validators = FileValidators(folder_id + '_prev', target_file)
+        if validators.is_not_modified():
+            return validators.not_modified_response(18000)
+
         # Create a response
-        response = make_response(send_from_directory(os.path.dirname(target_file), os.path.basename(target_file)))
+        response = make_response(send_from_directory(os.path.dirname(target_file), os.path.basename(target_file),
+                                                     etag=validators.etag))
 
         # Set cache control headers
-        expires_at = datetime.now() + timedelta(hours=5)
-        response.headers['Cache-Control'] = 'public, max-age=18000'  # 5 hours cache
-        response.headers['Expires'] = expires_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
+        set_cache_headers(response, 18000)  # 5 hours cache
 
-        return response
+        return validators.apply(response)
     else:
 
         # Create a response
@@ -1112,7 +1227,12 @@ def download_media_file(user_details, file_id):
     if target_path is None or not os.path.isfile(target_path):
         return generate_failure_response('requested file not found', 404)
 
-    response = make_response(send_file(target_path, as_attachment=True, download_name=filename))
+    validators = FileValidators(file_id, target_path)
+    if validators.is_not_modified():
+        return validators.not_modified_response()
+
+    response = validators.apply(make_response(send_file(target_path, as_attachment=True, download_name=filename,
+                                                        etag=validators.etag)))
 
     # Apply a specific CSP for the file download to limit exposure
     strict_csp = (
@@ -1151,8 +1271,10 @@ def download_multiple_files(user_details, file_ids):
 
     result_file_name = ''
 
+    files_by_id = {file.id: file for file in find_files_by_ids(file_ids)}
+
     for file_id in file_ids:
-        file = find_file_by_id(file_id)
+        file = files_by_id.get(file_id)
         if not file:
             continue
 
@@ -1192,28 +1314,13 @@ def download_multiple_files(user_details, file_ids):
     if not files_to_zip:
         return generate_failure_response('No valid files found for download.', 404)
 
-    temp_dir = tempfile.gettempdir()
-    zip_filename = f"{uuid.uuid4()}.zip"
-    zip_path = os.path.join(temp_dir, zip_filename)
-
-    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED) as zipf:
-        for file_path, arc_name in files_to_zip:
-            zipf.write(file_path, arcname=arc_name)
+    # Stored entries keep their size, so the archive is streamed with an exact length and no temp file
+    zip_stream = StoredZipStream(files_to_zip)
 
-    @after_this_request
-    def remove_file(response):
-        try:
-            os.remove(zip_path)
-        except Exception:
-            current_app.logger.exception("Failed to remove temporary zip file")
-        return response
-
-    return send_file(
-        zip_path,
-        as_attachment=True,
-        download_name=result_file_name,
-        mimetype='application/zip'
-    )
+    response = Response(stream_with_context(iter(zip_stream)), mimetype='application/zip', direct_passthrough=True)
+    response.headers['Content-Length'] = str(zip_stream.content_length())
+    response.headers.set('Content-Disposition', 'attachment', filename=result_file_name)
+    return response
 
 
 @media_blueprint.route('/view', methods=['GET'])
@@ -1264,7 +1371,12 @@ def view_media_file(user_details):
     if target_path is None or not os.path.isfile(target_path):
         return generate_failure_response('requested file not found', 404)
 
-    response = make_response(send_file(target_path, as_attachment=False, download_name=filename))
+    validators = FileValidators(file_id, target_path)
+    if validators.is_not_modified():
+        return validators.not_modified_response()
+
+    response = validators.apply(make_response(send_file(target_path, as_attachment=False, download_name=filename,
+                                                        etag=validators.etag)))
 
     # Apply a specific CSP for the file download to limit exposure
     strict_csp = (
@@ -1328,41 +1440,24 @@ def stream_media_file(user_details):
     if target_path is None or not os.path.isfile(target_path):
         return generate_failure_response('requested file not found', 404)
 
+    validators = FileValidators(file.id, target_path)
+    if validators.is_not_modified():
+        return _allow_stream_origin(validators.not_modified_response(), 'Range, Authorization')
+
+    response = None
     range_header = request.headers.get('Range', None)
-    if range_header:
+    if range_header and validators.is_range_current():
         # Handle byte range requests for partial content
         try:
-            start, end = parse_range_header(range_header, os.path.getsize(target_path))
-            length = end - start + 1
-            response = Response(
-                stream_with_context(read_file_chunk(target_path, start, length)),
-                206,  # Partial Content
-                mimetype=mimetype,
-                headers={
-                    'Content-Range': f'bytes {start}-{end}/{os.path.getsize(target_path)}',
-                    'Accept-Ranges': 'bytes',
-                    'Content-Length': str(length),
-                }
-            )
-            return response
+            response = create_range_response(target_path, mimetype, range_header)
         except ValueError:
-            return generate_failure_response('Invalid range', 416)  # Range Not Satisfiable
-
-    # Stream the entire file if no range is provided
-    response = send_file(target_path, mimetype=mimetype)
+            return _allow_stream_origin(_range_not_satisfiable(target_path), 'Range, Authorization')
+    if response is None:
+        # Stream the entire file if no range is provided, the client's copy is out of date, or the range is ignored
+        response = send_file(target_path, mimetype=mimetype, conditional=False)
+    response = validators.apply(response)
 
-    origin = request.headers.get("Origin")
-    if origin:
-        response.headers["Access-Control-Allow-Origin"] = origin
-        response.headers["Vary"] = "Origin"
-    else:
-        # fallback if no Origin header was sent (like curl/wget)
-        response.headers["Access-Control-Allow-Origin"] = "*"
-
-    response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Range, Authorization"
-
-    return response
+    return _allow_stream_origin(response, 'Range, Authorization')
 
 
 @media_blueprint.route('/request-unsafe-stream', methods=['POST'])
@@ -1410,64 +1505,40 @@ def request_unsafe_stream_media_file(user_details):
     return generate_success_response('', {"cache_id": cache_id})
 
 
-@media_blueprint.route('/unsafe-stream', methods=['GET'])
-def unsafe_stream_media_file():
+def _find_unsafe_stream_file(cache_id: str) -> Optional[tuple[MediaFile, str]]:
     """
-    Stream a file from the server
-    :return: File contents
+    Find the file behind a stream token from request-unsafe-stream
+    :param cache_id: The token
+    :return: The file and the path to its data, None when the token or the file is gone
     """
-    if not current_app.config[PROPERTY_SERVER_MEDIA_READY]:
-        return generate_failure_response(
-            'This feature is not ready.  Please configure the app properties and restart the server.')
-
-    cache_id = clean_string(request.args.get('cache_id'))
-
     slc: ShortLivedCache = current_app.config[APP_KEY_SLC]
 
     cache_item = slc.get_item(cache_id)
 
     if cache_item is None:
-        return generate_failure_response('file not found', 404)
+        return None
 
-    file_id = cache_item['file_id']
-
-    file = find_file_by_id(file_id)
+    file = find_file_by_id(cache_item['file_id'])
 
     if file is None:
-        return generate_failure_response('file not found', 404)
-
-    is_archive = file.archive
-    mimetype = file.mime_type
+        return None
 
     target_path = get_data_for_mediafile(file, current_app.config[PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER],
                                          current_app.config[PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER])
 
     if target_path is None or not os.path.isfile(target_path):
-        return generate_failure_response('requested file not found', 404)
+        return None
 
-    range_header = request.headers.get('Range', None)
-    if range_header:
-        # Handle byte range requests for partial content
-        try:
-            start, end = parse_range_header(range_header, os.path.getsize(target_path))
-            length = end - start + 1
-            response = Response(
-                stream_with_context(read_file_chunk(target_path, start, length)),
-                206,  # Partial Content
-                mimetype=mimetype,
-                headers={
-                    'Content-Range': f'bytes {start}-{end}/{os.path.getsize(target_path)}',
-                    'Accept-Ranges': 'bytes',
-                    'Content-Length': str(length),
-                }
-            )
-            return response
-        except ValueError:
-            return generate_failure_response('Invalid range', 416)  # Range Not Satisfiable
+    return file, str(target_path)
 
-    # Stream the entire file if no range is provided
-    response = send_file(target_path, mimetype=mimetype)
 
+def _allow_stream_origin(response: Response, allowed_headers: str = 'Range') -> Response:
+    """
+    Let players on other origins, like a cast receiver, read the stream
+    :param response: The response
+    :param allowed_headers: Request headers the player may send
+    :return: The same response
+    """
     origin = request.headers.get("Origin")
     if origin:
         response.headers["Access-Control-Allow-Origin"] = origin
@@ -1477,11 +1548,141 @@ def unsafe_stream_media_file():
         response.headers["Access-Control-Allow-Origin"] = "*"
 
     response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Range"
+    response.headers["Access-Control-Allow-Headers"] = allowed_headers
 
     return response
 
 
+def _range_not_satisfiable(target_path: str) -> Response:
+    """
+    Refuse a range that can't be served, with the file's size so the client can ask for a valid one
+    :param target_path: The requested file
+    :return: The 416 response
+    """
+    response = make_response(generate_failure_response('Invalid range', 416))  # Range Not Satisfiable
+    response.headers['Content-Range'] = f'bytes */{os.path.getsize(target_path)}'
+    return response
+
+
+@media_blueprint.route('/unsafe-stream', methods=['GET'])
+def unsafe_stream_media_file():
+    """
+    Stream a file from the server
+    :return: File contents
+    """
+    if not current_app.config[PROPERTY_SERVER_MEDIA_READY]:
+        return generate_failure_response(
+            'This feature is not ready.  Please configure the app properties and restart the server.')
+
+    cache_id = clean_string(request.args.get('cache_id'))
+
+    found = _find_unsafe_stream_file(cache_id)
+
+    if found is None:
+        return generate_failure_response('file not found', 404)
+
+    file, target_path = found
+    mimetype = file.mime_type
+
+    validators = FileValidators(file.id, target_path)
+    if validators.is_not_modified():
+        return _allow_stream_origin(validators.not_modified_response())
+
+    response = None
+    range_header = request.headers.get('Range', None)
+    if range_header and validators.is_range_current():
+        # Handle byte range requests for partial content
+        try:
+            response = create_range_response(target_path, mimetype, range_header)
+        except ValueError:
+            return _allow_stream_origin(_range_not_satisfiable(target_path))
+    if response is None:
+        # Stream the entire file if no range is provided, the client's copy is out of date, or the range is ignored
+        response = send_file(target_path, mimetype=mimetype, conditional=False)
+    response = validators.apply(response)
+
+    return _allow_stream_origin(response)
+
+
+@media_blueprint.route('/unsafe-hls', methods=['GET'])
+def unsafe_hls_media_file():
+    """
+    HLS playlist of a video, its segments are remuxed from the file on demand, see HlsSegmentCache
+    :return: The m3u8 playlist
+    """
+    if not current_app.config[PROPERTY_SERVER_MEDIA_READY]:
+        return generate_failure_response(
+            'This feature is not ready.  Please configure the app properties and restart the server.')
+
+    hls_cache: HlsSegmentCache = current_app.config[APP_KEY_HLS_CACHE]
+    if not hls_cache.is_enabled():
+        return generate_failure_response('HLS streaming is disabled', 404)
+
+    cache_id = clean_string(request.args.get('cache_id'))
+
+    found = _find_unsafe_stream_file(cache_id)
+
+    if found is None:
+        return generate_failure_response('file not found', 404)
+
+    file, target_path = found
+
+    try:
+        playlist = hls_cache.playlist(target_path, file.id,
+                                      lambda index: f'unsafe-hls-segment?cache_id={cache_id}&segment={index}')
+    except Exception as e:
+        logging.exception(e)
+        return generate_failure_response('Unable to package the file', 500)
+
+    if playlist is None:
+        return generate_failure_response('file has no video', 404)
+
+    response = make_response(playlist)
+    response.mimetype = 'application/vnd.apple.mpegurl'
+    response.headers['Cache-Control'] = 'no-cache'
+
+    return _allow_stream_origin(response)
+
+
+@media_blueprint.route('/unsafe-hls-segment', methods=['GET'])
+def unsafe_hls_segment_media_file():
+    """
+    One segment of an HLS playlist from unsafe-hls
+    :return: The MPEG-TS segment
+    """
+    if not current_app.config[PROPERTY_SERVER_MEDIA_READY]:
+        return generate_failure_response(
+            'This feature is not ready.  Please configure the app properties and restart the server.')
+
+    hls_cache: HlsSegmentCache = current_app.config[APP_KEY_HLS_CACHE]
+    if not hls_cache.is_enabled():
+        return generate_failure_response('HLS streaming is disabled', 404)
+
+    cache_id = clean_string(request.args.get('cache_id'))
+    segment = clean_string(request.args.get('segment'))
+
+    if not is_integer(segment):
+        return generate_failure_response('invalid segment value', 400)
+
+    found = _find_unsafe_stream_file(cache_id)
+
+    if found is None:
+        return generate_failure_response('file not found', 404)
+
+    file, target_path = found
+
+    try:
+        segment_path = hls_cache.fetch_segment(target_path, file.id, int(segment))
+    except Exception as e:
+        logging.exception(e)
+        return generate_failure_response('Unable to package the file', 500)
+
+    if segment_path is None:
+        return generate_failure_response('segment not found', 404)
+
+    return _allow_stream_origin(send_file(segment_path, mimetype='video/mp2t'))
+
+
 # Node Logic
 
 @media_blueprint.route('/nodes', methods=['POST'])
@@ -1625,6 +1826,10 @@ def list_history(user_details):
 
     max_rating = get_media_max_rating(user_details)
 
+    # History is ordered by when progress was written, so write this user's pending progress first
+    progress_buffer: ProgressBuffer = current_app.config[APP_KEY_PROGRESS_BUFFER]
+    progress_buffer.flush(user_uid)
+
     rows = find_progress_entries(user_uid, max_rating)
 
     results = []
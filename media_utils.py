@@ -1,5 +1,7 @@
 import logging
 import os
+import re
+import secrets
 from typing import Optional
 from datetime import datetime
 import mimetypes
@@ -7,12 +9,15 @@ import shutil
 from datetime import timedelta
 import subprocess
 
+from flask import Response, request
 from flask_sqlalchemy.session import Session
 from webvtt import WebVTT
 
 from auth_utils import get_user_features, get_user_group_id, get_user_media_limit
+from constants import STREAM_CHUNK_SIZE, MAX_BYTE_RANGES
 from db import MediaFile, MediaFolder, db
 from feature_flags import MANAGE_APP
+from media_probe import probe_media, media_stream
 from media_queries import find_folder_by_id, find_file_by_id, insert_file
 from text_utils import is_guid
 from thread_utils import TaskWrapper, NoOpTaskWrapper
@@ -44,75 +49,54 @@ def get_data_for_mediafile(file: MediaFile, primary_path: str, archive_path: str
         return os.path.join(primary_path, file.id + '.dat')
 
 
-def calculate_offset_limit(offset, limit, folder_count, file_count):
-    total_count = folder_count + file_count
-    if offset >= total_count:
-        # Offset is beyond the total items, no items to fetch
-        return {
-            "folders_needed": False,
-            "folder_offset": None,
-            "folder_limit": None,
-            "files_needed": False,
-            "file_offset": None,
-            "file_limit": None,
-        }
-
-    # Determine the remaining items to fetch after applying the offset
-    remaining_limit = min(limit, total_count - offset)
-
-    # Check if we need to fetch folders
-    if offset < folder_count:
-        folder_offset = offset
-        folder_limit = min(folder_count - folder_offset, remaining_limit)
-        remaining_limit -= folder_limit
-        folders_needed = True
-    else:
-        # Offset is beyond the folders, start directly with files
-        folder_offset = None
-        folder_limit = None
-        folders_needed = False
-
-    # Check if we need to fetch files
-    if remaining_limit > 0:
-        if offset >= folder_count:
-            file_offset = offset - folder_count
-        else:
-            file_offset = 0
-        file_limit = remaining_limit
-        files_needed = True
-    else:
-        file_offset = None
-        file_limit = None
-        files_needed = False
+def parse_range_header(header: str, file_size: int) -> Optional[list[tuple[int, int]]]:
+    """
+    Utility to figure out what BYTES are requested, supports multiple ranges and suffix ranges (bytes=-500)
+    :param header: The Range header value
+    :param file_size: Size of the requested file
+    :return: List of inclusive (start, end) pairs, in the requested order, None when the header is to be ignored
+    because of another unit, bad syntax or too many ranges, and the whole file is sent instead
+    :raises ValueError: If the header is valid but none of the ranges can be satisfied
+    """
+    if not header.startswith('bytes='):
+        return None
 
-    return {
-        "folders_needed": folders_needed,
-        "folder_offset": folder_offset,
-        "folder_limit": folder_limit,
-        "files_needed": files_needed,
-        "file_offset": file_offset,
-        "file_limit": file_limit,
-    }
+    specs = [spec.strip() for spec in header[len('bytes='):].split(',') if spec.strip()]
+    if len(specs) == 0 or len(specs) > MAX_BYTE_RANGES:
+        return None
 
+    parsed = []
+    for spec in specs:
+        match = re.fullmatch(r'(\d*)\s*-\s*(\d*)', spec, re.ASCII)
+        if match is None or match.group(1) == match.group(2) == '':
+            return None
+        first, last = match.groups()
+        if first != '' and last != '' and int(last) < int(first):
+            return None
+        parsed.append((first, last))
+
+    ranges = []
+    for first, last in parsed:
+        if first == '':
+            # Suffix range, the last N bytes
+            suffix = int(last)
+            if suffix <= 0:
+                continue
+            start, end = max(0, file_size - suffix), file_size - 1
+        else:
+            start = int(first)
+            end = min(int(last) if last != '' else file_size - 1, file_size - 1)
+        if start >= file_size:
+            continue
+        ranges.append((start, end))
 
-def parse_range_header(header, video_size):
-    """
-    Utility to figure out what BYTES are requested
-    :param header:
-    :param video_size:
-    :return:
-    """
-    # Extract start and end positions from the range header
-    if header.startswith('bytes='):
-        parts = header.split('=')[1].split('-')
-        start = int(parts[0])
-        end = int(parts[1]) if parts[1] else video_size - 1
-    else:
-        start, end = 0, video_size - 1
-    return start, end
+    if len(ranges) == 0:
+        raise ValueError(f'Range not satisfiable: {header}')
 
+    return ranges
 
-def read_file_chunk(filepath, start, length, chunk_size=8192):
+
+def read_file_chunk(filepath, start, length, chunk_size=STREAM_CHUNK_SIZE):
     """
     Generator to read a file in chunks.
     """
@@ -127,6 +111,73 @@ def read_file_chunk(filepath, start, length, chunk_size=8192):
             remaining -= len(chunk)
 
 
+def _read_file_ranges(filepath: str, parts: list[tuple[bytes, int, int]], closing: bytes):
+    with open(filepath, 'rb') as f:
+        for part_header, start, length in parts:
+            yield part_header
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                yield chunk
+                remaining -= len(chunk)
+    yield closing
+
+
+def create_range_response(target_path: str, mimetype: str, range_header: str) -> Optional[Response]:
+    """
+    Build a 206 response for the requested byte range(s) of a file.
+    A single range is handed to the WSGI server's file_wrapper when it has one, so waitress or gunicorn can send it
+    straight from the file (gunicorn uses os.sendfile), instead of pushing every chunk through a Python generator.
+    Multiple ranges are sent as multipart/byteranges.
+    :param target_path: The file to send
+    :param mimetype: The file's mime type
+    :param range_header: The Range header value
+    :return: The response, None when the header is ignored and the whole file should be sent
+    :raises ValueError: If the range can't be satisfied
+    """
+    file_size = os.path.getsize(target_path)
+    ranges = parse_range_header(range_header, file_size)
+    if ranges is None:
+        return None
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            f = open(target_path, 'rb')
+            f.seek(start)
+            # The server stops at Content-Length, not at the end of the file
+            body = file_wrapper(f, STREAM_CHUNK_SIZE)
+        else:
+            body = read_file_chunk(target_path, start, length)
+        return Response(body, 206, mimetype=mimetype, direct_passthrough=True, headers={
+            'Content-Range': f'bytes {start}-{end}/{file_size}',
+            'Accept-Ranges': 'bytes',
+            'Content-Length': str(length),
+        })
+
+    boundary = secrets.token_hex(16)
+    parts = []
+    content_length = 0
+    for start, end in ranges:
+        part_header = (f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                       f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n').encode('latin-1')
+        parts.append((part_header, start, end - start + 1))
+        content_length += len(part_header) + end - start + 1
+    closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    content_length += len(closing)
+
+    return Response(_read_file_ranges(target_path, parts, closing), 206, direct_passthrough=True,
+                    content_type=f'multipart/byteranges; boundary={boundary}', headers={
+                        'Accept-Ranges': 'bytes',
+                        'Content-Length': str(content_length),
+                    })
+
+
 def get_media_max_rating(user_details):
     max_rating = 0
     if 'limits' in user_details and 'media' in user_details['limits']:
@@ -334,19 +385,11 @@ def ingest_file(item_path: str, item_name: str, folder_id: str, is_archive: bool
     return False
 
 def get_video_params(filepath):
-    """Returns (width, height, codec_name) from a video file."""
+    """Returns (width, height, codec_name) from a video file, using the cached probe."""
+    stream = media_stream(probe_media(filepath), 'video')
     try:
-        cmd = [
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=width,height,codec_name",
-            "-of", "csv=p=0",
-            filepath
-        ]
-        output = subprocess.check_output(cmd, text=True).strip()
-        w, h, codec = output.split(',')
-        return int(w), int(h), codec
-    except Exception:
+        return int(stream['width']), int(stream['height']), stream['codec_name']
+    except (TypeError, KeyError, ValueError):
         return None
 
 def make_blank_segment(output_path: str, duration: float, width=640, height=360, task_wrapper: TaskWrapper = NoOpTaskWrapper()):
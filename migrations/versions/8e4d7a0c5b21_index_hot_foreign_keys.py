@@ -0,0 +1,41 @@
+"""index hot foreign keys and progress tables
+
+Revision ID: 8e4d7a0c5b21
+Revises: 3c1f6b2a9d40
+Create Date: 2026-10-17 09:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4d7a0c5b21'
+down_revision: Union[str, None] = '3c1f6b2a9d40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# A fresh database already has these from db.create_all, so only create what is missing
+INDEXES = [
+    ('ix_mediafiles_folder_id_filename', 'mediafiles', ['folder_id', 'filename']),
+    ('ix_mediafolders_parent_id_name', 'mediafolders', ['parent_id', 'name']),
+    ('ix_media_file_progress_user_id_file_id', 'media_file_progress', ['user_id', 'file_id']),
+    ('ix_media_file_progress_user_id_timestamp', 'media_file_progress', ['user_id', 'timestamp']),
+    ('ix_volume_progress_user_id_book_id_timestamp', 'volume_progress', ['user_id', 'book_id', 'timestamp']),
+    ('ix_volume_bookmarks_user_id_book_id', 'volume_bookmarks', ['user_id', 'book_id']),
+    ('ix_chapters_book_id_sequence', 'chapters', ['book_id', 'sequence']),
+]
+
+
+def upgrade() -> None:
+    for index_name, table_name, columns in INDEXES:
+        op.create_index(index_name, table_name, columns, if_not_exists=True)
+    # Give the planner row counts for the new indexes
+    op.execute('ANALYZE')
+
+
+def downgrade() -> None:
+    for index_name, table_name, columns in INDEXES:
+        op.drop_index(index_name, table_name=table_name, if_exists=True)
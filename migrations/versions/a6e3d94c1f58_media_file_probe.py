@@ -0,0 +1,37 @@
+"""stored ffprobe result and duration per media file
+
+Revision ID: a6e3d94c1f58
+Revises: f2d8b6c31e47
+Create Date: 2026-10-17 18:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6e3d94c1f58'
+down_revision: Union[str, None] = 'f2d8b6c31e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A fresh database already has the columns from db.create_all. Existing files are probed by the Probe Media task,
+    # or when a plugin first needs them
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('mediafiles')}
+    if 'probe' not in columns:
+        op.add_column('mediafiles', sa.Column('probe', sa.JSON(), nullable=True))
+    if 'probe_mtime' not in columns:
+        op.add_column('mediafiles', sa.Column('probe_mtime', sa.BigInteger(), nullable=True))
+    if 'duration' not in columns:
+        op.add_column('mediafiles', sa.Column('duration', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('mediafiles') as batch_op:
+        batch_op.drop_column('duration')
+        batch_op.drop_column('probe_mtime')
+        batch_op.drop_column('probe')
@@ -0,0 +1,36 @@
+"""index listing sort columns
+
+Revision ID: b7f2c9e14a63
+Revises: 8e4d7a0c5b21
+Create Date: 2026-10-17 11:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7f2c9e14a63'
+down_revision: Union[str, None] = '8e4d7a0c5b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Keyset paging seeks on the sort column within a folder, so every offered sort needs its own index
+INDEXES = [
+    ('ix_mediafolders_parent_id_created', 'mediafolders', ['parent_id', 'created']),
+    ('ix_mediafiles_folder_id_created', 'mediafiles', ['folder_id', 'created']),
+    ('ix_mediafiles_folder_id_filesize', 'mediafiles', ['folder_id', 'filesize']),
+]
+
+
+def upgrade() -> None:
+    for index_name, table_name, columns in INDEXES:
+        op.create_index(index_name, table_name, columns, if_not_exists=True)
+    op.execute('ANALYZE')
+
+
+def downgrade() -> None:
+    for index_name, table_name, columns in INDEXES:
+        op.drop_index(index_name, table_name=table_name, if_exists=True)
@@ -0,0 +1,46 @@
+"""materialize each user's last read chapter per book
+
+Revision ID: c5a8e3f17d92
+Revises: b7f2c9e14a63
+Create Date: 2026-10-17 13:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a8e3f17d92'
+down_revision: Union[str, None] = 'b7f2c9e14a63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A fresh database already has the table from db.create_all
+    op.execute(
+        "CREATE TABLE IF NOT EXISTS volume_last_read ("
+        "user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE, "
+        "book_id VARCHAR(128) NOT NULL REFERENCES books (id) ON DELETE CASCADE, "
+        "chapter_id VARCHAR(32) NOT NULL, page_number INTEGER, page_percent FLOAT, timestamp DATETIME NOT NULL, "
+        "PRIMARY KEY (user_id, book_id))")
+    op.create_index('ix_volume_last_read_user_id_timestamp', 'volume_last_read', ['user_id', 'timestamp'],
+                    if_not_exists=True)
+
+    # Backfill with the newest progress entry of every user and book
+    op.execute("DELETE FROM volume_last_read")
+    op.execute(
+        "INSERT INTO volume_last_read (user_id, book_id, chapter_id, page_number, page_percent, timestamp) "
+        "SELECT vp.user_id, vp.book_id, vp.chapter_id, vp.page_number, vp.page_percent, vp.timestamp "
+        "FROM volume_progress vp WHERE vp.id = ("
+        "SELECT newest.id FROM volume_progress newest "
+        "WHERE newest.user_id = vp.user_id AND newest.book_id = vp.book_id "
+        "ORDER BY newest.timestamp DESC, newest.id DESC LIMIT 1)")
+    op.execute('ANALYZE volume_last_read')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_volume_last_read_user_id_timestamp', table_name='volume_last_read', if_exists=True)
+    op.drop_table('volume_last_read')
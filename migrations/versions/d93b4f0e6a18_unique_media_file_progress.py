@@ -0,0 +1,35 @@
+"""one media progress entry per user and file
+
+Revision ID: d93b4f0e6a18
+Revises: c5a8e3f17d92
+Create Date: 2026-10-17 14:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd93b4f0e6a18'
+down_revision: Union[str, None] = 'c5a8e3f17d92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep the newest entry of any duplicates, so the index can be unique
+    op.execute(
+        "DELETE FROM media_file_progress WHERE id != ("
+        "SELECT newest.id FROM media_file_progress newest "
+        "WHERE newest.user_id = media_file_progress.user_id AND newest.file_id = media_file_progress.file_id "
+        "ORDER BY newest.timestamp DESC, newest.id DESC LIMIT 1)")
+    op.drop_index('ix_media_file_progress_user_id_file_id', table_name='media_file_progress', if_exists=True)
+    op.create_index('ix_media_file_progress_user_id_file_id', 'media_file_progress', ['user_id', 'file_id'],
+                    unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_media_file_progress_user_id_file_id', table_name='media_file_progress', if_exists=True)
+    op.create_index('ix_media_file_progress_user_id_file_id', 'media_file_progress', ['user_id', 'file_id'])
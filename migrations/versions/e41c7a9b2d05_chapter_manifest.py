@@ -0,0 +1,31 @@
+"""per chapter reader manifest with page dimensions
+
+Revision ID: e41c7a9b2d05
+Revises: d93b4f0e6a18
+Create Date: 2026-10-17 15:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41c7a9b2d05'
+down_revision: Union[str, None] = 'd93b4f0e6a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A fresh database already has the column from db.create_all. Existing chapters get their manifest from the next
+    # book scan, or when a reader first opens them
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('chapters')}
+    if 'manifest' not in columns:
+        op.add_column('chapters', sa.Column('manifest', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('chapters') as batch_op:
+        batch_op.drop_column('manifest')
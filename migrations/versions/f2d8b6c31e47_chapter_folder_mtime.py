@@ -0,0 +1,30 @@
+"""chapter folder mtime for incremental book scans
+
+Revision ID: f2d8b6c31e47
+Revises: e41c7a9b2d05
+Create Date: 2026-10-17 16:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2d8b6c31e47'
+down_revision: Union[str, None] = 'e41c7a9b2d05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A fresh database already has the column from db.create_all, existing chapters are listed again on the next scan
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('chapters')}
+    if 'folder_mtime' not in columns:
+        op.add_column('chapters', sa.Column('folder_mtime', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('chapters') as batch_op:
+        batch_op.drop_column('folder_mtime')
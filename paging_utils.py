@@ -0,0 +1,179 @@
+import base64
+import binascii
+import json
+import threading
+import time
+from datetime import datetime, date
+from typing import Optional, Callable
+
+from sqlalchemy import and_, or_, event, type_coerce, String
+from sqlalchemy.orm import object_session
+
+from db import MediaFolder, MediaFile, Book
+
+# What a cursor continues through, a folder listing pages through its sub folders and then its files
+PAGE_PHASE_FOLDERS = 'D'
+PAGE_PHASE_FILES = 'F'
+PAGE_PHASE_BOOKS = 'B'
+PAGE_PHASE_OFFSET = 'O'
+
+
+class PageCursor:
+    """
+    Where the next page of a listing starts, handed to clients as an opaque continuation token.
+
+    A keyset cursor holds the sort value and id of the last row sent, so the next page seeks straight to it instead of
+    skipping OFFSET rows. Orders that have no stable key (search relevance) carry a plain offset instead.
+    """
+
+    def __init__(self, sort: str, phase: str, sort_value=None, item_id: Optional[str] = None, offset: int = 0):
+        """
+        :param sort: The sort code the listing was requested with, a token is only valid for the same sort
+        :param phase: PAGE_PHASE_FOLDERS, PAGE_PHASE_FILES, PAGE_PHASE_BOOKS or PAGE_PHASE_OFFSET
+        :param sort_value: Sort column value of the last row sent
+        :param item_id: Id of the last row sent, None to start the phase from its first row
+        :param offset: Rows already sent, for PAGE_PHASE_OFFSET
+        """
+        self.sort = sort
+        self.phase = phase
+        self.sort_value = sort_value
+        self.item_id = item_id
+        self.offset = offset
+
+    def after_key(self) -> Optional[tuple]:
+        """
+        :return: (sort value, id) of the last row sent, or None to start from the first row
+        """
+        if self.item_id is None:
+            return None
+        return self.sort_value, self.item_id
+
+    def encode(self) -> str:
+        payload = [self.sort, self.phase, self.sort_value, self.item_id, self.offset]
+        data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode(token: str, sort: str) -> 'PageCursor':
+        """
+        Read a token produced by encode.
+        :param token: The continuation token
+        :param sort: The sort code of the current request
+        :return: The cursor
+        :raises ValueError: If the token is malformed or belongs to another sort
+        """
+        try:
+            data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            token_sort, phase, sort_value, item_id, offset = json.loads(data.decode('utf-8'))
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as ex:
+            raise ValueError(f'Malformed cursor: {ex}')
+
+        if token_sort != sort:
+            raise ValueError('Cursor belongs to a different sort')
+        if phase not in (PAGE_PHASE_FOLDERS, PAGE_PHASE_FILES, PAGE_PHASE_BOOKS, PAGE_PHASE_OFFSET):
+            raise ValueError('Unknown cursor phase')
+        if not isinstance(offset, int) or offset < 0 or (item_id is not None and not isinstance(item_id, str)):
+            raise ValueError('Malformed cursor')
+        if sort_value is not None and not isinstance(sort_value, (str, int, float)):
+            raise ValueError('Malformed cursor')
+
+        return PageCursor(sort, phase, sort_value, item_id, offset)
+
+    @staticmethod
+    def after_row(sort: str, phase: str, row, sort_column) -> 'PageCursor':
+        """
+        Build the cursor that continues after a row.
+        :param sort: The sort code
+        :param phase: The phase the row belongs to
+        :param row: The last row sent
+        :param sort_column: The model column the listing is ordered by
+        :return: The cursor
+        """
+        sort_value = getattr(row, sort_column.key)
+        if isinstance(sort_value, (datetime, date)):
+            # Keep the text SQLite holds, rows not written by the ORM use other formats and a reformatted value would
+            # not compare equal to itself
+            sort_value = (object_session(row).query(type_coerce(sort_column, String))
+                          .filter(sort_column.class_.id == row.id).scalar())
+        return PageCursor(sort, phase, sort_value, row.id)
+
+
+def after_key_filter(sort_column, id_column, sort_descending: bool, after_key: tuple):
+    """
+    Build the WHERE clause for rows that come after a key in ORDER BY sort_column, id_column.
+    The sort column is compared with >= / <= first, so SQLite can seek an index on it. SQLite sorts NULLs first, so
+    NULL sort values are handled on their own.
+    :param sort_column: The column the listing is ordered by
+    :param id_column: The tie breaking id column
+    :param sort_descending: Is this descending sort?
+    :param after_key: (sort value, id) of the last row sent
+    :return: The filter expression
+    """
+    sort_value, item_id = after_key
+
+    if isinstance(sort_value, str) and sort_column.type.python_type in (datetime, date):
+        # Dates are keyed by their stored text, see PageCursor.after_row
+        sort_column = type_coerce(sort_column, String)
+
+    if not sort_descending:
+        if sort_value is None:
+            return or_(and_(sort_column.is_(None), id_column > item_id), sort_column.isnot(None))
+        return and_(sort_column >= sort_value, or_(sort_column > sort_value, id_column > item_id))
+
+    if sort_value is None:
+        return and_(sort_column.is_(None), id_column < item_id)
+    return or_(and_(sort_column <= sort_value, or_(sort_column < sort_value, id_column < item_id)),
+               sort_column.is_(None))
+
+
+class CountCache:
+    """
+    Remembers listing totals for a short while, so paging through a listing doesn't count it again for every page.
+    Any insert, update or delete of a folder, file or book drops every cached total.
+    """
+
+    def __init__(self, max_age: int, max_size: int = 256):
+        """
+        :param max_age: Seconds a total is trusted, covers bulk changes that skip the ORM events
+        :param max_size: Most totals kept
+        """
+        self.max_age = max_age
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def fetch(self, key: tuple, counter: Callable[[], int]) -> int:
+        """
+        Get a cached total, counting it when missing or stale.
+        :param key: Everything the total depends on
+        :param counter: Counts the rows
+        :return: The total
+        """
+        now = time.time()
+        generation = _count_generation['value']
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] == generation and now - entry[2] < self.max_age:
+                return entry[0]
+
+        count = counter()
+
+        with self.lock:
+            if len(self.entries) >= self.max_size:
+                self.entries.clear()
+            self.entries[key] = (count, generation, now)
+
+        return count
+
+
+_count_generation = {'value': 0}
+
+
+def _invalidate_counts(mapper, connection, target):
+    _count_generation['value'] += 1
+
+
+for _model in (MediaFolder, MediaFile, Book):
+    event.listen(_model, 'after_insert', _invalidate_counts)
+    event.listen(_model, 'after_update', _invalidate_counts)
+    event.listen(_model, 'after_delete', _invalidate_counts)
@@ -1,18 +1,24 @@
 import argparse
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
+from flask import current_app
 from flask_sqlalchemy.session import Session
 
-from constants import PROPERTY_SERVER_VOLUME_FOLDER
+from constants import PROPERTY_SERVER_VOLUME_FOLDER, APP_KEY_IMAGE_CACHE, QUICK_IMAGE_WIDTH, \
+    PROPERTY_SERVER_VOLUME_SCAN_WORKERS
 from date_utils import convert_yyyymmdd_to_date, convert_timestamp_to_datetime
 from feature_flags import MANAGE_VOLUME
 from file_utils import reset_folder
-from image_utils import resize_image
+from image_cache import DerivedImageCache
+from image_utils import resize_image, build_chapter_manifest
 from plugin_methods import plugin_select_arg, plugin_select_values
 from plugin_system import ActionBookSpecificPlugin, ActionBookGeneralPlugin
 from text_utils import is_blank
 from thread_utils import TaskWrapper
-from volume_queries import update_book_live, manage_book_chapters
+from volume_queries import update_book_live, manage_book_chapters, find_chapter_scan_states
 
 
 class UpdateAllCaches(ActionBookGeneralPlugin):
@@ -23,6 +29,7 @@ class UpdateAllCaches(ActionBookGeneralPlugin):
     def __init__(self):
         super().__init__()
         self.prefix_lang_id = 'bkclnall'
+        self.scan_workers = 1
 
     def get_sort(self):
         return {'id': 'books_workers', 'sequence': 3}
@@ -61,12 +68,13 @@ class UpdateAllCaches(ActionBookGeneralPlugin):
 
     def absorb_config(self, config):
         super().absorb_config(config)
+        self.scan_workers = config[PROPERTY_SERVER_VOLUME_SCAN_WORKERS]
 
     def create_task(self, db_session: Session, args):
         return UpdateAllJson("Update", 'All Volume Definitions',
                              'clean_previews' in args and args['clean_previews'] == 'y',
                              'update_tags' in args and args['update_tags'] == 'y',
-                             self.book_storage_folder)
+                             self.book_storage_folder, self.scan_workers)
 
 
 class UpdateSingleCache(ActionBookSpecificPlugin):
@@ -155,145 +163,161 @@ def folder_creation_date(folder_path):
         return None
 
 
-def generate_db_for_folder(session, item_name, folder_path, task_wrapper: TaskWrapper, clean_previews: bool = False,
-                           sync_tags: bool = False):
-    task_wrapper.always("Building for: " + item_name)
-
-    json_data = {'id': item_name, 'chapters': []}
-
-    if task_wrapper.can_trace():
-        task_wrapper.trace(f'Sort Stuff')
-
-    for root, dirs, files in os.walk(folder_path):
-        if root == folder_path:
-            previews_path = os.path.join(root, '.previews')
-
-            if clean_previews:
-                reset_folder(previews_path)
-            else:
-                os.makedirs(previews_path, exist_ok=True)
-
-            prev_chapter = ''
-
-            number_of_chapters = len(dirs)
-            chapter_index = 1
-
-            for chapter_dir in dirs:
-
-                # Update the sub-progress
-                progress = (chapter_index / number_of_chapters) * 100
-                chapter_index = chapter_index + 1
-                task_wrapper.update_percent(progress)
-
-                if chapter_dir.startswith('.'):
-                    continue
-                chapter_path = os.path.join(root, chapter_dir)
-                if os.path.isdir(chapter_path):
-
-                    if task_wrapper.can_trace():
-                        task_wrapper.trace(f'Working on {chapter_path}')
-
-                    image_file_list = sorted(os.listdir(chapter_path))
-
-                    if task_wrapper.can_trace():
-                        task_wrapper.trace(f'Sorted')
-
-                    json_data['chapters'].append({'name': chapter_dir, 'files': image_file_list, 'prev': '', 'next': '',
-                                                  'date': folder_creation_date(chapter_path)})
-
-                    if task_wrapper.can_trace():
-                        task_wrapper.trace(f'Data Produced')
-
-                    if len(image_file_list) > 0:
-
-                        if task_wrapper.can_trace():
-                            task_wrapper.trace(f'Make Thumbnail Image')
-
-                        dest_image_file = os.path.join(previews_path, chapter_dir + '.webp')
-                        if clean_previews and os.path.isfile(dest_image_file):
-                            os.remove(dest_image_file)
-
-                        imgpath = os.path.join(chapter_path, image_file_list[0])
-
-                        if not os.path.isfile(dest_image_file) or os.path.getmtime(dest_image_file) < os.path.getmtime(
-                                imgpath):
-                            task_wrapper.set_worked()
-
-                            if task_wrapper.can_trace():
-                                task_wrapper.trace(f'New Image {imgpath}')
-                            try:
-                                resize_image(imgpath, dest_image_file, 200, "WEBP")
-                                if task_wrapper.can_trace():
-                                    task_wrapper.trace(f'Image Created')
-                            except Exception as e:
-                                task_wrapper.error("Error making thumbnail file")
-
-    if json_data['chapters'][0]['name'].startswith("chapter-"):
+def scan_book_folder(item_name: str, folder_path: str, clean_previews: bool = False,
+                     previous_chapters: Optional[dict] = None) -> dict:
+    """
+    The file system half of a book definition update, it doesn't touch the database so it can run in a scan thread.
+    Chapter folders whose mtime and entry count match the last scan reuse its page list and date, and keep the stored
+    manifest, without being sorted or having their pages looked at again.
+    :param item_name: The book id
+    :param folder_path: The book folder
+    :param clean_previews: Re-create every chapter thumbnail, this also rescans every chapter
+    :param previous_chapters: find_chapter_scan_states of the book
+    :return: Dict of id, path, chapters (in reading order, with prev and next), date, last, cover, changed (a thumbnail
+    was made, so new pages showed up), rescanned (chapters listed again) and errors
+    """
+    previous_chapters = previous_chapters or {}
 
-        if task_wrapper.can_trace():
-            task_wrapper.trace(f'Fancy Chapters')
+    previews_path = os.path.join(folder_path, '.previews')
 
-        sorted_objects = sorted(json_data['chapters'], key=custom_chapter_sorting)
-        json_data['chapters'] = sorted_objects
+    if clean_previews:
+        reset_folder(previews_path)
     else:
+        os.makedirs(previews_path, exist_ok=True)
+
+    chapters = []
+    errors = []
+    book_changed = False
+    rescanned = 0
+
+    with os.scandir(folder_path) as entries:
+        chapter_entries = [entry for entry in entries if not entry.name.startswith('.') and entry.is_dir()]
+
+    for entry in chapter_entries:
+        chapter_dir = entry.name
+        chapter_path = entry.path
+        folder_mtime = entry.stat().st_mtime_ns
+        image_file_list = os.listdir(chapter_path)
+        previous = previous_chapters.get(chapter_dir)
+
+        unchanged = (not clean_previews and previous is not None and previous['manifest_json'] is not None and
+                     previous['mtime'] == folder_mtime and previous['page_count'] == len(image_file_list))
+
+        if unchanged:
+            image_file_list = previous['files']
+            chapters.append({'name': chapter_dir, 'files': image_file_list, 'prev': '', 'next': '',
+                             'date': previous['date'], 'mtime': folder_mtime})
+        else:
+            rescanned += 1
+            image_file_list.sort()
+            previous_pages = json.loads(previous['manifest_json']) if previous and previous['manifest_json'] else None
+            pages = build_chapter_manifest(chapter_path, image_file_list, previous_pages)
+            chapters.append({'name': chapter_dir, 'files': image_file_list, 'prev': '', 'next': '',
+                             'date': folder_creation_date(chapter_path), 'pages': pages, 'mtime': folder_mtime})
+
+        if len(image_file_list) > 0:
+            dest_image_file = os.path.join(previews_path, chapter_dir + '.webp')
+            imgpath = os.path.join(chapter_path, image_file_list[0])
+
+            # The first page of an unchanged folder is the same file, only a missing thumbnail needs making
+            if not os.path.isfile(dest_image_file) or (
+                    not unchanged and os.path.getmtime(dest_image_file) < os.path.getmtime(imgpath)):
+                book_changed = True
+                try:
+                    resize_image(imgpath, dest_image_file, 200, "WEBP")
+                except Exception as e:
+                    errors.append(f'Error making thumbnail file for {chapter_path}: {e}')
+
+    if len(chapters) > 0:
+        if chapters[0]['name'].startswith("chapter-"):
+            chapters.sort(key=custom_chapter_sorting)
+        else:
+            chapters.sort(key=custom_decimal_sorting)
+
+    for i in range(len(chapters)):
+        if i > 0:
+            chapters[i]['prev'] = chapters[i - 1]['name']
+        if i < len(chapters) - 1:
+            chapters[i]['next'] = chapters[i + 1]['name']
+
+    result = {'id': item_name, 'path': folder_path, 'chapters': chapters, 'date': '20050101', 'last': '', 'cover': '',
+              'changed': book_changed, 'rescanned': rescanned, 'errors': errors}
 
-        if task_wrapper.can_trace():
-            task_wrapper.trace(f'Cheap Chapters')
-
-        sorted_objects = sorted(json_data['chapters'], key=custom_decimal_sorting)
-        json_data['chapters'] = sorted_objects
-
-    if task_wrapper.can_trace():
-        task_wrapper.trace(f'Chapter Findings')
-
-    array_of_objects = json_data['chapters']
-
-    # Loop through the array indices
-    for i in range(len(array_of_objects)):
-        current_object = array_of_objects[i]
-
-        # Get the previous object if it exists
-        previous_object = array_of_objects[i - 1] if i > 0 else None
-
-        if previous_object is not None:
-            current_object['prev'] = previous_object['name']
+    # If we have chapters, try to extract the dates from them
+    if len(chapters) > 0:
+        result['cover'] = chapters[0]['name']
+        result['last'] = chapters[-1]['name']
+        result['date'] = chapters[-1]['date']
 
-        # Get the next object if it exists
-        next_object = array_of_objects[i + 1] if i < len(array_of_objects) - 1 else None
+    return result
 
-        if next_object is not None:
-            current_object['next'] = next_object['name']
 
-    # Set a date in the FAR past
-    json_data['date'] = '20050101'
-    json_data['last'] = ''
+def apply_book_scan(session, scan: dict, task_wrapper: TaskWrapper, sync_tags: bool = False,
+                    prewarm_cache: bool = True):
+    """
+    The database half of a book definition update, writes the book and its chapters in one transaction, and only
+    when something changed.
+    :param session: The task's database session
+    :param scan: The result of scan_book_folder
+    :param task_wrapper: The task
+    :param sync_tags: Sync book tags?
+    :param prewarm_cache: Prewarm the image cache even if no new pages showed up
+    """
+    item_name = scan['id']
+    task_wrapper.always("Building for: " + item_name)
 
-    if task_wrapper.can_trace():
-        task_wrapper.trace(f'Chapter Lookups')
+    for error in scan['errors']:
+        task_wrapper.error(error)
 
-    # If we have chapters, try to extract the dates from them
-    if len(json_data['chapters']) > 0:
-        json_data['cover'] = json_data['chapters'][0]['name']
-        json_data['last'] = json_data['chapters'][-1]['name']
-        json_data['date'] = json_data['chapters'][-1]['date']
+    if len(scan['chapters']) == 0:
+        task_wrapper.error(f'No chapters found for {item_name}')
+        return
 
-    # Default the tags
-    json_data['tags'] = []
+    if scan['changed']:
+        task_wrapper.set_worked()
 
     if task_wrapper.can_trace():
-        task_wrapper.trace(f'Before Live Update')
+        task_wrapper.trace(f'Listed {scan["rescanned"]} of {len(scan["chapters"])} chapters')
 
-    update_book_live(item_name, convert_yyyymmdd_to_date(json_data['date']), json_data['last'], json_data['cover'],
-                     json_data['cover'], logger=task_wrapper, db_session=session, sync_tags=sync_tags)
+    book_updated = update_book_live(item_name, convert_yyyymmdd_to_date(scan['date']), scan['last'], scan['cover'],
+                                    scan['cover'], logger=task_wrapper, db_session=session, sync_tags=sync_tags,
+                                    auto_commit=False)
     if task_wrapper.can_trace():
         task_wrapper.trace('Before manage_book_chapters')
-    manage_book_chapters(item_name, json_data['chapters'], task_wrapper, session)
+    chapters_changed = manage_book_chapters(item_name, scan['chapters'], task_wrapper, session, auto_commit=False)
+    if book_updated or chapters_changed:
+        session.commit()
+    else:
+        session.rollback()
     if task_wrapper.can_trace():
         task_wrapper.trace('After manage_book_chapters')
 
+    if prewarm_cache or scan['changed']:
+        task_wrapper.run_after(
+            PrewarmBookImageCache("Prewarm", f'Prewarm {item_name} Images', item_name, scan['path']))
+
+
+def generate_db_for_folder(session, item_name, folder_path, task_wrapper: TaskWrapper, clean_previews: bool = False,
+                           sync_tags: bool = False, prewarm_cache: bool = True):
+    scan = scan_book_folder(item_name, folder_path, clean_previews, find_chapter_scan_states(item_name, session))
+    apply_book_scan(session, scan, task_wrapper, sync_tags, prewarm_cache)
+
 
 def generate_book_definitions(task_wrapper: TaskWrapper, series_id: str = None, book_folder: str = '',
-                              clean_previews: bool = False, sync_tags=False, session=None):
+                              clean_previews: bool = False, sync_tags=False, session=None, scan_workers: int = 1):
+    """
+    Update the definition of every book in the volume folder, or a single one.
+    With more than one scan worker the book folders are scanned by a thread pool, the scan is mostly listing folders and
+    reading image headers, so the threads overlap their waits on the disk. The results come back to the task thread
+    which does every database write.
+    :param task_wrapper: The task
+    :param series_id: Only update this book
+    :param book_folder: The volume folder
+    :param clean_previews: Re-create every chapter thumbnail
+    :param sync_tags: Sync book tags?
+    :param session: The task's database session
+    :param scan_workers: Threads scanning book folders, 1 scans in the task thread
+    """
     if is_blank(book_folder) or not os.path.isdir(book_folder):
         task_wrapper.add_log("Invalid book folder path.")
         return
@@ -302,27 +326,43 @@ def generate_book_definitions(task_wrapper: TaskWrapper, series_id: str = None,
         folders = [series_id]
     else:
         folders = os.listdir(book_folder)
-    index = 0
 
-    for item in folders:
-        index = index + 1
+    books = [(item, os.path.join(book_folder, item)) for item in folders
+             if os.path.isdir(os.path.join(book_folder, item))]
+
+    if task_wrapper.can_debug() and series_id is not None and len(books) > 0:
+        task_wrapper.debug(f'Found config for {series_id}')
+
+    if scan_workers <= 1 or len(books) <= 1:
+        for index, (item, item_path) in enumerate(books, 1):
+            # If it has been cancelled
+            if task_wrapper.is_cancelled:
+                break
+
+            task_wrapper.update_progress((index / len(books)) * 100.0)
 
-        # If it has been cancelled
-        if task_wrapper.is_cancelled:
-            break
+            try:
+                generate_db_for_folder(session, item, item_path, task_wrapper, clean_previews, sync_tags,
+                                       prewarm_cache=series_id is not None)
+            except Exception as ex:
+                task_wrapper.critical(ex)
+        return
 
-        if series_id is not None and series_id != item:
-            continue
+    with ThreadPoolExecutor(max_workers=scan_workers) as pool:
+        futures = [pool.submit(scan_book_folder, item, item_path, clean_previews,
+                               find_chapter_scan_states(item, session)) for item, item_path in books]
+        session.rollback()
 
-        if task_wrapper.can_debug() and series_id is not None:
-            task_wrapper.debug(f'Found config for {series_id}')
+        for index, future in enumerate(as_completed(futures), 1):
+            # If it has been cancelled
+            if task_wrapper.is_cancelled:
+                pool.shutdown(cancel_futures=True)
+                break
 
-        task_wrapper.update_progress((index / len(folders)) * 100.0)
+            task_wrapper.update_progress((index / len(books)) * 100.0)
 
-        item_path = os.path.join(book_folder, item)
-        if os.path.isdir(item_path):
             try:
-                generate_db_for_folder(session, item, item_path, task_wrapper, clean_previews, sync_tags)
+                apply_book_scan(session, future.result(), task_wrapper, sync_tags, prewarm_cache=series_id is not None)
             except Exception as ex:
                 task_wrapper.critical(ex)
 
@@ -332,15 +372,17 @@ class UpdateAllJson(TaskWrapper):
     Update every JSON file
     """
 
-    def __init__(self, name, description, clean_previews: bool, sync_tags: bool = False, book_folder: str = ''):
+    def __init__(self, name, description, clean_previews: bool, sync_tags: bool = False, book_folder: str = '',
+                 scan_workers: int = 1):
         super().__init__(name, description)
         self.clean_previews = clean_previews
         self.sync_tags = sync_tags
         self.book_folder = book_folder
+        self.scan_workers = scan_workers
 
     def run(self, db_session):
         generate_book_definitions(self, None, self.book_folder, self.clean_previews, sync_tags=self.sync_tags,
-                                  session=db_session)
+                                  session=db_session, scan_workers=self.scan_workers)
 
 
 class UpdateSingleBookStats(TaskWrapper):
@@ -357,3 +399,46 @@ class UpdateSingleBookStats(TaskWrapper):
 
     def run(self, db_session):
         generate_book_definitions(self, self.series_id, self.book_folder, self.clean_previews, session=db_session)
+
+
+class PrewarmBookImageCache(TaskWrapper):
+    """
+    Fill the derived image cache with the quick version of every page in a book
+    """
+
+    def __init__(self, name, description, book_id: str, book_path: str):
+        super().__init__(name, description, priority=8)
+        self.book_id = book_id
+        self.book_path = book_path
+        self.ref_book_id = book_id
+
+    def run(self, db_session):
+        image_cache: DerivedImageCache = current_app.config.get(APP_KEY_IMAGE_CACHE)
+        if image_cache is None or not image_cache.is_enabled():
+            self.info('Image cache is disabled')
+            return
+
+        chapter_dirs = sorted(entry for entry in os.listdir(self.book_path) if not entry.startswith('.') and os.path.isdir(
+            os.path.join(self.book_path, entry)))
+
+        total = len(chapter_dirs)
+        count = 0
+
+        for chapter_dir in chapter_dirs:
+            count = count + 1
+            self.update_progress((count / total) * 100.0)
+
+            if self.is_cancelled:
+                self.set_warning()
+                self.info('Ending Early')
+                break
+
+            chapter_path = os.path.join(self.book_path, chapter_dir)
+            for image_name in sorted(os.listdir(chapter_path)):
+                if not image_name.lower().endswith(('.png', '.webp', '.jpg', '.jpeg')):
+                    continue
+                try:
+                    image_cache.fetch(os.path.join(chapter_path, image_name), self.book_id, chapter_dir, image_name,
+                                      QUICK_IMAGE_WIDTH)
+                except Exception as e:
+                    self.error(f'Unable to cache {chapter_dir}/{image_name}: {e}')
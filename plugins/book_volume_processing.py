@@ -1,58 +1,129 @@
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from typing import Optional
 
 from flask_sqlalchemy.session import Session
 
+from constants import CURL_BATCH_SIZE
 from db import Book
 from file_utils import delete_empty_folders, is_text_file
-from html_utils import download_unsecure_file, download_secure_file, get_headers, get_headers_when_empty
+from html_utils import download_unsecure_file, download_secure_file, get_headers, get_headers_when_empty, \
+    download_secure_files
 from image_utils import clean_images_folder, is_valid_image
 from plugins.book_update_stats import generate_db_for_folder
 from processors.processor_core import CustomDownloadInterface
 from text_utils import is_not_blank, wildcard_to_regex
 from thread_utils import TaskWrapper
+from throttle_utils import HostLimiter, get_host_limiter, backoff_delay
 from utility import random_sleep
 
 
 def _process_file_download(headers_required: bool, task_wrapper: TaskWrapper, image_info, destination_folder,
-                           headers) -> str:
+                           headers, limiter: Optional[HostLimiter] = None, cost: float = 1.0, retries: int = 2,
+                           token=None) -> str:
+    """
+    Download one image, retrying failed downloads and text files with a growing pause.
+    :param headers_required: Use curl with browser headers
+    :param task_wrapper: The task
+    :param image_info: {'src': url, 'file': file name}
+    :param destination_folder: The chapter folder
+    :param headers: The headers to send
+    :param limiter: The limits of the image host, None to fetch right away
+    :param cost: Rate limit tokens the request uses, see TokenBucket.acquire
+    :param retries: How often to try again
+    :param token: Stop token of the task
+    :return: S (saved), F (download failed), X (only got text back) or E (the task was stopped)
+    """
     try_count = 0
 
     file_output = os.path.join(destination_folder, image_info['file'])
 
     while True:
-        if headers_required:
-            if task_wrapper.can_trace():
-                task_wrapper.trace('Secure: ' + image_info['src'])
-            if download_secure_file(
+        if token is not None and token.should_stop:
+            return "E"
+
+        with limiter.request(cost) if limiter is not None else nullcontext():
+            if headers_required:
+                if task_wrapper.can_trace():
+                    task_wrapper.trace('Secure: ' + image_info['src'])
+                downloaded = download_secure_file(
                     image_info['src'], destination_folder,
-                    image_info['file'], headers, task_wrapper):
-                pass
+                    image_info['file'], headers, task_wrapper)
             else:
-                task_wrapper.critical('Invalid Secure download, stopping')
-                return "F"
-        else:
-            task_wrapper.trace('Insecure: ' + image_info['src'])
-            if download_unsecure_file(
+                task_wrapper.trace('Insecure: ' + image_info['src'])
+                downloaded = download_unsecure_file(
                     image_info['src'], destination_folder,
-                    image_info['file'], headers, task_wrapper):
-                pass
-            else:
-                task_wrapper.critical('Invalid Insecure download, stopping')
-                return "F"
+                    image_info['file'], headers, task_wrapper)
 
-        if not is_text_file(file_output):
+        if downloaded and not is_text_file(file_output):
             return "S"
-        else:
+
+        try_count = try_count + 1
+        if try_count > retries:
+            if downloaded:
+                task_wrapper.set_failure()
+                task_wrapper.error("Too many failed attempts, failing")
+                return "X"
+            task_wrapper.critical(f'Invalid {"Secure" if headers_required else "Insecure"} download, stopping')
+            return "F"
+
+        if downloaded:
             task_wrapper.debug("Found Text File, Trying Again")
             random_sleep(20, 15, task_wrapper)
+        else:
+            task_wrapper.debug(f'Download failed, try {try_count} of {retries}')
+            time.sleep(backoff_delay(try_count))
 
-        try_count = try_count + 1
-        if try_count > 2:
-            task_wrapper.set_failure()
-            task_wrapper.error("Too many failed attempts, failing")
-            return "X"
+
+def _process_secure_downloads(task_wrapper: TaskWrapper, downloads: list, destination_folder, concurrency: int,
+                               rate: float, retries: int, token, progress) -> list[str]:
+    """
+    Download images with curl a batch at a time, instead of a curl process per image. A batch is images in a row that
+    share their headers and host, it holds the host's free slots while curl runs, see HostLimiter.batch. With one slot
+    the batch is paced by curl. With more curl can't pace it, so it is kept to the host's burst and runs as many
+    transfers at once as it holds slots.
+    Images the batch didn't get go through _process_file_download, for its retries.
+    :param task_wrapper: The task
+    :param downloads: (image_info, headers, limiter, cost) in page order
+    :param destination_folder: The chapter folder
+    :param concurrency: Transfers at once
+    :param rate: Requests per second
+    :param retries: Retries per image
+    :param token: Stop token of the task
+    :param progress: Called with the number of images done
+    :return: The result of each image, see _process_file_download
+    """
+    results = []
+    while len(results) < len(downloads):
+        if token is not None and token.should_stop:
+            results.extend('E' for _ in range(len(downloads) - len(results)))
+            break
+
+        _, headers, limiter, _ = downloads[len(results)]
+        batch_size = CURL_BATCH_SIZE if concurrency <= 1 else min(CURL_BATCH_SIZE, limiter.bucket.burst)
+        batch = []
+        for download in downloads[len(results):len(results) + batch_size]:
+            if download[1] != headers or download[2] is not limiter:
+                break
+            batch.append(download)
+
+        with limiter.batch(min(concurrency, len(batch)), sum(download[3] for download in batch)) as parallel:
+            fetched = download_secure_files([(download[0]['src'], download[0]['file']) for download in batch],
+                                            destination_folder, headers, task_wrapper, parallel,
+                                            rate / max(download[3] for download in batch))
+
+        for download, ok in zip(batch, fetched):
+            if ok and not is_text_file(os.path.join(destination_folder, download[0]['file'])):
+                results.append('S')
+            else:
+                results.append(_process_file_download(True, task_wrapper, download[0], destination_folder,
+                                                      download[1], download[2], download[3], retries, token))
+            progress(len(results))
+
+    return results
 
 
 def _process_download(processor, token, book: Book, task_wrapper, book_folder: str, storage_format: str,
@@ -172,10 +243,14 @@ def _process_download(processor, token, book: Book, task_wrapper, book_folder: s
 
         downloaded_chapters = downloaded_chapters + 1
 
-        current_image = 0
+        concurrency = max(processor.download_concurrency(), 1)
+        rate = processor.download_rate()
+        retries = processor.download_retries()
 
-        check_image = True
         stop_download = False
+
+        # Headers are worked out in order, an image with its own referer keeps it for the images after it
+        downloads = []
         for image_info in image_list:
 
             if headers_required:
@@ -196,38 +271,48 @@ def _process_download(processor, token, book: Book, task_wrapper, book_folder: s
                     task_wrapper.set_failure(True)
                     return False
 
-            min_duration = 1
-            delay = 3
+            # A delay asks for a slower pace than the processor's, it is the longest pause in seconds after the image
+            cost = 1.0
             if 'delay' in image_info:
-                delay = image_info['delay']
-                if delay < 3:
-                    delay = 3
-                min_duration = delay - 2
+                cost = max(1.0, (max(image_info['delay'], 3) - 1) * rate)
 
             if headers is not None:
                 headers['accept'] = 'image/avif,image/webp,image/png,image/svg+xml,image/*;q=0.8,*/*;q=0.5'
 
-            resu = _process_file_download(headers_required, task_wrapper, image_info, destination_folder, headers)
+            downloads.append((image_info, dict(headers) if headers is not None else None,
+                              get_host_limiter(image_info['src'], rate, concurrency, concurrency), cost))
+
+        def fetch(download) -> str:
+            return _process_file_download(headers_required, task_wrapper, download[0], destination_folder,
+                                          download[1], download[2], download[3], retries, token)
+
+        # The first image is fetched alone, when it isn't an image the site is not serving this chapter
+        results = [fetch(downloads[0])]
+        task_wrapper.update_percent(100.0 / len(image_list))
+        stopped = results[0] == 'E'
+        if not stopped and not is_valid_image(os.path.join(destination_folder, downloads[0][0]['file'])):
+            task_wrapper.critical('1st file is not an image, stopping')
+            task_wrapper.info(chapter['href'])
+        elif not stopped and len(downloads) > 1 and headers_required:
+            results.extend(_process_secure_downloads(
+                task_wrapper, downloads[1:], destination_folder, concurrency, rate, retries, token,
+                lambda done: task_wrapper.update_percent(100.0 * ((done + 1) / len(image_list)))))
+        elif not stopped and len(downloads) > 1:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='chapter-download') as pool:
+                futures = [pool.submit(fetch, download) for download in downloads[1:]]
+                for current_image, _ in enumerate(as_completed(futures), start=2):
+                    task_wrapper.update_percent(100.0 * (current_image / len(image_list)))
+                results.extend(future.result() for future in futures)
+
+        # Results are looked at in page order, like the pages were fetched one after another
+        for resu in results:
             if resu == 'X':
                 task_wrapper.error('Failed to download image, skipping item')
-                #stop_download = True
-                #break
             elif resu == 'E':
                 break
 
             downloaded_images = downloaded_images + 1
-            current_image = current_image + 1
-            task_wrapper.update_percent(100.0 * (current_image / len(image_list)))
             modified = True
-            random_sleep(delay, min_duration)
-
-            if check_image:
-                check_image = False
-                image_path = os.path.join(destination_folder, image_info['file'])
-                if not is_valid_image(image_path):
-                    task_wrapper.critical('1st file is not an image, stopping')
-                    task_wrapper.info(chapter['href'])
-                    break
 
         # Get rid of bad files
         clean_images_folder(destination_folder, task_wrapper)
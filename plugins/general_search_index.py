@@ -0,0 +1,59 @@
+import argparse
+
+from flask_sqlalchemy.session import Session
+
+from feature_flags import MANAGE_APP
+from plugin_system import ActionPlugin
+from search_index import rebuild_search_index
+from thread_utils import TaskWrapper
+
+
+class RebuildSearchIndexPlugin(ActionPlugin):
+    """
+    Rebuild the full text search index from the folder, file and book tables.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.prefix_lang_id = 'srchidx'
+
+    def get_sort(self):
+        return {'id': 'search_index', 'sequence': 0}
+
+    def add_args(self, parser: argparse):
+        pass
+
+    def use_args(self, args):
+        pass
+
+    def get_action_name(self):
+        return 'Rebuild Search Index'
+
+    def get_action_id(self):
+        return 'action.search.rebuild'
+
+    def get_action_icon(self):
+        return 'search'
+
+    def get_action_args(self):
+        return []
+
+    def process_action_args(self, args):
+        return None
+
+    def get_feature_flags(self):
+        return MANAGE_APP
+
+    def get_category(self):
+        return 'utility'
+
+    def create_task(self, db_session: Session, args):
+        return RebuildSearchIndexJob("Search", 'Rebuild Search Index')
+
+
+class RebuildSearchIndexJob(TaskWrapper):
+    def __init__(self, name, description):
+        super().__init__(name, description)
+
+    def run(self, db_session):
+        rebuild_search_index(db_session, self)
@@ -9,7 +9,7 @@ from flask_sqlalchemy.session import Session
 
 from db import MediaFolder
 from feature_flags import MANAGE_MEDIA
-from media_probe import get_file_formats
+from media_probe import get_file_formats, probe_media_file
 from media_queries import find_folder_by_id, find_files_in_folder, find_all_folders, find_file_by_id, insert_file
 from media_utils import get_data_for_mediafile, get_preview_for_mediafile
 from plugin_methods import plugin_select_arg, PLUGIN_VALUES_Y_N, plugin_media_folder_chooser_folder_arg
@@ -219,6 +219,10 @@ class CheckFolderIntegrity(TaskWrapper):
                                     self.set_failure()
                                     return
 
+                                # Already probed for the format, keep it with the file
+                                probe_media_file(new_file, str(src_path), self)
+                                db_session.commit()
+
                     if entry.name.endswith(".png"):
                         self.warn(f'Found leftover PNG preview {entry.name}')
 
@@ -14,6 +14,7 @@ from flask_sqlalchemy.session import Session
 from feature_flags import MANAGE_MEDIA
 from ffmpeg_utils import get_ffmpeg_f_argument_from_mimetype
 from file_utils import temporary_folder
+from media_probe import probe_media_file, media_stream
 from media_queries import insert_file
 from media_utils import get_data_for_mediafile, get_file_by_user, describe_file_size_change
 from plugin_system import ActionMediaFilePlugin, ActionMediaFilesPlugin
@@ -21,46 +22,35 @@ from text_utils import is_blank
 from thread_utils import TaskWrapper
 
 
-def detect_freezes(file_path, import_format:str = 'null'):
-
-    cmd = [
-        "ffmpeg", "-i", file_path,
-        "-vf", "freezedetect=n=-60dB:d=0.5",
-        "-map", "0:v:0", "-f", import_format, "-"
-    ]
-
-    result = subprocess.run(cmd, stderr=subprocess.PIPE, text=True)
-    timestamps = re.findall(r"freeze_start: (\d+\.\d+)|freeze_end: (\d+\.\d+)", result.stderr)
-    freeze_ranges = []
+def _parse_ranges(output: str, name: str):
+    timestamps = re.findall(rf"{name}_start: (\d+\.?\d*)|{name}_end: (\d+\.?\d*)", output)
+    ranges = []
     start = None
     for start_time, end_time in timestamps:
         if start_time:
             start = float(start_time)
         if end_time and start is not None:
-            freeze_ranges.append((start, float(end_time)))
+            ranges.append((start, float(end_time)))
             start = None
-    return freeze_ranges
+    return ranges
 
 
-def detect_silences(file_path, import_format:str = 'null'):
+def detect_freezes_and_silences(file_path, import_format: str = 'null'):
+    """
+    Find frozen video and silent audio in one decode of the file, both filters log to the same stderr
+    :param file_path: The media file, with a video and an audio stream
+    :param import_format: The ffmpeg output format
+    :return: Freeze ranges and silence ranges, as (start, end) seconds
+    """
     cmd = [
         "ffmpeg", "-i", file_path,
-        "-af", "silencedetect=noise=-30dB:d=0.5",
+        "-map", "0:v:0", "-vf", "freezedetect=n=-60dB:d=0.5",
+        "-map", "0:a:0", "-af", "silencedetect=noise=-30dB:d=0.5",
         "-f", import_format, "-"
     ]
 
     result = subprocess.run(cmd, stderr=subprocess.PIPE, text=True)
-    timestamps = re.findall(r"silence_start: (\d+\.\d+)|silence_end: (\d+\.\d+)", result.stderr)
-    silence_ranges = []
-    start = None
-
-    for start_time, end_time in timestamps:
-        if start_time:
-            start = float(start_time)
-        if end_time and start is not None:
-            silence_ranges.append((start, float(end_time)))
-            start = None
-    return silence_ranges
+    return _parse_ranges(result.stderr, 'freeze'), _parse_ranges(result.stderr, 'silence')
 
 
 def merge_intervals(video_gaps, audio_gaps, min_duration=3.0):
@@ -89,14 +79,17 @@ def merge_intervals(video_gaps, audio_gaps, min_duration=3.0):
     return merged
 
 
-def cut_gaps(file_path, output_file, import_format, task_wrapper: TaskWrapper):
-    task_wrapper.update_percent(30)
-    freezes = detect_freezes(file_path)
-    task_wrapper.update_percent(60)
-    silences = detect_silences(file_path)
+def cut_gaps(file_path, output_file, import_format, task_wrapper: TaskWrapper, has_audio: bool = True):
+    if has_audio:
+        task_wrapper.update_percent(30)
+        freezes, silences = detect_freezes_and_silences(file_path)
+        task_wrapper.update_percent(60)
 
-    # Merge only overlapping video & audio gaps of at least 3 seconds
-    gaps = merge_intervals(freezes, silences, min_duration=1.5)
+        # Merge only overlapping video & audio gaps of at least 3 seconds
+        gaps = merge_intervals(freezes, silences, min_duration=1.5)
+    else:
+        # A gap is frozen and silent, without audio there is nothing to cut
+        gaps = []
 
     if not gaps:
         task_wrapper.info(f"No significant gaps detected in {file_path}. Copying the original file.")
@@ -380,7 +373,10 @@ class DeFreezeJob(TaskWrapper):
 
                     self.info(f'Working on {file.filename}')
 
-                    cut_gaps(source_file, dest_file, desired_format, self)
+                    probe = probe_media_file(file, source_file, self)
+                    has_audio = probe is None or media_stream(probe, 'audio') is not None
+
+                    cut_gaps(source_file, dest_file, desired_format, self, has_audio)
 
                     src_path = Path(temp_folder) / 'temp.mp4'
 
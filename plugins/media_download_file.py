@@ -13,6 +13,7 @@ from curl_utils import custom_curl_get
 from feature_flags import MANAGE_MEDIA
 from file_utils import is_valid_url, temporary_folder
 from html_utils import get_headers, get_base_url
+from http_client import http_download
 from media_queries import find_folder_by_id, insert_file
 from media_utils import get_data_for_mediafile
 from plugin_methods import plugin_filename_arg, plugin_url_arg, plugin_select_arg, plugin_select_values
@@ -135,14 +136,9 @@ class DownloadFileJob(TaskWrapper):
         try:
             # Send a GET request to the file URL
             headers = get_headers(file_url, False, self, False, get_base_url(file_url))
-            with requests.get(file_url, stream=True, headers=headers) as response:
-                response.raise_for_status()  # Raise an error for HTTP requests with a bad status code
-                # Open the local file in write-binary mode
-                with open(local_path, 'wb') as file:
-                    # Write the response content to the file in chunks
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:  # Filter out keep-alive new chunks
-                            file.write(chunk)
+            # Streamed to the local file over a pooled connection
+            response = http_download(file_url, local_path, headers)
+            response.raise_for_status()  # Raise an error for HTTP requests with a bad status code
             # print(f"File downloaded successfully and saved to {local_path}")
             return True
         except requests.exceptions.RequestException as e:
@@ -5,13 +5,15 @@ import os
 import shutil
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 from flask_sqlalchemy.session import Session
 
-from constants import PROPERTY_SERVER_MEDIA_ENCODER_HOST, PROPERTY_SERVER_MEDIA_ENCODER_PORT
+from constants import APP_KEY_ENCODER_POOL
 from db import MediaFile
+from encoder_pool import EncoderPool
 from feature_flags import MANAGE_MEDIA
-from ffmpeg_utils import encode_video, FFMPEG_PRESET, FFMPEG_PRESET_VALUES, FFMPEG_CRF, FFMPEG_CRF_VALUES, \
+from ffmpeg_utils import FFMPEG_PRESET, FFMPEG_PRESET_VALUES, FFMPEG_CRF, FFMPEG_CRF_VALUES, \
     get_ffmpeg_f_argument_from_mimetype, FFMPEG_AUDIO_BIT, FFMPEG_STEREO, FFMPEG_AUDIO_BIT_RATE_VALUES, \
     FFMPEG_STEREO_VALUES
 from file_utils import temporary_folder
@@ -31,15 +33,11 @@ class EncodeForFilePlugin(ActionMediaFilePlugin):
     def __init__(self):
         super().__init__()
         self.prefix_lang_id = 'medenc'
-        self.media_encoder_host = None
-        self.media_encoder_port = 8080
+        self.encoder_pool: Optional[EncoderPool] = None
 
     def absorb_config(self, config):
         super().absorb_config(config)
-        self.media_encoder_port = config[PROPERTY_SERVER_MEDIA_ENCODER_PORT]
-        self.media_encoder_host = config[PROPERTY_SERVER_MEDIA_ENCODER_HOST]
-        if self.media_encoder_host is not None and len(self.media_encoder_host) == 0:
-            self.media_encoder_host = None
+        self.encoder_pool = config[APP_KEY_ENCODER_POOL]
 
     def get_sort(self):
         return {'id': 'media_file_encode', 'sequence': 1}
@@ -116,7 +114,7 @@ class EncodeForFilePlugin(ActionMediaFilePlugin):
         return EncodeJob("EncodeFile", 'Encoding: ' + args['file_id'], args['file_id'], args['ffmpeg_preset'],
                          args['ffmpeg_crf'],
                          self.primary_path, self.archive_path, self.temp_path, int(args['ffmpeg_abr']),
-                         args['ffmpeg_mix'] == 't', self.media_encoder_host, self.media_encoder_port)
+                         args['ffmpeg_mix'] == 't', self.encoder_pool)
 
 
 class EncodeForFilesPlugin(ActionMediaFilesPlugin):
@@ -127,15 +125,11 @@ class EncodeForFilesPlugin(ActionMediaFilesPlugin):
     def __init__(self):
         super().__init__()
         self.prefix_lang_id = 'medencs'
-        self.media_encoder_host = None
-        self.media_encoder_port = 8080
+        self.encoder_pool: Optional[EncoderPool] = None
 
     def absorb_config(self, config):
         super().absorb_config(config)
-        self.media_encoder_port = config[PROPERTY_SERVER_MEDIA_ENCODER_PORT]
-        self.media_encoder_host = config[PROPERTY_SERVER_MEDIA_ENCODER_HOST]
-        if self.media_encoder_host is not None and len(self.media_encoder_host) == 0:
-            self.media_encoder_host = None
+        self.encoder_pool = config[APP_KEY_ENCODER_POOL]
 
     def get_sort(self):
         return {'id': 'media_files_encode', 'sequence': 1}
@@ -218,7 +212,7 @@ class EncodeForFilesPlugin(ActionMediaFilesPlugin):
             result.append(EncodeJob("EncodeFile", 'Encoding: ' + file_id, file_id, args['ffmpeg_preset'],
                                     args['ffmpeg_crf'],
                                     self.primary_path, self.archive_path, self.temp_path, int(args['ffmpeg_abr']),
-                                    args['ffmpeg_mix'] == 't', self.media_encoder_host, self.media_encoder_port))
+                                    args['ffmpeg_mix'] == 't', self.encoder_pool))
 
         return result
 
@@ -226,8 +220,8 @@ class EncodeForFilesPlugin(ActionMediaFilesPlugin):
 class EncodeJob(TaskWrapper):
     def __init__(self, name, description, file_id, ffmpeg_preset: str, ffmpeg_crf: str, primary_folder: str,
                  archive_folder: str,
-                 temp_folder: str, audio_bit_rate: int = 128, stereo: bool = True, encoder_host: str | None = None,
-                 encoder_port: int | None = 8080):
+                 temp_folder: str, audio_bit_rate: int = 128, stereo: bool = True,
+                 encoder_pool: Optional[EncoderPool] = None):
         super().__init__(name, description)
         self.file_id = file_id
         self.folder_id = None
@@ -237,12 +231,11 @@ class EncodeJob(TaskWrapper):
         self.ffmpeg_preset = ffmpeg_preset
         self.ffmpeg_crf = int(ffmpeg_crf)
         self.weight = 70
-        if encoder_host is not None and len(encoder_host) > 0:
+        self.encoder_pool = encoder_pool or EncoderPool([])
+        if self.encoder_pool.has_remote():
             self.weight = 10
         self.audio_bit_rate = audio_bit_rate
         self.stereo = stereo
-        self.encoder_host = encoder_host
-        self.encoder_port = encoder_port
 
     def run(self, db_session: Session):
 
@@ -324,13 +317,8 @@ class EncodeJob(TaskWrapper):
 
                     self.info(f'Working on {file.filename}')
 
-                    modified_encoder_host = None
-
-                    if self.encoder_host is not None:
-                        modified_encoder_host = 'http://' + self.encoder_host + ":" + str(self.encoder_port)
-
-                    if encode_video(source_file, dest_file, desired_format, self.ffmpeg_preset, self.ffmpeg_crf,
-                                    self.stereo, self.audio_bit_rate, log=self, server_url=modified_encoder_host):
+                    if self.encoder_pool.encode(source_file, dest_file, desired_format, self.ffmpeg_preset,
+                                                self.ffmpeg_crf, self.stereo, self.audio_bit_rate, log=self):
 
                         src_path = Path(temp_folder) / 'temp.mp4'
 
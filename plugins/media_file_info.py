@@ -9,6 +9,7 @@ from flask_sqlalchemy.session import Session
 from db import MediaFile
 from feature_flags import MANAGE_MEDIA
 from ffmpeg_utils import get_media_info
+from media_probe import probe_media_file
 from media_utils import get_data_for_mediafile, \
     get_file_by_user
 from plugin_system import ActionMediaFilePlugin
@@ -125,7 +126,12 @@ class MediaInfoJob(TaskWrapper):
 
                 source_file = get_data_for_mediafile(file, self.primary_folder, self.archive_folder)
 
-                get_media_info(source_file, self)
+                metadata = probe_media_file(file, source_file, self)
+                if metadata is not None:
+                    get_media_info(source_file, self, metadata)
+                    db_session.commit()
+                else:
+                    self.set_failure()
 
         finally:
             if is_not_blank(temp_folder) and os.path.exists(temp_folder):
@@ -9,12 +9,13 @@ from typing import Optional
 
 from flask_sqlalchemy.session import Session
 
-from constants import PROPERTY_SERVER_MEDIA_ENCODER_PORT, PROPERTY_SERVER_MEDIA_ENCODER_HOST
+from constants import APP_KEY_ENCODER_POOL
 from db import MediaFile, MediaFolder
+from encoder_pool import EncoderPool
 from feature_flags import MANAGE_MEDIA
 from ffmpeg_utils import FFMPEG_PRESET, FFMPEG_PRESET_VALUES, FFMPEG_CRF, FFMPEG_CRF_VALUES, \
     get_ffmpeg_f_argument_from_mimetype, FFMPEG_AUDIO_BIT, FFMPEG_AUDIO_BIT_RATE_VALUES, \
-    FFMPEG_STEREO, FFMPEG_STEREO_VALUES, encode_video
+    FFMPEG_STEREO, FFMPEG_STEREO_VALUES
 from file_utils import temporary_folder
 from media_queries import insert_file, find_file_by_filename, find_files_in_folder
 from media_utils import get_data_for_mediafile, \
@@ -34,15 +35,11 @@ class SubtitleForFilePlugin(ActionMediaFilePlugin):
     def __init__(self):
         super().__init__()
         self.prefix_lang_id = 'medsub'
-        self.media_encoder_host = None
-        self.media_encoder_port = 8080
+        self.encoder_pool: Optional[EncoderPool] = None
 
     def absorb_config(self, config):
         super().absorb_config(config)
-        self.media_encoder_port = config[PROPERTY_SERVER_MEDIA_ENCODER_PORT]
-        self.media_encoder_host = config[PROPERTY_SERVER_MEDIA_ENCODER_HOST]
-        if self.media_encoder_host is not None and len(self.media_encoder_host) == 0:
-            self.media_encoder_host = None
+        self.encoder_pool = config[APP_KEY_ENCODER_POOL]
 
     def get_sort(self):
         return {'id': 'media_file_subtitle', 'sequence': 1}
@@ -127,8 +124,7 @@ class SubtitleForFilePlugin(ActionMediaFilePlugin):
         return SubtitleEncodeJob("SubtitleFile", 'Encoding: ' + args['file_id'], args['file_id'], None,
                                  args['ffmpeg_preset'], args['ffmpeg_crf'], self.primary_path, self.archive_path,
                                  self.temp_path, int(args['ffmpeg_abr']), args['ffmpeg_mix'] == 't',
-                                 int(args['offset']), encoder_host=self.media_encoder_host,
-                                 encoder_port=self.media_encoder_port)
+                                 int(args['offset']), encoder_pool=self.encoder_pool)
 
 
 class SubtitleForFilesPlugin(ActionMediaFilesPlugin):
@@ -139,15 +135,11 @@ class SubtitleForFilesPlugin(ActionMediaFilesPlugin):
     def __init__(self):
         super().__init__()
         self.prefix_lang_id = 'medsub'
-        self.media_encoder_host = None
-        self.media_encoder_port = 8080
+        self.encoder_pool: Optional[EncoderPool] = None
 
     def absorb_config(self, config):
         super().absorb_config(config)
-        self.media_encoder_port = config[PROPERTY_SERVER_MEDIA_ENCODER_PORT]
-        self.media_encoder_host = config[PROPERTY_SERVER_MEDIA_ENCODER_HOST]
-        if self.media_encoder_host is not None and len(self.media_encoder_host) == 0:
-            self.media_encoder_host = None
+        self.encoder_pool = config[APP_KEY_ENCODER_POOL]
 
     def get_sort(self):
         return {'id': 'media_file_subtitle', 'sequence': 1}
@@ -238,8 +230,7 @@ class SubtitleForFilesPlugin(ActionMediaFilesPlugin):
             result.append(SubtitleEncodeJob("SubtitleFile", 'Encoding: ' + file_id, file_id, None,
                                  args['ffmpeg_preset'], args['ffmpeg_crf'], self.primary_path, self.archive_path,
                                  self.temp_path, int(args['ffmpeg_abr']), args['ffmpeg_mix'] == 't',
-                                 int(args['offset']), encoder_host=self.media_encoder_host,
-                                 encoder_port=self.media_encoder_port))
+                                 int(args['offset']), encoder_pool=self.encoder_pool))
 
         return result
 
@@ -252,15 +243,11 @@ class SubtitleForFolderPlugin(ActionMediaFolderPlugin):
     def __init__(self):
         super().__init__()
         self.prefix_lang_id = 'medsubfol'
-        self.media_encoder_host = None
-        self.media_encoder_port = 8080
+        self.encoder_pool: Optional[EncoderPool] = None
 
     def absorb_config(self, config):
         super().absorb_config(config)
-        self.media_encoder_port = config[PROPERTY_SERVER_MEDIA_ENCODER_PORT]
-        self.media_encoder_host = config[PROPERTY_SERVER_MEDIA_ENCODER_HOST]
-        if self.media_encoder_host is not None and len(self.media_encoder_host) == 0:
-            self.media_encoder_host = None
+        self.encoder_pool = config[APP_KEY_ENCODER_POOL]
 
     def get_sort(self):
         return {'id': 'media_folder_subtitle', 'sequence': 1}
@@ -336,14 +323,13 @@ class SubtitleForFolderPlugin(ActionMediaFolderPlugin):
         return SubtitleEncodeJob("SubtitleFolder", 'Encoding: ' + args['folder_id'], None, args['folder_id'],
                                  args['ffmpeg_preset'], args['ffmpeg_crf'], self.primary_path, self.archive_path,
                                  self.temp_path, int(args['ffmpeg_abr']), args['ffmpeg_mix'] == 't',
-                                 encoder_host=self.media_encoder_host, encoder_port=self.media_encoder_port)
+                                 encoder_pool=self.encoder_pool)
 
 
 class SubtitleEncodeJob(TaskWrapper):
     def __init__(self, name, description, file_id: Optional[str], folder_id: Optional[str], ffmpeg_preset: str,
                  ffmpeg_crf: str, primary_folder: str, archive_folder: str, temp_folder: str, audio_bit_rate: int = 128,
-                 stereo: bool = True, offset: int = 0, encoder_host: str | None = None,
-                 encoder_port: int | None = 8080):
+                 stereo: bool = True, offset: int = 0, encoder_pool: Optional[EncoderPool] = None):
         super().__init__(name, description)
         self.file_id = file_id
         self.folder_id = folder_id
@@ -353,13 +339,12 @@ class SubtitleEncodeJob(TaskWrapper):
         self.ffmpeg_preset = ffmpeg_preset
         self.ffmpeg_crf = int(ffmpeg_crf)
         self.weight = 70
-        if encoder_host is not None and len(encoder_host) > 0:
+        self.encoder_pool = encoder_pool or EncoderPool([])
+        if self.encoder_pool.has_remote():
             self.weight = 10
         self.audio_bit_rate = audio_bit_rate
         self.stereo = stereo
         self.offset = offset
-        self.encoder_host = encoder_host
-        self.encoder_port = encoder_port
 
     def find_subtitle_for_file(self, folder: MediaFolder, file: MediaFile, temp_folder: str, db_session: Session) -> \
             Optional[str]:
@@ -473,14 +458,9 @@ class SubtitleEncodeJob(TaskWrapper):
 
                     self.info('Found Subtitle File, Working...')
 
-                    modified_encoder_host = None
-
-                    if self.encoder_host is not None:
-                        modified_encoder_host = 'http://' + self.encoder_host + ":" + str(self.encoder_port)
-
-                    if encode_video(source_file, dest_file, desired_format, self.ffmpeg_preset, self.ffmpeg_crf,
-                                    self.stereo, self.audio_bit_rate, log=self, server_url=modified_encoder_host,
-                                    srt_file=srt_file):
+                    if self.encoder_pool.encode(source_file, dest_file, desired_format, self.ffmpeg_preset,
+                                                self.ffmpeg_crf, self.stereo, self.audio_bit_rate, srt_file=srt_file,
+                                                log=self):
                         # if burn_subtitles_to_video(source_file, srt_file, dest_file, self.offset, desired_format,
                         #                           self.ffmpeg_preset,
                         #                           self.ffmpeg_crf, self.stereo, self.audio_bit_rate, log=self):
@@ -3,6 +3,7 @@ import io
 import logging
 import os
 import os.path
+from typing import Optional
 
 import eyed3
 from PIL import Image
@@ -13,6 +14,7 @@ from db import MediaFile
 from feature_flags import MANAGE_MEDIA
 from ffmpeg_utils import get_ffmpeg_f_argument_from_mimetype, generate_video_thumbnail
 from image_utils import resize_image
+from media_probe import probe_media_file, media_duration
 from media_queries import find_missing_file_previews_in_folder, find_missing_file_previews, \
     find_files_in_folder
 from media_utils import get_data_for_mediafile, get_preview_for_mediafile, get_folder_by_user, get_file_by_user
@@ -492,8 +494,11 @@ class MakeMediaPreviewJob(TaskWrapper):
 
             try:
                 self.trace('Before Gen')
+                duration = None
+                if file.mime_type.lower().startswith('video/'):
+                    duration = media_duration(probe_media_file(file, str(source_path), self))
                 if generate_thumbnail(file.mime_type, str(source_path), str(preview_path), self,
-                                      self.media_position):
+                                      self.media_position, duration):
                     file.preview = True
                     if count % 100 == 0:
                         self.set_worked()
@@ -511,7 +516,7 @@ class MakeMediaPreviewJob(TaskWrapper):
 
 
 def generate_thumbnail(mime_type: str, input_file, output_file, tw: TaskWrapper = None,
-                       percent: int = 10) -> bool:
+                       percent: int = 10, duration: Optional[float] = None) -> bool:
     """
     Generate a thumbnail for a media file.
 
@@ -521,6 +526,7 @@ def generate_thumbnail(mime_type: str, input_file, output_file, tw: TaskWrapper
         output_file (str): The path to the output file.
         tw (TaskWrapper, optional): The logger to use. Defaults to None.
         percent (int, optional): The position in the media file to capture the thumbnail. Defaults to 10.
+        duration (float, optional): Seconds, when already known from the file's stored probe.
     """
 
     if is_blank(mime_type):
@@ -543,14 +549,12 @@ def generate_thumbnail(mime_type: str, input_file, output_file, tw: TaskWrapper
         video_format = get_ffmpeg_f_argument_from_mimetype(mime_type)
 
         try:
-            generate_video_thumbnail(input_file, video_format, output_file, percent)
+            generate_video_thumbnail(input_file, video_format, output_file, percent, duration=duration)
 
             if tw.can_trace():
                 file_size = os.path.getsize(output_file)
                 tw.trace(f'Generated Image Size: {file_size}')
 
-            resize_image(output_file, output_file, 256, 'WEBP')
-
         except ValueError as ve:
             tw.error(str(ve))
             tw.set_failure()
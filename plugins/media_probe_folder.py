@@ -0,0 +1,241 @@
+import argparse
+import logging
+from typing import Optional
+
+from flask_sqlalchemy.session import Session
+
+from feature_flags import MANAGE_MEDIA
+from media_probe import probe_media_file
+from media_queries import find_files_to_probe
+from media_utils import get_data_for_mediafile, get_folder_by_user
+from number_utils import parse_boolean
+from plugin_methods import plugin_select_arg, plugin_select_values
+from plugin_system import ActionMediaFolderPlugin, ActionMediaPlugin
+from text_utils import is_blank
+from thread_utils import TaskWrapper
+
+
+class ProbeMediaForFolderPlugin(ActionMediaFolderPlugin):
+    """
+    Task to store the probe of the audio and video files in a folder.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.prefix_lang_id = 'probemed'
+
+    def get_sort(self):
+        """
+        Define the sort order for this task.
+        """
+        return {'id': 'media_probe_folder', 'sequence': 1}
+
+    def add_args(self, parser: argparse):
+        """
+        Add command-line arguments for this task.
+        """
+        pass
+
+    def use_args(self, args):
+        """
+        Use the provided command-line arguments.
+        """
+        pass
+
+    def get_action_name(self):
+        """
+        Get the name of the action.
+        """
+        return 'Probe Media'
+
+    def get_action_id(self):
+        """
+        Get the unique ID of the action.
+        """
+        return 'action.probe.media.folder'
+
+    def get_action_icon(self):
+        """
+        Get the icon for the action.
+        """
+        return 'info'
+
+    def get_action_args(self):
+        """
+        Get the arguments for the action.
+        """
+        result = super().get_action_args()
+
+        result.append(
+            plugin_select_arg('Recheck', 'recheck', 'false',
+                              plugin_select_values("No", 'false', 'Yes', 'true'),
+                              'Also check probed files, and probe the ones that changed?')
+        )
+
+        return result
+
+    def process_action_args(self, args):
+        """
+        Process the action arguments.
+        """
+        results = []
+
+        if 'recheck' not in args or is_blank(args['recheck']):
+            results.append('recheck is required')
+        elif not (args['recheck'] == 'false' or args['recheck'] == 'true'):
+            results.append('recheck incorrect value')
+
+        if len(results) > 0:
+            return results
+
+        return None
+
+    def get_feature_flags(self):
+        """
+        Get the feature flags required for this task.
+        """
+        return MANAGE_MEDIA
+
+    def create_task(self, db_session: Session, args):
+        """
+        Create the task to probe the files of a folder.
+        """
+        folder_id = args['folder_id']
+        return ProbeMediaJob("Probe", f'Probe media for Folder: {folder_id}', folder_id, self.primary_path,
+                             self.archive_path, parse_boolean(args['recheck']))
+
+
+class ProbeMediaForAllPlugin(ActionMediaPlugin):
+    """
+    Task to store the probe of every audio and video file, for files added before probes were stored.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.prefix_lang_id = 'probemed'
+
+    def get_sort(self):
+        """
+        Define the sort order for this task.
+        """
+        return {'id': 'media_probe_all', 'sequence': 1}
+
+    def add_args(self, parser: argparse):
+        """
+        Add command-line arguments for this task.
+        """
+        pass
+
+    def use_args(self, args):
+        """
+        Use the provided command-line arguments.
+        """
+        pass
+
+    def get_action_name(self):
+        """
+        Get the name of the action.
+        """
+        return 'Probe Media'
+
+    def get_action_id(self):
+        """
+        Get the unique ID of the action.
+        """
+        return 'action.probe.media.all'
+
+    def get_action_icon(self):
+        """
+        Get the icon for the action.
+        """
+        return 'info'
+
+    def get_action_args(self):
+        """
+        Get the arguments for the action.
+        """
+        result = super().get_action_args()
+
+        return result
+
+    def process_action_args(self, args):
+        """
+        Process the action arguments.
+        """
+        return None
+
+    def get_feature_flags(self):
+        """
+        Get the feature flags required for this task.
+        """
+        return MANAGE_MEDIA
+
+    def create_task(self, db_session: Session, args):
+        """
+        Create the task to probe the files of all folders.
+        """
+        return ProbeMediaJob("Probe", 'All Folders', None, self.primary_path, self.archive_path)
+
+
+class ProbeMediaJob(TaskWrapper):
+    """
+    Task to probe files once and keep the result on their row, see probe_media_file.
+    """
+
+    def __init__(self, name, description, folder_id: Optional[str], primary_path, archived_path,
+                 recheck: bool = False):
+        super().__init__(name, description)
+        self.folder_id = folder_id
+        self.primary_path = primary_path
+        self.archived_path = archived_path
+        self.recheck = recheck
+        self.weight = 25
+        if folder_id is not None:
+            self.ref_folder_id = folder_id
+
+    def run(self, db_session: Session):
+        """
+        Run the task to probe the files.
+        """
+
+        if is_blank(self.primary_path) or is_blank(self.archived_path):
+            self.critical('This feature is not ready. Please configure the app properties and restart the server.')
+
+        if self.folder_id is not None:
+            try:
+                get_folder_by_user(self.folder_id, self.user, db_session)
+            except ValueError as ve:
+                logging.exception(ve)
+                self.error(str(ve))
+                self.set_failure()
+                return
+
+        files = find_files_to_probe(self.folder_id, self.recheck, db_session)
+
+        total = len(files)
+        count = 0
+        failed = 0
+
+        for file in files:
+
+            if self.is_cancelled:
+                break
+
+            count = count + 1
+            self.update_progress((count / total) * 100.0)
+
+            source_path = get_data_for_mediafile(file, self.primary_path, self.archived_path)
+            if probe_media_file(file, str(source_path), self) is None:
+                failed = failed + 1
+                self.warn(f'Could not probe {file.filename}')
+
+            if count % 100 == 0:
+                self.set_worked()
+                db_session.commit()
+
+        if failed > 0:
+            self.info(f'{failed} of {total} files could not be probed')
+
+        if total > 0:
+            self.set_worked()
+            db_session.commit()
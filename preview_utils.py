@@ -3,8 +3,8 @@ import os
 
 import eyed3
 from PIL import Image
-from moviepy.editor import VideoFileClip
 
+from ffmpeg_utils import generate_video_thumbnail
 from hash_utils import generate_unique_string
 from thread_utils import TaskWrapper
 
@@ -20,14 +20,8 @@ def generate_thumbnail(input_file, output_file, logger: TaskWrapper = None):
     _, ext = os.path.splitext(input_file)
 
     if ext.lower() in ['.mp4', '.m4v', '.mpg', '.avi', '.mkv', '.webm']:  # Video file
-        clip = VideoFileClip(input_file)
-        duration = clip.duration
-        thumbnail_time = duration * 0.1  # 10% playback position
-        frame = clip.get_frame(thumbnail_time)
-        resized_frame = Image.fromarray(frame)
-        resized_frame.thumbnail((256, 256))
-        resized_frame.save(output_file)
-        clip.close()
+        # 10% playback position, the same ffmpeg pipeline as the media previews
+        generate_video_thumbnail(input_file, None, output_file, 10)
 
     elif ext.lower() == '.mp3':  # MP3 file
         audiofile = eyed3.load(input_file)
@@ -36,7 +30,7 @@ def generate_thumbnail(input_file, output_file, logger: TaskWrapper = None):
             try:
                 cover_art = Image.open(io.BytesIO(image.image_data))
                 cover_art.thumbnail((256, 256))
-                cover_art.save(output_file)
+                cover_art.save(output_file, "WEBP")
                 return
             except Exception as inst:
                 logger.error(str(inst))
@@ -62,6 +56,6 @@ class CreatePreviewTask(TaskWrapper):
                 if os.path.isfile(file_path):
                     hash_name = generate_unique_string(file_path)
 
-                    hash_file = os.path.join(self.preview_folder, hash_name + '.png')
+                    hash_file = os.path.join(self.preview_folder, hash_name + '.webp')
                     if not os.path.exists(hash_file):
                         generate_thumbnail(file_path, hash_file, self)
@@ -7,13 +7,13 @@ from concurrent.futures import ThreadPoolExecutor
 from math import floor
 
 from flask import Blueprint, request, current_app
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
 
 from auth_utils import shall_authenticate_user, feature_required, feature_required_silent, get_username, get_uid, \
     get_user_features
 from common_utils import generate_failure_response, generate_success_response
-from constants import MAX_WORKERS
-from db import db
+from constants import MAX_WORKERS, WORKER_IDLE_TIMEOUT
+from db import db, create_task_session
 from feature_flags import MANAGE_PROCESSES, VIEW_PROCESSES, MANAGE_APP
 from messages import msg_invalid_parameter, msg_tasks_started, msg_action_cancelled_duplicate_task, \
     msg_missing_parameter, msg_action_failed, msg_operation_complete, msg_action_failed_missing, msg_removed_x_items, \
@@ -52,6 +52,16 @@ def close_queue_session(my_task_manager: TaskManager, task_wrapper: TaskWrapper,
     worker_status.position = 20
 
 
+def queue_post_tasks(my_task_manager: TaskManager, task_wrapper: TaskWrapper):
+    for post_task in task_wrapper.post_tasks:
+        if my_task_manager.has_task(post_task.name, post_task.description):
+            continue
+        post_task.update_user(task_wrapper.user)
+        post_task.update_logging_level(task_wrapper.logging_level)
+        my_task_manager.add_task(post_task)
+    task_wrapper.post_tasks.clear()
+
+
 # Worker function to consume tasks
 def queue_worker(my_task_manager: TaskManager, app, index: int):
     worker_status = my_task_manager.add_worker(index)
@@ -59,10 +69,9 @@ def queue_worker(my_task_manager: TaskManager, app, index: int):
     while True:
         worker_status.wait_stamp = 0
         worker_status.position = 1
-        task_wrapper = my_task_manager.get_task_queue()
+        task_wrapper = my_task_manager.wait_task_queue(WORKER_IDLE_TIMEOUT)
         if task_wrapper is None:
             worker_status.position = 2
-            time.sleep(3)
             continue  # Sentinel to exit
         worker_status.job = task_wrapper.task_id
         session = None
@@ -72,8 +81,7 @@ def queue_worker(my_task_manager: TaskManager, app, index: int):
             with app.app_context():
                 task_wrapper.trace('In Context')
                 worker_status.position = 4
-                SessionMak = sessionmaker(bind=db.engine)
-                session = SessionMak()
+                session = create_task_session()
 
                 # Create a new session for the thread
                 task_wrapper.trace('Before Local Session')
@@ -86,6 +94,7 @@ def queue_worker(my_task_manager: TaskManager, app, index: int):
                 task_wrapper.run(session)
                 task_wrapper.set_finished(True)
                 task_wrapper.always('Finished Task')
+                queue_post_tasks(my_task_manager, task_wrapper)
         except Exception as inst:
             worker_status.position = 5
             logging.error(inst)
@@ -434,10 +443,9 @@ def cancel_task(user_details, task_id: int):
 
     username = get_username(user_details)
 
-    task = task_manager.get_task_by_id(task_id)
+    task = task_manager.cancel_task(task_id)
     if task is not None:
         task.always(f'Task Cancelled by {username}')
-        task.cancel()
 
         return generate_success_response("Task canceled", messages=[msg_operation_complete()])
 
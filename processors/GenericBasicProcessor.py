@@ -17,7 +17,8 @@ Generic class used to make a Book Processor
 class GenericBasicProcessor(CustomDownloadInterface):
     def __init__(self, processor_id: str, processor_name: str, chapter_query: str, image_query: str,
                  chapter_parser: str,
-                 task_wrapper: TaskWrapper = None, image_method:str = 'default'):
+                 task_wrapper: TaskWrapper = None, image_method:str = 'default', download_concurrency: int = 2,
+                 download_rate: float = 0.5):
         """
         :type processor_id: str
         :type processor_name: str
@@ -26,12 +27,16 @@ class GenericBasicProcessor(CustomDownloadInterface):
         :type chapter_parser: str
         :type task_wrapper: TaskWrapper
         :type image_method: str
+        :type download_concurrency: int
+        :type download_rate: float
         """
         super().__init__(processor_id, processor_name, task_wrapper)
         self.chapter_query = chapter_query
         self.image_query = image_query
         self.chapter_parser = chapter_parser
         self.image_method = image_method
+        self.concurrency = download_concurrency
+        self.rate = download_rate
 
     def list_chapters(self, definition: Book, headers=None):
         # Download the webpage
@@ -130,5 +135,11 @@ class GenericBasicProcessor(CustomDownloadInterface):
     def headers_required(self, definition: Book):
         return True
 
+    def download_concurrency(self) -> int:
+        return self.concurrency
+
+    def download_rate(self) -> float:
+        return self.rate
+
     def page_description(self):
         return 'The root page for the media'
@@ -131,6 +131,28 @@ class CustomDownloadInterface(ABC):
     def check_and_retry(self):
         return False
 
+    def download_concurrency(self) -> int:
+        """
+        How many chapter images are fetched at once from one host, this is also how many requests can go out back to
+        back before the rate limit applies.
+        :return: Requests in flight, 1 fetches one image after another
+        """
+        return 2
+
+    def download_rate(self) -> float:
+        """
+        How fast chapter images are requested from one host, images with their own delay ask for a slower pace.
+        :return: Requests per second on average
+        """
+        return 0.5
+
+    def download_retries(self) -> int:
+        """
+        How often a failed image download is tried again, with a growing pause in between.
+        :return: Retries per image
+        """
+        return 2
+
     # noinspection PyMethodMayBeStatic
     def rss_description(self):
         """
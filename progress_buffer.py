@@ -0,0 +1,200 @@
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from db import create_task_session
+from media_queries import upsert_progress_entries
+from volume_queries import upsert_recent_entries
+
+
+class PendingProgress:
+    """
+    A reading position waiting to be written, with the same fields as the VolumeProgress row it becomes.
+    """
+
+    def __init__(self, book_id: str, chapter_id: str, page_number: Optional[int], page_percent: Optional[float],
+                 timestamp: datetime):
+        self.book_id = book_id
+        self.chapter_id = chapter_id
+        self.page_number = page_number
+        self.page_percent = page_percent
+        self.timestamp = timestamp
+
+
+class ProgressBuffer:
+    """
+    Write-behind buffer for reading and playback progress.
+
+    Readers report every page turn and players send a heartbeat every few seconds, but only the latest position per
+    user and item matters. Positions are kept in memory and written together in one transaction every flush_interval
+    seconds, when the buffer fills up, and at shutdown. Reads of a single item check the buffer first, listings
+    ordered by progress time flush the user's pending positions before they query.
+    """
+
+    def __init__(self, flush_interval: int, max_entries: int):
+        """
+        :param flush_interval: Seconds between background flushes
+        :param max_entries: Pending positions that force a flush from the recording request
+        """
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # One flush at a time, so an older batch never lands after a newer one
+        self.flush_lock = threading.Lock()
+        self.media = {}  # (user_id, file_id) -> entry
+        self.volume = {}  # (user_id, book_id, chapter_id) -> entry
+        self.last_read = {}  # (user_id, book_id) -> newest volume entry of the book
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.app = None
+
+    def record_media(self, user_id: int, file_id: str, progress: float, timestamp: datetime):
+        """
+        Remember a playback position.
+        :param user_id: The user
+        :param file_id: The media file
+        :param progress: Seconds into the file
+        :param timestamp: When it was reported
+        """
+        with self.lock:
+            self.media[(user_id, file_id)] = {'user_id': user_id, 'file_id': file_id, 'progress': progress,
+                                              'timestamp': timestamp}
+            full = len(self.media) + len(self.volume) >= self.max_entries
+        if full:
+            self.flush()
+
+    def record_volume(self, user_id: int, book_id: str, chapter_id: str, page_number: Optional[int],
+                      page_percent: Optional[float], timestamp: datetime):
+        """
+        Remember a reading position.
+        :param user_id: The user
+        :param book_id: The book
+        :param chapter_id: The chapter
+        :param page_number: Page for paged books
+        :param page_percent: Scroll position for scrolling books
+        :param timestamp: When it was reported
+        """
+        with self.lock:
+            self._put_volume({'user_id': user_id, 'book_id': book_id, 'chapter_id': chapter_id,
+                              'page_number': page_number, 'page_percent': page_percent, 'timestamp': timestamp})
+            full = len(self.media) + len(self.volume) >= self.max_entries
+        if full:
+            self.flush()
+
+    def _put_volume(self, entry: dict):
+        self.volume[(entry['user_id'], entry['book_id'], entry['chapter_id'])] = entry
+        book_key = (entry['user_id'], entry['book_id'])
+        newest = self.last_read.get(book_key)
+        if newest is None or newest['timestamp'] <= entry['timestamp']:
+            self.last_read[book_key] = entry
+
+    def media_progress(self, user_id: int, file_id: str) -> Optional[float]:
+        """
+        :return: The pending playback position of a file, None if nothing is pending
+        """
+        with self.lock:
+            entry = self.media.get((user_id, file_id))
+        return entry['progress'] if entry is not None else None
+
+    def volume_progress(self, user_id: int, book_id: str, chapter_id: str) -> Optional[PendingProgress]:
+        """
+        :return: The pending reading position in a chapter, None if nothing is pending
+        """
+        with self.lock:
+            entry = self.volume.get((user_id, book_id, chapter_id))
+        return self._to_pending(entry)
+
+    def book_last_read(self, user_id: int, book_id: str) -> Optional[PendingProgress]:
+        """
+        :return: The newest pending reading position in a book, None if nothing is pending
+        """
+        with self.lock:
+            entry = self.last_read.get((user_id, book_id))
+        return self._to_pending(entry)
+
+    @staticmethod
+    def _to_pending(entry: Optional[dict]) -> Optional[PendingProgress]:
+        if entry is None:
+            return None
+        return PendingProgress(entry['book_id'], entry['chapter_id'], entry['page_number'], entry['page_percent'],
+                               entry['timestamp'])
+
+    def _drain(self, user_id: Optional[int]) -> tuple[list[dict], list[dict]]:
+        if user_id is None:
+            media = list(self.media.values())
+            volume = list(self.volume.values())
+            self.media.clear()
+            self.volume.clear()
+            self.last_read.clear()
+            return media, volume
+
+        media = [entry for key, entry in self.media.items() if key[0] == user_id]
+        volume = [entry for key, entry in self.volume.items() if key[0] == user_id]
+        for entry in media:
+            del self.media[(user_id, entry['file_id'])]
+        for entry in volume:
+            del self.volume[(user_id, entry['book_id'], entry['chapter_id'])]
+            self.last_read.pop((user_id, entry['book_id']), None)
+        return media, volume
+
+    def flush(self, user_id: Optional[int] = None) -> int:
+        """
+        Write pending positions in one transaction. Must be called inside an app context.
+        A failed write puts the positions back, unless a newer one arrived meanwhile.
+        :param user_id: Only flush this user's positions, None for everyone
+        :return: Number of positions written
+        """
+        with self.flush_lock:
+            with self.lock:
+                media, volume = self._drain(user_id)
+
+            if len(media) == 0 and len(volume) == 0:
+                return 0
+
+            session = create_task_session()
+            try:
+                upsert_progress_entries(media, session)
+                upsert_recent_entries(volume, session)
+                session.commit()
+            except Exception as ex:
+                session.rollback()
+                logging.error(f'Unable to write {len(media) + len(volume)} progress entries: {ex}')
+                with self.lock:
+                    for entry in media:
+                        self.media.setdefault((entry['user_id'], entry['file_id']), entry)
+                    for entry in volume:
+                        if (entry['user_id'], entry['book_id'], entry['chapter_id']) not in self.volume:
+                            self._put_volume(entry)
+                return 0
+            finally:
+                session.close()
+
+            return len(media) + len(volume)
+
+    def start(self, app):
+        """
+        Start flushing in the background, and flush whatever is left when the process exits.
+        :param app: The Flask app
+        """
+        self.app = app
+        self.thread = threading.Thread(target=self._run, name='progress-buffer', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            with self.app.app_context():
+                self.flush()
+
+    def stop(self):
+        """
+        Stop the background flush, and write what is still pending.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(self.flush_interval + 5)
+        if self.app is not None:
+            with self.app.app_context():
+                self.flush()
@@ -0,0 +1,270 @@
+"""
+Client for a remote encoder, another machine on the LAN that runs ffmpeg for this server.
+
+  HEAD  /encode/upload/<sha256>            Upload-Offset: bytes of the input the encoder already holds
+  PATCH /encode/upload/<sha256>            Upload-Offset and Upload-Length headers, the input from that offset
+  POST  /encode/start                      options (JSON, upload=<sha256>), srt_file when subtitles are burned in
+  GET   /encode/status/<ticket>?wait=<s>   answers once the status isn't queued or processing, or after s seconds
+  GET   /encode/result/<ticket>            the output, with Range requests and an X-Content-SHA256 header
+
+The upload is named by its checksum, the encoder verifies it once complete. An encoder without the upload endpoints
+gets the input in the start request, as before, streamed from disk instead of read into memory first.
+"""
+import io
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+from constants import REMOTE_ENCODE_WAIT_SECONDS, REMOTE_ENCODE_MAX_POLL_SECONDS, REMOTE_ENCODE_ATTEMPTS, \
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+from hash_utils import file_sha256
+from http_client import http_session, http_get, http_post, http_download
+from thread_utils import TaskWrapper
+
+
+class _MultipartBody:
+    """
+    A multipart/form-data body that reads its files from disk as it is sent. requests builds multipart bodies in
+    memory, which for a video is the whole file.
+    """
+
+    def __init__(self, fields: dict[str, str], files: dict[str, str]):
+        """
+        :param fields: Form fields
+        :param files: Paths of the files sent, by field
+        """
+        self.boundary = uuid.uuid4().hex
+        self.parts = []
+        self.length = 0
+
+        for name, value in fields.items():
+            self._add_bytes(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                            f'{value}\r\n'.encode())
+        for name, path in files.items():
+            self._add_bytes(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                            f'filename="{Path(path).name}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+                            .encode())
+            self.parts.append(open(path, 'rb'))
+            self.length += os.path.getsize(path)
+            self._add_bytes(b'\r\n')
+        self._add_bytes(f'--{self.boundary}--\r\n'.encode())
+
+    def _add_bytes(self, data: bytes):
+        self.parts.append(io.BytesIO(data))
+        self.length += len(data)
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while len(self.parts) > 0 and size != 0:
+            data = self.parts[0].read(size)
+            if len(data) == 0:
+                self.parts.pop(0).close()
+                continue
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(chunks)
+
+    def close(self):
+        for part in self.parts:
+            part.close()
+        self.parts = []
+
+
+def _upload_offset(upload_url: str) -> Optional[int]:
+    response = http_session().head(upload_url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    if response.status_code != 200 or 'Upload-Offset' not in response.headers:
+        return None
+    return int(response.headers['Upload-Offset'])
+
+
+def _upload(upload_url: str, input_path: Path, log: TaskWrapper) -> bool:
+    """
+    Send the input, continuing from what the encoder already has when an attempt breaks off.
+    :param upload_url: The upload, named by the input's checksum
+    :param input_path: The input
+    :param log: Task logger
+    :return: True once the encoder holds the whole, verified input
+    """
+    size = input_path.stat().st_size
+    for attempt in range(REMOTE_ENCODE_ATTEMPTS):
+        try:
+            offset = _upload_offset(upload_url)
+            if offset is None:
+                return False
+            if offset >= size:
+                return True
+            if offset > 0:
+                log.info(f'Resuming upload at {offset} of {size} bytes')
+
+            with open(input_path, 'rb') as input_file:
+                input_file.seek(offset)
+                response = http_session().patch(upload_url, data=input_file, headers={
+                    'Upload-Offset': str(offset), 'Upload-Length': str(size),
+                    'Content-Type': 'application/offset+octet-stream'},
+                                                timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+            if response.status_code == 422:
+                # The encoder threw the upload away, it didn't match its checksum
+                log.warn('Upload failed verification, sending it again')
+            elif not response.ok and response.status_code != 409:
+                log.warn(f'Upload returned {response.status_code}')
+                return False
+        except requests.RequestException as e:
+            log.warn(f'Upload attempt {attempt + 1} broke off: {e}')
+
+    return _upload_offset(upload_url) == size
+
+
+def _sleep_unless_cancelled(seconds: float, log: TaskWrapper):
+    deadline = time.monotonic() + seconds
+    while not log.is_cancelled and time.monotonic() < deadline:
+        time.sleep(min(1.0, deadline - time.monotonic()))
+
+
+def _wait_for_ticket(server_url: str, ticket_id: str, log: TaskWrapper) -> Optional[str]:
+    """
+    Wait for a ticket to finish. The encoder holds each status request until the status changes, so the result is
+    picked up as soon as it is ready. Encoders that answer right away are asked again after a growing pause.
+    :param server_url: The encoder
+    :param ticket_id: The ticket
+    :param log: Task logger
+    :return: done or failed, a status the encoder shouldn't send counts as failed, None when the encoder can't be
+    asked or the task was cancelled
+    """
+    pause = 1
+    last_status = None
+    while True:
+        if log.is_cancelled:
+            return None
+
+        started = time.monotonic()
+        response = http_get(f'{server_url}/encode/status/{ticket_id}', params={'wait': REMOTE_ENCODE_WAIT_SECONDS},
+                            timeout=(HTTP_CONNECT_TIMEOUT, REMOTE_ENCODE_WAIT_SECONDS + HTTP_READ_TIMEOUT))
+        if response.status_code != 200:
+            return None
+
+        status = response.json().get('status')
+        if status != last_status:
+            log.info(f'Ticket {ticket_id} status: {status}')
+            last_status = status
+        if status in ('done', 'failed'):
+            return status
+        if status not in ('queued', 'processing'):
+            log.warn(f'Ticket {ticket_id} has an unknown status')
+            return 'failed'
+
+        if time.monotonic() - started < 1:
+            _sleep_unless_cancelled(pause, log)
+            pause = min(pause * 2, REMOTE_ENCODE_MAX_POLL_SECONDS)
+
+
+def _download_result(result_url: str, output_path: Path, log: TaskWrapper) -> bool:
+    """
+    Save the output, continuing a transfer that breaks off, and check it against the encoder's checksum.
+    :param result_url: The output
+    :param output_path: Where it is saved
+    :param log: Task logger
+    :return: True once the output is in place
+    """
+    for attempt in range(REMOTE_ENCODE_ATTEMPTS):
+        try:
+            response = http_download(result_url, output_path, resume=True)
+        except requests.RequestException as e:
+            log.warn(f'Download attempt {attempt + 1} broke off: {e}')
+            continue
+
+        if not response.ok:
+            log.error(f'Download returned {response.status_code}')
+            return False
+
+        expected = response.headers.get('X-Content-SHA256')
+        if expected is not None and file_sha256(output_path) != expected.lower():
+            log.warn('Downloaded file does not match its checksum, downloading it again')
+            os.remove(output_path)
+            continue
+
+        return True
+
+    return False
+
+
+def remote_encode(server_url: str, input_path: Path, output_path: Path, options: dict, srt_file: Optional[str],
+                  log: TaskWrapper) -> bool:
+    """
+    Encode a file on a remote encoder.
+    :param server_url: The encoder
+    :param input_path: The file to encode
+    :param output_path: Where the encoded file is saved
+    :param options: Encoder options, see encode_video
+    :param srt_file: Subtitles to burn in, or None
+    :param log: Task logger
+    :return: True when the encoded file is in place, False to encode locally instead, or when the task was cancelled
+    """
+    log.info(f"Submitting job to remote server: {server_url}")
+
+    files = {}
+    input_sha256 = file_sha256(input_path)
+    upload_url = f'{server_url}/encode/upload/{input_sha256}'
+    if _upload_offset(upload_url) is not None:
+        if not _upload(upload_url, input_path, log):
+            log.warn("Upload failed; falling back to local.")
+            return False
+        options = options | {'upload': input_sha256}
+    else:
+        # An encoder without resumable uploads takes the input in the start request
+        files['input_file'] = str(input_path)
+    if srt_file and Path(srt_file).exists():
+        files['srt_file'] = srt_file
+
+    body = _MultipartBody({'options': json.dumps(options)}, files)
+    try:
+        response = http_post(f'{server_url}/encode/start', data=body, headers={'Content-Type': body.content_type})
+    finally:
+        body.close()
+
+    if response.status_code != 200:
+        log.warn(f"Server returned {response.status_code}, falling back to local.")
+        return False
+
+    ticket_id = response.json().get("ticket_id")
+    if not ticket_id:
+        log.warn("No ticket_id in response; falling back to local encoding.")
+        return False
+
+    status = _wait_for_ticket(server_url, ticket_id, log)
+    if log.is_cancelled:
+        log.info(f'Stopped waiting for ticket {ticket_id}, the task was cancelled')
+        return False
+    if status is None:
+        log.warn("Status check failed; falling back to local.")
+        return False
+    if status == 'failed':
+        log.error("Remote encoding failed; falling back to local.")
+        return False
+
+    # A partial file from an earlier ticket is not this one's output
+    partial_path = Path(f'{output_path}.part')
+    if partial_path.exists():
+        partial_path.unlink()
+
+    if not _download_result(f'{server_url}/encode/result/{ticket_id}', output_path, log):
+        log.error("Failed to download result file; falling back to local.")
+        if partial_path.exists():
+            partial_path.unlink()
+        return False
+
+    log.info("Downloaded encoded file successfully.")
+    return True
@@ -0,0 +1,231 @@
+import logging
+import re
+from typing import Optional
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text, table, column, select, literal, literal_column, insert, delete, func, inspect, \
+    or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db import db, MediaFolder, MediaFile, Book
+from thread_utils import TaskWrapper
+
+# SQLite FTS5 index over folder names, file names and books, used to answer the filter_text searches.
+# Rows live in a plain table with a unique (kind, item_id) key, the FTS5 table indexes it as external content and is
+# kept in step by triggers.
+SEARCH_TABLE = 'search_index'
+SEARCH_DOCUMENTS_TABLE = 'search_documents'
+
+SEARCH_KIND_FOLDER = 'F'
+SEARCH_KIND_FILE = 'M'
+SEARCH_KIND_BOOK = 'B'
+
+search_table = table(SEARCH_TABLE, column('rowid'), column('rank'))
+search_documents_table = table(SEARCH_DOCUMENTS_TABLE, column('id'), column('kind'), column('item_id'), column('name'),
+                               column('keywords'))
+
+# The unique key leads with item_id on purpose, an index usable for kind = ? alone makes SQLite walk every document of
+# that kind and probe the FTS table per row, instead of starting from the MATCH
+_SEARCH_INDEX_DDL = [
+    f"CREATE TABLE IF NOT EXISTS {SEARCH_DOCUMENTS_TABLE} (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, "
+    f"item_id TEXT NOT NULL, name TEXT NOT NULL, keywords TEXT NOT NULL, UNIQUE (item_id, kind))",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(name, keywords, content='{SEARCH_DOCUMENTS_TABLE}', "
+    f"content_rowid='id', tokenize=\"unicode61 remove_diacritics 2\", prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_DOCUMENTS_TABLE}_ai AFTER INSERT ON {SEARCH_DOCUMENTS_TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, name, keywords) VALUES (new.id, new.name, new.keywords); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_DOCUMENTS_TABLE}_ad AFTER DELETE ON {SEARCH_DOCUMENTS_TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, keywords) VALUES ('delete', old.id, old.name, "
+    f"old.keywords); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_DOCUMENTS_TABLE}_au AFTER UPDATE ON {SEARCH_DOCUMENTS_TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, keywords) VALUES ('delete', old.id, old.name, "
+    f"old.keywords); INSERT INTO {SEARCH_TABLE}(rowid, name, keywords) VALUES (new.id, new.name, new.keywords); END",
+]
+
+_search_index_state = {'enabled': False}
+
+
+def is_search_index_enabled() -> bool:
+    return _search_index_state['enabled']
+
+
+def init_search_index(app) -> bool:
+    """
+    Create the FTS5 index if it is missing, and fill it when it was just created.
+    If this SQLite build has no FTS5 support, searches keep using LIKE.
+    :param app: The Flask app
+    :return: True if the index is usable
+    """
+    with app.app_context():
+        with db.engine.connect() as connection:
+            exists = connection.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name=:name"),
+                                        {'name': SEARCH_TABLE}).first() is not None
+
+        if not _create_search_index([]):
+            return False
+
+        if not exists:
+            rebuild_search_index(db.session)
+
+    return True
+
+
+def reset_search_index() -> bool:
+    """
+    Drop the search index and create it again, empty, in the current app context.
+    Used when the indexed tables were just recreated, the old index would still answer for what they held.
+    :return: True if the index is usable
+    """
+    return _create_search_index([f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+                                 f"DROP TABLE IF EXISTS {SEARCH_DOCUMENTS_TABLE}"])
+
+
+def _create_search_index(statements: list[str]) -> bool:
+    try:
+        with db.engine.begin() as connection:
+            for statement in statements + _SEARCH_INDEX_DDL:
+                connection.execute(text(statement))
+    except Exception as ex:
+        logging.warning(f'Full text search is not available, falling back to LIKE searches: {ex}')
+        _search_index_state['enabled'] = False
+        return False
+
+    _search_index_state['enabled'] = True
+    return True
+
+
+def rebuild_search_index(db_session: Session, logger: Optional[TaskWrapper] = None) -> int:
+    """
+    Throw away the search index and rebuild it from the folder, file and book tables.
+    :param db_session: The database session
+    :param logger: Optional task to log against
+    :return: Number of indexed rows
+    """
+    if not is_search_index_enabled():
+        if logger is not None:
+            logger.error('Full text search is not available')
+        return 0
+
+    columns = ['kind', 'item_id', 'name', 'keywords']
+
+    db_session.execute(delete(search_documents_table))
+    db_session.execute(insert(search_documents_table).from_select(
+        columns, select(literal(SEARCH_KIND_FOLDER), MediaFolder.id, MediaFolder.name,
+                        func.coalesce(MediaFolder.tags, ''))))
+    db_session.execute(insert(search_documents_table).from_select(
+        columns, select(literal(SEARCH_KIND_FILE), MediaFile.id, MediaFile.filename, literal(''))))
+    db_session.execute(insert(search_documents_table).from_select(
+        columns, select(literal(SEARCH_KIND_BOOK), Book.id, Book.name, Book.id + ' ' + func.coalesce(Book.tags, ''))))
+    db_session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"))
+    db_session.commit()
+
+    count = db_session.execute(select(func.count()).select_from(search_documents_table)).scalar()
+
+    if logger is not None:
+        logger.info(f'Indexed {count} rows')
+
+    return count
+
+
+def build_match_expression(filter_text: str) -> Optional[str]:
+    """
+    Convert user input into an FTS5 query where every word must match as a prefix.
+    :param filter_text: The raw search text
+    :return: The MATCH expression, or None if the text has no searchable words
+    """
+    words = re.findall(r'\w+', filter_text or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_matches(kind: str, filter_text: str):
+    """
+    Build a subquery of (item_id, rank) rows for every indexed item of a kind that matches the search text.
+    A lower rank is a better match.
+    :param kind: SEARCH_KIND_FOLDER, SEARCH_KIND_FILE or SEARCH_KIND_BOOK
+    :param filter_text: The raw search text
+    :return: The subquery, or None when the index can't answer this search and LIKE should be used
+    """
+    if not is_search_index_enabled():
+        return None
+
+    match_expression = build_match_expression(filter_text)
+    if match_expression is None:
+        return None
+
+    return (select(search_documents_table.c.item_id, search_table.c.rank)
+            .select_from(search_table.join(search_documents_table,
+                                           search_documents_table.c.id == search_table.c.rowid))
+            .where(literal_column(SEARCH_TABLE).op('MATCH')(match_expression))
+            .where(search_documents_table.c.kind == kind)
+            .subquery())
+
+
+# Keep the index in sync with ORM changes
+
+def _index_values(target) -> tuple[str, str, str]:
+    if isinstance(target, MediaFolder):
+        return SEARCH_KIND_FOLDER, target.name, target.tags or ''
+    if isinstance(target, MediaFile):
+        return SEARCH_KIND_FILE, target.filename, ''
+    return SEARCH_KIND_BOOK, target.name, f'{target.id} {target.tags or ""}'
+
+
+def _index_document(connection, target):
+    kind, name, keywords = _index_values(target)
+    statement = sqlite_insert(search_documents_table).values(kind=kind, item_id=target.id, name=name,
+                                                             keywords=keywords)
+    statement = statement.on_conflict_do_update(index_elements=['item_id', 'kind'],
+                                                set_={'name': statement.excluded.name,
+                                                      'keywords': statement.excluded.keywords})
+    connection.execute(statement)
+
+
+def _after_insert(mapper, connection, target):
+    if is_search_index_enabled():
+        _index_document(connection, target)
+
+
+def _after_update(mapper, connection, target):
+    if not is_search_index_enabled():
+        return
+    # Most updates (previews, dates, ratings) don't touch anything searchable
+    state = inspect(target)
+    if any(state.attrs[attr].history.has_changes() for attr in ('name', 'filename', 'tags') if attr in state.attrs):
+        _index_document(connection, target)
+
+
+def _after_delete(mapper, connection, target):
+    if not is_search_index_enabled():
+        return
+    kind, _, _ = _index_values(target)
+    connection.execute(delete(search_documents_table).where(search_documents_table.c.kind == kind,
+                                                            search_documents_table.c.item_id == target.id))
+
+
+for _model in (MediaFolder, MediaFile, Book):
+    event.listen(_model, 'after_insert', _after_insert)
+    event.listen(_model, 'after_update', _after_update)
+    event.listen(_model, 'after_delete', _after_delete)
+
+
+def apply_text_search(query, kind: str, id_column, filter_text: str, like_columns: list, rank: bool = False):
+    """
+    Restrict a query to the items matching the search text, through the FTS5 index when possible.
+    :param query: The query to restrict
+    :param kind: SEARCH_KIND_FOLDER, SEARCH_KIND_FILE or SEARCH_KIND_BOOK
+    :param id_column: The queried model's id column
+    :param filter_text: The raw search text
+    :param like_columns: Columns searched with LIKE when the index can't be used
+    :param rank: Order the results by relevance, ahead of any later order_by
+    :return: The restricted query
+    """
+    matches = search_matches(kind, filter_text)
+
+    if matches is None:
+        return query.filter(or_(*[like_column.like(f'%{filter_text}%') for like_column in like_columns]))
+
+    if rank:
+        return query.join(matches, id_column == matches.c.item_id).order_by(matches.c.rank)
+
+    return query.filter(id_column.in_(select(matches.c.item_id)))
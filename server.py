@@ -12,28 +12,45 @@ import os
 from app_properties import AppPropertyDefinition
 from app_queries import get_secret_key, get_server_port, get_server_host, get_auth_timeout, check_and_insert_property, \
     get_media_primary_folder, get_media_alt_folder, get_media_temp_folder, clean_unknown_properties, get_volume_folder, \
-    get_plugin_value, get_volume_format, get_media_encoder_host, get_media_encoder_port
+    get_plugin_value, get_volume_format, get_media_encoder_host, get_media_encoder_port, get_volume_image_cache_size, \
+    get_database_journal_mode, get_database_synchronous, get_database_mmap_size, get_database_cache_size, \
+    get_database_busy_timeout, get_volume_scan_workers, get_media_hls_cache_size, get_media_hls_window, \
+    get_media_encoder_pool, get_media_encoder_local_slots
 from app_routes import admin_blueprint
 from app_utils import value_is_folder, value_is_integer, value_is_between_int_x_y, value_is_ipaddress, get_random_hash, \
-    value_is_in_list, value_is_hostname
+    value_is_in_list, value_is_hostname, value_is_encoder_list
 from auth_routes import auth_blueprint
 from constants import PROPERTY_SERVER_PORT_KEY, PROPERTY_SERVER_SECRET_KEY, PROPERTY_SERVER_HOST_KEY, \
     PROPERTY_SERVER_AUTH_TIMEOUT_KEY, PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER, \
     PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER, PROPERTY_SERVER_MEDIA_TEMP_FOLDER, PROPERTY_SERVER_MEDIA_READY, \
     CONFIG_USE_HTTPS, PROPERTY_DEFINITIONS, PROPERTY_SERVER_VOLUME_READY, \
     PROPERTY_SERVER_VOLUME_FOLDER, APP_KEY_SLC, APP_KEY_AUTHENTICATE, APP_KEY_PLUGINS, APP_KEY_PROCESSORS, \
-    PROPERTY_SERVER_VOLUME_FORMAT, PROPERTY_SERVER_MEDIA_ENCODER_HOST, PROPERTY_SERVER_MEDIA_ENCODER_PORT
+    PROPERTY_SERVER_VOLUME_FORMAT, PROPERTY_SERVER_MEDIA_ENCODER_HOST, PROPERTY_SERVER_MEDIA_ENCODER_PORT, \
+    PROPERTY_SERVER_VOLUME_IMAGE_CACHE_SIZE, APP_KEY_IMAGE_CACHE, PRODUCTION_SERVER_THREADS, \
+    PRODUCTION_SERVER_KEEP_ALIVE, PROPERTY_SERVER_DATABASE_JOURNAL_MODE, PROPERTY_SERVER_DATABASE_SYNCHRONOUS, \
+    PROPERTY_SERVER_DATABASE_MMAP_SIZE, PROPERTY_SERVER_DATABASE_CACHE_SIZE, PROPERTY_SERVER_DATABASE_BUSY_TIMEOUT, \
+    APP_KEY_COUNT_CACHE, PAGING_COUNT_CACHE_SECONDS, APP_KEY_PROGRESS_BUFFER, PROGRESS_FLUSH_SECONDS, \
+    PROGRESS_BUFFER_MAX_ENTRIES, PROPERTY_SERVER_VOLUME_SCAN_WORKERS, PROPERTY_SERVER_MEDIA_HLS_CACHE_SIZE, \
+    PROPERTY_SERVER_MEDIA_HLS_WINDOW, APP_KEY_HLS_CACHE, PROPERTY_SERVER_MEDIA_ENCODER_POOL, \
+    PROPERTY_SERVER_MEDIA_ENCODER_LOCAL_SLOTS, APP_KEY_ENCODER_POOL
 from db import init_db, db
+from encoder_pool import create_encoder_pool
 from file_utils import create_timestamped_folder
 from health_routes import health_blueprint
-from inout import perform_backup, validate_database_schema, perform_restore
+from hls_cache import HlsSegmentCache
+from image_cache import DerivedImageCache
+from inout import perform_backup, validate_database_schema, perform_restore, upgrade_database_schema
+from search_index import init_search_index
 from media_routes import media_blueprint
 from network_utils import is_private_ip, get_local_ip
+from paging_utils import CountCache
+from progress_buffer import ProgressBuffer
 from plugin_routes import plugin_blueprint
 from plugin_utils import get_plugins
 from process_routes import process_blueprint, init_processors
 from serve_routes import serve_blueprint
 from short_lived_cache import ShortLivedCache
+from sqlite_utils import apply_sqlite_settings, SQLITE_JOURNAL_MODES, SQLITE_SYNCHRONOUS_MODES
 from text_utils import is_not_blank
 from thread_utils import NoOpTaskWrapper
 from volume_routes import volume_blueprint
@@ -74,6 +91,31 @@ app.config['MAX_CONTENT_LENGTH'] = 1610612736
 # Initialize the database
 init_db(app)
 
+
+def serve_production(flask_app: Flask, host: str, port: int, threads: int, keep_alive: int):
+    """
+    Serve the app with waitress instead of the Werkzeug development server.
+    Requests are handled by a fixed pool of threads inside this process, the task manager, its workers and the
+    short-lived stream keys all live in memory, so the server must never be split over several processes.
+    :param flask_app: The app to serve
+    :param host: Host to bind to
+    :param port: Port to bind to
+    :param threads: Number of request threads
+    :param keep_alive: Seconds an idle connection is kept open
+    """
+    try:
+        from waitress import serve
+    except ImportError:
+        print('Error: waitress is not installed (pip install waitress), falling back to the development server')
+        flask_app.run(host=host, port=port, debug=False)
+        return
+
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+
+    print(f'Serving on {host}:{port} with {threads} threads')
+    serve(flask_app, host=host, port=port, threads=threads, channel_timeout=keep_alive,
+          connection_limit=max(100, threads * 4), ident='LimitedMediaServer')
+
 if __name__ == '__main__':
     # Load plugins and processors
     plugins = get_plugins('plugins')
@@ -110,6 +152,26 @@ if __name__ == '__main__':
         help="Specify a port override (integer). Default is 0."
     )
 
+    parser.add_argument(
+        '--production',
+        action='store_true',
+        help="Serve with the multi-threaded waitress server, instead of the development server. Default is False."
+    )
+
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=PRODUCTION_SERVER_THREADS,
+        help=f"Number of request threads when using --production. Default is {PRODUCTION_SERVER_THREADS}."
+    )
+
+    parser.add_argument(
+        '--keep-alive',
+        type=int,
+        default=PRODUCTION_SERVER_KEEP_ALIVE,
+        help=f"Seconds an idle connection is kept open when using --production. Default is {PRODUCTION_SERVER_KEEP_ALIVE}."
+    )
+
     parser.add_argument(
         "--backup-folder",
         type=str,
@@ -178,6 +240,18 @@ if __name__ == '__main__':
         AppPropertyDefinition(PROPERTY_SERVER_MEDIA_ENCODER_PORT, '',
                               'Port number to the external media encoder.  This is useful, if you are running on a raspberry PI and want to initialize another computer to encode media faster.  Restart server if changed.',
                               [value_is_integer, value_is_between_int_x_y(5, 43200)]),
+        AppPropertyDefinition(PROPERTY_SERVER_MEDIA_ENCODER_POOL, '',
+                              'More external media encoders, comma separated host:port, with /slots for the videos one encodes at once.  For example: 10.0.0.5:8080/2, encoder.lan:8080.  Videos go to the least busy encoder.  Restart server if changed.',
+                              [value_is_encoder_list]),
+        AppPropertyDefinition(PROPERTY_SERVER_MEDIA_ENCODER_LOCAL_SLOTS, '1',
+                              'Videos this server encodes at once, next to the external media encoders.  Use 0 to leave every video to the external media encoders.  Restart server if changed.',
+                              [value_is_integer, value_is_between_int_x_y(0, 64)]),
+        AppPropertyDefinition(PROPERTY_SERVER_MEDIA_HLS_CACHE_SIZE, '2048',
+                              'Max size in MB of the HLS segment cache, kept in the primary media folder.  Use 0 to disable HLS streaming.  Restart server if changed.',
+                              [value_is_integer, value_is_between_int_x_y(0, 1048576)]),
+        AppPropertyDefinition(PROPERTY_SERVER_MEDIA_HLS_WINDOW, '3',
+                              'HLS segments prepared ahead of the one being played.  Use 0 to only make segments when asked for.  Restart server if changed.',
+                              [value_is_integer, value_is_between_int_x_y(0, 20)]),
         # Volume
         AppPropertyDefinition(PROPERTY_SERVER_VOLUME_FOLDER, '',
                               'Path to a folder where volume files will be kept.  This should be on a high performance drive.  Restart server if changed.',
@@ -185,6 +259,28 @@ if __name__ == '__main__':
         AppPropertyDefinition(PROPERTY_SERVER_VOLUME_FORMAT, 'PNG',
                               'The file format to store new images as.  Possible values include: PNG or WEBP.  Restart server if changed.',
                               [value_is_in_list(['PNG', 'WEBP'])]),
+        AppPropertyDefinition(PROPERTY_SERVER_VOLUME_IMAGE_CACHE_SIZE, '512',
+                              'Max size in MB of the resized image cache, kept in the primary media folder.  Use 0 to disable the cache.  Restart server if changed.',
+                              [value_is_integer, value_is_between_int_x_y(0, 1048576)]),
+        AppPropertyDefinition(PROPERTY_SERVER_VOLUME_SCAN_WORKERS, '2',
+                              'Threads scanning book folders when every book definition is updated.  Use 1 to scan in the task itself.  Restart server if changed.',
+                              [value_is_integer, value_is_between_int_x_y(1, 64)]),
+        # Database
+        AppPropertyDefinition(PROPERTY_SERVER_DATABASE_JOURNAL_MODE, 'WAL',
+                              'SQLite journal mode.  WAL lets pages keep loading while a task writes.  Possible values include: WAL, DELETE or TRUNCATE.  Restart server if changed.',
+                              [value_is_in_list(SQLITE_JOURNAL_MODES)]),
+        AppPropertyDefinition(PROPERTY_SERVER_DATABASE_SYNCHRONOUS, 'NORMAL',
+                              'SQLite synchronous mode.  NORMAL is safe with WAL, FULL also survives a power loss.  Possible values include: OFF, NORMAL or FULL.  Restart server if changed.',
+                              [value_is_in_list(SQLITE_SYNCHRONOUS_MODES)]),
+        AppPropertyDefinition(PROPERTY_SERVER_DATABASE_MMAP_SIZE, '256',
+                              'Max MB of the database file memory mapped per connection.  Use 0 to disable.  Restart server if changed.',
+                              [value_is_integer, value_is_between_int_x_y(0, 65536)]),
+        AppPropertyDefinition(PROPERTY_SERVER_DATABASE_CACHE_SIZE, '64',
+                              'MB of page cache per database connection.  Restart server if changed.',
+                              [value_is_integer, value_is_between_int_x_y(1, 4096)]),
+        AppPropertyDefinition(PROPERTY_SERVER_DATABASE_BUSY_TIMEOUT, '10000',
+                              'Milliseconds to wait on a database locked by another writer, before failing.  Restart server if changed.',
+                              [value_is_integer, value_is_between_int_x_y(0, 600000)]),
     ]
 
     # Ensure any plugin that needs a property, gets it
@@ -222,9 +318,14 @@ if __name__ == '__main__':
             print('The Database is not synced, please run the previous software version, export the database, and import it back in.')
             exit(0)
 
+        upgrade_database_schema()
+
         for property_definition in property_definitions:
             check_and_insert_property(property_definition, db.session)
 
+    # The index is built from the upgraded tables
+    init_search_index(app)
+
     if args.list_plugins:
         print('---------------------------')
         print('-Discovered Plugins')
@@ -257,6 +358,11 @@ if __name__ == '__main__':
         print()
 
     app.config[APP_KEY_SLC] = ShortLivedCache()
+    app.config[APP_KEY_COUNT_CACHE] = CountCache(PAGING_COUNT_CACHE_SECONDS)
+
+    progress_buffer = ProgressBuffer(PROGRESS_FLUSH_SECONDS, PROGRESS_BUFFER_MAX_ENTRIES)
+    app.config[APP_KEY_PROGRESS_BUFFER] = progress_buffer
+    progress_buffer.start(app)
 
     # Configure processors
     app.config[APP_KEY_PROCESSORS] = processors
@@ -284,9 +390,49 @@ if __name__ == '__main__':
         app.config[PROPERTY_SERVER_MEDIA_TEMP_FOLDER] = get_media_temp_folder()
         app.config[PROPERTY_SERVER_MEDIA_ENCODER_HOST] = get_media_encoder_host()
         app.config[PROPERTY_SERVER_MEDIA_ENCODER_PORT] = get_media_encoder_port()
+        app.config[PROPERTY_SERVER_MEDIA_ENCODER_POOL] = get_media_encoder_pool()
+        app.config[PROPERTY_SERVER_MEDIA_ENCODER_LOCAL_SLOTS] = get_media_encoder_local_slots()
+        app.config[PROPERTY_SERVER_MEDIA_HLS_CACHE_SIZE] = get_media_hls_cache_size()
+        app.config[PROPERTY_SERVER_MEDIA_HLS_WINDOW] = get_media_hls_window()
 
         app.config[PROPERTY_SERVER_VOLUME_FOLDER] = get_volume_folder()
         app.config[PROPERTY_SERVER_VOLUME_FORMAT] = get_volume_format()
+        app.config[PROPERTY_SERVER_VOLUME_IMAGE_CACHE_SIZE] = get_volume_image_cache_size()
+        app.config[PROPERTY_SERVER_VOLUME_SCAN_WORKERS] = get_volume_scan_workers()
+
+        app.config[PROPERTY_SERVER_DATABASE_JOURNAL_MODE] = get_database_journal_mode()
+        app.config[PROPERTY_SERVER_DATABASE_SYNCHRONOUS] = get_database_synchronous()
+        app.config[PROPERTY_SERVER_DATABASE_MMAP_SIZE] = get_database_mmap_size()
+        app.config[PROPERTY_SERVER_DATABASE_CACHE_SIZE] = get_database_cache_size()
+        app.config[PROPERTY_SERVER_DATABASE_BUSY_TIMEOUT] = get_database_busy_timeout()
+
+        # Requests and task workers share this engine, so every pooled connection picks these up
+        apply_sqlite_settings(db.engine, app.config[PROPERTY_SERVER_DATABASE_JOURNAL_MODE],
+                              app.config[PROPERTY_SERVER_DATABASE_SYNCHRONOUS],
+                              app.config[PROPERTY_SERVER_DATABASE_MMAP_SIZE],
+                              app.config[PROPERTY_SERVER_DATABASE_CACHE_SIZE],
+                              app.config[PROPERTY_SERVER_DATABASE_BUSY_TIMEOUT])
+
+        # Resized images are cached on the primary drive
+        image_cache_folder = ''
+        if is_not_blank(app.config[PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER]):
+            image_cache_folder = os.path.join(app.config[PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER], '.cache', 'images')
+        app.config[APP_KEY_IMAGE_CACHE] = DerivedImageCache(image_cache_folder,
+                                                            app.config[PROPERTY_SERVER_VOLUME_IMAGE_CACHE_SIZE] * 1024 * 1024)
+
+        # So are HLS segments of media files
+        hls_cache_folder = ''
+        if is_not_blank(app.config[PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER]):
+            hls_cache_folder = os.path.join(app.config[PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER], '.cache', 'hls')
+        app.config[APP_KEY_HLS_CACHE] = HlsSegmentCache(hls_cache_folder,
+                                                        app.config[PROPERTY_SERVER_MEDIA_HLS_CACHE_SIZE] * 1024 * 1024,
+                                                        app.config[PROPERTY_SERVER_MEDIA_HLS_WINDOW])
+
+        # Every encode task shares the pool, so each encoder is kept to its slots
+        app.config[APP_KEY_ENCODER_POOL] = create_encoder_pool(app.config[PROPERTY_SERVER_MEDIA_ENCODER_HOST],
+                                                               app.config[PROPERTY_SERVER_MEDIA_ENCODER_PORT],
+                                                               app.config[PROPERTY_SERVER_MEDIA_ENCODER_POOL],
+                                                               app.config[PROPERTY_SERVER_MEDIA_ENCODER_LOCAL_SLOTS])
 
         app.config[CONFIG_USE_HTTPS] = use_ssl
 
@@ -331,7 +477,11 @@ if __name__ == '__main__':
             print('Error: IP Address is not a local address, do not expose this server to the Internet!!!!')
 
     if not args.skip_run:
-        app.run(host=app.config[PROPERTY_SERVER_HOST_KEY], port=app.config[PROPERTY_SERVER_PORT_KEY], debug=False)
+        if args.production:
+            serve_production(app, app.config[PROPERTY_SERVER_HOST_KEY], app.config[PROPERTY_SERVER_PORT_KEY],
+                             max(1, args.threads), max(1, args.keep_alive))
+        else:
+            app.run(host=app.config[PROPERTY_SERVER_HOST_KEY], port=app.config[PROPERTY_SERVER_PORT_KEY], debug=False)
     else:
         # Windows is having trouble, used to actually exit
         os._exit(1)
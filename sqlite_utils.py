@@ -0,0 +1,75 @@
+import logging
+
+from sqlalchemy import event, Engine
+
+# Connection settings applied to every new SQLite connection, startup replaces them with the AppProperties values.
+# WAL lets requests keep reading while a task writes, the busy timeout makes a second writer wait instead of failing
+# with "database is locked".
+_sqlite_settings = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size_mb': 256,
+    'cache_size_mb': 64,
+    'busy_timeout_ms': 10000,
+}
+
+SQLITE_JOURNAL_MODES = ['WAL', 'DELETE', 'TRUNCATE']
+SQLITE_SYNCHRONOUS_MODES = ['OFF', 'NORMAL', 'FULL']
+
+
+def get_sqlite_settings() -> dict:
+    return dict(_sqlite_settings)
+
+
+def _on_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        # First, so a journal mode switch waits for other connections instead of failing
+        cursor.execute(f"PRAGMA busy_timeout = {int(_sqlite_settings['busy_timeout_ms'])}")
+        cursor.execute(f"PRAGMA journal_mode = {_sqlite_settings['journal_mode']}")
+        journal_mode = cursor.fetchone()[0]
+        if journal_mode.upper() != _sqlite_settings['journal_mode'] and journal_mode != 'memory':
+            logging.warning(f"SQLite journal mode is {journal_mode}, {_sqlite_settings['journal_mode']} was requested")
+        cursor.execute(f"PRAGMA synchronous = {_sqlite_settings['synchronous']}")
+        cursor.execute(f"PRAGMA mmap_size = {int(_sqlite_settings['mmap_size_mb']) * 1024 * 1024}")
+        # A negative cache size is in KiB instead of pages
+        cursor.execute(f"PRAGMA cache_size = {-int(_sqlite_settings['cache_size_mb']) * 1024}")
+    finally:
+        cursor.close()
+
+
+def configure_sqlite_engine(engine: Engine):
+    """
+    Tune every connection the engine opens, call this before the engine is first used.
+    :param engine: The app's engine, shared by requests and task workers
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    if not event.contains(engine, 'connect', _on_connect):
+        event.listen(engine, 'connect', _on_connect)
+
+
+def apply_sqlite_settings(engine: Engine, journal_mode: str, synchronous: str, mmap_size_mb: int, cache_size_mb: int,
+                          busy_timeout_ms: int):
+    """
+    Replace the connection settings, and drop the pooled connections so the next checkout uses them.
+    :param engine: The app's engine
+    :param journal_mode: WAL, DELETE or TRUNCATE
+    :param synchronous: OFF, NORMAL or FULL
+    :param mmap_size_mb: MB of the database file memory mapped per connection, 0 disables it
+    :param cache_size_mb: MB of page cache per connection
+    :param busy_timeout_ms: Milliseconds to wait on a locked database before failing
+    """
+    if journal_mode.upper() not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f'Unknown journal mode: {journal_mode}')
+    if synchronous.upper() not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f'Unknown synchronous mode: {synchronous}')
+
+    _sqlite_settings['journal_mode'] = journal_mode.upper()
+    _sqlite_settings['synchronous'] = synchronous.upper()
+    _sqlite_settings['mmap_size_mb'] = max(0, int(mmap_size_mb))
+    _sqlite_settings['cache_size_mb'] = max(1, int(cache_size_mb))
+    _sqlite_settings['busy_timeout_ms'] = max(0, int(busy_timeout_ms))
+
+    configure_sqlite_engine(engine)
+    engine.dispose()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+from flask import Flask
+
+from db import db, Book, Chapter
+from plugins.book_update_stats import generate_book_definitions
+from thread_utils import TaskWrapper
+
+BOOKS = 3
+CHAPTERS = 4
+PAGES = 3
+
+
+class ScanTask(TaskWrapper):
+
+    def run(self, db_session):
+        pass
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.temp_dir.name, 'test.db')
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.book_folder = os.path.join(self.temp_dir.name, 'volumes')
+        for book in range(BOOKS):
+            db.session.add(Book(id=f'book-{book}', name=f'Book {book}', info_url='', active=True, processor='test'))
+            for chapter in range(CHAPTERS):
+                chapter_path = os.path.join(self.book_folder, f'book-{book}', f'{chapter + 1}')
+                os.makedirs(chapter_path)
+                for page in range(PAGES):
+                    Image.new('RGB', (20, 30 + page)).save(os.path.join(chapter_path, f'{page:03}.png'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        self.temp_dir.cleanup()
+
+    def _scan(self, scan_workers: int) -> ScanTask:
+        task = ScanTask('Scan', 'Scan')
+        task.logging_level = task.TRACE
+        generate_book_definitions(task, None, self.book_folder, session=db.session, scan_workers=scan_workers)
+        self.assertEqual([], [entry for entry in task.log_entries if entry['s'] == task.CRITICAL])
+        return task
+
+    def _chapters(self) -> list:
+        db.session.expire_all()
+        return [(row.book_id, row.chapter_id, row.sequence, row.image_names, row.manifest) for row in
+                db.session.query(Chapter).order_by(Chapter.book_id, Chapter.sequence)]
+
+    def test_pool_matches_serial_and_skips_unchanged_chapters(self):
+        self._scan(1)
+        serial = self._chapters()
+        self.assertEqual(BOOKS * CHAPTERS, len(serial))
+        self.assertEqual((20, 32), (serial[0][4][2]['w'], serial[0][4][2]['h']))
+
+        # A new page in one chapter, only that chapter is listed again
+        Image.new('RGB', (20, 40)).save(os.path.join(self.book_folder, 'book-1', '2', '003.png'))
+        task = self._scan(2)
+        listed = [entry['text'] for entry in task.log_entries if 'Listed' in entry['text']]
+        self.assertEqual(BOOKS, len(listed))
+        self.assertEqual(1, sum('Listed 1 of' in text for text in listed))
+        self.assertEqual(BOOKS - 1, sum('Listed 0 of' in text for text in listed))
+
+        changed = self._chapters()
+        self.assertEqual([row for row in serial if row[:2] != ('book-1', '2')],
+                         [row for row in changed if row[:2] != ('book-1', '2')])
+        self.assertEqual('000.png,001.png,002.png,003.png',
+                         [row[3] for row in changed if row[:2] == ('book-1', '2')][0])
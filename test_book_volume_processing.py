@@ -0,0 +1,215 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from db import Book
+from plugins.book_volume_processing import _process_download
+from processors.processor_core import CustomDownloadInterface
+from thread_utils import TaskWrapper
+from throttle_utils import HostLimiter
+
+PAGES = 12
+LATENCY = 0.1
+CONCURRENCY = 4
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    An image host that answers slowly and keeps track of how many requests it serves at once.
+    """
+    lock = threading.Lock()
+    in_flight = 0
+    most_in_flight = 0
+    failures = {}
+
+    def do_GET(self):
+        with StandInHandler.lock:
+            StandInHandler.in_flight += 1
+            StandInHandler.most_in_flight = max(StandInHandler.most_in_flight, StandInHandler.in_flight)
+            fail = StandInHandler.failures.get(self.path, 0)
+            StandInHandler.failures[self.path] = max(fail - 1, 0)
+        time.sleep(LATENCY)
+        with StandInHandler.lock:
+            StandInHandler.in_flight -= 1
+
+        if fail > 0:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        page = int(self.path.strip('/').split('.')[0])
+        buffer = io.BytesIO()
+        # Noise, so the page is not dropped as too small by clean_images_folder
+        size = (64, 64 + page)
+        Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(buffer, 'PNG')
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(buffer.getvalue())))
+        self.end_headers()
+        self.wfile.write(buffer.getvalue())
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Mimics curl_chrome116 for a batch read with --config -, the page number in the URL picks the image size. Every run is
+# logged, and page 5 fails the first time it is asked for
+CURL_STUB = """#!{python}
+import os, sys
+from PIL import Image
+
+log_path = os.environ['CURL_STUB_LOG']
+with open(log_path, 'a') as log:
+    log.write(' '.join(sys.argv[1:]) + '\\n')
+
+downloads = []
+for line in sys.stdin.read().splitlines():
+    key, _, value = line.partition(' = ')
+    value = value[1:-1].replace('\\\\"', '"').replace('\\\\\\\\', '\\\\')
+    if key == 'url':
+        downloads.append([value, None])
+    elif key == 'output':
+        downloads[-1][1] = value
+
+for index, (url, output) in enumerate(downloads):
+    page = int(url.rsplit('/', 1)[1].split('.')[0])
+    if page == 5 and not os.path.exists(log_path + '.failed'):
+        open(log_path + '.failed', 'w').close()
+        print(index, 22, 503)
+        continue
+    size = (64, 64 + page)
+    Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(output, 'PNG')
+    print(index, 0, 200)
+"""
+
+
+class StandInProcessor(CustomDownloadInterface):
+
+    def __init__(self, base_url: str, secure: bool = False):
+        super().__init__('stand-in', 'Stand In')
+        self.base_url = base_url
+        self.secure = secure
+
+    def list_chapters(self, definition: Book, headers=None):
+        return [{'chapter': '0001', 'href': self.base_url}]
+
+    def list_images(self, definition: Book, chapter, headers=None):
+        return [{'src': f'{self.base_url}/{page}.png', 'file': f'{page + 1:04}.png'} for page in range(PAGES)]
+
+    def clean_folder(self, definition: Book, chapter, path, storage_format: str):
+        pass
+
+    def get_tags(self, definition: Book, headers):
+        return None
+
+    def headers_required(self, definition: Book):
+        return self.secure
+
+    def download_concurrency(self) -> int:
+        return CONCURRENCY
+
+    def download_rate(self) -> float:
+        return 100.0
+
+
+class DownloadTask(TaskWrapper):
+
+    def run(self, db_session):
+        pass
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        StandInHandler.most_in_flight = 0
+        StandInHandler.failures = {'/5.png': 1}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def test_chapter_pages_are_fetched_concurrently_in_order(self):
+        processor = StandInProcessor(f'http://127.0.0.1:{self.server.server_address[1]}')
+        book = Book(id='book-0', name='Book 0', info_url='', active=True, processor='stand-in')
+        task = DownloadTask('Download', 'Download')
+
+        self.assertTrue(_process_download(processor, None, book, task, self.temp_dir.name, 'PNG'))
+
+        # Same names and pages as a download one after another, the failed page was retried
+        chapter_path = os.path.join(self.temp_dir.name, 'book-0', '0001')
+        self.assertEqual([f'{page + 1:04}.png' for page in range(PAGES)], sorted(os.listdir(chapter_path)))
+        for page in range(PAGES):
+            with Image.open(os.path.join(chapter_path, f'{page + 1:04}.png')) as image:
+                self.assertEqual((64, 64 + page), image.size)
+
+        self.assertEqual(CONCURRENCY, StandInHandler.most_in_flight)
+        self.assertEqual([], [entry for entry in task.log_entries if task.ERROR <= entry['s'] <= task.CRITICAL])
+
+    def test_secure_chapter_is_fetched_in_curl_batches(self):
+        stub_folder = os.path.join(self.temp_dir.name, 'bin')
+        os.makedirs(stub_folder)
+        stub_path = os.path.join(stub_folder, 'curl_chrome116')
+        with open(stub_path, 'w') as stub:
+            stub.write(CURL_STUB.format(python=sys.executable))
+        os.chmod(stub_path, 0o755)
+        log_path = os.path.join(self.temp_dir.name, 'curl.log')
+        with open(os.path.join(self.temp_dir.name, 'headers.json'), 'w') as file:
+            file.write('{"user-agent": "stand-in"}')
+
+        processor = StandInProcessor('https://example.com/chapter', True)
+        book = Book(id='book-0', name='Book 0', info_url='https://example.com/', active=True, processor='stand-in')
+        task = DownloadTask('Download', 'Download')
+
+        environment = {'PATH': stub_folder + os.pathsep + os.environ['PATH'], 'CURL_STUB_LOG': log_path}
+        current_folder = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        try:
+            with patch.dict(os.environ, environment), patch('plugins.book_volume_processing.time.sleep'):
+                self.assertTrue(_process_download(processor, None, book, task, self.temp_dir.name, 'PNG'))
+        finally:
+            os.chdir(current_folder)
+
+        chapter_path = os.path.join(self.temp_dir.name, 'book-0', '0001')
+        self.assertEqual([f'{page + 1:04}.png' for page in range(PAGES)], sorted(os.listdir(chapter_path)))
+
+        # The first page alone, batches of the host's burst for the rest and the retry of the failed page, after its
+        # batch, instead of a run per page
+        with open(log_path) as log:
+            runs = log.read().splitlines()
+        self.assertEqual(5, len(runs))
+        self.assertIn('--parallel-max 4', runs[1])
+        self.assertIn('--parallel-max 4', runs[2])
+        self.assertNotIn('--parallel', runs[3])
+        self.assertIn('--parallel-max 3', runs[4])
+
+    def test_batches_share_the_host_slots(self):
+        limiter = HostLimiter(1000.0, CONCURRENCY, CONCURRENCY)
+        held = []
+
+        def other_batch():
+            with limiter.batch(CONCURRENCY, 1) as other_parallel:
+                held.append(other_parallel)
+
+        with limiter.request():
+            with limiter.batch(CONCURRENCY, CONCURRENCY) as parallel:
+                held.append(parallel)
+                # Every slot is taken, another task's batch waits for one to free up
+                other = threading.Thread(target=other_batch)
+                other.start()
+                other.join(0.2)
+                self.assertTrue(other.is_alive())
+
+        other.join(1.0)
+        self.assertEqual([CONCURRENCY - 1, CONCURRENCY], held)
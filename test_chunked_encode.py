@@ -0,0 +1,67 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+import ffmpeg_utils
+from chunked_encode import plan_chunks
+from ffmpeg_utils import encode_video_locally
+
+
+def _stream_info(path: str) -> dict[str, dict]:
+    result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries',
+                             'stream=codec_type,start_time,duration,nb_frames', '-of', 'csv=p=0', path],
+                            stdout=subprocess.PIPE, text=True, check=True)
+    streams = {}
+    for line in result.stdout.splitlines():
+        codec_type, start_time, duration, frames = line.split(',')[:4]
+        streams[codec_type] = {'start': float(start_time), 'duration': float(duration), 'frames': int(frames)}
+    return streams
+
+
+class Test(TestCase):
+
+    def test_plan_chunks(self):
+        keyframes = [0.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0, 14.0, 16.0, 18.0]
+        self.assertEqual([(0.0, 6.0), (6.0, 14.0), (14.0, 20.0)], plan_chunks(keyframes, 20.0, 3))
+        self.assertEqual([(0.0, 20.0)], plan_chunks(keyframes, 20.0, 1))
+        self.assertEqual([], plan_chunks([], 20.0, 4))
+
+    def test_plan_chunks_with_few_keyframes(self):
+        # A keyframe nearest to two cut points starts one chunk
+        self.assertEqual([(0.5, 9.0), (9.0, 12.0)], plan_chunks([0.5, 9.0], 12.0, 4))
+
+    @skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), 'ffmpeg is not installed')
+    def test_chunked_encode_matches_single_pass(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            encoded_path = os.path.join(temp_dir, 'encoded.mp4')
+            subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=25:duration=30',
+                            '-f', 'lavfi', '-i', 'sine=frequency=440:duration=30', '-c:v', 'libx264', '-preset',
+                            'ultrafast', '-g', '50', '-c:a', 'aac', encoded_path, '-y'], check=True)
+            # The audio starts half a second late, it has to stay where it is against the video
+            source_path = os.path.join(temp_dir, 'source.mkv')
+            subprocess.run(['ffmpeg', '-v', 'error', '-i', encoded_path, '-itsoffset', '0.5', '-i', encoded_path,
+                            '-map', '0:v', '-map', '1:a', '-c', 'copy', source_path, '-y'], check=True)
+
+            single_path = os.path.join(temp_dir, 'single.mp4')
+            self.assertTrue(encode_video_locally(source_path, single_path, ffmpeg_preset='ultrafast'))
+
+            chunked_path = os.path.join(temp_dir, 'chunked.mp4')
+            with patch('ffmpeg_utils.os.cpu_count', return_value=3), \
+                    patch('ffmpeg_utils.CHUNKED_ENCODE_MIN_SECONDS', 10), \
+                    patch('ffmpeg_utils.encode_in_chunks', wraps=ffmpeg_utils.encode_in_chunks) as encode_in_chunks:
+                self.assertTrue(encode_video_locally(source_path, chunked_path, ffmpeg_preset='ultrafast'))
+            self.assertEqual(3, encode_in_chunks.call_args.args[6])
+
+            single = _stream_info(single_path)
+            chunked = _stream_info(chunked_path)
+            self.assertEqual(750, chunked['video']['frames'])
+            self.assertEqual(single['video']['frames'], chunked['video']['frames'])
+            self.assertAlmostEqual(single['video']['duration'], chunked['video']['duration'], delta=0.001)
+            self.assertEqual(single['audio']['frames'], chunked['audio']['frames'])
+            self.assertAlmostEqual(0.5, chunked['audio']['start'], delta=0.05)
+            self.assertAlmostEqual(single['audio']['start'], chunked['audio']['start'], delta=0.001)
+            self.assertAlmostEqual(single['audio']['duration'], chunked['audio']['duration'], delta=0.03)
+            self.assertFalse(os.path.exists(f'{chunked_path}.chunks'))
@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+
+from encoder_pool import EncoderPool, create_encoder_pool
+from test_remote_encoder import StandInEncoder
+from thread_utils import NoOpTaskWrapper
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.processes = []
+
+    def tearDown(self):
+        for process in self.processes:
+            process.kill()
+            process.join()
+        self.temp_dir.cleanup()
+
+    def _start_encoder(self, encode_seconds: float) -> tuple[tuple[str, int, int], multiprocessing.Process]:
+        encoder = StandInEncoder(tempfile.mkdtemp(dir=self.temp_dir.name), encode_seconds)
+        # The encoder runs in its own process, so it can be killed part way through a job
+        process = multiprocessing.get_context('fork').Process(target=encoder.serve_forever, daemon=True)
+        process.start()
+        encoder.server_close()
+        self.processes.append(process)
+        return ('127.0.0.1', encoder.server_address[1], 1), process
+
+    def _encode(self, pool: EncoderPool, count: int) -> float:
+        inputs = []
+        for index in range(count):
+            input_path = Path(self.temp_dir.name, f'input{index}.mp4')
+            input_path.write_bytes(os.urandom(64 * 1024))
+            inputs.append(input_path)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(count) as executor:
+            results = list(executor.map(lambda path: pool.encode(path, path.with_suffix('.out')), inputs))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual([True] * count, results)
+        for input_path in inputs:
+            self.assertEqual(b'encoded:' + input_path.read_bytes(), input_path.with_suffix('.out').read_bytes())
+        return elapsed
+
+    def test_jobs_are_spread_over_the_encoders(self):
+        encoders = [self._start_encoder(0.5)[0] for _ in range(3)]
+
+        one_encoder = self._encode(EncoderPool(encoders[:1], local_slots=0), 6)
+        three_encoders = self._encode(EncoderPool(encoders, local_slots=0), 6)
+
+        self.assertGreater(one_encoder, 3.0)
+        self.assertLess(three_encoders, one_encoder / 2)
+
+    def test_job_moves_when_an_encoder_dies(self):
+        slow, slow_process = self._start_encoder(5.0)
+        fast, _ = self._start_encoder(0.2)
+        pool = EncoderPool([slow, fast], local_slots=0)
+
+        threading.Timer(1.0, slow_process.kill).start()
+        elapsed = self._encode(pool, 1)
+
+        self.assertLess(elapsed, 4.0)
+        self.assertFalse(pool.nodes[0].healthy)
+        self.assertEqual([0, 0], [node.active for node in pool.nodes])
+
+    def test_cancelled_job_stops_waiting_for_a_slot(self):
+        encoder, _ = self._start_encoder(0.2)
+        pool = EncoderPool([encoder], local_slots=0)
+        busy = pool.acquire(set())
+
+        log = NoOpTaskWrapper()
+        threading.Timer(0.5, log.cancel).start()
+        input_path = Path(self.temp_dir.name, 'input.mp4')
+        input_path.write_bytes(os.urandom(1024))
+        started = time.monotonic()
+        self.assertFalse(pool.encode(input_path, input_path.with_suffix('.out'), log=log))
+
+        self.assertLess(time.monotonic() - started, 3.0)
+        self.assertFalse(input_path.with_suffix('.out').exists())
+        self.assertEqual(1, pool.nodes[0].active)
+        pool.release(busy)
+
+    def test_local_slots(self):
+        self.assertEqual(['10.0.0.5:8080'], [node.name for node in create_encoder_pool('10.0.0.5', 8080, '', 0).nodes])
+        # With no external encoder the videos still have to go somewhere
+        self.assertEqual([('local', 1)], [(node.name, node.slots) for node in create_encoder_pool('', 0, '', 0).nodes])
@@ -0,0 +1,196 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from flask import Flask
+
+from constants import PROPERTY_SERVER_MEDIA_READY, PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER, \
+    PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER, APP_KEY_HLS_CACHE, APP_KEY_SLC
+from db import db, MediaFolder, MediaFile
+from hls_cache import split_at_keyframes, HlsSegmentCache
+from media_routes import media_blueprint
+from short_lived_cache import ShortLivedCache
+
+# Mimics ffprobe listing packets, in decode order, with a keyframe every 2 seconds of a 13 second video
+FFPROBE_STUB = """#!{python}
+for frame in [0, 2, 1] + list(range(3, 26)):
+    print(f'{{frame * 0.5:.6f}},0.500000,{{"K_" if frame % 4 == 0 else "__"}}')
+"""
+
+FIXTURE_SECONDS = 20
+FIXTURE_FRAME_SECONDS = 1 / 25
+
+
+def _make_fixture(path: str):
+    # A keyframe every second, so the segments are 2, 6, 6 and 6 seconds
+    subprocess.run(['ffmpeg', '-v', 'error',
+                    '-f', 'lavfi', '-i', f'testsrc=size=320x240:rate=25:duration={FIXTURE_SECONDS}',
+                    '-f', 'lavfi', '-i', f'sine=frequency=440:duration={FIXTURE_SECONDS}', '-c:v', 'libx264',
+                    '-preset', 'ultrafast', '-g', '25', '-keyint_min', '25', '-sc_threshold', '0', '-c:a', 'aac',
+                    '-f', 'mp4', path, '-y'], check=True)
+
+
+def _pes_timestamps(data: bytes) -> dict[str, list[float]]:
+    """
+    The PTS of every PES packet in an MPEG-TS segment, read from the packets, so ffmpeg's demuxer isn't involved
+    :return: Seconds, by video and audio
+    """
+    timestamps = {'video': [], 'audio': []}
+    for offset in range(0, len(data) - 187, 188):
+        packet = data[offset:offset + 188]
+        # Only packets that start a PES packet, with a payload
+        if packet[0] != 0x47 or not packet[1] & 0x40 or not packet[3] & 0x10:
+            continue
+        payload = packet[5 + packet[4]:] if packet[3] & 0x20 else packet[4:]
+        if payload[:3] != b'\x00\x00\x01' or not payload[7] & 0x80:
+            continue
+        pts = payload[9:14]
+        value = ((pts[0] >> 1) & 0x07) << 30 | pts[1] << 22 | (pts[2] >> 1) << 15 | pts[3] << 7 | pts[4] >> 1
+        if 0xE0 <= payload[3] <= 0xEF:
+            timestamps['video'].append(value / 90000)
+        elif 0xC0 <= payload[3] <= 0xDF:
+            timestamps['audio'].append(value / 90000)
+    return timestamps
+
+
+class Test(TestCase):
+
+    def test_split_at_keyframes(self):
+        keyframes = [0.0, 1.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0, 14.0, 16.0, 18.0]
+        self.assertEqual([(0.0, 2.0), (2.0, 6.0), (8.0, 6.0), (14.0, 6.0)],
+                         split_at_keyframes(keyframes, 20.0, first_seconds=2, seconds=6))
+        self.assertEqual([], split_at_keyframes([], 20.0))
+
+    def test_playlist(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            stub_path = os.path.join(temp_dir, 'ffprobe')
+            with open(stub_path, 'w') as stub:
+                stub.write(FFPROBE_STUB.format(python=sys.executable))
+            os.chmod(stub_path, 0o755)
+            media_path = os.path.join(temp_dir, 'video.mp4')
+            with open(media_path, 'wb') as file:
+                file.write(b'x')
+
+            with patch.dict(os.environ, {'PATH': temp_dir + os.pathsep + os.environ['PATH']}):
+                cache = HlsSegmentCache(os.path.join(temp_dir, 'cache'), 1024 * 1024, 0)
+                playlist = cache.playlist(media_path, 'file', lambda index: f'segment?n={index}')
+
+            self.assertEqual([(0.0, 2.0), (2.0, 6.0), (8.0, 5.0)], cache.segments(media_path, 'file'))
+            self.assertEqual(['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:0',
+                              '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-INDEPENDENT-SEGMENTS',
+                              '#EXTINF:2.000000,', 'segment?n=0', '#EXTINF:6.000000,', 'segment?n=1',
+                              '#EXTINF:5.000000,', 'segment?n=2', '#EXT-X-ENDLIST'], playlist.splitlines())
+
+    @skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), 'ffmpeg is not installed')
+    def test_segments_play_back_to_back(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            app = Flask(__name__)
+            app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(temp_dir, 'test.db')
+            app.config[PROPERTY_SERVER_MEDIA_READY] = True
+            app.config[PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER] = temp_dir
+            app.config[PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER] = temp_dir
+            app.config[APP_KEY_SLC] = ShortLivedCache()
+            cache = HlsSegmentCache(os.path.join(temp_dir, 'cache'), 64 * 1024 * 1024, 2)
+            app.config[APP_KEY_HLS_CACHE] = cache
+            db.init_app(app)
+            app.register_blueprint(media_blueprint, url_prefix='/api/media')
+
+            with app.app_context():
+                db.create_all()
+                folder = MediaFolder(name='Videos', active=True)
+                db.session.add(folder)
+                db.session.flush()
+                file = MediaFile(folder_id=folder.id, filename='video.mp4', mime_type='video/mp4', archive=False,
+                                 filesize=0)
+                db.session.add(file)
+                db.session.commit()
+                file_id = file.id
+            source_path = os.path.join(temp_dir, f'{file_id}.dat')
+            _make_fixture(source_path)
+            cache_id = app.config[APP_KEY_SLC].add_item(file_id)
+
+            client = app.test_client()
+            response = client.get(f'/api/media/unsafe-hls?cache_id={cache_id}', headers={'Origin': 'https://cast'})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('https://cast', response.headers['Access-Control-Allow-Origin'])
+            uris = [line for line in response.get_data(as_text=True).splitlines() if not line.startswith('#')]
+            segments = cache.segments(source_path, file_id)
+            self.assertEqual([(0.0, 2.0), (2.0, 6.0), (8.0, 6.0), (14.0, 6.0)], segments)
+            self.assertEqual(len(segments), len(uris))
+
+            timestamps = []
+            for index, uri in enumerate(uris):
+                response = client.get(f'/api/media/{uri}')
+                self.assertEqual(200, response.status_code)
+                self.assertEqual('video/mp2t', response.mimetype)
+                timestamps.append(_pes_timestamps(response.data))
+                response.close()
+
+                if index == 0:
+                    # The next two segments are made in the background, the one after waits to be asked for
+                    cache.prefetcher.submit(lambda: None).result()
+                    entry_folder = cache._entry_folder(source_path, file_id)
+                    self.assertEqual([True, True, True, False],
+                                     [os.path.exists(cache._segment_path(entry_folder, n)) for n in range(4)])
+
+            # Each segment starts where it sits in the source and right where the one before it ends
+            base = min(timestamps[0]['video'])
+            for index, (start, _) in enumerate(segments):
+                self.assertAlmostEqual(start, min(timestamps[index]['video']) - base, delta=0.001)
+                self.assertAlmostEqual(start, min(timestamps[index]['audio']) - base, delta=0.05)
+                if index > 0:
+                    self.assertAlmostEqual(max(timestamps[index - 1]['video']) + FIXTURE_FRAME_SECONDS,
+                                           min(timestamps[index]['video']), delta=0.001)
+            self.assertAlmostEqual(FIXTURE_SECONDS, max(timestamps[-1]['video']) + FIXTURE_FRAME_SECONDS - base,
+                                   delta=0.001)
+            self.assertEqual(FIXTURE_SECONDS * 25, sum(len(segment['video']) for segment in timestamps))
+
+            cache.prefetcher.shutdown()
+            with app.app_context():
+                db.session.remove()
+
+    @skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), 'ffmpeg is not installed')
+    def test_concurrent_requests_make_a_segment_once(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_path = os.path.join(temp_dir, 'video.mp4')
+            _make_fixture(source_path)
+            cache = HlsSegmentCache(os.path.join(temp_dir, 'cache'), 64 * 1024 * 1024, 0)
+
+            built = []
+            write_index = HlsSegmentCache._write_index
+            write_segment = HlsSegmentCache._write_segment
+
+            def counted_index(*args):
+                built.append('index')
+                write_index(*args)
+
+            def counted_segment(*args):
+                built.append(args[2])
+                write_segment(*args)
+
+            barrier = threading.Barrier(4)
+            paths = []
+
+            def fetch():
+                barrier.wait()
+                paths.append(cache.fetch_segment(source_path, 'file', 2))
+
+            with patch.object(HlsSegmentCache, '_write_index', staticmethod(counted_index)), \
+                    patch.object(HlsSegmentCache, '_write_segment', staticmethod(counted_segment)):
+                threads = [threading.Thread(target=fetch) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            self.assertEqual(['index', 2], built)
+            self.assertEqual(4, len(paths))
+            self.assertEqual(1, len(set(paths)))
+            self.assertTrue(os.path.getsize(paths[0]) > 0)
+            self.assertEqual([], [name for name in os.listdir(os.path.dirname(paths[0])) if name.endswith('.tmp')])
+            cache.prefetcher.shutdown()
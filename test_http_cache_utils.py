@@ -0,0 +1,98 @@
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+from flask import Flask, send_file
+
+from http_cache_utils import FileValidators, set_cache_headers
+
+
+def _create_app(folder: str) -> Flask:
+    app = Flask(__name__)
+
+    @app.route('/image/<name>')
+    def image(name):
+        file_path = os.path.join(folder, name)
+        validators = FileValidators(name, file_path)
+        if validators.is_not_modified():
+            return validators.not_modified_response(60)
+        response = send_file(file_path, etag=validators.etag)
+        set_cache_headers(response, 60)
+        return validators.apply(response)
+
+    return app
+
+
+class Test(TestCase):
+    def test_browse_session_revalidates(self):
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pages = [f'page_{index}.png' for index in range(20)]
+            for page in pages:
+                with open(os.path.join(temp_dir, page), 'wb') as f:
+                    f.write(os.urandom(1000))
+
+            client = _create_app(temp_dir).test_client()
+
+            # A browser keeps the validators of everything it has seen, and revalidates when it comes back
+            browser_cache = {}
+            statuses = []
+            random.seed(7)
+            visits = pages + [random.choice(pages) for _ in range(180)]
+
+            for index, page in enumerate(visits):
+                if index == 100:
+                    # A page is replaced half way through the session
+                    with open(os.path.join(temp_dir, pages[0]), 'wb') as f:
+                        f.write(os.urandom(1200))
+                    changed_at = index
+
+                headers = {}
+                if page in browser_cache:
+                    headers['If-None-Match'] = browser_cache[page]['etag']
+                response = client.get(f'/image/{page}', headers=headers)
+                statuses.append((page, response.status_code))
+
+                if response.status_code == 200:
+                    self.assertEqual(os.path.getsize(os.path.join(temp_dir, page)), len(response.data))
+                    browser_cache[page] = {'etag': response.headers['ETag']}
+                else:
+                    self.assertEqual(304, response.status_code)
+                    self.assertEqual(b'', response.data)
+                    self.assertEqual(browser_cache[page]['etag'], response.headers['ETag'])
+                    self.assertEqual('public, max-age=60', response.headers['Cache-Control'])
+
+            # Every page is downloaded once, plus the replaced page once more
+            downloads = [status for status in statuses if status[1] == 200]
+            self.assertEqual(len(pages) + 1, len(downloads))
+            self.assertIn((pages[0], 200), statuses[changed_at:])
+
+            # Everything else is answered with a 304
+            not_modified_rate = sum(1 for status in statuses if status[1] == 304) / len(visits)
+            self.assertEqual(0.895, not_modified_rate)
+
+    def test_if_modified_since_and_if_range(self):
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, 'a.png'), 'wb') as f:
+                f.write(b'x' * 100)
+
+            app = _create_app(temp_dir)
+            client = app.test_client()
+
+            first = client.get('/image/a.png')
+            self.assertEqual(200, first.status_code)
+            last_modified = first.headers['Last-Modified']
+
+            self.assertEqual(304, client.get('/image/a.png', headers={'If-Modified-Since': last_modified}).status_code)
+            # If-None-Match wins over If-Modified-Since
+            self.assertEqual(200, client.get('/image/a.png', headers={'If-None-Match': '"other"',
+                                                                      'If-Modified-Since': last_modified}).status_code)
+
+            with app.test_request_context('/image/a.png', headers={'If-Range': first.headers['ETag']}):
+                self.assertTrue(FileValidators('a.png', os.path.join(temp_dir, 'a.png')).is_range_current())
+            with app.test_request_context('/image/a.png', headers={'If-Range': '"other"'}):
+                self.assertFalse(FileValidators('a.png', os.path.join(temp_dir, 'a.png')).is_range_current())
+            with app.test_request_context('/image/a.png', headers={'If-Range': 'W/' + first.headers['ETag']}):
+                self.assertFalse(FileValidators('a.png', os.path.join(temp_dir, 'a.png')).is_range_current())
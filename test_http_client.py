@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase
+
+from html_utils import download_unsecure_file, _load_header_profile
+from http_client import http_get
+from thread_utils import TaskWrapper
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """
+    Serves the path back as the body, and counts the connections it was asked over.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        KeepAliveHandler.connections += 1
+
+    def do_GET(self):
+        if self.path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode() * 1000
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ClientTask(TaskWrapper):
+
+    def run(self, db_session):
+        pass
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        KeepAliveHandler.connections = 0
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def test_connections_are_reused_and_files_streamed(self):
+        task = ClientTask('Download', 'Download')
+        for index in range(20):
+            self.assertTrue(download_unsecure_file(f'{self.base_url}/{index}.png', self.temp_dir.name,
+                                                   f'{index}.png', None, task))
+        self.assertEqual(b'/7.png' * 1000, open(os.path.join(self.temp_dir.name, '7.png'), 'rb').read())
+        self.assertEqual('/x' * 1000, http_get(f'{self.base_url}/x').text)
+
+        # Nothing is left behind for a missing file
+        self.assertFalse(download_unsecure_file(f'{self.base_url}/missing', self.temp_dir.name, 'missing.png',
+                                                None, task))
+        self.assertEqual(20, len(os.listdir(self.temp_dir.name)))
+
+        self.assertEqual(1, KeepAliveHandler.connections)
+
+    def test_header_profile_is_reloaded_when_changed(self):
+        file_path = os.path.join(self.temp_dir.name, 'headers.json')
+        with open(file_path, 'w') as file:
+            json.dump({'user-agent': 'first'}, file)
+
+        # Callers get a copy they can change
+        profile = _load_header_profile(file_path)
+        profile['user-agent'] = 'changed by the caller'
+        self.assertEqual('first', _load_header_profile(file_path)['user-agent'])
+
+        with open(file_path, 'w') as file:
+            json.dump({'user-agent': 'second'}, file)
+        mtime = os.stat(file_path).st_mtime_ns + 1000000
+        os.utime(file_path, ns=(mtime, mtime))
+        self.assertEqual('second', _load_header_profile(file_path)['user-agent'])
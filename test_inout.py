@@ -0,0 +1,103 @@
+import datetime
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+import search_index
+from db import db, MediaFolder, MediaFile, User, MediaFileProgress
+from inout import perform_backup, perform_restore, restore_media_progress
+from search_index import init_search_index, apply_text_search, SEARCH_KIND_FOLDER, SEARCH_KIND_FILE
+from thread_utils import NoOpTaskWrapper
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        # The listeners follow the module state, other tests' databases have no index
+        self.state = patch.dict(search_index._search_index_state)
+        self.state.start()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.temp_dir.name, 'test.db')
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.backup_folder = os.path.join(self.temp_dir.name, 'backup')
+        os.makedirs(self.backup_folder)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.context.pop()
+        self.temp_dir.cleanup()
+        self.state.stop()
+
+    def _folders(self, filter_text: str) -> list[str]:
+        query = apply_text_search(db.session.query(MediaFolder), SEARCH_KIND_FOLDER, MediaFolder.id, filter_text,
+                                  [MediaFolder.name, MediaFolder.tags])
+        return sorted(folder.name for folder in query.all())
+
+    def _files(self, filter_text: str) -> list[str]:
+        query = apply_text_search(db.session.query(MediaFile), SEARCH_KIND_FILE, MediaFile.id, filter_text,
+                                  [MediaFile.filename])
+        return sorted(file.filename for file in query.all())
+
+    def test_restore_replaces_the_search_index(self):
+        self.assertTrue(init_search_index(self.app))
+        folder = MediaFolder(name='Harbor Lights', active=True)
+        db.session.add(folder)
+        db.session.flush()
+        db.session.add(MediaFile(folder_id=folder.id, filename='sunset.mp4', mime_type='video/mp4', archive=False,
+                                 filesize=0))
+        db.session.commit()
+        perform_backup(self.backup_folder, db.session, NoOpTaskWrapper())
+
+        # The catalogue moves on after the backup
+        folder.name = 'Quiet Port'
+        db.session.add(MediaFolder(name='Mountain Pass', active=True))
+        db.session.commit()
+        self.assertEqual(['Quiet Port'], self._folders('port'))
+
+        # --restore runs before the server opens the index
+        search_index._search_index_state['enabled'] = False
+        perform_restore(self.backup_folder, NoOpTaskWrapper())
+        self.assertTrue(search_index.is_search_index_enabled())
+        self.assertEqual(['Harbor Lights'], self._folders('harbor'))
+        self.assertEqual(['sunset.mp4'], self._files('sun'))
+
+        # The next start finds the index in place and trusts it
+        db.session.remove()
+        search_index._search_index_state['enabled'] = False
+        self.assertTrue(init_search_index(self.app))
+        self.assertEqual(['Harbor Lights'], self._folders('harbor'))
+        self.assertEqual([], self._folders('port'))
+        self.assertEqual([], self._folders('mountain'))
+        self.assertEqual(['sunset.mp4'], self._files('sunset'))
+
+    def test_restore_keeps_the_newest_of_duplicate_progress(self):
+        db.session.add(User(id=1, username='reader', password='x', features=0))
+        folder = MediaFolder(name='Videos', active=True)
+        db.session.add(folder)
+        db.session.flush()
+        files = [MediaFile(folder_id=folder.id, filename=f'{index}.mp4', mime_type='video/mp4', archive=False,
+                           filesize=0) for index in range(2)]
+        db.session.add_all(files)
+        db.session.commit()
+
+        # Taken before progress was unique per user and file
+        rows = [(files[0].id, 10.0, 1), (files[0].id, 30.0, 3), (files[0].id, 20.0, 2), (files[1].id, 5.0, 1)]
+        with open(os.path.join(self.backup_folder, 'progress_media.json'), 'w') as file:
+            for file_id, progress, day in rows:
+                file.write(json.dumps({'@user': 'reader', 'file_id': file_id, 'progress': progress,
+                                       'timestamp': datetime.datetime(2024, 1, day).isoformat()}) + '\n')
+
+        restore_media_progress(self.backup_folder, db.session, {'reader': 1}, NoOpTaskWrapper())
+
+        restored = {(row.file_id, row.progress, row.timestamp.day) for row in db.session.query(MediaFileProgress)}
+        self.assertEqual({(files[0].id, 30.0, 3), (files[1].id, 5.0, 1)}, restored)
@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import media_probe
+from db import MediaFile
+from media_probe import get_media_duration, get_file_formats, probe_media_file
+
+# Mimics ffprobe, every run is logged and the duration is the size of the file
+FFPROBE_STUB = """#!{python}
+import json, os, sys
+
+with open(os.environ['FFPROBE_STUB_LOG'], 'a') as log:
+    log.write(sys.argv[-1] + '\\n')
+print(json.dumps({{'format': {{'format_name': 'mov,mp4,m4a', 'duration': str(os.path.getsize(sys.argv[-1]))}}}}))
+"""
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        stub_path = os.path.join(self.temp_dir.name, 'ffprobe')
+        with open(stub_path, 'w') as stub:
+            stub.write(FFPROBE_STUB.format(python=sys.executable))
+        os.chmod(stub_path, 0o755)
+        self.log_path = os.path.join(self.temp_dir.name, 'ffprobe.log')
+        self.environment = patch.dict(os.environ, {'PATH': self.temp_dir.name + os.pathsep + os.environ['PATH'],
+                                                   'FFPROBE_STUB_LOG': self.log_path})
+        self.environment.start()
+
+    def tearDown(self):
+        self.environment.stop()
+        self.temp_dir.cleanup()
+
+    def _runs(self) -> int:
+        with open(self.log_path) as log:
+            return len(log.read().splitlines())
+
+    def test_probe_is_cached_until_the_file_changes(self):
+        media_path = os.path.join(self.temp_dir.name, 'video.dat')
+        with open(media_path, 'wb') as file:
+            file.write(b'x' * 10)
+
+        self.assertEqual(10.0, get_media_duration(media_path))
+        self.assertEqual('mov', get_file_formats(media_path))
+        self.assertEqual(10.0, get_media_duration(media_path))
+        self.assertEqual(1, self._runs())
+
+        with open(media_path, 'ab') as file:
+            file.write(b'x' * 5)
+        self.assertEqual(15.0, get_media_duration(media_path))
+        self.assertEqual(2, self._runs())
+
+    def test_probe_is_stored_on_the_file(self):
+        media_path = os.path.join(self.temp_dir.name, 'stored.dat')
+        with open(media_path, 'wb') as file:
+            file.write(b'x' * 20)
+        media_file = MediaFile(folder_id='folder', filename='stored', mime_type='video/mp4', archive=False,
+                               preview=False, filesize=20)
+
+        self.assertIsNotNone(probe_media_file(media_file, media_path))
+        self.assertEqual(20.0, media_file.duration)
+        self.assertEqual('mov,mp4,m4a', media_file.probe['format']['format_name'])
+
+        # As after a restart, the row is enough
+        media_probe._probe_cache.clear()
+        self.assertEqual(media_file.probe, probe_media_file(media_file, media_path))
+        self.assertEqual(1, self._runs())
+
+        with open(media_path, 'ab') as file:
+            file.write(b'x' * 5)
+        os.utime(media_path, ns=(os.stat(media_path).st_mtime_ns + 1000000,) * 2)
+        probe_media_file(media_file, media_path)
+        self.assertEqual(25.0, media_file.duration)
+        self.assertEqual(2, self._runs())
@@ -0,0 +1,80 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+from constants import PROPERTY_SERVER_MEDIA_READY, PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER, \
+    PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER, APP_KEY_SLC
+from db import db, MediaFolder, MediaFile
+from media_routes import media_blueprint
+from short_lived_cache import ShortLivedCache
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.app.config[PROPERTY_SERVER_MEDIA_READY] = True
+        self.app.config[PROPERTY_SERVER_MEDIA_PRIMARY_FOLDER] = self.temp_dir.name
+        self.app.config[PROPERTY_SERVER_MEDIA_ARCHIVE_FOLDER] = self.temp_dir.name
+        self.app.config[APP_KEY_SLC] = ShortLivedCache()
+        db.init_app(self.app)
+        self.app.register_blueprint(media_blueprint, url_prefix='/api/media')
+
+        with self.app.app_context():
+            db.create_all()
+            folder = MediaFolder(name='Videos', active=True)
+            db.session.add(folder)
+            db.session.flush()
+            file = MediaFile(folder_id=folder.id, filename='video.mp4', mime_type='video/mp4', archive=False,
+                             filesize=1000)
+            db.session.add(file)
+            db.session.commit()
+            file_id = file.id
+        with open(os.path.join(self.temp_dir.name, f'{file_id}.dat'), 'wb') as f:
+            f.write(os.urandom(1000))
+        self.stream_url = f'/api/media/unsafe-stream?cache_id={self.app.config[APP_KEY_SLC].add_item(file_id)}'
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.temp_dir.cleanup()
+
+    def test_not_modified_stream_allows_the_origin(self):
+        first = self.client.get(self.stream_url, headers={'Origin': 'https://cast'})
+        self.assertEqual(200, first.status_code)
+
+        # A player on another origin has to be able to read the revalidation too
+        response = self.client.get(self.stream_url, headers={'Origin': 'https://cast',
+                                                             'If-None-Match': first.headers['ETag']})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('https://cast', response.headers['Access-Control-Allow-Origin'])
+        self.assertEqual('Origin', response.headers['Vary'])
+        self.assertEqual('Range', response.headers['Access-Control-Allow-Headers'])
+
+        response = self.client.get(self.stream_url, headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('*', response.headers['Access-Control-Allow-Origin'])
+
+    def test_unsatisfiable_range_gives_the_size(self):
+        response = self.client.get(self.stream_url, headers={'Origin': 'https://cast', 'Range': 'bytes=2000-3000'})
+        self.assertEqual(416, response.status_code)
+        self.assertEqual('bytes */1000', response.headers['Content-Range'])
+        self.assertEqual('https://cast', response.headers['Access-Control-Allow-Origin'])
+
+        response = self.client.get(self.stream_url, headers={'Range': 'bytes=900-'})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual('bytes 900-999/1000', response.headers['Content-Range'])
+        self.assertEqual(100, len(response.data))
+
+    def test_ignored_range_sends_the_whole_file(self):
+        for header in ['items=0-9', 'bytes=abc-', 'bytes=5-2']:
+            response = self.client.get(self.stream_url, headers={'Range': header})
+            self.assertEqual(200, response.status_code, msg=header)
+            self.assertNotIn('Content-Range', response.headers)
+            self.assertEqual(1000, len(response.data))
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from media_utils import parse_range_header
+
+
+class Test(TestCase):
+    def test_parse_range_header(self):
+
+        self.assertEqual([(0, 99)], parse_range_header('bytes=0-99', 1000))
+        self.assertEqual([(500, 999)], parse_range_header('bytes=500-', 1000))
+        self.assertEqual([(900, 999)], parse_range_header('bytes=-100', 1000))
+        self.assertEqual([(0, 999)], parse_range_header('bytes=-5000', 1000))
+        self.assertEqual([(990, 999)], parse_range_header('bytes=990-5000', 1000))
+        self.assertEqual([(0, 9), (20, 29), (995, 999)], parse_range_header('bytes=0-9, 20-29,-5', 1000))
+
+        # Unsatisfiable ranges are dropped, as long as one remains
+        self.assertEqual([(0, 9)], parse_range_header('bytes=0-9,2000-3000', 1000))
+
+        # Valid ranges that all miss the file can't be satisfied
+        for header in ['bytes=2000-', 'bytes=-0', 'bytes=1000-1005,2000-']:
+            with self.assertRaises(ValueError, msg=header):
+                parse_range_header(header, 1000)
+
+        # Other units and bad syntax are ignored, the whole file is sent
+        for header in ['bytes=9-1', 'bytes=a-b', 'bytes=abc-', 'bytes=5', 'bytes=-', 'bytes=0-9,x', 'items=0-9',
+                       'bytes=', 'bytes=' + ','.join(['0-1'] * 100)]:
+            self.assertIsNone(parse_range_header(header, 1000), msg=header)
@@ -0,0 +1,88 @@
+import datetime
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+from db import db, init_db, Book, User, MediaFolder, MediaFile, MediaFileProgress, VolumeProgress, VolumeLastRead
+from progress_buffer import ProgressBuffer
+
+FOLDER_ID = '5f1f2a2e-7f7c-4b7c-9d3e-0a1b2c3d4e5f'
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.temp_dir.name, 'test.db')
+        init_db(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+
+        for index in range(2):
+            db.session.add(User(id=index + 101, username=f'reader{index}', password='x', features=0))
+        db.session.add(Book(id='book-0', name='Book 0', info_url='', active=True, processor='test'))
+        db.session.add(MediaFolder(id=FOLDER_ID, name='Root', active=True))
+        for index in range(3):
+            db.session.add(MediaFile(id=f'file-{index}', folder_id=FOLDER_ID, filename=f'File {index}.mp4',
+                                     mime_type='video/mp4', archive=False, filesize=10))
+        db.session.commit()
+
+        self.buffer = ProgressBuffer(60, 1000)
+        self.start = datetime.datetime(2024, 1, 1)
+        self.first, self.second = 101, 102
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.context.pop()
+        self.temp_dir.cleanup()
+
+    def _read(self, user_id: int, count: int):
+        # A fast reader, every page turn of two chapters and a playback heartbeat per page
+        for second in range(count):
+            timestamp = self.start + datetime.timedelta(seconds=second)
+            self.buffer.record_volume(user_id, 'book-0', f'ch{second // 50}', second % 50, None, timestamp)
+            self.buffer.record_media(user_id, f'file-{second % 3}', float(second), timestamp)
+
+    def test_positions_are_coalesced(self):
+        self._read(self.first, 100)
+
+        # Nothing is written until a flush, reads see the newest position
+        self.assertEqual(0, db.session.query(VolumeProgress).count())
+        self.assertEqual(99.0, self.buffer.media_progress(self.first, 'file-0'))
+        self.assertEqual(49, self.buffer.volume_progress(self.first, 'book-0', 'ch0').page_number)
+        self.assertEqual('ch1', self.buffer.book_last_read(self.first, 'book-0').chapter_id)
+        self.assertIsNone(self.buffer.media_progress(self.second, 'file-0'))
+
+        # Two chapters and three files, however many updates came in
+        self.assertEqual(5, self.buffer.flush())
+        self.assertIsNone(self.buffer.media_progress(self.first, 'file-0'))
+        self.assertEqual(0, self.buffer.flush())
+
+        progress = {row.file_id: row.progress for row in db.session.query(MediaFileProgress).all()}
+        self.assertEqual({'file-0': 99.0, 'file-1': 97.0, 'file-2': 98.0}, progress)
+        chapters = {row.chapter_id: row.page_number for row in db.session.query(VolumeProgress).all()}
+        self.assertEqual({'ch0': 49, 'ch1': 49}, chapters)
+        last_read = db.session.query(VolumeLastRead).one()
+        self.assertEqual(('ch1', 49), (last_read.chapter_id, last_read.page_number))
+
+    def test_flush_updates_existing_rows_per_user(self):
+        self._read(self.first, 10)
+        self._read(self.second, 10)
+        # One chapter and three files
+        self.assertEqual(4, self.buffer.flush(self.second))
+        self.assertEqual(9.0, self.buffer.media_progress(self.first, 'file-0'))
+
+        self.start += datetime.timedelta(hours=1)
+        self._read(self.second, 60)
+        self.buffer.flush()
+        db.session.expire_all()
+
+        self.assertEqual(2 * 3, db.session.query(MediaFileProgress).count())
+        row = db.session.query(MediaFileProgress).filter_by(user_id=self.second, file_id='file-2').one()
+        self.assertEqual(59.0, row.progress)
+        last_read = db.session.query(VolumeLastRead).filter_by(user_id=self.second).one()
+        self.assertEqual(('ch1', 9), (last_read.chapter_id, last_read.page_number))
@@ -0,0 +1,89 @@
+import re
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import event
+
+from db import db, Book
+from media_queries import find_folders_in_folder, count_folders_in_folder, find_root_folders, count_root_folders, \
+    find_files_with_progress_in_folder, count_files_in_folder, find_progress_entry, find_progress_entries, \
+    find_file_by_filename
+from volume_queries import find_recent_entries, find_chapters_by_book, find_chapter_by_sequence, \
+    list_books_for_rating, find_bookmarks
+
+# Tables that grow with the library or with use, a full SCAN of these in a hot query is a regression
+GROWING_TABLES = ['mediafiles', 'mediafolders', 'media_file_progress', 'volume_progress', 'chapters',
+                  'volume_bookmarks', 'volume_last_read']
+
+FOLDER_ID = '5f1f2a2e-7f7c-4b7c-9d3e-0a1b2c3d4e5f'
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def _capture_statements(self, calls) -> list[tuple[str, object]]:
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for call in calls:
+                call()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return statements
+
+    def test_hot_queries_do_not_scan(self):
+
+        calls = [
+            lambda: find_folders_in_folder(FOLDER_ID, None, 200, 0, 20),
+            lambda: count_folders_in_folder(FOLDER_ID, None, 200, None),
+            lambda: find_root_folders(None, 200, 0, 20),
+            lambda: count_root_folders(None, 200),
+            lambda: find_files_with_progress_in_folder(FOLDER_ID, 1, None, 0, 20),
+            lambda: count_files_in_folder(FOLDER_ID),
+            lambda: find_file_by_filename('a.mp4', FOLDER_ID),
+            lambda: find_progress_entry(1, FOLDER_ID),
+            lambda: find_progress_entries(1, 200),
+            lambda: find_recent_entries(1, 200),
+            lambda: find_chapters_by_book('book', 1),
+            lambda: find_chapter_by_sequence('book', 3),
+            lambda: find_bookmarks(1, 'book'),
+            lambda: list_books_for_rating(1, 200, sort_field=Book.name, query_limit=20),
+            # Keyset pages
+            lambda: find_folders_in_folder(FOLDER_ID, None, 200, 0, 21, after_key=('b', FOLDER_ID)),
+            lambda: find_files_with_progress_in_folder(FOLDER_ID, 1, None, 0, 21, after_key=('b', FOLDER_ID),
+                                                       with_total=False),
+            lambda: list_books_for_rating(1, 200, sort_field=Book.name, query_limit=21, after_key=('b', 'book')),
+        ]
+
+        statements = self._capture_statements(calls)
+        self.assertGreaterEqual(len(statements), len(calls))
+
+        scans = []
+        with db.engine.connect() as connection:
+            for statement, parameters in statements:
+                plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                details = [row[-1] for row in plan]
+                for detail in details:
+                    # SCAN, with or without USING (COVERING) INDEX, is a full pass over the table
+                    match = re.match(r'SCAN (\w+)', detail)
+                    if match is not None and match.group(1) in GROWING_TABLES:
+                        scans.append(f'{match.group(1)} is scanned by:\n{statement}\nPlan: {details}')
+
+        self.assertEqual([], scans, '\n\n'.join(scans))
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import urlparse, parse_qs
+
+from ffmpeg_utils import encode_video
+from remote_encoder import remote_encode
+from thread_utils import NoOpTaskWrapper
+
+
+class StandInEncoder(ThreadingHTTPServer):
+    """
+    A local remote encoder, see remote_encoder. Encoding prefixes the input with b'encoded:'. The first upload and the
+    first download can be cut off part way, to check that they resume.
+    """
+    daemon_threads = True
+
+    def __init__(self, folder: str, encode_seconds: float = 0.0, resumable: bool = True, drop_after: int = 0):
+        super().__init__(('127.0.0.1', 0), StandInEncoderHandler)
+        self.folder = folder
+        self.encode_seconds = encode_seconds
+        self.resumable = resumable
+        self.drop_upload_after = drop_after
+        self.drop_download_after = drop_after
+        self.changed = threading.Condition()
+        self.tickets: dict[str, str] = {}
+        self.requests: list[str] = []
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def encode(self, ticket_id: str, input_data: bytes):
+        time.sleep(self.encode_seconds)
+        Path(self.folder, f'{ticket_id}.out').write_bytes(b'encoded:' + input_data)
+        with self.changed:
+            self.tickets[ticket_id] = 'done'
+            self.changed.notify_all()
+
+
+class StrangeStatusEncoder(StandInEncoder):
+    """
+    An encoder whose tickets end up in a status the client doesn't know
+    """
+
+    def encode(self, ticket_id: str, input_data: bytes):
+        with self.changed:
+            self.tickets[ticket_id] = 'paused'
+            self.changed.notify_all()
+
+
+class StandInEncoderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: StandInEncoder
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes = b'', headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _upload_path(self) -> Path:
+        return Path(self.server.folder, self.path.rsplit('/', 1)[1] + '.upload')
+
+    def do_HEAD(self):
+        self.server.requests.append(f'HEAD {self.path}')
+        if not self.server.resumable:
+            self._reply(404)
+            return
+        upload_path = self._upload_path()
+        self._reply(200, headers={'Upload-Offset': upload_path.stat().st_size if upload_path.exists() else 0})
+
+    def do_PATCH(self):
+        self.server.requests.append(f'PATCH {self.path} {self.headers["Upload-Offset"]}')
+        upload_path = self._upload_path()
+        offset = upload_path.stat().st_size if upload_path.exists() else 0
+        if int(self.headers['Upload-Offset']) != offset:
+            self._reply(409, headers={'Upload-Offset': offset})
+            return
+
+        remaining = int(self.headers['Content-Length'])
+        with open(upload_path, 'ab') as upload:
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 16 * 1024))
+                upload.write(chunk)
+                remaining -= len(chunk)
+                if 0 < self.server.drop_upload_after <= upload.tell():
+                    self.server.drop_upload_after = 0
+                    self.close_connection = True
+                    return
+
+        data = upload_path.read_bytes()
+        if len(data) == int(self.headers['Upload-Length']) and \
+                hashlib.sha256(data).hexdigest() != upload_path.name.split('.')[0]:
+            upload_path.unlink()
+            self._reply(422)
+            return
+        self._reply(204, headers={'Upload-Offset': len(data)})
+
+    def do_POST(self):
+        self.server.requests.append(f'POST {self.path}')
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        message = BytesParser().parsebytes(f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode() + body)
+        parts = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                 for part in message.get_payload()}
+        options = json.loads(parts['options'])
+        if 'upload' in options:
+            input_data = Path(self.server.folder, options['upload'] + '.upload').read_bytes()
+        else:
+            input_data = parts['input_file']
+
+        with self.server.changed:
+            ticket_id = f'ticket{len(self.server.tickets)}'
+            self.server.tickets[ticket_id] = 'processing'
+        threading.Thread(target=self.server.encode, args=(ticket_id, input_data), daemon=True).start()
+        self._reply(200, json.dumps({'ticket_id': ticket_id}).encode())
+
+    def do_GET(self):
+        self.server.requests.append(f'GET {self.path} {self.headers.get("Range", "")}'.strip())
+        url = urlparse(self.path)
+        if url.path == '/encode/health':
+            with self.server.changed:
+                running = sum(1 for status in self.server.tickets.values() if status == 'processing')
+            self._reply(200, json.dumps({'running': running, 'queued': 0}).encode())
+            return
+
+        ticket_id = url.path.rsplit('/', 1)[1]
+
+        if url.path.startswith('/encode/status/'):
+            wait = float(parse_qs(url.query).get('wait', ['0'])[0]) if self.server.resumable else 0
+            with self.server.changed:
+                self.server.changed.wait_for(lambda: self.server.tickets[ticket_id] != 'processing', wait)
+                self._reply(200, json.dumps({'status': self.server.tickets[ticket_id]}).encode())
+            return
+
+        data = Path(self.server.folder, f'{ticket_id}.out').read_bytes()
+        start = 0
+        status = 200
+        headers = {'X-Content-SHA256': hashlib.sha256(data).hexdigest()}
+        if 'Range' in self.headers:
+            start = int(re.match(r'bytes=(\d+)-', self.headers['Range']).group(1))
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{len(data) - 1}/{len(data)}'
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        if self.server.drop_download_after > 0:
+            self.wfile.write(data[start:self.server.drop_download_after])
+            self.server.drop_download_after = 0
+            self.close_connection = True
+            return
+        self.wfile.write(data[start:])
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_path = Path(self.temp_dir.name, 'input.mp4')
+        self.input_data = os.urandom(1024 * 1024)
+        self.input_path.write_bytes(self.input_data)
+        self.output_path = Path(self.temp_dir.name, 'output.mp4')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _encode(self, encoder: StandInEncoder, log: NoOpTaskWrapper = None) -> tuple[bool, float]:
+        threading.Thread(target=encoder.serve_forever, daemon=True).start()
+        try:
+            started = time.monotonic()
+            result = remote_encode(encoder.url, self.input_path, self.output_path, {'constant_rate_factor': 23}, None,
+                                   log or NoOpTaskWrapper())
+            return result, time.monotonic() - started
+        finally:
+            encoder.shutdown()
+            encoder.server_close()
+
+    def test_transfers_resume_and_completion_is_pushed(self):
+        encoder_folder = os.path.join(self.temp_dir.name, 'encoder')
+        os.mkdir(encoder_folder)
+        encoder = StandInEncoder(encoder_folder, encode_seconds=1.0, drop_after=256 * 1024)
+
+        result, elapsed = self._encode(encoder)
+
+        self.assertTrue(result)
+        self.assertEqual(b'encoded:' + self.input_data, self.output_path.read_bytes())
+        self.assertFalse(Path(f'{self.output_path}.part').exists())
+        # Picked up as soon as the encode finished, not on the next poll
+        self.assertLess(elapsed, 3.0)
+
+        patches = [request for request in encoder.requests if request.startswith('PATCH')]
+        self.assertEqual(2, len(patches))
+        self.assertNotEqual(' 0', patches[1][-2:])
+        downloads = [request for request in encoder.requests if request.startswith('GET /encode/result')]
+        self.assertEqual(2, len(downloads))
+        self.assertIn('bytes=262144-', downloads[1])
+
+    def test_encoder_without_resumable_uploads(self):
+        encoder_folder = os.path.join(self.temp_dir.name, 'encoder')
+        os.mkdir(encoder_folder)
+        encoder = StandInEncoder(encoder_folder, resumable=False)
+
+        result, _ = self._encode(encoder)
+
+        self.assertTrue(result)
+        self.assertEqual(b'encoded:' + self.input_data, self.output_path.read_bytes())
+        self.assertFalse(any(request.startswith('PATCH') for request in encoder.requests))
+
+    def test_encode_video_uses_the_remote_encoder(self):
+        encoder_folder = os.path.join(self.temp_dir.name, 'encoder')
+        os.mkdir(encoder_folder)
+        encoder = StandInEncoder(encoder_folder)
+        threading.Thread(target=encoder.serve_forever, daemon=True).start()
+
+        try:
+            # Paths, like the encode plugins pass, a failure on the remote side would fall back to a local encode
+            with patch('ffmpeg_utils.encode_video_locally', return_value=False) as encode_video_locally:
+                result = encode_video(self.input_path, self.output_path, server_url=encoder.url)
+        finally:
+            encoder.shutdown()
+            encoder.server_close()
+
+        self.assertTrue(result)
+        encode_video_locally.assert_not_called()
+        self.assertEqual(b'encoded:' + self.input_data, self.output_path.read_bytes())
+
+    def test_cancelled_task_stops_waiting(self):
+        encoder_folder = os.path.join(self.temp_dir.name, 'encoder')
+        os.mkdir(encoder_folder)
+        encoder = StandInEncoder(encoder_folder, encode_seconds=30.0)
+        log = NoOpTaskWrapper()
+        threading.Timer(0.5, log.cancel).start()
+
+        with patch('remote_encoder.REMOTE_ENCODE_WAIT_SECONDS', 1):
+            result, elapsed = self._encode(encoder, log)
+
+        self.assertFalse(result)
+        self.assertLess(elapsed, 3.0)
+        self.assertFalse(self.output_path.exists())
+
+    def test_unknown_status_fails_the_ticket(self):
+        encoder_folder = os.path.join(self.temp_dir.name, 'encoder')
+        os.mkdir(encoder_folder)
+        encoder = StrangeStatusEncoder(encoder_folder)
+
+        result, elapsed = self._encode(encoder)
+
+        self.assertFalse(result)
+        self.assertLess(elapsed, 3.0)
+        self.assertFalse(any(request.startswith('GET /encode/result') for request in encoder.requests))
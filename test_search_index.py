@@ -0,0 +1,130 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+import search_index
+from db import db, MediaFolder, MediaFile, Book
+from search_index import init_search_index, apply_text_search, rebuild_search_index, SEARCH_KIND_FOLDER, \
+    SEARCH_KIND_FILE, SEARCH_KIND_BOOK
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        # The listeners follow the module state, other tests' databases have no index
+        self.state = patch.dict(search_index._search_index_state)
+        self.state.start()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.assertTrue(init_search_index(self.app))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        self.state.stop()
+
+    def _folders(self, filter_text: str) -> list[str]:
+        query = apply_text_search(db.session.query(MediaFolder), SEARCH_KIND_FOLDER, MediaFolder.id, filter_text,
+                                  [MediaFolder.name, MediaFolder.tags])
+        return sorted(folder.name for folder in query.all())
+
+    def _files(self, filter_text: str) -> list[str]:
+        query = apply_text_search(db.session.query(MediaFile), SEARCH_KIND_FILE, MediaFile.id, filter_text,
+                                  [MediaFile.filename])
+        return sorted(file.filename for file in query.all())
+
+    def _books(self, filter_text: str, rank: bool = False) -> list[str]:
+        query = apply_text_search(db.session.query(Book), SEARCH_KIND_BOOK, Book.id, filter_text,
+                                  [Book.id, Book.name, Book.tags], rank)
+        books = [book.id for book in query.all()]
+        return books if rank else sorted(books)
+
+    def test_index_follows_inserts_renames_and_deletes(self):
+        folder = MediaFolder(name='Harbor Lights', active=True, tags='boats')
+        db.session.add(folder)
+        db.session.flush()
+        file = MediaFile(folder_id=folder.id, filename='sunset_over_water.mp4', mime_type='video/mp4', archive=False,
+                         filesize=0)
+        book = Book(id='deep-sea', name='Voyage Below', info_url='', active=True, processor='test', tags='ocean')
+        db.session.add_all([file, book])
+        db.session.commit()
+
+        # Every word is matched as a prefix, against the name and the keywords
+        self.assertEqual(['Harbor Lights'], self._folders('har lig'))
+        self.assertEqual(['Harbor Lights'], self._folders('boat'))
+        self.assertEqual([], self._folders('harbor sunset'))
+        self.assertEqual(['sunset_over_water.mp4'], self._files('sun wat'))
+        self.assertEqual(['deep-sea'], self._books('voy'))
+        self.assertEqual(['deep-sea'], self._books('deep'))
+        self.assertEqual(['deep-sea'], self._books('ocean'))
+        # Kinds don't mix
+        self.assertEqual([], self._books('harbor'))
+
+        folder.name = 'Quiet Port'
+        file.filename = 'sunrise.mp4'
+        book.name = 'Surface Tension'
+        book.tags = None
+        db.session.commit()
+
+        self.assertEqual([], self._folders('harbor'))
+        self.assertEqual(['Quiet Port'], self._folders('port'))
+        self.assertEqual([], self._files('sunset'))
+        self.assertEqual(['sunrise.mp4'], self._files('sunrise'))
+        self.assertEqual([], self._books('voyage'))
+        self.assertEqual([], self._books('ocean'))
+        self.assertEqual(['deep-sea'], self._books('tension'))
+
+        db.session.delete(file)
+        db.session.delete(book)
+        db.session.delete(folder)
+        db.session.commit()
+
+        self.assertEqual([], self._folders('port'))
+        self.assertEqual([], self._files('sunrise'))
+        self.assertEqual([], self._books('tension'))
+        self.assertEqual([], db.session.execute(search_index.search_documents_table.select()).all())
+
+    def test_rank_puts_the_closest_match_first(self):
+        db.session.add_all([
+            Book(id='b1', name='A Long History of the Northern Kingdoms and Their Dragon', info_url='', active=True,
+                 processor='test'),
+            Book(id='b2', name='Dragon', info_url='', active=True, processor='test'),
+            Book(id='b3', name='Kingdoms', info_url='', active=True, processor='test'),
+        ])
+        db.session.commit()
+
+        # The shorter name is the closer match, whichever order the rows were added in
+        self.assertEqual(['b2', 'b1'], self._books('drag', rank=True))
+        self.assertEqual(['b1', 'b3'], self._books('kingdoms'))
+        self.assertEqual(['b3', 'b1'], self._books('kingdoms', rank=True))
+
+    def test_rebuild_matches_the_tables(self):
+        db.session.add(MediaFolder(name='Harbor Lights', active=True))
+        db.session.add(Book(id='deep-sea', name='Voyage Below', info_url='', active=True, processor='test'))
+        db.session.commit()
+        db.session.execute(search_index.search_documents_table.delete())
+        db.session.commit()
+        self.assertEqual([], self._folders('harbor'))
+
+        self.assertEqual(2, rebuild_search_index(db.session))
+        self.assertEqual(['Harbor Lights'], self._folders('harbor'))
+        self.assertEqual(['deep-sea'], self._books('voyage'))
+
+    def test_like_fallback(self):
+        db.session.add(MediaFolder(name='Harbor Lights', active=True))
+        db.session.commit()
+
+        # The index only matches the start of words
+        self.assertEqual([], self._folders('arbor'))
+        # Text with no words can't be matched by the index
+        self.assertEqual([], self._folders('--'))
+
+        search_index._search_index_state['enabled'] = False
+        self.assertEqual(['Harbor Lights'], self._folders('arbor'))
+        self.assertEqual([], self._folders('harbour'))
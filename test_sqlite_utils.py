@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import text, func
+
+from db import db, init_db, create_task_session, AppProperties
+from sqlite_utils import apply_sqlite_settings
+
+WRITERS = 2
+READERS = 4
+TRANSACTIONS = 5
+ROWS_PER_TRANSACTION = 200
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.temp_dir.name, 'test.db')
+        init_db(self.app)
+        with self.app.app_context():
+            apply_sqlite_settings(db.engine, 'WAL', 'NORMAL', 64, 8, 10000)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.temp_dir.cleanup()
+
+    def test_connections_are_tuned(self):
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                self.assertEqual('wal', connection.execute(text('PRAGMA journal_mode')).scalar())
+                # NORMAL
+                self.assertEqual(1, connection.execute(text('PRAGMA synchronous')).scalar())
+                self.assertEqual(10000, connection.execute(text('PRAGMA busy_timeout')).scalar())
+                self.assertEqual(-8 * 1024, connection.execute(text('PRAGMA cache_size')).scalar())
+
+    def test_readers_and_writers(self):
+        errors = []
+        writing = threading.Event()
+        writers_done = threading.Event()
+        reads_during_write = []
+
+        def writer(index: int):
+            try:
+                with self.app.app_context():
+                    for transaction in range(TRANSACTIONS):
+                        session = create_task_session()
+                        try:
+                            for row in range(ROWS_PER_TRANSACTION):
+                                session.add(AppProperties(id=f'TEST.{index}.{transaction}.{row}', value='x',
+                                                          comment='Test'))
+                            session.flush()
+                            # Hold the write lock for a while, like a long chapter sync
+                            writing.set()
+                            time.sleep(0.05)
+                            session.commit()
+                        finally:
+                            writing.clear()
+                            session.close()
+            except Exception as ex:
+                errors.append(ex)
+
+        def reader():
+            reads = 0
+            try:
+                with self.app.app_context():
+                    while not writers_done.is_set():
+                        was_writing = writing.is_set()
+                        db.session.query(func.count(AppProperties.id)).scalar()
+                        db.session.rollback()
+                        if was_writing and writing.is_set():
+                            reads += 1
+                    db.session.remove()
+            except Exception as ex:
+                errors.append(ex)
+            reads_during_write.append(reads)
+
+        writer_threads = [threading.Thread(target=writer, args=(index,)) for index in range(WRITERS)]
+        reader_threads = [threading.Thread(target=reader) for _ in range(READERS)]
+        for thread in reader_threads + writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        writers_done.set()
+        for thread in reader_threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        # Readers were never shut out while a write transaction was open
+        self.assertTrue(all(reads > 0 for reads in reads_during_write))
+
+        with self.app.app_context():
+            count = db.session.query(func.count(AppProperties.id)).filter(AppProperties.id.like('TEST.%')).scalar()
+            self.assertEqual(WRITERS * TRANSACTIONS * ROWS_PER_TRANSACTION, count)
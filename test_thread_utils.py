@@ -0,0 +1,90 @@
+import threading
+import time
+from unittest import TestCase
+
+from thread_utils import TaskManager, TaskWrapper
+
+
+class StandInTask(TaskWrapper):
+
+    def run(self, db_session):
+        pass
+
+
+class Test(TestCase):
+
+    def _add(self, manager: TaskManager, name: str, priority: int = 5, weight: int = 1) -> StandInTask:
+        task = StandInTask(name, '', priority, weight)
+        manager.add_task(task)
+        return task
+
+    def test_cancel_queued_task(self):
+        manager = TaskManager()
+        first = self._add(manager, 'first')
+        second = self._add(manager, 'second')
+
+        self.assertIs(second, manager.cancel_task(second.task_id))
+        self.assertTrue(second.is_cancelled)
+        self.assertTrue(second.is_finished)
+        self.assertFalse(second.is_waiting)
+        self.assertIn(second, manager.get_finished_tasks())
+
+        self.assertIs(first, manager.get_task_queue())
+        self.assertIsNone(manager.get_task_queue())
+        self.assertIsNone(manager.cancel_task(-1))
+        self.assertEqual({}, manager.group_weights)
+
+    def test_priority_promotion(self):
+        manager = TaskManager()
+        first = self._add(manager, 'first')
+        second = self._add(manager, 'second')
+        third = self._add(manager, 'third')
+
+        self.assertTrue(manager.adjust_priority(third.task_id, 1))
+        self.assertFalse(manager.adjust_priority(-1, 1))
+
+        self.assertEqual([third, first, second], [manager.get_task_queue() for _ in range(3)])
+        self.assertIsNone(manager.get_task_queue())
+        self.assertEqual({}, manager.group_weights)
+
+    def test_heavy_head_lets_lighter_task_through(self):
+        manager = TaskManager(max_capacity=10)
+        running = self._add(manager, 'running', weight=6)
+        self.assertIs(running, manager.get_task_queue())
+
+        heavy = self._add(manager, 'heavy', weight=8)
+        light = self._add(manager, 'light', weight=2)
+        later = self._add(manager, 'later', priority=9, weight=1)
+
+        # The light task shares the heavy one's priority, the later one has to wait for the whole group
+        self.assertIs(light, manager.get_task_queue())
+        self.assertFalse(manager._can_dispatch())
+        self.assertIsNone(manager.get_task_queue())
+        self.assertEqual(8, manager.get_weight())
+
+        # Nothing fits until capacity is released, then the heavy task is still first in line
+        manager.task_done_queue(running, manager.add_worker(0))
+        manager.task_done_queue(light, manager.add_worker(1))
+        self.assertIs(heavy, manager.get_task_queue())
+        self.assertIs(later, manager.get_task_queue())
+        self.assertEqual({}, manager.group_weights)
+
+    def test_finished_task_wakes_a_waiting_worker(self):
+        manager = TaskManager(max_capacity=10)
+        running = self._add(manager, 'running', weight=8)
+        self.assertIs(running, manager.get_task_queue())
+        heavy = self._add(manager, 'heavy', weight=5)
+
+        picked = []
+        worker = threading.Thread(target=lambda: picked.append(manager.wait_task_queue(timeout=10)))
+        started = time.monotonic()
+        worker.start()
+        time.sleep(0.2)
+        self.assertTrue(worker.is_alive())
+
+        manager.task_done_queue(running, manager.add_worker(0))
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual([heavy], picked)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(5, manager.get_weight())
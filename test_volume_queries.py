@@ -0,0 +1,148 @@
+import datetime
+import json
+import os
+import random
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+from flask import Flask
+from sqlalchemy import func
+
+from db import db, Book, User, VolumeProgress, VolumeLastRead, Chapter
+from image_utils import build_chapter_manifest
+from inout import upgrade_database_schema
+from volume_queries import upsert_recent, rebuild_volume_last_read, find_recent_entries, list_books_for_rating, \
+    manage_book_chapters, find_chapter_scan_states, find_chapter_for_reader
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        for index in range(3):
+            db.session.add(User(id=index + 1, username=f'user{index}', password='x', features=0))
+        for index in range(8):
+            db.session.add(Book(id=f'book-{index}', name=f'Book {index}', info_url='', active=True, processor='test',
+                                rating=index * 25))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def _aggregate(self) -> dict:
+        # What the book list used to compute on every request
+        latest = (db.session.query(VolumeProgress.user_id, VolumeProgress.book_id,
+                                   func.max(VolumeProgress.timestamp).label('latest_timestamp'))
+                  .group_by(VolumeProgress.user_id, VolumeProgress.book_id)
+                  .subquery())
+        rows = (db.session.query(VolumeProgress)
+                .join(latest, (VolumeProgress.user_id == latest.c.user_id) &
+                      (VolumeProgress.book_id == latest.c.book_id) &
+                      (VolumeProgress.timestamp == latest.c.latest_timestamp))
+                .all())
+        return {(row.user_id, row.book_id): (row.chapter_id, row.page_number, row.page_percent, row.timestamp)
+                for row in rows}
+
+    def _summary(self) -> dict:
+        return {(row.user_id, row.book_id): (row.chapter_id, row.page_number, row.page_percent, row.timestamp)
+                for row in db.session.query(VolumeLastRead).all()}
+
+    def _read_randomly(self, count: int):
+        random.seed(11)
+        start = datetime.datetime(2024, 1, 1)
+        # The server stamps progress as it arrives, users hop between books and chapters
+        for minute in range(count):
+            upsert_recent(random.randint(1, 3), f'book-{random.randint(0, 7)}', f'ch{random.randint(1, 12)}',
+                          random.randint(0, 40), None, start + datetime.timedelta(minutes=minute), db.session)
+
+    def test_summary_matches_aggregate(self):
+        self._read_randomly(600)
+
+        expected = self._aggregate()
+        self.assertEqual(expected, self._summary())
+
+        # The history and book list read the summary
+        for user_id in (1, 2, 3):
+            history = find_recent_entries(user_id, 100)
+            self.assertEqual(sorted([(user, book) for user, book in expected if user == user_id
+                                     and int(book.split('-')[1]) * 25 <= 100]),
+                             sorted([(user_id, row.book_id) for row, _ in history]))
+            self.assertEqual(sorted([row.timestamp for row, _ in history], reverse=True),
+                             [row.timestamp for row, _ in history])
+
+            for book, last_read in list_books_for_rating(user_id, 200, sort_field=Book.name):
+                if last_read is None:
+                    self.assertNotIn((user_id, book.id), expected)
+                else:
+                    self.assertEqual(expected[(user_id, book.id)][0], last_read.chapter_id)
+
+        self.assertEqual(len(expected), rebuild_volume_last_read(db.session))
+        self.assertEqual(expected, self._summary())
+
+    def test_migration_backfills_summary(self):
+        self._read_randomly(300)
+        expected = self._aggregate()
+
+        db.session.query(VolumeLastRead).delete()
+        db.session.commit()
+
+        upgrade_database_schema()
+        db.session.expire_all()
+
+        self.assertEqual(expected, self._summary())
+
+    def test_chapter_manifest(self):
+        with tempfile.TemporaryDirectory() as chapter_path:
+            files = [f'{page:03}.png' for page in range(4)]
+            for page, file_name in enumerate(files):
+                Image.new('RGB', (100, 150 + page)).save(os.path.join(chapter_path, file_name))
+
+            chapters = [{'name': name, 'files': files, 'date': '20240101',
+                         'pages': build_chapter_manifest(chapter_path, files)} for name in ('1', '2', '3')]
+            manage_book_chapters('book-0', chapters, db_session=db.session)
+
+            # A rescan of unchanged pages doesn't open them
+            with patch('image_utils.Image.open') as image_open:
+                previous = json.loads(find_chapter_scan_states('book-0')['2']['manifest_json'])
+                manifest = build_chapter_manifest(chapter_path, files, previous)
+                image_open.assert_not_called()
+
+        self.assertEqual([(100, 150 + page, 'png') for page in range(4)],
+                         [(page['w'], page['h'], page['format']) for page in manifest])
+
+        book, chapter, previous_id, next_id = find_chapter_for_reader('book-0', '2')
+        self.assertEqual(('book-0', manifest, '1', '3'), (book.id, chapter.manifest, previous_id, next_id))
+        self.assertEqual((None, '2'), find_chapter_for_reader('book-0', '1')[2:])
+        self.assertIsNone(find_chapter_for_reader('book-0', '4'))
+
+    def test_chapter_sync(self):
+        def chapter(name: str, pages: int) -> dict:
+            return {'name': name, 'files': [f'{page:03}.png' for page in range(pages)], 'date': '20240101'}
+
+        def stored() -> list:
+            db.session.expire_all()
+            return [(row.chapter_id, row.sequence, row.page_count, row.manifest) for row in
+                    db.session.query(Chapter).filter_by(book_id='book-1').order_by(Chapter.sequence)]
+
+        first = dict(chapter('1', 3), pages=[{'name': '000.png'}])
+        self.assertTrue(manage_book_chapters('book-1', [first, chapter('2', 4), chapter('3', 5)]))
+        self.assertFalse(manage_book_chapters('book-1', [first, chapter('2', 4), chapter('3', 5)]))
+
+        # 2 renamed to 2.5 and moved first, 3 removed, 1 grows a page and a new 4 shows up
+        self.assertTrue(manage_book_chapters('book-1', [chapter('2.5', 4), chapter('1', 4), chapter('4', 1)]))
+        self.assertEqual([('2.5', 0, 4, None), ('1', 1, 4, [{'name': '000.png'}]), ('4', 2, 1, None)], stored())
+
+        # Nothing is written until the caller commits
+        manage_book_chapters('book-1', [chapter('4', 1)], db_session=db.session, auto_commit=False)
+        db.session.rollback()
+        self.assertEqual(['2.5', '1', '4'], [row[0] for row in stored()])
@@ -0,0 +1,31 @@
+import io
+import os
+import tempfile
+import zipfile
+from unittest import TestCase
+
+from zip_utils import StoredZipStream
+
+
+class Test(TestCase):
+    def test_stored_zip_stream(self):
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            files = []
+            for index, size in enumerate([0, 1, 5000, 3 * 1024 * 1024 + 7]):
+                file_path = os.path.join(temp_dir, f'{index}.dat')
+                with open(file_path, 'wb') as f:
+                    f.write(os.urandom(size))
+                files.append((file_path, f'Épisode {index}.mp4'))
+
+            stream = StoredZipStream(files, chunk_size=64 * 1024)
+            content = b''.join(stream)
+
+            self.assertEqual(stream.content_length(), len(content))
+
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                self.assertIsNone(archive.testzip())
+                self.assertEqual([name for _, name in files], archive.namelist())
+                for file_path, arc_name in files:
+                    with open(file_path, 'rb') as f:
+                        self.assertEqual(f.read(), archive.read(arc_name))
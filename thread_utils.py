@@ -1,11 +1,12 @@
+import heapq
 import inspect
+import itertools
 import sys
 import threading
 import time
 import traceback
 from abc import ABC, abstractmethod
 from datetime import datetime, timezone
-from queue import PriorityQueue
 from typing import Optional
 import json
 
@@ -34,15 +35,23 @@ class TaskWorker:
 class TaskManager:
     """
     Manages a list of tasks with thread-safe operations.
+
+    Queued tasks live in a binary heap ordered by (priority, task_id). Re-prioritized and cancelled tasks are not
+    removed from the heap, their entry is marked as removed and skipped when it reaches the top (lazy deletion).
+    Workers block on a condition variable and are woken whenever a task may have become runnable.
     """
 
     def __init__(self, max_capacity=100):
 
         self.known_workers: list[TaskWorker] = []
 
-        self.task_queue = PriorityQueue()
+        self.task_heap: list[list] = []  # Heap entries [priority, task_id, sequence, task], task is None once removed
+        self.entry_counter = itertools.count()  # Tie-breaker so a task never gets compared with a removed entry
+        self.task_entries: dict[int, list] = {}  # Map task IDs to their live heap entry
         self.task_lookup: dict[int, TaskWrapper] = {}  # Map task IDs to task objects
+        self.group_weights: dict[int, dict[int, int]] = {}  # Queued task counts by weight, by priority
         self.lock = threading.Lock()
+        self.task_available = threading.Condition(self.lock)
         self.running_tasks: dict[int, TaskWrapper] = {}  # Store running tasks
         self.finished_tasks: dict[int, TaskWrapper] = {}  # Store finished tasks
         self.max_capacity = max_capacity  # Total capacity
@@ -62,26 +71,79 @@ class TaskManager:
     def add_task(self, task: 'TaskWrapper'):
         with self.lock:
             self.task_lookup[task.task_id] = task
-            self.task_queue.put(task)
+            self._push_entry(task)
+            self.task_available.notify()
+
+    def _push_entry(self, task: 'TaskWrapper'):
+        entry = [task.priority, task.task_id, next(self.entry_counter), task]
+        self.task_entries[task.task_id] = entry
+        heapq.heappush(self.task_heap, entry)
+        self._count_weight(task.priority, task.weight, 1)
+
+    def _remove_entry(self, task_id: int) -> Optional['TaskWrapper']:
+        entry = self.task_entries.pop(task_id, None)
+        if entry is None:
+            return None
+        task = entry[3]
+        entry[3] = None
+        self._count_weight(entry[0], task.weight, -1)
+        return task
+
+    def _count_weight(self, priority: int, weight: int, change: int):
+        weights = self.group_weights.setdefault(priority, {})
+        count = weights.get(weight, 0) + change
+        if count > 0:
+            weights[weight] = count
+        else:
+            weights.pop(weight, None)
+            if not weights:
+                del self.group_weights[priority]
+
+    def _group_fits(self, priority: int) -> bool:
+        # The lightest queued task of the group is enough to tell, without walking the heap
+        weights = self.group_weights.get(priority)
+        return weights is not None and min(weights) + self.current_capacity <= self.max_capacity
+
+    def _peek_entry(self) -> Optional[list]:
+        # Discard removed entries sitting on top of the heap
+        while self.task_heap and self.task_heap[0][3] is None:
+            heapq.heappop(self.task_heap)
+        if self.task_heap:
+            return self.task_heap[0]
+        return None
 
     def adjust_priority(self, task_id, new_priority) -> bool:
         with self.lock:
             if task_id in self.task_lookup:
-                task = self.task_lookup.pop(task_id)
+                task = self.task_lookup[task_id]
                 task.priority = new_priority
-                self.task_lookup[task.task_id] = task
-                self._rebuild_queue()
+                if self._remove_entry(task_id) is not None:
+                    self._push_entry(task)
+                    self.task_available.notify_all()
                 task.info(f"Priority adjusted to {new_priority}")
                 return True
         return False
 
-    def _rebuild_queue(self):
-        # Clear and rebuild the priority queue with updated priorities
-        items = list(self.task_lookup.values())
-        while not self.task_queue.empty():
-            self.task_queue.get()
-        for item in items:
-            self.task_queue.put(item)
+    def cancel_task(self, task_id: int) -> Optional['TaskWrapper']:
+        """
+        Cancel a task. A task that is still queued is pulled from the queue and finished right away, a running task
+        is asked to stop through its token.
+        :param task_id: The task to cancel
+        :return: The cancelled task, or None if it is unknown
+        """
+        with self.lock:
+            task = self.task_lookup.get(task_id) or self.finished_tasks.get(task_id)
+            if task is None:
+                return None
+            task.cancel()
+            if self._remove_entry(task_id) is not None:
+                task.set_waiting(False)
+                task.set_finished(True)
+                task.mark_end()
+                self.finished_tasks[task_id] = task
+                del self.task_lookup[task_id]
+                self.task_available.notify_all()
+            return task
 
     def get_task_queue(self):
         """
@@ -89,49 +151,67 @@ class TaskManager:
         Only tasks matching the first task's priority will be considered for execution.
         """
         with self.lock:
-            # Skip it, no capacity
-            if self.current_capacity >= self.max_capacity:
-                return None
-
-            if self.task_queue.empty():
-                return None  # No tasks left
-
-            temp_queue = []  # Temporary storage for tasks that can't run
-            eligible_tasks = []  # Tasks eligible to run (same priority group)
-
-            # Step 1: Identify the priority group
-            first_task = self.task_queue.get()
-            temp_queue.append(first_task)  # Hold the first task temporarily
-
-            target_priority = first_task.priority
-
-            # Step 2: Collect all tasks with the same priority
-            while not self.task_queue.empty():
-                task = self.task_queue.get()
-                if task.priority == target_priority:
-                    eligible_tasks.append(task)
-                else:
-                    temp_queue.append(task)
+            return self._next_task()
 
-            # Step 3: Check eligible tasks for capacity
-            for task in [first_task] + eligible_tasks:
-                if task.weight + self.current_capacity <= self.max_capacity:
+    def wait_task_queue(self, timeout: Optional[float] = None):
+        """
+        Block until a task can be executed, then retrieve it (see get_task_queue).
+        :param timeout: Max seconds to wait, None waits forever
+        :return: The task to execute, or None if the timeout expired
+        """
+        with self.lock:
+            task = self._next_task()
+            if task is None:
+                self.task_available.wait_for(lambda: self._can_dispatch(), timeout)
+                task = self._next_task()
+            return task
+
+    def _can_dispatch(self) -> bool:
+        if self.current_capacity >= self.max_capacity:
+            return False
+        entry = self._peek_entry()
+        if entry is None:
+            return False
+        # The head may not fit, but a lighter task of the same priority might
+        return self._group_fits(entry[0])
+
+    def _next_task(self):
+        # Skip it, no capacity
+        if self.current_capacity >= self.max_capacity:
+            return None
 
-                    # Put back skipped tasks
-                    for skipped_task in temp_queue + eligible_tasks:
-                        if skipped_task.task_id != task.task_id:  # Don't re-add the running task
-                            self.task_queue.put(skipped_task)
+        first_entry = self._peek_entry()
+        if first_entry is None:
+            return None  # No tasks left
 
-                    self.running_tasks[task.task_id] = task
-                    self._update_weights()
+        target_priority = first_entry[0]
+        if not self._group_fits(target_priority):
+            return None  # No task could fit in the current capacity
 
-                    return task
+        # Pop tasks of the leading priority group until one fits, the rest go back on the heap
+        skipped = []
+        selected = None
+        while self.task_heap and self.task_heap[0][0] == target_priority:
+            entry = heapq.heappop(self.task_heap)
+            task = entry[3]
+            if task is None:
+                continue
+            if task.weight + self.current_capacity <= self.max_capacity:
+                selected = task
+                break
+            skipped.append(entry)
+
+        for entry in skipped:
+            heapq.heappush(self.task_heap, entry)
+
+        if selected is None:
+            return None  # No task could fit in the current capacity
 
-            # Step 4: No eligible task could run, put everything back
-            for skipped_task in temp_queue + eligible_tasks:
-                self.task_queue.put(skipped_task)
+        self._remove_entry(selected.task_id)
+        self.running_tasks[selected.task_id] = selected
+        self.current_capacity += selected.weight
 
-            return None  # No task could fit in the current capacity
+        return selected
 
     def _update_weights(self):
         calculated_weight = 0
@@ -142,9 +222,7 @@ class TaskManager:
 
     def task_done_queue(self, task: 'TaskWrapper', worker_status: TaskWorker):
         worker_status.position = 88
-        time.sleep(0.001)
         with self.lock:
-            time.sleep(0.1)
             worker_status.position = 89
             if task.task_id in self.task_lookup:
                 self.finished_tasks[task.task_id] = task
@@ -155,7 +233,8 @@ class TaskManager:
             worker_status.position = 91
             self._update_weights()
             worker_status.position = 92
-            self.task_queue.task_done()
+            # Capacity was released, waiting workers may be able to pick up something heavier
+            self.task_available.notify_all()
 
     def get_finished_tasks(self):
         with self.lock:
@@ -284,7 +363,7 @@ class TaskWrapper(ABC):
         self.start_time = None
         self.end_time = None
         self.user = None
-        self.post_task = None
+        self.post_tasks: list['TaskWrapper'] = []
         self.ref_book_id = ''
         self.ref_folder_id = ''
 
@@ -340,7 +419,13 @@ class TaskWrapper(ABC):
         return int(diff.total_seconds())
 
     def run_after(self, task: 'TaskWrapper'):
-        self.post_task = task
+        """
+        Queue a follow-up task, it is added to the task queue once this task finishes successfully.
+
+        Args:
+            task (TaskWrapper): The task to queue.
+        """
+        self.post_tasks.append(task)
 
     def update_logging_level(self, logging_level: int):
         """
@@ -0,0 +1,137 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average, with up to burst of them back to back.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        :param rate: Tokens added per second
+        :param burst: Most tokens the bucket holds
+        """
+        self.rate = max(rate, 0.001)
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cost: float = 1.0):
+        """
+        Wait until a token is available and take cost tokens. A cost above one leaves the bucket in debt, so the next
+        request waits longer, that is how a slower pace for a single request is kept.
+        :param cost: Tokens the request uses up
+        """
+        self._take(1, cost)
+
+    def acquire_together(self, cost: float):
+        """
+        Wait until the bucket holds enough tokens for cost requests sent back to back and take them, for requests that
+        can't be paced one by one. A cost above the burst waits for a full bucket and leaves the rest as debt.
+        :param cost: Tokens the requests use up
+        """
+        self._take(min(cost, self.burst), cost)
+
+    def _take(self, needed: float, cost: float):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= cost
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostLimiter:
+    """
+    Politeness limits for one host, a token bucket for the request rate and a cap on requests in flight.
+    """
+
+    def __init__(self, rate: float, burst: int, concurrency: int):
+        """
+        :param rate: Requests per second
+        :param burst: Requests allowed back to back
+        :param concurrency: Requests in flight at once
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = max(concurrency, 1)
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+
+    @contextmanager
+    def request(self, cost: float = 1.0):
+        """
+        Hold a slot for the duration of a request, waiting on the rate limit first.
+        :param cost: Tokens the request uses up, see TokenBucket.acquire
+        """
+        with self.slots:
+            self.bucket.acquire(cost)
+            yield
+
+    @contextmanager
+    def batch(self, count: int, cost: float):
+        """
+        Hold slots for a batch of requests made by one curl call, for the whole call. One slot is waited for, then
+        any other free ones are taken, up to count. With a single slot the batch is sent one request after another and
+        paced by the caller, with more its requests go out back to back, so the bucket must hold all of them first.
+        :param count: Most requests the batch sends at once
+        :param cost: Tokens the whole batch uses up
+        :return: The slots held, the requests the batch may send at once
+        """
+        self.slots.acquire()
+        held = 1
+        while held < count and self.slots.acquire(blocking=False):
+            held += 1
+        try:
+            if held > 1:
+                self.bucket.acquire_together(cost)
+            else:
+                self.bucket.acquire(cost)
+            yield held
+        finally:
+            for _ in range(held):
+                self.slots.release()
+
+
+_host_limiters: dict[str, HostLimiter] = {}
+_host_limiters_lock = threading.Lock()
+
+
+def get_host_limiter(url: str, rate: float, burst: int, concurrency: int) -> HostLimiter:
+    """
+    The limiter of the host the URL points to. It is shared by every task of this process, so two books downloading
+    from the same site stay within one budget. The limits given when a host is first seen are kept.
+    :param url: Any URL on the host
+    :param rate: Requests per second
+    :param burst: Requests allowed back to back
+    :param concurrency: Requests in flight at once
+    :return: The limiter
+    """
+    host = urlparse(url).netloc.lower()
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None:
+            limiter = HostLimiter(rate, burst, concurrency)
+            _host_limiters[host] = limiter
+        return limiter
+
+
+def backoff_delay(attempt: int, base: float = 2.0, cap: float = 60.0, rng: Optional[random.Random] = None) -> float:
+    """
+    Exponential backoff with full jitter, so retries from several workers don't line up.
+    :param attempt: The retry number, starting at 1
+    :param base: Delay of the first retry
+    :param cap: Longest delay
+    :param rng: Random source, for tests
+    :return: Seconds to wait
+    """
+    rng = rng or random
+    return rng.uniform(0, min(cap, base * (2 ** (attempt - 1))))
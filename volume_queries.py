@@ -1,14 +1,18 @@
+import json
 import logging
 from datetime import date, datetime
 from typing import Optional, List, Tuple
 
 from flask_sqlalchemy.session import Session
-from sqlalchemy import desc, func, or_
+from sqlalchemy import desc, func, delete, insert, select, update, type_coerce, Text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import aliased
 
 from date_utils import convert_yyyymmdd_to_date
-from db import Book, Chapter, VolumeProgress, VolumeBookmark, db, Tag
+from db import Book, Chapter, VolumeProgress, VolumeBookmark, db, Tag, VolumeLastRead
+from paging_utils import after_key_filter
+from search_index import apply_text_search, SEARCH_KIND_BOOK
 from text_utils import is_not_blank
 from thread_utils import TaskWrapper
 
@@ -29,37 +33,19 @@ def find_book_by_id(book_id: str, db_session: Session = None) -> Optional[Book]:
 
 # Recent / Viewed
 
-def find_recent_entries(user_id: int, max_rating: int) -> Optional[List[Tuple[VolumeProgress, str]]]:
+def find_recent_entries(user_id: int, max_rating: int) -> Optional[List[Tuple[VolumeLastRead, str]]]:
     """
-    Find the user's recent activities, grouped by book_id with the latest timestamp,
-    and filtered by the book's rating.
+    Find the user's recent activities, the latest entry of each book, filtered by the book's rating.
     :param user_id: The user's ID.
     :param max_rating: The maximum rating allowed for the books.
-    :return: List of recent VolumeProgress entries.
+    :return: List of recent VolumeLastRead entries, with the book's name.
     """
-    # Subquery to get the latest timestamp per book_id
-    latest_entries_subquery = (
-        db.session.query(
-            VolumeProgress.book_id,
-            func.max(VolumeProgress.timestamp).label("latest_timestamp")
-        )
-        .filter(VolumeProgress.user_id == user_id)
-        .group_by(VolumeProgress.book_id)
-        .subquery()
-    )
-
-    # Alias for the book model to apply rating filter
-    BookAlias = aliased(Book)
-
-    # Main query: Join with the subquery and filter by max_rating
     return (
-        db.session.query(VolumeProgress, BookAlias.name)
-        .join(latest_entries_subquery,
-              (VolumeProgress.book_id == latest_entries_subquery.c.book_id) &
-              (VolumeProgress.timestamp == latest_entries_subquery.c.latest_timestamp))
-        .join(BookAlias, VolumeProgress.book_id == BookAlias.id)
-        .filter(BookAlias.rating <= max_rating)
-        .order_by(desc(VolumeProgress.timestamp))
+        db.session.query(VolumeLastRead, Book.name)
+        .join(Book, VolumeLastRead.book_id == Book.id)
+        .filter(VolumeLastRead.user_id == user_id)
+        .filter(Book.rating <= max_rating)
+        .order_by(desc(VolumeLastRead.timestamp))
         .limit(35)
         .all()
     )
@@ -181,8 +167,52 @@ def find_chapter_by_sequence(book_id: str, sequence: int) -> Optional[Chapter]:
     return Chapter.query.filter_by(book_id=book_id, sequence=sequence).first()
 
 
+def _neighbour_chapter_id(step: int):
+    neighbour = aliased(Chapter)
+    return (select(neighbour.chapter_id)
+            .where(neighbour.book_id == Chapter.book_id, neighbour.sequence == Chapter.sequence + step)
+            .limit(1)
+            .scalar_subquery())
+
+
+# Built once, constructing the aliases costs more than running the query
+_previous_chapter_id = _neighbour_chapter_id(-1)
+_next_chapter_id = _neighbour_chapter_id(1)
+
+
+def find_chapter_for_reader(book_id: str, chapter_id: str) -> Optional[tuple[Book, Chapter, Optional[str], Optional[str]]]:
+    """
+    Everything the reader needs to open a chapter, in one query
+    :param book_id: Book ID
+    :param chapter_id: Chapter ID
+    :return: (book, chapter, previous chapter id, next chapter id), None if the book or chapter is missing
+    """
+    return (db.session.query(Book, Chapter, _previous_chapter_id, _next_chapter_id)
+            .join(Chapter, Chapter.book_id == Book.id)
+            .filter(Book.id == book_id, Chapter.chapter_id == chapter_id)
+            .first())
+
+
+def find_chapter_scan_states(book_id: str, db_session: Session = db.session) -> dict[str, dict]:
+    """
+    What the last scan recorded for each chapter of a book, so a rescan can skip chapter folders that haven't changed
+    and only open pages that did
+    :param book_id: Book ID
+    :param db_session: The database session
+    :return: Chapter ID to a dict of mtime, page_count, files, date (YYYYMMDD) and manifest_json (the stored manifest
+    text, may be None, only chapters that are rescanned need it decoded)
+    """
+    rows = (db_session.query(Chapter.chapter_id, Chapter.folder_mtime, Chapter.page_count, Chapter.image_names,
+                             Chapter.date, type_coerce(Chapter.manifest, Text).label('manifest_json'))
+            .filter(Chapter.book_id == book_id)
+            .all())
+    return {row.chapter_id: {'mtime': row.folder_mtime, 'page_count': row.page_count,
+                             'files': row.image_names.split(',') if row.image_names else [],
+                             'date': row.date.strftime('%Y%m%d'), 'manifest_json': row.manifest_json} for row in rows}
+
+
 def _build_books_query(max_rating: int = 0, filter_text: str = None, user_id: Optional[int] = None,
-                       tags: list[str] = [], db_session: Session = db.session):
+                       tags: list[str] = [], db_session: Session = db.session, rank_search: bool = False):
     """
     Used to share book search functionality
     :param max_rating:
@@ -191,22 +221,8 @@ def _build_books_query(max_rating: int = 0, filter_text: str = None, user_id: Op
     """
 
     if user_id is not None:
-
-        # Aliased subquery to get the latest VolumeProgress entry for each book for a given user
-        latest_volume_progress = (
-            db.session.query(
-                VolumeProgress.book_id,
-                func.max(VolumeProgress.timestamp).label("latest_timestamp")
-            )
-            .filter(VolumeProgress.user_id == user_id)
-            .group_by(VolumeProgress.book_id)
-            .subquery()
-        )
-
-        # Aliased for easy reference in join condition
-        vp_alias = aliased(VolumeProgress)
-
-        query = db.session.query(Book, vp_alias)
+        query = db.session.query(Book, VolumeLastRead).outerjoin(
+            VolumeLastRead, (VolumeLastRead.user_id == user_id) & (VolumeLastRead.book_id == Book.id))
     else:
         query = db.session.query(Book)
 
@@ -214,13 +230,8 @@ def _build_books_query(max_rating: int = 0, filter_text: str = None, user_id: Op
         query = query.filter(Book.rating <= max_rating)
 
     if is_not_blank(filter_text):
-        query = query.filter(
-            or_(
-                Book.name.like(f'%{filter_text}%'),
-                Book.id.like(f'%{filter_text}%'),
-                Book.tags.like(f'%{filter_text}%')
-            )
-        )
+        query = apply_text_search(query, SEARCH_KIND_BOOK, Book.id, filter_text, [Book.name, Book.id, Book.tags],
+                                  rank_search)
 
     if tags:
         # Normalize tags to uppercase (to match how we store them)
@@ -235,7 +246,7 @@ def _build_books_query(max_rating: int = 0, filter_text: str = None, user_id: Op
 
 
 def _build_books_with_progress_query(user_id: int, max_rating: int = 0, filter_text: str = None, tags: list[str] = [],
-                                     db_session: Session = db.session):
+                                     db_session: Session = db.session, rank_search: bool = False):
     """
     Used to share book search functionality
     :param max_rating:
@@ -244,42 +255,16 @@ def _build_books_with_progress_query(user_id: int, max_rating: int = 0, filter_t
     :return:
     """
 
-    # Aliased subquery to get the latest VolumeProgress entry for each book for a given user
-    latest_volume_progress = (
-        db.session.query(
-            VolumeProgress.book_id,
-            func.max(VolumeProgress.timestamp).label("latest_timestamp")
-        )
-        .filter(VolumeProgress.user_id == user_id)
-        .group_by(VolumeProgress.book_id)
-        .subquery()
-    )
-
-    # Aliased for easy reference in join condition
-    vp_alias = aliased(VolumeProgress)
-
-    query = db.session.query(Book, vp_alias)
-
-    query = query.outerjoin(
-        latest_volume_progress,
-        Book.id == latest_volume_progress.c.book_id
-    ).outerjoin(
-        vp_alias,
-        (vp_alias.book_id == Book.id) &
-        (vp_alias.timestamp == latest_volume_progress.c.latest_timestamp)
-    )
+    # The user's last read chapter of each book
+    query = db.session.query(Book, VolumeLastRead).outerjoin(
+        VolumeLastRead, (VolumeLastRead.user_id == user_id) & (VolumeLastRead.book_id == Book.id))
 
     if max_rating < 200:
         query = query.filter(Book.rating <= max_rating)
 
     if is_not_blank(filter_text):
-        query = query.filter(
-            or_(
-                Book.name.like(f'%{filter_text}%'),
-                Book.id.like(f'%{filter_text}%'),
-                Book.tags.like(f'%{filter_text}%')
-            )
-        )
+        query = apply_text_search(query, SEARCH_KIND_BOOK, Book.id, filter_text, [Book.name, Book.id, Book.tags],
+                                  rank_search)
 
     if tags:
         # Normalize tags to uppercase (to match how we store them)
@@ -297,7 +282,9 @@ def _build_books_with_progress_query(user_id: int, max_rating: int = 0, filter_t
 def list_books_for_rating(user_id: int, max_rating: int, filter_text: str = None, filter_tags: list[str] = [],
                           sort_field=None,
                           sort_descending: bool = False, query_offset: int = 0, query_limit: int = 0,
-                          db_session: Session = db.session) -> List[tuple[Book, VolumeProgress]]:
+                          db_session: Session = db.session, rank_search: bool = False,
+                          after_key: Optional[tuple] = None) -> \
+        List[tuple[Book, VolumeLastRead]]:
     """
     List the books that a user has access to based upon their criteria and the search window
     :param filter_tags:
@@ -309,9 +296,15 @@ def list_books_for_rating(user_id: int, max_rating: int, filter_text: str = None
     :param query_limit: How many items should we return?
     :param user_id:
     :param db_session:
+    :param rank_search: Order by search relevance first, when filtering
+    :param after_key: (sort value, id) of the last book already sent, to seek past instead of using an offset
     :return:
     """
-    query = _build_books_with_progress_query(user_id, max_rating, filter_text, tags=filter_tags, db_session=db_session)
+    query = _build_books_with_progress_query(user_id, max_rating, filter_text, tags=filter_tags, db_session=db_session,
+                                             rank_search=rank_search)
+
+    if after_key is not None:
+        query = query.filter(after_key_filter(sort_field, Book.id, sort_descending, after_key))
 
     if sort_descending:
         query = query.order_by(sort_field.desc(), Book.id.desc())
@@ -440,7 +433,7 @@ def upsert_book(book_id: str, name: str, processor: str, active: bool, info_url:
 # Function to update live book details
 def update_book_live(book_id: str, last_date: date, last_chapter: str, cover: str, first_chapter: str,
                      sync_tags: bool = False,
-                     logger: TaskWrapper = None, db_session: Session = db.session):
+                     logger: TaskWrapper = None, db_session: Session = db.session, auto_commit: bool = True) -> bool:
     """
     This is explicitly an update request for a book
     :param sync_tags:
@@ -451,7 +444,8 @@ def update_book_live(book_id: str, last_date: date, last_chapter: str, cover: st
     :param first_chapter:
     :param logger:
     :param db_session:
-    :return:
+    :param auto_commit: Commit the changes, False leaves the transaction open for the caller
+    :return: True if the book was changed
     """
     try:
         # Try to get the book with the specified ID
@@ -482,10 +476,12 @@ def update_book_live(book_id: str, last_date: date, last_chapter: str, cover: st
             tag_list = [t.strip().upper() for t in (book.tags or "").split(",") if t.strip()]
             sync_book_tags(book, tag_list, db_session)
 
-            db_session.commit()
+            if auto_commit:
+                db_session.commit()
             if logger is not None:
                 logger.info(f"Updated book with ID {book_id}")
-        else:
+            return True
+        elif auto_commit:
             # Nothing to change
             db_session.rollback()
 
@@ -493,6 +489,8 @@ def update_book_live(book_id: str, last_date: date, last_chapter: str, cover: st
         if logger is not None:
             logger.error(f"Could not find book for {book_id}")
 
+    return False
+
 
 # Function to insert or update a book record
 def upsert_recent(user_id: int, book_id: str, chapter_id: str, page_number: int | None, page_percent: float | None,
@@ -508,100 +506,142 @@ def upsert_recent(user_id: int, book_id: str, chapter_id: str, page_number: int
     :param db_session:
     :return:
     """
-    try:
-        # Try to get the book with the specified ID
-        existing_progress = db_session.query(VolumeProgress).filter(VolumeProgress.user_id == user_id,
-                                                                    VolumeProgress.book_id == book_id,
-                                                                    VolumeProgress.chapter_id == chapter_id).one()
+    upsert_recent_entries([{'user_id': user_id, 'book_id': book_id, 'chapter_id': chapter_id,
+                            'page_number': page_number, 'page_percent': page_percent, 'timestamp': timestamp}],
+                          db_session)
+    db_session.commit()
 
-        existing_progress.chapter_id = chapter_id
-        existing_progress.page_number = page_number
-        existing_progress.page_percent = page_percent
-        existing_progress.timestamp = timestamp
 
-        # Commit the updates
-        db_session.commit()
+def upsert_recent_entries(entries: List[dict], db_session: Session):
+    """
+    Add/update many recent entries, and the last read summary of their books, with INSERT ... ON CONFLICT DO UPDATE.
+    The caller commits.
+    :param entries: Dicts of user_id, book_id, chapter_id, page_number, page_percent and timestamp, at most one per
+    user, book and chapter
+    :param db_session: The database session
+    """
+    if len(entries) == 0:
+        return
 
-    except NoResultFound:
-        # If no book is found, create a new record
-        new_progress = VolumeProgress(
-            user_id=user_id,
-            book_id=book_id,
-            chapter_id=chapter_id,
-            page_number=page_number,
-            page_percent=page_percent,
-            timestamp=timestamp
-        )
+    statement = sqlite_insert(VolumeProgress)
+    statement = statement.on_conflict_do_update(index_elements=['user_id', 'book_id', 'chapter_id'],
+                                                set_={'page_number': statement.excluded.page_number,
+                                                      'page_percent': statement.excluded.page_percent,
+                                                      'timestamp': statement.excluded.timestamp})
+    db_session.execute(statement, entries)
 
-        # Add and commit the new book
-        db_session.add(new_progress)
-        db_session.commit()
+    statement = sqlite_insert(VolumeLastRead)
+    # Several chapters of a book can arrive together, an older entry must not replace a newer one
+    statement = statement.on_conflict_do_update(index_elements=['user_id', 'book_id'],
+                                                set_={'chapter_id': statement.excluded.chapter_id,
+                                                      'page_number': statement.excluded.page_number,
+                                                      'page_percent': statement.excluded.page_percent,
+                                                      'timestamp': statement.excluded.timestamp},
+                                                where=VolumeLastRead.timestamp <= statement.excluded.timestamp)
+    db_session.execute(statement, entries)
 
 
-# Function to manage book chapters
-def manage_book_chapters(book_id: str, chapters, logger: TaskWrapper = None, db_session: Session = db.session):
-    # Retrieve existing chapters for the book
-    exiting_chapters = db_session.query(Chapter).filter_by(book_id=book_id).order_by(Chapter.sequence).all()
-    existing_lookup = {}
+def rebuild_volume_last_read(db_session: Session, logger: TaskWrapper = None) -> int:
+    """
+    Throw away the last read summary and build it again from every VolumeProgress entry.
+    :param db_session: The database session
+    :param logger: Optional task to log against
+    :return: Number of summary rows
+    """
+    newest = aliased(VolumeProgress)
+    newest_id = (select(newest.id)
+                 .where(newest.user_id == VolumeProgress.user_id, newest.book_id == VolumeProgress.book_id)
+                 .order_by(newest.timestamp.desc(), newest.id.desc())
+                 .limit(1)
+                 .scalar_subquery())
 
-    for exiting_chapter in exiting_chapters:
-        existing_lookup[exiting_chapter.chapter_id] = exiting_chapter
+    db_session.execute(delete(VolumeLastRead))
+    db_session.execute(insert(VolumeLastRead).from_select(
+        ['user_id', 'book_id', 'chapter_id', 'page_number', 'page_percent', 'timestamp'],
+        select(VolumeProgress.user_id, VolumeProgress.book_id, VolumeProgress.chapter_id, VolumeProgress.page_number,
+               VolumeProgress.page_percent, VolumeProgress.timestamp).where(VolumeProgress.id == newest_id)))
+    db_session.commit()
 
-    sequence_number = 0
+    count = db_session.query(func.count()).select_from(VolumeLastRead).scalar()
 
-    for chapter in chapters:
-        chapter_name = chapter['name']
-        page_count = len(chapter['files'])
-        pages = ','.join(chapter['files'])
-        chapter_date = convert_yyyymmdd_to_date(chapter['date'])
+    if logger is not None:
+        logger.info(f'Rebuilt {count} last read entries')
 
-        if logger is not None and logger.can_trace():
-            logger.trace(f"Finding {chapter_name}")
+    return count
 
-        if chapter_name in existing_lookup:
-            exiting_chapter = existing_lookup[chapter_name]
-            del existing_lookup[chapter_name]
 
-            if exiting_chapter.sequence != sequence_number or exiting_chapter.page_count != page_count or exiting_chapter.image_names != pages or exiting_chapter.date != chapter_date:
-                exiting_chapter.sequence = sequence_number
-                exiting_chapter.page_count = page_count
-                exiting_chapter.image_names = pages
-                db_session.commit()
-
-                if logger is not None and logger.can_debug():
-                    logger.debug(f"Updated Chapter {book_id} {chapter_name}")
-            else:
-                if logger is not None and logger.can_trace():
-                    logger.trace(f"Chapter {book_id} {chapter_name} in Sync")
+# Function to manage book chapters
+def manage_book_chapters(book_id: str, chapters, logger: TaskWrapper = None, db_session: Session = db.session,
+                         auto_commit: bool = True) -> bool:
+    """
+    Sync the chapter rows of a book with the chapters found on disk. Only the differences are written, with one bulk
+    insert, update and delete, in a single transaction.
+    :param book_id: The book
+    :param chapters: Chapter dicts with name, files, date and optionally pages (the manifest, left out it keeps the
+    stored one) and mtime (of the folder), in reading order
+    :param logger:
+    :param db_session:
+    :param auto_commit: Commit the changes, False leaves it to the caller so the book update can share the transaction
+    :return: True if any chapter row changed
+    """
+    existing_lookup = {row.chapter_id: row for row in db_session.execute(
+        select(Chapter.book_id, Chapter.chapter_id, Chapter.sequence, Chapter.page_count, Chapter.image_names,
+               Chapter.date, Chapter.folder_mtime, type_coerce(Chapter.manifest, Text).label('manifest_json'))
+        .where(Chapter.book_id == book_id))}
 
-        else:
-            new_chapter = Chapter(
-                book_id=book_id,
-                chapter_id=chapter_name,
-                page_count=page_count,
-                image_names=pages,
-                sequence=sequence_number,
-                date=chapter_date
-            )
-
-            # Add and commit the new chapter
-            db_session.add(new_chapter)
-            db_session.commit()
+    new_rows = []
+    changed_rows = []
 
+    for sequence_number, chapter in enumerate(chapters):
+        chapter_name = chapter['name']
+        values = {'book_id': book_id, 'chapter_id': chapter_name, 'sequence': sequence_number,
+                  'page_count': len(chapter['files']), 'image_names': ','.join(chapter['files']),
+                  'date': convert_yyyymmdd_to_date(chapter['date'])}
+        manifest = chapter.get('pages')
+        if manifest is not None:
+            values['manifest'] = manifest
+        if 'mtime' in chapter:
+            values['folder_mtime'] = chapter['mtime']
+
+        existing = existing_lookup.pop(chapter_name, None)
+
+        if existing is None:
+            new_rows.append(values)
             if logger is not None and logger.can_debug():
                 logger.debug(f"New Chapter {book_id} {chapter_name}")
+        # The stored manifest is compared as text, so unchanged books don't decode every manifest again
+        elif any(getattr(existing, key) != value for key, value in values.items() if key != 'manifest') or (
+                manifest is not None and existing.manifest_json != json.dumps(manifest)):
+            changed_rows.append(values)
+            if logger is not None and logger.can_debug():
+                logger.debug(f"Updated Chapter {book_id} {chapter_name}")
+        elif logger is not None and logger.can_trace():
+            logger.trace(f"Chapter {book_id} {chapter_name} in Sync")
+
+    removed_ids = list(existing_lookup.keys())
 
-        sequence_number = sequence_number + 1
+    if len(new_rows) == 0 and len(changed_rows) == 0 and len(removed_ids) == 0:
+        return False
+
+    if logger is not None and logger.can_trace():
+        for chapter_id in removed_ids:
+            logger.trace(f"Erasing Chapter {chapter_id}")
 
     try:
-        for exiting_chapter in existing_lookup.values():
-            if logger is not None and logger.can_trace():
-                logger.trace(f"Erasing Chapter {exiting_chapter.chapter_id}")
-            db_session.delete(exiting_chapter)
+        if len(removed_ids) > 0:
+            db_session.execute(delete(Chapter).where(Chapter.book_id == book_id, Chapter.chapter_id.in_(removed_ids)))
+        if len(new_rows) > 0:
+            db_session.execute(insert(Chapter), new_rows)
+        # Rows are grouped by the columns they set, chapters without a manifest keep the stored one
+        for columns in {tuple(row.keys()) for row in changed_rows}:
+            db_session.execute(update(Chapter), [row for row in changed_rows if tuple(row.keys()) == columns])
+        if auto_commit:
             db_session.commit()
-    except Exception as ex:
-        logging.exception(ex)
-        logger.info(existing_lookup)
+    except Exception:
+        db_session.rollback()
+        raise
+
+    return True
 
 
 # Function to manage book chapters
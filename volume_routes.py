@@ -2,26 +2,31 @@ import io
 import logging
 import os
 import shutil
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
-from PIL import Image
 from flask import Blueprint, send_from_directory, current_app, request, make_response, abort, send_file
 from werkzeug.utils import secure_filename
 
 from auth_utils import shall_authenticate_user, feature_required, feature_required_with_cookie, get_uid
 from common_utils import generate_success_response, generate_failure_response
-from constants import PROPERTY_SERVER_VOLUME_FOLDER, PROPERTY_SERVER_VOLUME_READY, APP_KEY_PROCESSORS
+from constants import PROPERTY_SERVER_VOLUME_FOLDER, PROPERTY_SERVER_VOLUME_READY, APP_KEY_PROCESSORS, \
+    APP_KEY_IMAGE_CACHE, QUICK_IMAGE_WIDTH, APP_KEY_COUNT_CACHE, APP_KEY_PROGRESS_BUFFER
 from date_utils import convert_date_to_yyyymmdd, convert_datetime_to_yyyymmdd
 from db import db, Book
 from feature_flags import BOOKMARKS, VIEW_BOOKS, MANAGE_VOLUME
-from image_utils import split_and_save_image, merge_two_images
+from http_cache_utils import FileValidators, set_cache_headers
+from image_cache import DerivedImageCache
+from image_utils import split_and_save_image, merge_two_images, shrink_image_to_width, build_chapter_manifest, \
+    read_page_info
 from messages import msg_action_cancelled_wrong, msg_missing_parameter, msg_invalid_parameter, \
     msg_access_denied_content_rating, msg_operation_complete, msg_action_failed, msg_server_error, msg_book_added, \
     msg_book_removed
 from number_utils import is_integer, parse_boolean, is_boolean
+from paging_utils import PageCursor, CountCache, PAGE_PHASE_BOOKS, PAGE_PHASE_OFFSET
+from progress_buffer import ProgressBuffer
 from text_utils import is_blank, clean_string, is_valid_book_id, is_not_blank
 from volume_queries import list_books_for_rating, find_chapters_by_book, find_book_by_id, find_chapter_by_id, \
-    find_chapter_by_sequence, upsert_book, upsert_recent, \
+    find_chapter_for_reader, upsert_book, \
     find_bookmarks, add_volume_bookmark, remove_volume_bookmark, \
     count_books_for_rating, find_recent_entries, manage_remove_book, find_tags
 from volume_utils import get_volume_max_rating
@@ -96,6 +101,10 @@ def get_books(user_details: dict) -> tuple:
         elif sort == 'DD':
             book_sort = Book.last_date
             sort_descending = True
+        elif sort == 'RL':
+            # Best search matches first, name breaks ties
+            book_sort = Book.name
+            sort_descending = False
         else:
             book_sort = Book.name
             sort_descending = False
@@ -103,20 +112,59 @@ def get_books(user_details: dict) -> tuple:
         book_sort = Book.name
         sort_descending = False
 
-    total_books = count_books_for_rating(requested_rating_limit, filter_text, filter_tags)
+    rank_search = sort == 'RL' and is_not_blank(filter_text)
 
-    if offset > total_books:
-        offset = 0
+    # Clients that send a cursor (blank for the first page) page by keyset, older clients keep using offset
+    keyset_paging = request.form.get('cursor') is not None
+    cursor = None
+    if keyset_paging and is_not_blank(request.form.get('cursor')):
+        try:
+            cursor = PageCursor.decode(clean_string(request.form.get('cursor')), sort)
+        except ValueError:
+            return generate_failure_response('Invalid cursor', messages=[msg_invalid_parameter('cursor')])
+        offset = cursor.offset
+
+    include_total = parse_boolean(request.form.get('total', 'true'))
+    count_cache: CountCache = current_app.config[APP_KEY_COUNT_CACHE]
+    next_cursor = None
+
+    total_books = None
+    if include_total or not keyset_paging:
+        total_books = count_cache.fetch(('books', requested_rating_limit, filter_text, tuple(filter_tags)),
+                                        lambda: count_books_for_rating(requested_rating_limit, filter_text,
+                                                                       filter_tags))
+
+    if keyset_paging and not rank_search and limit > 0:
+        # One extra row tells if there is a next page
+        books_with_progress = list_books_for_rating(user_uid, requested_rating_limit, filter_text,
+                                                    filter_tags=filter_tags, sort_field=book_sort,
+                                                    sort_descending=sort_descending, query_limit=limit + 1,
+                                                    db_session=db.session,
+                                                    after_key=cursor.after_key() if cursor is not None else None)
+        if len(books_with_progress) > limit:
+            books_with_progress = books_with_progress[:limit]
+            next_cursor = PageCursor.after_row(sort, PAGE_PHASE_BOOKS, books_with_progress[-1][0], book_sort)
+    else:
+        if not keyset_paging and offset > total_books:
+            offset = 0
+
+        books_with_progress = list_books_for_rating(user_uid, requested_rating_limit, filter_text,
+                                                    filter_tags=filter_tags, sort_field=book_sort,
+                                                    sort_descending=sort_descending, query_offset=offset,
+                                                    query_limit=limit, db_session=db.session, rank_search=rank_search)
+        if keyset_paging and limit > 0 and len(books_with_progress) == limit:
+            next_cursor = PageCursor(sort, PAGE_PHASE_OFFSET, offset=offset + limit)
 
-    books_with_progress = list_books_for_rating(user_uid, requested_rating_limit, filter_text, filter_tags=filter_tags,
-                                                sort_field=book_sort,
-                                                sort_descending=sort_descending, query_offset=offset, query_limit=limit,
-                                                db_session=db.session)
+    progress_buffer: ProgressBuffer = current_app.config[APP_KEY_PROGRESS_BUFFER]
 
     for book, progress in books_with_progress:
 
         latest = None
 
+        pending_progress = progress_buffer.book_last_read(user_uid, book.id)
+        if pending_progress is not None:
+            progress = pending_progress
+
         if progress is not None:
 
             if progress.page_number is not None:
@@ -134,7 +182,10 @@ def get_books(user_details: dict) -> tuple:
 
         book_data.append(result)
 
-    return generate_success_response('', {"books": book_data, "paging": {"total": total_books, "offset": offset}})
+    paging = {"total": total_books if include_total else None, "offset": offset,
+              "next": next_cursor.encode() if next_cursor is not None else None}
+
+    return generate_success_response('', {"books": book_data, "paging": paging})
 
 
 @volume_blueprint.route('/list/chapters', methods=['POST'])
@@ -174,8 +225,14 @@ def get_chapters(user_details: dict) -> tuple:
 
     chapter_results = []
 
+    progress_buffer: ProgressBuffer = current_app.config[APP_KEY_PROGRESS_BUFFER]
+
     for chapter, progress in chapters:
 
+        pending_progress = progress_buffer.volume_progress(user_uid, book_id, chapter.chapter_id)
+        if pending_progress is not None:
+            progress = pending_progress
+
         if progress is not None:
             if progress.page_percent is not None:
                 value = f'@{progress.page_percent:.5f}'
@@ -238,10 +295,14 @@ def get_images(user_details: dict) -> tuple:
         return generate_failure_response('chapter_id parameter is required',
                                          messages=[msg_missing_parameter('chapter_id')])
 
-    book = find_book_by_id(book_id)
+    reader_row = find_chapter_for_reader(book_id, chapter_id)
 
-    if book is None:
-        return generate_failure_response('book not found', 404, messages=[msg_action_cancelled_wrong()])
+    if reader_row is None:
+        if find_book_by_id(book_id) is None:
+            return generate_failure_response('book not found', 404, messages=[msg_action_cancelled_wrong()])
+        return generate_failure_response('chapter not found', messages=[msg_action_cancelled_wrong()])
+
+    book, current_chapter, prev_chapter_id, next_chapter_id = reader_row
 
     max_rating = get_volume_max_rating(user_details)
 
@@ -249,35 +310,29 @@ def get_images(user_details: dict) -> tuple:
         return generate_failure_response('User is not allowed to view content out of their rating zone',
                                          messages=[msg_access_denied_content_rating()])
 
-    current_chapter = find_chapter_by_id(book_id, chapter_id)
-
-    if current_chapter is None:
-        return generate_failure_response('chapter not found', messages=[msg_action_cancelled_wrong()])
-
-    prev_chapter_record = find_chapter_by_sequence(book_id, current_chapter.sequence - 1)
-    next_chapter_record = find_chapter_by_sequence(book_id, current_chapter.sequence + 1)
+    manifest = current_chapter.manifest
 
-    files = current_chapter.image_names.split(',') if current_chapter.image_names else []
-    prev_chapter_id = prev_chapter_record.chapter_id if prev_chapter_record else ''
-    next_chapter_id = next_chapter_record.chapter_id if next_chapter_record else ''
+    if manifest is None:
+        # Scanned before chapters had a manifest, build it once from the page headers
+        files = current_chapter.image_names.split(',') if current_chapter.image_names else []
+        chapter_path = os.path.join(current_app.config[PROPERTY_SERVER_VOLUME_FOLDER], book_id, chapter_id)
+        manifest = build_chapter_manifest(chapter_path, files)
+        current_chapter.manifest = manifest
+        db.session.commit()
 
+    files = [page['name'] for page in manifest]
     sizes = []
+    pages = []
 
     if include_sizes:
-        for file_name in files:
-            file_path = os.path.join(current_app.config[PROPERTY_SERVER_VOLUME_FOLDER], book_id, chapter_id, file_name)
-            w, h = 0, 0
-            if (os.path.exists(file_path)):
-                try:
-                    with Image.open(file_path) as img:
-                        w, h = img.size
-                except Exception:
-                    w, h = 0, 0
-
-            sizes.append({"w": w, "h": h})
+        for page in manifest:
+            sizes.append({"w": page['w'], "h": page['h']})
+            pages.append({"name": page['name'], "w": page['w'], "h": page['h'], "size": page['size'],
+                          "format": page['format']})
 
     return generate_success_response('',
-                                     {"prev": prev_chapter_id, "next": next_chapter_id, "sizes": sizes, "files": files,
+                                     {"prev": prev_chapter_id or '', "next": next_chapter_id or '', "sizes": sizes,
+                                      "files": files, "pages": pages,
                                       "style": 'page' if book.style == 'P' else 'scroll'})
 
 
@@ -327,8 +382,9 @@ def push_progress(user_details):
         else:
             client_page = int(value)
 
-    upsert_recent(user_id, book_id, chapter_id, client_page, client_progress,
-                  datetime.now(timezone.utc), db.session)
+    progress_buffer: ProgressBuffer = current_app.config[APP_KEY_PROGRESS_BUFFER]
+    progress_buffer.record_volume(user_id, book_id, chapter_id, client_page, client_progress,
+                                  datetime.now(timezone.utc))
 
     return generate_success_response('')
 
@@ -405,6 +461,7 @@ def merge_image(user_details):
         try:
             if merge_two_images(file_path, alt_file_path):
                 if chapter_row.remove_image(alt_file_name):
+                    chapter_row.replace_page(read_page_info(file_path))
                     db.session.commit()
                     return generate_success_response('Image Merged', messages=[msg_operation_complete()])
                 else:
@@ -474,6 +531,8 @@ def split_image(user_details):
     if os.path.exists(file_path) and os.path.isfile(file_path):
         try:
             split_and_save_image(file_path, position, is_horizontal, keep_first)
+            chapter_row.replace_page(read_page_info(file_path))
+            db.session.commit()
             return generate_success_response('Image adjusted', messages=[msg_operation_complete()])
         except ValueError as ve:
             return generate_failure_response(str(ve))
@@ -535,6 +594,10 @@ def list_history(user_details):
     user_uid = get_uid(user_details)
     max_rating = get_volume_max_rating(user_details)
 
+    # History is ordered by when progress was written, so write this user's pending progress first
+    progress_buffer: ProgressBuffer = current_app.config[APP_KEY_PROGRESS_BUFFER]
+    progress_buffer.flush(user_uid)
+
     rows = find_recent_entries(user_uid, max_rating)
 
     results = []
@@ -593,37 +656,42 @@ def serve_image(user_details, book_folder: str, chapter_name: str, image_name: s
     quick = request.args.get('quick', 'false').lower() == 'true'
 
     if quick:
+        # Validators come from the source image, a 304 skips the resize entirely
+        validators = FileValidators(f'{book_folder}/{chapter_name}/{image_name}@{QUICK_IMAGE_WIDTH}', file_path)
+        if validators.is_not_modified():
+            return validators.not_modified_response(60)
+
         try:
-            # Open and shrink the image
-            with Image.open(file_path) as img:
-                width, height = img.size
-                if width > 256:
-                    new_height = int((256 / width) * height)
-                    img = img.resize((256, new_height), Image.LANCZOS)
-
-                # Save to in-memory bytes
+            image_cache: DerivedImageCache = current_app.config[APP_KEY_IMAGE_CACHE]
+            cached_path = image_cache.fetch(file_path, book_folder, chapter_name, image_name, QUICK_IMAGE_WIDTH)
+
+            if cached_path is not None:
+                response = make_response(send_file(cached_path, etag=validators.etag,
+                                                   last_modified=validators.last_modified))
+            else:
+                # No cache available, shrink to in-memory bytes
                 img_bytes = io.BytesIO()
-                img_format = img.format if img.format else 'JPEG'
-                img.save(img_bytes, format=img_format)
+                img_format = shrink_image_to_width(file_path, img_bytes, QUICK_IMAGE_WIDTH)
                 img_bytes.seek(0)
+                response = make_response(send_file(img_bytes, mimetype=f'image/{img_format.lower()}'))
 
             # Build the Flask response
-            response = make_response(send_file(img_bytes, mimetype=f'image/{img_format.lower()}'))
-            expires_at = datetime.now() + timedelta(minutes=1)
-            response.headers['Cache-Control'] = 'public, max-age=60'
-            response.headers['Expires'] = expires_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
-            return response
+            set_cache_headers(response, 60)
+            return validators.apply(response)
 
         except Exception as e:
             logging.exception(f'Error generating quick image for {file_path}: {e}')
             abort(500)
 
     # Default: full-size image, 5-hour cache
-    response = make_response(send_from_directory(os.path.dirname(file_path), os.path.basename(file_path)))
-    expires_at = datetime.now() + timedelta(hours=5)
-    response.headers['Cache-Control'] = 'public, max-age=18000'  # 5 hours
-    response.headers['Expires'] = expires_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
-    return response
+    validators = FileValidators(f'{book_folder}/{chapter_name}/{image_name}', file_path)
+    if validators.is_not_modified():
+        return validators.not_modified_response(18000)
+
+    response = make_response(send_from_directory(os.path.dirname(file_path), os.path.basename(file_path),
+                                                 etag=validators.etag))
+    set_cache_headers(response, 18000)  # 5 hours
+    return validators.apply(response)
 
 
 @volume_blueprint.route('/serve_preview/<book_folder>/<chapter_name>', methods=['GET'])
@@ -649,11 +717,14 @@ def serve_preview_image(user_details, book_folder: str, chapter_name: str) -> 'R
                              chapter_name + '.webp')
 
     if os.path.exists(file_path) and os.path.isfile(file_path):
-        response = make_response(send_from_directory(os.path.dirname(file_path), os.path.basename(file_path)))
-        expires_at = datetime.now() + timedelta(hours=5)
-        response.headers['Cache-Control'] = 'public, max-age=18000'  # 5 hours cache
-        response.headers['Expires'] = expires_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
-        return response
+        validators = FileValidators(f'{book_folder}/{chapter_name}.preview', file_path)
+        if validators.is_not_modified():
+            return validators.not_modified_response(18000)
+
+        response = make_response(send_from_directory(os.path.dirname(file_path), os.path.basename(file_path),
+                                                     etag=validators.etag))
+        set_cache_headers(response, 18000)  # 5 hours cache
+        return validators.apply(response)
     else:
         logging.warning('File not found: ' + file_path)
         abort(404)
@@ -0,0 +1,155 @@
+import os
+import struct
+import time
+import zlib
+from typing import Iterator
+
+# Values at or above this limit need ZIP64 records
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+# General purpose flags, bit 3 = sizes and crc follow the data, bit 11 = UTF-8 names
+_ZIP_FLAGS = 0x0808
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_DATA_DESCRIPTOR = struct.Struct('<IIII')
+_DATA_DESCRIPTOR_64 = struct.Struct('<IIQQ')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_END_RECORD_64 = struct.Struct('<IQHHIIQQQQ')
+_END_LOCATOR_64 = struct.Struct('<IIQI')
+
+
+def _dos_date_time(timestamp: float) -> tuple[int, int]:
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    dos_date = (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    dos_time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return dos_date, dos_time
+
+
+class _ZipEntry:
+
+    def __init__(self, file_path: str, arc_name: str):
+        stat = os.stat(file_path)
+        self.file_path = file_path
+        self.name = arc_name.encode('utf-8')
+        self.size = stat.st_size
+        self.dos_date, self.dos_time = _dos_date_time(stat.st_mtime)
+        self.zip64 = self.size >= ZIP64_LIMIT
+        self.version = 45 if self.zip64 else 20
+        self.offset = 0
+        self.crc = 0
+
+    def local_header_size(self) -> int:
+        return _LOCAL_HEADER.size + len(self.name) + (20 if self.zip64 else 0)
+
+    def descriptor_size(self) -> int:
+        return _DATA_DESCRIPTOR_64.size if self.zip64 else _DATA_DESCRIPTOR.size
+
+    def _central_extra_values(self) -> list[int]:
+        values = []
+        if self.zip64:
+            values.extend([self.size, self.size])
+        if self.offset >= ZIP64_LIMIT:
+            values.append(self.offset)
+        return values
+
+    def central_header_size(self) -> int:
+        values = self._central_extra_values()
+        return _CENTRAL_HEADER.size + len(self.name) + (4 + 8 * len(values) if values else 0)
+
+    def local_header(self) -> bytes:
+        if self.zip64:
+            # The real sizes are in the data descriptor, the extra field only flags the entry as ZIP64
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            size_field = ZIP64_LIMIT
+        else:
+            extra = b''
+            size_field = 0
+        return _LOCAL_HEADER.pack(0x04034b50, self.version, _ZIP_FLAGS, 0, self.dos_time, self.dos_date, 0,
+                                  size_field, size_field, len(self.name), len(extra)) + self.name + extra
+
+    def data_descriptor(self) -> bytes:
+        if self.zip64:
+            return _DATA_DESCRIPTOR_64.pack(0x08074b50, self.crc, self.size, self.size)
+        return _DATA_DESCRIPTOR.pack(0x08074b50, self.crc, self.size, self.size)
+
+    def central_header(self) -> bytes:
+        values = self._central_extra_values()
+        extra = struct.pack('<HH' + 'Q' * len(values), 1, 8 * len(values), *values) if values else b''
+        size_field = ZIP64_LIMIT if self.zip64 else self.size
+        offset_field = ZIP64_LIMIT if self.offset >= ZIP64_LIMIT else self.offset
+        return _CENTRAL_HEADER.pack(0x02014b50, self.version, self.version, _ZIP_FLAGS, 0, self.dos_time,
+                                    self.dos_date, self.crc, size_field, size_field, len(self.name), len(extra), 0, 0,
+                                    0, 0, offset_field) + self.name + extra
+
+
+class StoredZipStream:
+    """
+    Builds an uncompressed (ZIP_STORED) archive on the fly, without a temp file.
+
+    Since nothing is compressed, the exact archive length is known before the first byte is sent. The CRC of each
+    entry is computed while its data streams out and written in a data descriptor after it.
+    """
+
+    def __init__(self, files: list[tuple[str, str]], chunk_size: int = 1024 * 1024):
+        """
+        :param files: List of (file path, name inside the archive)
+        :param chunk_size: Read size used while streaming file data
+        """
+        self.entries = [_ZipEntry(file_path, arc_name) for file_path, arc_name in files]
+        self.chunk_size = chunk_size
+
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            offset += entry.local_header_size() + entry.size + entry.descriptor_size()
+
+        self.central_offset = offset
+        self.central_size = sum(entry.central_header_size() for entry in self.entries)
+        self.zip64_end = (self.central_offset >= ZIP64_LIMIT or self.central_size >= ZIP64_LIMIT or
+                          len(self.entries) >= ZIP_MAX_ENTRIES)
+
+    def content_length(self) -> int:
+        """
+        :return: The exact size of the archive in bytes
+        """
+        end_size = _END_RECORD.size
+        if self.zip64_end:
+            end_size += _END_RECORD_64.size + _END_LOCATOR_64.size
+        return self.central_offset + self.central_size + end_size
+
+    def _end_records(self) -> bytes:
+        count = len(self.entries)
+        records = b''
+        if self.zip64_end:
+            zip64_end_offset = self.central_offset + self.central_size
+            records += _END_RECORD_64.pack(0x06064b50, _END_RECORD_64.size - 12, 45, 45, 0, 0, count, count,
+                                           self.central_size, self.central_offset)
+            records += _END_LOCATOR_64.pack(0x07064b50, 0, zip64_end_offset, 1)
+        records += _END_RECORD.pack(0x06054b50, 0, 0, min(count, ZIP_MAX_ENTRIES), min(count, ZIP_MAX_ENTRIES),
+                                    min(self.central_size, ZIP64_LIMIT), min(self.central_offset, ZIP64_LIMIT), 0)
+        return records
+
+    def __iter__(self) -> Iterator[bytes]:
+        for entry in self.entries:
+            yield entry.local_header()
+
+            crc = 0
+            remaining = entry.size
+            with open(entry.file_path, 'rb') as f:
+                while remaining > 0:
+                    chunk = f.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        # The length was already promised to the client, so a short file breaks the archive
+                        raise IOError(f'File shrank while streaming: {entry.file_path}')
+                    crc = zlib.crc32(chunk, crc)
+                    remaining -= len(chunk)
+                    yield chunk
+
+            entry.crc = crc
+            yield entry.data_descriptor()
+
+        yield b''.join(entry.central_header() for entry in self.entries)
+        yield self._end_records()